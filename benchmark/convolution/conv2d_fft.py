@@ -0,0 +1,57 @@
+"""
+Compare the legacy ConvOp, the im2col + gemm CorrMM and the FFT
+convolution on the CPU, for the forward pass and the gradients.
+
+This is what the default of the conv.fft_min_kernel_size flag is based on.
+
+Usage: conv2d_fft.py <batch> <stack> <img rows> <img cols>
+                     <nkern> <ker rows> <ker cols> [dtype [mode [nb_call]]]
+"""
+from __future__ import print_function
+import sys
+import time
+
+import numpy
+import theano
+import theano.tensor as T
+from theano.tensor.nnet import conv, corr, fftconv
+
+try:
+    bsize, stack, img_rows, img_cols, nkern, ker_rows, ker_cols = map(
+        int, sys.argv[1:8])
+except (ValueError, IndexError):
+    print(__doc__, file=sys.stderr)
+    sys.exit(-1)
+dtype = sys.argv[8] if len(sys.argv) > 8 else theano.config.floatX
+border_mode = sys.argv[9] if len(sys.argv) > 9 else 'valid'
+nb_call = int(sys.argv[10]) if len(sys.argv) > 10 else 10
+
+img_shape = (bsize, stack, img_rows, img_cols)
+ker_shape = (nkern, stack, ker_rows, ker_cols)
+rng = numpy.random.RandomState(42)
+img = theano.shared(rng.rand(*img_shape).astype(dtype), name='img')
+ker = theano.shared(rng.rand(*ker_shape).astype(dtype), name='ker')
+
+outputs = {}
+out = conv.conv2d(img, ker, image_shape=img_shape, filter_shape=ker_shape,
+                  border_mode=border_mode)
+outputs['ConvOp'] = [out] + T.grad(out.sum(), [img, ker])
+# CorrMM computes a correlation, flip the filters to get a convolution.
+out = corr.CorrMM(border_mode)(img, ker[:, :, ::-1, ::-1])
+outputs['CorrMM'] = [out] + T.grad(out.sum(), [img, ker])
+out = fftconv.FFTConv2D(border_mode, cache_filters=True)(img, ker)
+outputs['FFTConv2D'] = [out] + T.grad(out.sum(), [img, ker])
+
+# Keep the optimizer from changing one implementation into another.
+mode = theano.compile.get_default_mode().excluding('conv_gemm', 'conv_fft')
+for name in ['ConvOp', 'CorrMM', 'FFTConv2D']:
+    for what, outs in [('fwd', outputs[name][:1]),
+                       ('fwd+grad', outputs[name])]:
+        f = theano.function([], outs, mode=mode)
+        f()  # warm up
+        t0 = time.time()
+        for i in xrange(nb_call):
+            f()
+        t = (time.time() - t0) / nb_call
+        print('%-9s %-8s %s %s %s: %.5fs' % (name, what, border_mode,
+                                             img_shape, ker_shape, t))
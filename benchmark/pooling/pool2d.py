@@ -0,0 +1,52 @@
+"""
+Time DownsampleFactorMax, its gradient and the gradient of its gradient
+on the CPU, with and without OpenMP. Set OMP_NUM_THREADS to choose the
+number of threads.
+
+Usage: pool2d.py <batch> <channels> <img rows> <img cols> <pool rows>
+                 <pool cols> [mode [stride rows, stride cols [nb_call]]]
+"""
+from __future__ import print_function
+import sys
+import time
+
+import numpy
+import theano
+import theano.tensor as T
+from theano.tensor.signal.downsample import (DownsampleFactorMax,
+                                             DownsampleFactorMaxGrad)
+
+try:
+    bsize, channels, img_rows, img_cols, ds0, ds1 = map(int, sys.argv[1:7])
+except (ValueError, IndexError):
+    print(__doc__, file=sys.stderr)
+    sys.exit(-1)
+mode = sys.argv[7] if len(sys.argv) > 7 else 'max'
+st = tuple(map(int, sys.argv[8:10])) if len(sys.argv) > 9 else (ds0, ds1)
+nb_call = int(sys.argv[10]) if len(sys.argv) > 10 else 10
+
+img_shape = (bsize, channels, img_rows, img_cols)
+rng = numpy.random.RandomState(42)
+img = theano.shared(rng.rand(*img_shape).astype(theano.config.floatX),
+                    name='img')
+ggx = theano.shared(rng.rand(*img_shape).astype(theano.config.floatX),
+                    name='ggx')
+
+for openmp in [False, True]:
+    out = DownsampleFactorMax((ds0, ds1), True, st, mode=mode,
+                              openmp=openmp)(img)
+    gz = T.ones_like(out)
+    grad = DownsampleFactorMaxGrad((ds0, ds1), True, st, mode=mode,
+                                   openmp=openmp)(img, out, gz)
+    gradgrad = T.grad(None, gz, known_grads={grad: ggx})
+    for what, outs in [('fwd', out), ('grad', grad),
+                       ('gradgrad', gradgrad)]:
+        f = theano.function([], outs)
+        f()  # warm up
+        t0 = time.time()
+        for i in xrange(nb_call):
+            f()
+        t = (time.time() - t0) / nb_call
+        # each timing also includes the ops computed before the one named
+        print('openmp=%-5s %-8s %s %s %s st=%s: %.5fs' % (
+            openmp, what, mode, img_shape, (ds0, ds1), st, t))
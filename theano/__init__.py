@@ -27,6 +27,7 @@ __docformat__ = "restructuredtext en"
 # Set a default logger. It is important to do this before importing some other
 # theano code, since this code may want to log some messages.
 import logging
+import sys
 
 theano_logger = logging.getLogger("theano")
 logging_default_handler = logging.StreamHandler()
@@ -37,6 +38,7 @@ theano_logger.addHandler(logging_default_handler)
 theano_logger.setLevel(logging.WARNING)
 
 from theano.configdefaults import config
+from theano.compat import LazyModule
 
 # Version information.
 from theano.version import version as __version__
@@ -81,15 +83,18 @@ from theano.updates import OrderedUpdates
 
 from theano.gradient import Rop, Lop, grad, subgraph_grad
 
-# This need to be before the init of GPU, as it add config variable
-# needed during that phase.
-import theano.tests
-if hasattr(theano.tests, "TheanoNoseTester"):
-    test = theano.tests.TheanoNoseTester().test
-else:
-    def test():
+# theano.tests imports nose, which is slow to import. It is imported on
+# the first use of theano.tests or theano.test().
+if 'theano.tests' not in sys.modules:
+    tests = LazyModule('theano.tests')
+
+
+def test(*args, **kwargs):
+    """Run the Theano tests, see numpy.testing.NoseTester.test."""
+    if not hasattr(tests, "TheanoNoseTester"):
         raise ImportError("The nose module is not installed."
                           " It is needed for Theano tests.")
+    return tests.TheanoNoseTester().test(*args, **kwargs)
 
 if config.device.startswith('gpu') or config.init_gpu_device.startswith('gpu'):
     import theano.sandbox.cuda
@@ -6,8 +6,11 @@ from theano.compat.six import PY3, b, BytesIO, next, get_unbound_function
 from theano.compat.six.moves import configparser
 from theano.compat.six.moves import reload_module as reload
 
+import importlib
+import types
+
 __all__ = ['PY3', 'b', 'BytesIO', 'next', 'get_unbound_function',
-           'configparser', 'reload']
+           'configparser', 'reload', 'LazyModule']
 
 if PY3:
     from operator import truediv as operator_div
@@ -99,3 +102,25 @@ class DefaultOrderedDict(OrderedDict):
         return type(self)(self.default_factory, self)
 
 __all__ += ['DefaultOrderedDict']
+
+
+class LazyModule(types.ModuleType):
+    """Placeholder of a module that imports it on the first attribute access.
+
+    Python 2 doesn't support the module level __getattr__, so the packages
+    put an instance of this class as the attribute of a submodule that is
+    slow to import. Importing the real module replaces the placeholder in
+    its package.
+    """
+    def __init__(self, name):
+        super(LazyModule, self).__init__(name)
+
+    def __getattr__(self, attr):
+        if attr.startswith('__') and attr.endswith('__'):
+            # Don't import the module for introspection (pickle, doctest).
+            raise AttributeError(attr)
+        module = importlib.import_module(self.__name__)
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return "<lazy module '%s'>" % self.__name__
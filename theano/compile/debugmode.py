@@ -8,6 +8,7 @@ from __future__ import print_function
 __docformat__ = "restructuredtext en"
 
 import copy, sys, copy_reg, gc
+import cPickle
 from itertools import izip
 
 import numpy
@@ -20,12 +21,12 @@ from theano.gof import (FunctionGraph, graph, utils, link,
                         ops_with_inner_function)
 from theano.gof.link import raise_with_op
 from theano.gof.cc import CLinker
-from theano.configparser import (config, AddConfigVar, BoolParam, IntParam,
-                                 StrParam)
+from theano.configparser import (config, AddConfigVar, BoolParam, FloatParam,
+                                 IntParam, StrParam, thread_local_config)
 from theano.compile.function_module import (
     FunctionMaker, Function, infer_reuse_pattern,
-    SymbolicInputKit, SymbolicOutput, Supervisor, std_fgraph
-    )
+    SymbolicInputKit, SymbolicOutput, Supervisor, std_fgraph,
+    _with_compile_lock)
 from theano.compile.mode import Mode, register_mode
 from theano.compile.ops import OutputGuard
 
@@ -94,6 +95,28 @@ AddConfigVar('DebugMode.check_preallocated_output_ndim',
         IntParam(4, lambda i: i > 0),
         in_c_key=False)
 
+AddConfigVar('DebugMode.check_sample',
+        ('Probability of checking each node at each call of a function. '
+         'The nodes that are not checked are only computed once, with '
+         'their C implementation if there is one.'),
+        FloatParam(1.0, lambda f: 0 <= f <= 1),
+        in_c_key=False)
+
+AddConfigVar('DebugMode.check_cache',
+        ('Check each node only once for each signature (type, dtype, '
+         'shape and strides) of its input values, instead of at each '
+         'call of the function.'),
+        BoolParam(False),
+        in_c_key=False)
+
+AddConfigVar('DebugMode.check_workers',
+        ('Number of processes used to run the Python implementations '
+         'and compare them to the C implementations, while the function '
+         'runs the C implementations. 0 means that everything is done in '
+         'the calling process.'),
+        IntParam(0, lambda i: i >= 0),
+        in_c_key=False)
+
 import logging
 _logger = logging.getLogger("theano.compile.debugmode")
 
@@ -737,6 +760,56 @@ def check_eq(var, val1, val2):
         return var.type.values_eq_approx(val1, val2)
 
 
+def _value_signature(value):
+    """Return the part of a value that decides which code path an Op takes.
+
+    Used by `DebugMode.check_cache` to skip the nodes already checked
+    with inputs of the same type, dtype, shape and strides.
+    """
+    return (type(value), str(getattr(value, 'dtype', '')),
+            getattr(value, 'shape', None), getattr(value, 'strides', None))
+
+
+def _compare_perform(node, input_vals, output_vals):
+    """Run `node.op.perform` and compare its outputs to `output_vals`.
+
+    Return None if they all match, else the index of the first output
+    that does not match and the value computed by perform.
+    """
+    output_storage = [[None] for r in node.outputs]
+    node.op.perform(node, input_vals, output_storage)
+    for idx, (r, storage) in enumerate(zip(node.outputs, output_storage)):
+        if (not r.type.is_valid_value(storage[0]) or
+                not check_eq(r, storage[0], output_vals[idx])):
+            return idx, storage[0]
+    return None
+
+
+def _check_perform(node_pickle, values_pickle):
+    """Worker side of `DebugMode.check_workers`.
+
+    `node_pickle` holds the op of a node, its inputs (constants, or the
+    type of the other inputs) and the types of its outputs, and
+    `values_pickle` the input and output values computed by the C code.
+    """
+    op, inputs, output_types = cPickle.loads(node_pickle)
+    inputs = [i if isinstance(i, gof.Variable) else i() for i in inputs]
+    node = gof.Apply(op, inputs, [t() for t in output_types])
+    input_vals, output_vals = cPickle.loads(values_pickle)
+    return _compare_perform(node, input_vals, output_vals)
+
+
+# Process pools used by DebugMode.check_workers, by number of processes.
+_check_pools = {}
+
+
+def _get_check_pool(n):
+    if n not in _check_pools:
+        import multiprocessing
+        _check_pools[n] = multiprocessing.Pool(n)
+    return _check_pools[n]
+
+
 def _check_inputs(node, storage_map, r_vals, dr_vals, active_nodes,
                   clobber_dr_vals=True,
                   perform=None, warn_input_not_reused=True):
@@ -1628,6 +1701,49 @@ class _DummyLinker(object):
         return self
 
 
+def _run_unchecked(node, thunk, storage_map, r_vals, dr_vals,
+                   active_order_set):
+    """Compute the outputs of a node that is not checked during this call.
+
+    Only the inputs in the destroy_map of the node are copied, and the
+    outputs are stored in r_vals.
+    """
+    destroyed = set()
+    for i_pos_list in getattr(node.op, 'destroy_map', {}).values():
+        destroyed.update(i_pos_list)
+    for idx, r in enumerate(node.inputs):
+        if idx in destroyed:
+            storage_map[r][0] = _lessbroken_deepcopy(r_vals[r])
+        else:
+            storage_map[r][0] = r_vals[r]
+    try:
+        thunk()
+    except Exception:
+        raise_with_op(node, thunk)
+    for r in node.outputs:
+        if not r.type.is_valid_value(storage_map[r][0]):
+            raise InvalidValueError(r, storage_map[r][0], hint='output')
+        r_vals[r] = storage_map[r][0]
+        storage_map[r][0] = None
+    for idx, r in enumerate(node.inputs):
+        if idx in destroyed and node in active_order_set:
+            dr_vals[r] = (storage_map[r][0], node)
+        storage_map[r][0] = None
+
+
+def _raise_bad_perform(node, result, r_vals):
+    """Raise the error for a `_compare_perform` result, if any."""
+    if result is None:
+        return
+    idx, val = result
+    r = node.outputs[idx]
+    if not r.type.is_valid_value(val):
+        raise InvalidValueError(r, val, hint='perform output')
+    raise BadThunkOutput(r, thunk1='perform', val1=val,
+                         thunk2='c_code', val2=r_vals[r],
+                         inputs_val=[r_vals[inp] for inp in node.inputs])
+
+
 class _Linker(gof.link.LocalLinker):
     """Special debugging linker"""
     def __init__(self, maker, schedule=None):
@@ -1779,6 +1895,31 @@ class _Linker(gof.link.LocalLinker):
         except ValueError:
             def_val = 666
 
+        # Nodes to check at each call, and where to check them
+        check_sample = self.maker.mode.check_sample
+        sample_rng = numpy.random.RandomState(def_val)
+        # Signatures of the nodes already checked, for check_cache
+        verified = set()
+        check_pool = None
+        node_pickles = [None] * len(order)
+        if self.maker.mode.check_workers:
+            check_pool = _get_check_pool(self.maker.mode.check_workers)
+            for i, node in enumerate(order):
+                # Only the nodes with both implementations, and a python
+                # one that is a plain perform, can be checked elsewhere.
+                if (thunks_c[i] is None or
+                        getattr(thunks_py[i], 'perform', None) is None or
+                        node.run_context() is not graph.NoContext):
+                    continue
+                try:
+                    node_pickles[i] = cPickle.dumps(
+                        (node.op,
+                         [r if isinstance(r, graph.Constant) else r.type
+                          for r in node.inputs],
+                         [r.type for r in node.outputs]), -1)
+                except Exception:
+                    pass
+
         #####
         # This is the function that runs when you evaluate the graph
         #####
@@ -1851,6 +1992,11 @@ class _Linker(gof.link.LocalLinker):
                         print(r, s)
                     assert s[0] is None
 
+                # (node, result) of the checks done by the workers
+                pending_checks = []
+                # signatures of the nodes checked during this call
+                checked = []
+
                 # try:
                 # compute the value of all variables
                 for i, (thunk_py, thunk_c, node) in enumerate(zip(thunks_py,
@@ -1860,6 +2006,31 @@ class _Linker(gof.link.LocalLinker):
 
                     _logger.debug("%i - starting node %i %s", i, i, node)
 
+                    signature = None
+                    if self.maker.mode.check_cache:
+                        signature = (node.op,
+                                     tuple(r.type for r in node.inputs),
+                                     tuple(_value_signature(r_vals[r])
+                                           for r in node.inputs))
+                    if ((check_sample < 1 and
+                         sample_rng.uniform() >= check_sample) or
+                            (signature is not None and
+                             signature in verified)):
+                        _logger.debug("%i - running without checks", i)
+                        _run_unchecked(node, thunk_c or thunk_py,
+                                       storage_map, r_vals, dr_vals,
+                                       active_order_set)
+                        continue
+                    if signature is not None:
+                        checked.append(signature)
+
+                    # With check_workers, the C code gives the reference
+                    # outputs and perform is compared to them in a worker.
+                    check_elsewhere = (check_pool is not None and
+                                       node_pickles[i] is not None)
+                    if check_elsewhere:
+                        thunk_py = None
+
                     # put a copy of each input into the storage_map
                     # also, check that inputs have valid values
                     for r in node.inputs:
@@ -2039,6 +2210,31 @@ class _Linker(gof.link.LocalLinker):
                             # clear the storage_map for the thunk_c
                             storage_map[r][0] = None
 
+                        if check_elsewhere:
+                            input_vals = [r_vals[r] for r in node.inputs]
+                            output_vals = [r_vals[r] for r in node.outputs]
+                            try:
+                                values_pickle = cPickle.dumps(
+                                    (input_vals, output_vals), -1)
+                            except Exception:
+                                values_pickle = None
+                            if values_pickle is None:
+                                _logger.debug("%i - comparing perform to "
+                                              "thunk_c", i)
+                                result = _compare_perform(
+                                    node,
+                                    [_lessbroken_deepcopy(v)
+                                     for v in input_vals],
+                                    output_vals)
+                                _raise_bad_perform(node, result, r_vals)
+                            else:
+                                _logger.debug("%i - sending perform to a "
+                                              "worker", i)
+                                pending_checks.append((node,
+                                    check_pool.apply_async(
+                                        _check_perform,
+                                        (node_pickles[i], values_pickle))))
+
                         if self.maker.mode.check_preallocated_output:
                             prealloc_modes = \
                                     self.maker.mode.check_preallocated_output
@@ -2075,6 +2271,10 @@ class _Linker(gof.link.LocalLinker):
                         storage_map[r][0] = None
                     _logger.debug("%i - done with node", i)
 
+                for node, result in pending_checks:
+                    _raise_bad_perform(node, result.get(), r_vals)
+                verified.update(checked)
+
                 if False:
                     # This could be useful to help finding refcount problem.
                     # But it is very slow and it is not sure it will help.
@@ -2182,6 +2382,7 @@ class _Maker(FunctionMaker):  # inheritance buys a few helper functions
     """Verbosity level of compile-time and run-time checks. (Default
     0: silent)"""
 
+    @_with_compile_lock
     def __init__(self, inputs, outputs, optimizer, mode,
             accept_inplace=False,
             function_builder=Function,
@@ -2245,15 +2446,13 @@ class _Maker(FunctionMaker):  # inheritance buys a few helper functions
             fgraph.equivalence_tracker = equivalence_tracker
 
             # optimize the fgraph
-            compute_test_value_orig = theano.config.compute_test_value
-            try:
-                theano.config.compute_test_value = theano.config.compute_test_value_opt
+            with thread_local_config({
+                    'compute_test_value':
+                    theano.config.compute_test_value_opt}):
                 optimizer(fgraph)
 
                 theano.compile.function_module.insert_deepcopy(fgraph, inputs,
                                                     outputs + additional_outputs)
-            finally:
-                theano.config.compute_test_value = compute_test_value_orig
 
             if i:
                 li = fgraph.equivalence_tracker.event_list
@@ -2328,6 +2527,7 @@ class _Maker(FunctionMaker):  # inheritance buys a few helper functions
         self.mode = mode
         self.output_keys = output_keys
 
+    @_with_compile_lock
     def create(self, defaults=None, trustme=False):
         """
         Create a function.
@@ -2523,6 +2723,24 @@ class DebugMode(Mode):
     (all of the above).
     """
 
+    check_sample = config.DebugMode.check_sample
+    """
+    Probability of checking each node at each call. The nodes that are
+    not checked are computed once, without copying their inputs.
+    """
+
+    check_cache = config.DebugMode.check_cache
+    """
+    Should we check each node only once for each type, dtype, shape and
+    strides of its inputs, instead of at each call?
+    """
+
+    check_workers = config.DebugMode.check_workers
+    """
+    Number of processes that run the `perform` implementations and
+    compare them to the `c_code` ones. 0 runs them in this process.
+    """
+
     # This function will be used to create a FunctionMaker in
     # function_module.function
     def function_maker(self, i, o, m, *args, **kwargs):
@@ -2540,6 +2758,9 @@ class DebugMode(Mode):
             check_isfinite=None,
             check_preallocated_output=None,
             require_matching_strides=None,
+            check_sample=None,
+            check_cache=None,
+            check_workers=None,
             linker=_DummyLinker()):
         """Initialize member variables.
 
@@ -2576,6 +2797,15 @@ class DebugMode(Mode):
         if require_matching_strides is not None:
             self.require_matching_strides = require_matching_strides
 
+        if check_sample is not None:
+            self.check_sample = check_sample
+
+        if check_cache is not None:
+            self.check_cache = check_cache
+
+        if check_workers is not None:
+            self.check_workers = check_workers
+
         if not (self.check_c_code or self.check_py_code):
             raise ValueError('DebugMode has to check at least one of c and py '
                              'code')
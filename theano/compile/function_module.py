@@ -8,7 +8,9 @@ __docformat__ = "restructuredtext en"
 import copy
 import copy_reg
 import cPickle
+from functools import wraps
 import itertools
+import threading
 import time
 import warnings
 import numpy
@@ -20,8 +22,10 @@ import theano.compile.mode
 from theano.compile.io import (
     In, SymbolicInput, SymbolicInputKit, SymbolicOutput)
 from theano.compile.ops import deep_copy_op, view_op
+from theano.configparser import thread_local_config
 from theano.gof.graph import is_same_graph
 from theano.gof.op import ops_with_inner_function
+from theano.gof.utils import compile_phase_snapshot, time_compile_phase
 
 import logging
 _logger = logging.getLogger('theano.compile.function_module')
@@ -486,6 +490,12 @@ class Function(object):
     def __call__(self, *args, **kwargs):
         profile = self.profile
         t0 = time.time()
+        if profile:
+            # Number of calls that this one stands for, 0 if its thunks
+            # are not timed.
+            sample_weight = profile.sample_call()
+            self.fn.time_thunks = (sample_weight > 0 and
+                                   profile.flag_time_thunks)
 
         # Reinitialize each container's 'provided' counter
         if self.trust_input:
@@ -672,8 +682,12 @@ class Function(object):
         if profile:
             profile.fct_callcount += 1
             profile.fct_call_time += dt_call
-            if hasattr(self.fn, 'update_profile'):
-                self.fn.update_profile(profile)
+            if profile.latency is not None:
+                profile.record_latency(dt_call, t0_fn - t0, dt_fn)
+            if profile.fct_call_timeline is not None and sample_weight:
+                profile.fct_call_timeline.append((t0, dt_call))
+            if hasattr(self.fn, 'update_profile') and sample_weight:
+                self.fn.update_profile(profile, sample_weight)
 
         if self.return_none:
             return None
@@ -843,6 +857,21 @@ def insert_deepcopy(fgraph, wrapped_inputs, wrapped_outputs):
 
 NODEFAULT = ['NODEFAULT']
 
+# The compilation of functions is not thread safe: the lock of the
+# compilation directory, the module cache and the caches of the optimizers
+# are shared by the process. FunctionMaker holds this lock, so only one
+# thread compiles at a time.
+compile_lock = threading.RLock()
+
+
+def _with_compile_lock(f):
+    """Decorator that calls `f` with compile_lock held."""
+    @wraps(f)
+    def rval(*args, **kwargs):
+        with compile_lock:
+            return f(*args, **kwargs)
+    return rval
+
 
 class FunctionMaker(object):
     """`FunctionMaker` is the class to `create` `Function` instances.
@@ -1056,6 +1085,7 @@ class FunctionMaker(object):
         release_lock()
         return optimizer_profile
 
+    @_with_compile_lock
     def __init__(self, inputs, outputs,
             mode=None, accept_inplace=False, function_builder=Function,
             profile=None, on_unused_input=None, fgraph=None,
@@ -1131,34 +1161,46 @@ class FunctionMaker(object):
         if fgraph is None:
             need_opt = True
             # make the fgraph (copies the graph, creates NEW INPUT AND OUTPUT VARIABLES)
-            fgraph, additional_outputs = std_fgraph(inputs, outputs, accept_inplace)
+            with time_compile_phase('std_fgraph'):
+                fgraph, additional_outputs = std_fgraph(inputs, outputs,
+                                                        accept_inplace)
             fgraph.profile = profile
         else:
             # fgraph is already an optimized one
             need_opt = False
-            _, additional_outputs = std_fgraph(inputs, outputs, accept_inplace)
-            pass
+            with time_compile_phase('std_fgraph'):
+                _, additional_outputs = std_fgraph(inputs, outputs,
+                                                   accept_inplace)
 
         self.fgraph = fgraph
 
         # Fetch the optimizer and linker
         optimizer, linker = mode.optimizer, copy.copy(mode.linker)
         if need_opt:
-            compute_test_value_orig = theano.config.compute_test_value
-            limit_orig = theano.config.traceback.limit
             # Why we add stack on node when it get done in output var?
-            try:
+            # The flags are only changed in this thread, so the graphs built
+            # while compiling in another thread keep their test values.
+            with thread_local_config({
+                    'compute_test_value':
+                    theano.config.compute_test_value_opt,
+                    'traceback.limit': 0}):
                 # optimize the fgraph
-                theano.config.compute_test_value = theano.config.compute_test_value_opt
-                theano.config.traceback.limit = 0
+                record_optimizer = (profile and
+                                    theano.config.profile_optimizer and
+                                    theano.config.profiling.optimizer_db)
+                if record_optimizer:
+                    signature = theano.compile.profiling.graph_signature(
+                        fgraph)
+                    nb_nodes_before = len(fgraph.apply_nodes)
                 start_optimizer = time.time()
 
                 # now optimize the graph
-                if theano.config.cache_optimizations:
-                    optimizer_profile = self.optimize_graph_with_cache(
-                        optimizer, inputs, outputs)
-                else:
-                    optimizer_profile = optimizer(fgraph)
+                with time_compile_phase('optimizer'):
+                    if theano.config.cache_optimizations:
+                        optimizer_profile = self.optimize_graph_with_cache(
+                            optimizer, inputs, outputs)
+                    else:
+                        optimizer_profile = optimizer(fgraph)
 
                 end_optimizer = time.time()
                 opt_time = end_optimizer - start_optimizer
@@ -1166,13 +1208,18 @@ class FunctionMaker(object):
                     profile.optimizer_time += opt_time
                     if theano.config.profile_optimizer:
                         profile.optimizer_profile = (optimizer, optimizer_profile)
+                    if record_optimizer:
+                        theano.compile.profiling.record_optimizer_profile(
+                            theano.config.profiling.optimizer_db,
+                            profile.message, profile.optimizer_profile,
+                            signature, nb_nodes_before,
+                            len(fgraph.apply_nodes), opt_time)
                 _logger.debug('Optimizing took %f seconds', opt_time)
 
                 # Add deep copy to respect the memory interface
-                insert_deepcopy(fgraph, inputs, outputs + additional_outputs)
-            finally:
-                theano.config.compute_test_value = compute_test_value_orig
-                theano.config.traceback.limit = limit_orig
+                with time_compile_phase('insert_deepcopy'):
+                    insert_deepcopy(fgraph, inputs,
+                                    outputs + additional_outputs)
 
         # initialize the linker
         if not hasattr(linker, 'accept'):
@@ -1250,6 +1297,7 @@ class FunctionMaker(object):
                         "valid values are 'raise', 'warn', and 'ignore'."
                         % on_unused_input))
 
+    @_with_compile_lock
     def create(self, input_storage=None, trustme=False):
         """
         Create a function.
@@ -1319,13 +1367,10 @@ class FunctionMaker(object):
         # Get a function instance
         start_linker = time.time()
         start_import_time = theano.gof.cmodule.import_time
-        limit_orig = theano.config.traceback.limit
-        try:
-            theano.config.traceback.limit = 0
-            _fn, _i, _o = self.linker.make_thunk(
-                input_storage=input_storage_lists)
-        finally:
-            theano.config.traceback.limit = limit_orig
+        with thread_local_config({'traceback.limit': 0}):
+            with time_compile_phase('linker'):
+                _fn, _i, _o = self.linker.make_thunk(
+                    input_storage=input_storage_lists)
 
         end_linker = time.time()
 
@@ -1450,6 +1495,7 @@ def orig_function(inputs, outputs, mode=None, accept_inplace=False,
     # instance if necessary:
 
     t1 = time.time()
+    compile_phases = compile_phase_snapshot()
     mode = theano.compile.mode.get_mode(mode)
 
     inputs = map(convert_function_input, inputs)
@@ -1477,6 +1523,7 @@ def orig_function(inputs, outputs, mode=None, accept_inplace=False,
     t2 = time.time()
     if profile:
         profile.compile_time += t2 - t1
+        profile.add_compile_phases(compile_phases)
         profile.nb_nodes = len(fn.maker.fgraph.apply_nodes)
 
     fn.name = name
@@ -675,6 +675,11 @@ class Rebroadcast(gof.Op):
             return [None]
         return self(*eval_points, **dict(return_list=True))
 
+    def batch_apply(self, inputs, batched):
+        op = Rebroadcast(*[(axis + 1, value)
+                           for axis, value in self.axis.iteritems()])
+        return op(*inputs, **dict(return_list=True))
+
     def c_code(self, node, nodename, inp, out, sub):
         iname, = inp
         oname, = out
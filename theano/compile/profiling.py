@@ -17,7 +17,11 @@ __contact__ = "theano-dev <theano-dev@googlegroups.com>"
 __docformat__ = "restructuredtext en"
 import atexit
 import copy
+import hashlib
+import json
+import numbers
 import os
+import socket
 import sys
 import time
 from theano.compat import defaultdict
@@ -26,7 +30,9 @@ import numpy
 
 import theano
 from theano.gof import graph
-from theano.configparser import AddConfigVar, BoolParam, IntParam, StrParam
+from theano.compat.six import string_types
+from theano.configparser import (AddConfigVar, BoolParam, EnumStr,
+                                 FloatParam, IntParam, StrParam)
 
 
 import_time = time.time()
@@ -73,6 +79,59 @@ AddConfigVar('profiling.destination',
              StrParam('stderr'),
              in_c_key=False)
 
+AddConfigVar('profiling.output_format',
+             """Format of the profiles written to profiling.destination at
+             exit: 'text' is the human readable summary, 'json' the per-Apply
+             statistics (see ProfileStats.to_dict) and 'trace' the timeline
+             of each function and thunk call in the Chrome trace event
+             format (viewable in chrome://tracing). Recording the timeline
+             uses the Stack VM.""",
+             EnumStr('text', 'json', 'trace'),
+             in_c_key=False)
+
+AddConfigVar('profiling.sample_every',
+             """Time the thunks of only one call out of this number of calls
+             to each profiled function, and extrapolate the statistics to
+             all calls. 0 disables the timing of thunks.""",
+             IntParam(1, lambda i: i >= 0),
+             in_c_key=False)
+
+AddConfigVar('profiling.sample_interval',
+             """If positive, time the thunks of a call to a profiled
+             function only if this many seconds have passed since the last
+             timed call. It replaces profiling.sample_every.""",
+             FloatParam(0.0, lambda f: f >= 0),
+             in_c_key=False)
+
+AddConfigVar('profiling.latency',
+             """Keep a histogram of the latency of the calls to each
+             profiled function, split into input filtering, VM execution
+             and output handling, and print its percentiles.""",
+             BoolParam(False),
+             in_c_key=False)
+
+AddConfigVar('profiling.optimizer_db',
+             """If not empty and profile_optimizer is True, append the
+             time spent in each optimizer while compiling a profiled
+             function to this file, as one JSON line per function. See
+             theano/misc/optimizer_profiles.py to compare such files.""",
+             StrParam(''),
+             in_c_key=False)
+
+# The phases of theano.function, in the order they happen. The phases of
+# _nested_compile_phases run inside the other ones.
+_compile_phases = ['rebuild_collect_shared', 'std_fgraph', 'optimizer',
+                   'insert_deepcopy', 'linker', 'lock_wait', 'cache_refresh',
+                   'cxx', 'dlimport']
+_nested_compile_phases = ['lock_wait', 'cache_refresh', 'cxx', 'dlimport']
+
+_latency_parts = ['call', 'input', 'vm', 'output']
+
+# The attributes of ProfileStats that are summed when merging profiles.
+_merged_attrs = ["compile_time", "fct_call_time", "fct_callcount",
+                 "vm_call_time", "optimizer_time", "linker_time",
+                 "validate_time", "import_time", "sampled_callcount"]
+
 
 def _atexit_print_fn():
     """Print ProfileStat objects in _atexit_print_list to _atexit_print_file
@@ -86,6 +145,15 @@ def _atexit_print_fn():
     else:
         destination_file = open(config.profiling.destination, 'w')
 
+    if config.profiling.output_format == 'json':
+        dump_profiles([ps for ps in _atexit_print_list
+                       if ps.fct_callcount or ps.compile_time > 0],
+                      destination_file)
+        return
+    elif config.profiling.output_format == 'trace':
+        dump_chrome_trace(_atexit_print_list, destination_file)
+        return
+
     for ps in _atexit_print_list:
         if ps.fct_callcount or ps.compile_time > 0:
             ps.summary(file=destination_file,
@@ -102,11 +170,15 @@ def _atexit_print_fn():
         msg = ("Sum of all(%d) printed profiles at exit excluding Scan op"
                " profile." % len(to_sum))
         cum.message = msg
+        # The latency of different functions can't be summed.
+        cum.latency = None
         for ps in to_sum[1:]:
-            for attr in ["compile_time", "fct_call_time", "fct_callcount",
-                         "vm_call_time", "optimizer_time", "linker_time",
-                         "validate_time", "import_time"]:
+            for attr in _merged_attrs:
                 setattr(cum, attr, getattr(cum, attr) + getattr(ps, attr))
+            cum.compile_phase_time = dict(cum.compile_phase_time)
+            for name, t in ps.compile_phase_time.items():
+                cum.compile_phase_time[name] = (
+                    cum.compile_phase_time.get(name, 0.0) + t)
 
             # merge dictonary
             for attr in ["apply_time", "apply_callcount",
@@ -129,6 +201,114 @@ def _atexit_print_fn():
                     n_apply_to_print=config.profiling.n_apply)
 
 
+class LatencyHistogram(object):
+    """
+    Streaming histogram of durations that uses a fixed amount of memory.
+
+    Like HdrHistogram, the buckets are linear within each power of two of
+    nanoseconds, so the percentiles have a relative error of at most
+    2 ** -(sub_bucket_bits - 1) (1.6% by default) for all durations up to
+    2 ** max_bits nanoseconds (18 minutes by default), while the count,
+    min, max and sum are exact.
+    """
+
+    def __init__(self, sub_bucket_bits=7, max_bits=40):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.max_bits = max_bits
+        self.sub_buckets = 1 << sub_bucket_bits
+        self.counts = [0] * self._index(1 << max_bits)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, ns):
+        """Return the index of the bucket of `ns` nanoseconds."""
+        if ns < self.sub_buckets:
+            return ns
+        shift = ns.bit_length() - self.sub_bucket_bits
+        return shift * (self.sub_buckets // 2) + (ns >> shift)
+
+    def _value(self, idx):
+        """Return the middle of bucket `idx`, in seconds."""
+        if idx < self.sub_buckets:
+            return idx * 1e-9
+        half = self.sub_buckets // 2
+        shift = idx // half - 1
+        low = (idx % half + half) << shift
+        return (low + (1 << shift) / 2.) * 1e-9
+
+    def record(self, seconds):
+        """Add a duration to the histogram."""
+        ns = min(max(int(seconds * 1e9), 0), (1 << self.max_bits) - 1)
+        self.counts[self._index(ns)] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """Return the duration (in seconds) below which q% of them are.
+
+        Returns None if the histogram is empty.
+        """
+        if self.count == 0:
+            return None
+        rank = max(int(numpy.ceil(q / 100. * self.count)), 1)
+        # The exact min and max are better than a bucket middle.
+        if rank == 1:
+            return self.min
+        if rank >= self.count:
+            return self.max
+        seen = 0
+        for idx, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return min(max(self._value(idx), self.min), self.max)
+        return self.max
+
+    def percentiles(self, qs=(50, 95, 99)):
+        """Return a dict q -> self.percentile(q)."""
+        return dict((q, self.percentile(q)) for q in qs)
+
+    def merge(self, other):
+        """Add the durations of another histogram with the same buckets."""
+        assert len(self.counts) == len(other.counts)
+        for idx, c in enumerate(other.counts):
+            if c:
+                self.counts[idx] += c
+        self.count += other.count
+        self.total += other.total
+        for attr, fn in [('min', min), ('max', max)]:
+            vals = [v for v in (getattr(self, attr), getattr(other, attr))
+                    if v is not None]
+            if vals:
+                setattr(self, attr, fn(vals))
+
+    def to_dict(self):
+        """Return the histogram as a dict of JSON types."""
+        return {'sub_bucket_bits': self.sub_bucket_bits,
+                'max_bits': self.max_bits,
+                'counts': dict((str(idx), c)
+                               for idx, c in enumerate(self.counts) if c),
+                'count': self.count, 'total': self.total,
+                'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, d):
+        """Inverse of to_dict."""
+        rval = cls(d['sub_bucket_bits'], d['max_bits'])
+        for idx, c in d['counts'].items():
+            rval.counts[int(idx)] = c
+        rval.count = d['count']
+        rval.total = d['total']
+        rval.min = d['min']
+        rval.max = d['max']
+        return rval
+
+
 class ProfileStats(object):
 
     """
@@ -198,6 +378,16 @@ class ProfileStats(object):
     import_time = 0.0
     # time spent in importing compiled python module.
 
+    compile_phase_time = None
+    # dict phase -> time spent in each phase of the compilation (see
+    # _compile_phases). Some phases are nested in others: the compile lock
+    # waits, module cache refreshes, C++ compiler runs and imports mostly
+    # happen inside 'linker' (or 'optimizer' for ops compiled there).
+
+    compile_timeline = None
+    # None or list of (phase, start time, duration) of the compilation
+    # phases. Only recorded when profiling.output_format is 'trace'.
+
     line_width = config.profiling.output_line_width
 
     nb_nodes = -1
@@ -208,18 +398,55 @@ class ProfileStats(object):
     optimizer_profile = None
     # None or tuple (the optimizer, the profile it returned)
 
+    fct_call_timeline = None
+    # None or list of (start time, duration) of each call to
+    # Function.__call__. Only recorded when profiling.output_format
+    # is 'trace'.
+
+    apply_timeline = None
+    # None or list of (node, start time, duration) of each thunk call.
+    # Recorded by the VM along with fct_call_timeline.
+
+    sample_every = 1
+    # Time the thunks of one call out of sample_every calls (0: never).
+    # The thunk statistics of a timed call are multiplied by the number of
+    # calls it stands for, so they estimate the statistics of all calls.
+
+    sample_interval = 0.0
+    # If > 0, time a call only when this many seconds have passed since
+    # the last timed call, instead of using sample_every.
+
+    sampled_callcount = 0
+    # Number of calls whose thunks were timed
+
+    latency = None
+    # None or dict part -> LatencyHistogram of the calls to the function.
+    # The parts are 'call' (all of Function.__call__), 'input' (filtering
+    # the inputs), 'vm' (running the graph) and 'output' (updates and
+    # output handling).
+
     # param is called flag_time_thunks because most other attributes with time
     # in the name are times *of* something, rather than configuration flags.
-    def __init__(self, atexit_print=True, flag_time_thunks=None, **kwargs):
+    def __init__(self, atexit_print=True, flag_time_thunks=None,
+                 latency=None, **kwargs):
         """
         atexit_print - bool. True means that this object will be printed to
                        stderr (using .summary()) at the end of the program.
+        latency - bool. True means that the latency histograms are kept.
+                  Default to config.profiling.latency.
         **kwargs - misc initializers. These should (but need not) match the
                    names of the class vars declared in this class.
         """
+        self.sample_every = config.profiling.sample_every
+        self.sample_interval = config.profiling.sample_interval
+        self._calls_since_sample = 0
+        self._last_sample_time = 0.0
+        # When sampling, the time of GPU ops is only their launch time,
+        # but that is better than not being able to profile at all.
         if (hasattr(theano, 'sandbox') and
                 hasattr(theano.sandbox, 'cuda') and
-                theano.sandbox.cuda.cuda_enabled):
+                theano.sandbox.cuda.cuda_enabled and
+                not self.is_sampling()):
             if os.environ.get('CUDA_LAUNCH_BLOCKING', '0') != '1':
                 raise Exception(
                     "You are running the Theano profiler with CUDA enabled."
@@ -235,10 +462,21 @@ class ProfileStats(object):
         self.apply_cimpl = {}
         self.variable_shape = {}
         self.variable_strides = {}
+        self.compile_phase_time = {}
+        if config.profiling.output_format == 'trace':
+            self.fct_call_timeline = []
+            self.apply_timeline = []
+            self.compile_timeline = []
+            theano.gof.utils.record_compile_phase_events = True
         if flag_time_thunks is None:
             self.flag_time_thunks = config.profiling.time_thunks
         else:
             self.flag_time_thunks = flag_time_thunks
+        if latency is None:
+            latency = config.profiling.latency
+        if latency:
+            self.latency = dict((part, LatencyHistogram())
+                                for part in _latency_parts)
         self.__dict__.update(kwargs)
         #print >> sys.stderr, "self.message", self.message
         if atexit_print:
@@ -249,6 +487,76 @@ class ProfileStats(object):
                 atexit.register(_atexit_print_fn)
                 _atexit_registered = True
 
+    def add_compile_phases(self, snapshot):
+        """Add the compilation phases of this thread since `snapshot`.
+
+        `snapshot` is the return value of
+        theano.gof.utils.compile_phase_snapshot(), taken before compiling.
+        """
+        times, events = theano.gof.utils.compile_phases_since(snapshot)
+        for name, dt in times.items():
+            self.compile_phase_time[name] = (
+                self.compile_phase_time.get(name, 0.0) + dt)
+        if self.compile_timeline is not None:
+            self.compile_timeline.extend(events)
+
+    def record_latency(self, call_time, input_time, vm_time):
+        """Add the durations of one call to the latency histograms."""
+        latency = self.latency
+        latency['call'].record(call_time)
+        latency['input'].record(input_time)
+        latency['vm'].record(vm_time)
+        latency['output'].record(call_time - input_time - vm_time)
+
+    def latency_percentiles(self, percentiles=(50, 95, 99)):
+        """dict part -> dict percentile -> latency in seconds
+
+        Returns None if the latency histograms are not kept.
+        """
+        if self.latency is None:
+            return None
+        return dict((part, hist.percentiles(percentiles))
+                    for part, hist in self.latency.items())
+
+    def is_sampling(self):
+        """True if only some of the calls are timed."""
+        return self.sample_every != 1 or self.sample_interval > 0
+
+    def set_sampling(self, every=1, interval=0.0):
+        """Change at runtime which calls have their thunks timed.
+
+        every - time one call out of `every` (0 stops timing thunks).
+        interval - if positive, time a call only when `interval` seconds
+                   passed since the last timed call. Replaces `every`.
+        """
+        if every < 0 or interval < 0:
+            raise ValueError("every and interval must be positive",
+                             every, interval)
+        self.sample_every = every
+        self.sample_interval = interval
+        self._calls_since_sample = 0
+
+    def sample_call(self):
+        """Called once per function call, decides if it is timed.
+
+        Returns 0 if the thunks of this call must not be timed, else the
+        number of calls that this one stands for (the weight to give to
+        its statistics).
+        """
+        self._calls_since_sample += 1
+        if self.sample_interval > 0:
+            now = time.time()
+            if now - self._last_sample_time < self.sample_interval:
+                return 0
+            self._last_sample_time = now
+        elif (self.sample_every == 0 or
+                self._calls_since_sample < self.sample_every):
+            return 0
+        weight = self._calls_since_sample
+        self._calls_since_sample = 0
+        self.sampled_callcount += 1
+        return weight
+
     def class_time(self):
         """dict op -> total time on thunks"""
         # timing is stored by node, we compute timing by class on demand
@@ -634,6 +942,9 @@ class ProfileStats(object):
         print('  Message: %s' % self.message, file=file)
         print('  Time in %i calls to Function.__call__: %es' % (
             self.fct_callcount, self.fct_call_time), file=file)
+        if self.is_sampling():
+            print('  Thunks timed in %i calls, times and call counts are'
+                  ' extrapolated' % self.sampled_callcount, file=file)
         if self.fct_call_time > 0:
             print('  Time in Function.fn.__call__: %es (%.3f%%)' % (
                 self.vm_call_time,
@@ -642,6 +953,13 @@ class ProfileStats(object):
             if local_time > 0:
                 print('  Time in thunks: %es (%.3f%%)' % (
                     local_time, 100 * local_time / self.fct_call_time), file=file)
+        if self.latency is not None and self.latency['call'].count:
+            print('  Latency per call (p50 p95 p99 max):', file=file)
+            for part in _latency_parts:
+                hist = self.latency[part]
+                print('    %-6s %es %es %es %es' % (
+                    part, hist.percentile(50), hist.percentile(95),
+                    hist.percentile(99), hist.max), file=file)
         print('  Total compile time: %es' % self.compile_time, file=file)
         print('    Number of Apply nodes: %d' % self.nb_nodes, file=file)
         print('    Theano Optimizer time: %es' % self.optimizer_time, file=file)
@@ -650,6 +968,15 @@ class ProfileStats(object):
                         ' CUDA code generation/compiling): %es' %
                         self.linker_time), file=file)
         print('       Import time %es' % self.import_time, file=file)
+        if self.compile_phase_time:
+            print('    Compile phases (nested phases are indented):',
+                  file=file)
+            for name in _compile_phases:
+                if name in self.compile_phase_time:
+                    indent = ' ' * (6 if name in _nested_compile_phases else 4)
+                    print('%s  %-24s %es' % (
+                        indent, name, self.compile_phase_time[name]),
+                        file=file)
         print('', file=file)
 
         # The validation time is a subset of optimizer_time
@@ -1230,6 +1557,333 @@ class ProfileStats(object):
             self.optimizer_profile[0].print_profile(file,
                                                     self.optimizer_profile[1])
 
+    def node_index(self):
+        """dict node -> position of the node in the toposort of its graph
+
+        Unlike the nodes, this identifies the same node in the profiles of
+        different processes running the same program.
+        """
+        rval = {}
+        for fgraph in set(getattr(node, 'fgraph', None)
+                          for node in self.apply_callcount):
+            if fgraph is None:
+                continue
+            for i, node in enumerate(fgraph.toposort()):
+                rval[node] = i
+        return rval
+
+    def to_dict(self):
+        """Return the content of this profile as a dict of JSON types.
+
+        It contains the global timings of the function and, for each Apply
+        node, its time, call count, implementation and the shape, strides
+        and size in bytes of its inputs and outputs (these are only known
+        with profile_memory=True).
+        """
+        rval = dict((attr, getattr(self, attr)) for attr in _merged_attrs)
+        rval['message'] = self.message
+        rval['nb_nodes'] = self.nb_nodes
+        rval['pid'] = os.getpid()
+        rval['hostname'] = socket.gethostname()
+
+        def var_info(var):
+            info = {'type': str(var.type)}
+            if var in self.variable_shape:
+                sh = self.variable_shape[var]
+                info['shape'] = _to_json_type(sh)
+                if hasattr(var.type, 'get_size'):
+                    info['bytes'] = int(var.type.get_size(sh))
+            if var in self.variable_strides:
+                info['strides'] = _to_json_type(self.variable_strides[var])
+            return info
+
+        node_index = self.node_index()
+        applies = []
+        for node in sorted(self.apply_callcount,
+                           key=lambda n: node_index.get(n, -1)):
+            applies.append({
+                'index': node_index.get(node, -1),
+                'op': str(node.op),
+                'op_class': '%s.%s' % (type(node.op).__module__,
+                                       type(node.op).__name__),
+                'impl': 'C' if self.apply_cimpl.get(node) else 'Py',
+                'time': self.apply_time.get(node, 0.0),
+                'callcount': self.apply_callcount[node],
+                'inputs': [var_info(v) for v in node.inputs],
+                'outputs': [var_info(v) for v in node.outputs]})
+        rval['apply'] = applies
+        rval['compile_phase_time'] = dict(self.compile_phase_time)
+        if self.latency is not None:
+            rval['latency'] = dict((part, hist.to_dict())
+                                   for part, hist in self.latency.items())
+        return rval
+
+    def chrome_trace_events(self, tid=0):
+        """Return the timeline of this profile as Chrome trace events.
+
+        Each function and thunk call is a complete ('X') event of thread
+        `tid` of the current process. Times are in microseconds since the
+        epoch, so the events of different processes line up.
+        """
+        pid = os.getpid()
+        name = str(self.message)
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                   'args': {'name': name}}]
+        for t0, dt in self.fct_call_timeline or []:
+            events.append({'name': name, 'cat': 'function', 'ph': 'X',
+                           'ts': t0 * 1e6, 'dur': dt * 1e6,
+                           'pid': pid, 'tid': tid})
+        for phase, t0, dt in self.compile_timeline or []:
+            events.append({'name': phase, 'cat': 'compile', 'ph': 'X',
+                           'ts': t0 * 1e6, 'dur': dt * 1e6,
+                           'pid': pid, 'tid': tid})
+        node_index = self.node_index()
+        for node, t0, dt in self.apply_timeline or []:
+            events.append({'name': str(node.op), 'cat': 'apply', 'ph': 'X',
+                           'ts': t0 * 1e6, 'dur': dt * 1e6,
+                           'pid': pid, 'tid': tid,
+                           'args': {'index': node_index.get(node, -1),
+                                    'op_class': type(node.op).__name__}})
+        return events
+
+
+def _to_json_type(value):
+    """Convert shapes and strides to JSON types."""
+    if isinstance(value, (tuple, list)):
+        return [_to_json_type(v) for v in value]
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, numbers.Integral):
+        return int(value)
+    if isinstance(value, numbers.Real):
+        return float(value)
+    if isinstance(value, string_types):
+        return value
+    return str(value)
+
+
+def set_sampling(every=1, interval=0.0):
+    """Change the sampling of all the profiles printed at exit.
+
+    Also change the default of the profiles created later. See
+    ProfileStats.set_sampling. `set_sampling(0)` stops timing thunks and
+    `set_sampling()` times all the calls again.
+    """
+    config.profiling.sample_every = every
+    config.profiling.sample_interval = interval
+    for ps in _atexit_print_list:
+        ps.set_sampling(every, interval)
+
+
+def dump_profiles(profiles, file):
+    """Write ProfileStats objects (or their to_dict()) as JSON to `file`.
+
+    `file` is a file object or a file name.
+    """
+    profiles = [p if isinstance(p, dict) else p.to_dict() for p in profiles]
+    if isinstance(file, string_types):
+        with open(file, 'w') as f:
+            json.dump({'profiles': profiles}, f, indent=1)
+    else:
+        json.dump({'profiles': profiles}, file, indent=1)
+
+
+def dump_chrome_trace(profiles, file):
+    """Write the timelines of ProfileStats objects to `file`.
+
+    The output is in the Chrome trace event format, each profile being a
+    thread of the current process. `file` is a file object or a file name.
+    """
+    events = []
+    for tid, ps in enumerate(profiles):
+        events.extend(ps.chrome_trace_events(tid))
+    if isinstance(file, string_types):
+        with open(file, 'w') as f:
+            json.dump({'traceEvents': events}, f)
+    else:
+        json.dump({'traceEvents': events}, file)
+
+
+def merge_profiles(profiles):
+    """Merge profiles, as returned by ProfileStats.to_dict.
+
+    The profiles with the same message and number of nodes are considered
+    to be of the same function, typically run by different worker
+    processes: their timings and call counts are summed, for the function
+    and for each Apply node. The shapes are those of the first profile.
+
+    :return: list of merged profile dicts. Their 'processes' key lists
+        the (hostname, pid) that contributed to them.
+    """
+    merged = []
+    by_key = {}
+    for prof in profiles:
+        key = (prof['message'], prof['nb_nodes'])
+        if key not in by_key:
+            cum = copy.deepcopy(prof)
+            cum['processes'] = []
+            by_key[key] = cum
+            merged.append(cum)
+        else:
+            cum = by_key[key]
+            for attr in _merged_attrs:
+                cum[attr] += prof[attr]
+            phases = cum.setdefault('compile_phase_time', {})
+            for name, t in prof.get('compile_phase_time', {}).items():
+                phases[name] = phases.get(name, 0.0) + t
+            if 'latency' in cum and 'latency' in prof:
+                for part, hist in prof['latency'].items():
+                    cum_hist = LatencyHistogram.from_dict(
+                        cum['latency'][part])
+                    cum_hist.merge(LatencyHistogram.from_dict(hist))
+                    cum['latency'][part] = cum_hist.to_dict()
+            else:
+                cum.pop('latency', None)
+            applies = dict(((a['index'], a['op']), a) for a in cum['apply'])
+            for a in prof['apply']:
+                if (a['index'], a['op']) in applies:
+                    cum_a = applies[(a['index'], a['op'])]
+                    cum_a['time'] += a['time']
+                    cum_a['callcount'] += a['callcount']
+                else:
+                    cum['apply'].append(copy.deepcopy(a))
+        if 'processes' in prof:
+            cum['processes'].extend(prof['processes'])
+        else:
+            cum['processes'].append([prof['hostname'], prof['pid']])
+    for cum in merged:
+        cum.pop('pid', None)
+        cum.pop('hostname', None)
+        cum['apply'].sort(key=lambda a: a['index'])
+    return merged
+
+
+def graph_signature(fgraph):
+    """Return a hash of the structure of the graph of `fgraph`.
+
+    It depends on the types of the inputs, the Ops and how they are
+    connected, but not on the names or the values of the constants. It
+    identifies a graph from one run of a program to the next.
+    """
+    index = dict((v, i) for i, v in enumerate(fgraph.inputs))
+    lines = [str(v.type) for v in fgraph.inputs]
+    for node in fgraph.toposort():
+        inputs = []
+        for v in node.inputs:
+            if v in index:
+                inputs.append(str(index[v]))
+            else:
+                inputs.append('constant ' + str(v.type))
+        lines.append('%s(%s)' % (node.op, ', '.join(inputs)))
+        for v in node.outputs:
+            index[v] = len(index)
+    lines.append('outputs %s' % [index.get(v) for v in fgraph.outputs])
+    return hashlib.md5('\n'.join(lines).encode('utf-8')).hexdigest()
+
+
+def record_optimizer_profile(filename, message, optimizer_profile,
+                             signature, nb_nodes_before, nb_nodes_after,
+                             optimizer_time):
+    """Append the profile of the optimization of a graph to `filename`.
+
+    `optimizer_profile` is a tuple (optimizer, profile it returned). The
+    line written is the JSON of a dict with the `message` (name of the
+    function), the `signature` of the graph before optimization (see
+    graph_signature), the number of nodes before and after optimization,
+    the optimizer time and the 'optimizers' statistics (see
+    Optimizer.profile_records).
+    """
+    optimizer, prof = optimizer_profile
+    entry = {'message': str(message),
+             'signature': signature,
+             'theano_version': theano.__version__,
+             'hostname': socket.gethostname(),
+             'timestamp': time.time(),
+             'nb_nodes_before': nb_nodes_before,
+             'nb_nodes_after': nb_nodes_after,
+             'optimizer_time': optimizer_time,
+             'optimizers': optimizer.profile_records(prof)}
+    # One write of a line opened in append mode, so that processes
+    # sharing the file don't mix their lines.
+    with open(filename, 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+
+
+def load_optimizer_profiles(filename):
+    """Return the list of the entries of an optimizer profile file."""
+    with open(filename) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _mean_optimizer_times(entries):
+    """Return dict signature -> dict optimizer name -> mean time."""
+    sums = {}
+    counts = {}
+    for entry in entries:
+        sig = entry['signature']
+        counts[sig] = counts.get(sig, 0) + 1
+        times = sums.setdefault(sig, {})
+        for r in entry['optimizers']:
+            times[r['name']] = times.get(r['name'], 0.0) + r['time']
+    for sig, times in sums.items():
+        for name in times:
+            times[name] /= counts[sig]
+    return sums
+
+
+def compare_optimizer_profiles(old, new, threshold=1.5, min_time=0.01):
+    """Find the optimizers that got slower between two sets of entries.
+
+    Only the graphs (identified by their signature) present in both
+    `old` and `new` are compared. The time of each optimizer is averaged
+    over the entries of the same graph and summed over the graphs.
+
+    :return: list of (name, old time, new time) of the optimizers whose
+        new time is at least `min_time` and more than `threshold` times
+        the old time, the biggest increases first.
+    """
+    old_times = _mean_optimizer_times(old)
+    new_times = _mean_optimizer_times(new)
+    old_sum = {}
+    new_sum = {}
+    for sig in set(old_times).intersection(new_times):
+        for name, t in old_times[sig].items():
+            old_sum[name] = old_sum.get(name, 0.0) + t
+        for name, t in new_times[sig].items():
+            new_sum[name] = new_sum.get(name, 0.0) + t
+    rval = []
+    for name, t in new_sum.items():
+        t_old = old_sum.get(name, 0.0)
+        if t >= min_time and t > threshold * t_old:
+            rval.append((name, t_old, t))
+    rval.sort(key=lambda r: r[1] - r[2])
+    return rval
+
+
+def unused_optimizers(entries):
+    """Return the optimizers tried without changing the graph.
+
+    :return: list of (name, total time, number of entries) of the
+        optimizers that were never applied in the entries where they
+        were tried, the slowest first.
+    """
+    times = {}
+    counts = {}
+    used = set()
+    for entry in entries:
+        for r in entry['optimizers']:
+            if r['applied'] is None:
+                continue
+            if r['applied']:
+                used.add(r['name'])
+            elif r['time'] > 0:
+                times[r['name']] = times.get(r['name'], 0.0) + r['time']
+                counts[r['name']] = counts.get(r['name'], 0) + 1
+    rval = [(name, t, counts[name]) for name, t in times.items()
+            if name not in used]
+    rval.sort(key=lambda r: -r[1])
+    return rval
+
 
 if 0:  # old code still to be ported from ProfileMode
     def long_print(self, file=sys.stderr, fct_name=None, message=None,
@@ -0,0 +1,185 @@
+"""
+Compile variants of a function specialized for the input shapes it is
+frequently called with.
+
+When the shapes of the inputs are constant in the graph, the optimizer
+can constant fold the shape computations and some Ops can use faster
+implementations (e.g. ConvOp unrolls its loops when it knows its shapes).
+"""
+import copy
+import logging
+import threading
+
+import numpy
+
+from theano.compat import OrderedDict
+from theano.compile.function_module import orig_function
+from theano.compile.io import Out
+from theano.compile.ops import specify_shape
+from theano.compile.pfunc import rebuild_collect_shared
+from theano.configparser import thread_local_config
+from theano.tensor.type import TensorType
+
+_logger = logging.getLogger('theano.compile.shape_specialize')
+
+
+class ShapeSpecializedFunction(object):
+    """Wrap a Function to dispatch its calls to shape specialized variants.
+
+    The wrapper counts the shapes of the tensor inputs of the calls. Once
+    `min_calls` calls were made with the same shapes, it compiles a
+    variant of the function whose inputs have these constant shapes. The
+    calls with these shapes then go to the variant, the other ones to the
+    original function.
+
+    The variants share the storage of the shared variables with the
+    original function, so the updates are seen by all of them. Only the
+    `max_variants` most recently used variants are kept.
+
+    :param fn: a Function returned by theano.function.
+    :param min_calls: number of calls with the same shapes after which a
+        variant is compiled.
+    :param max_variants: maximum number of variants kept.
+    :param background: compile the variants in a thread. The calls keep
+        going to the original function until the variant is ready. The
+        functions compiled meanwhile in the other threads wait for the
+        variant to be compiled (see function_module.compile_lock).
+
+    :note: The keyword arguments of the calls are not supported by the
+        dispatch: such calls always go to the original function.
+
+    Example:
+
+    .. code-block:: python
+
+        f = ShapeSpecializedFunction(theano.function([x], conv2d(x, w)))
+        for batch in batches:
+            f(batch)
+    """
+    def __init__(self, fn, min_calls=10, max_variants=4, background=False):
+        self.fn = fn
+        self.min_calls = min_calls
+        self.max_variants = max_variants
+        self.background = background
+        # Number of calls by shape signature of the inputs.
+        self.shape_counts = {}
+        # The bound on the number of signatures counted.
+        self.max_signatures = 256
+        # Shape signature -> variant, the most recently used last.
+        self.variants = OrderedDict()
+        # (signature, variant) compiled by the thread not yet in variants.
+        # The thread only appends to it, so there is no need for a lock.
+        self._ready = []
+        self._threads = []
+        self._tensor_inputs = [isinstance(i.variable.type, TensorType)
+                               for i in fn.maker.inputs]
+
+    def signature(self, args):
+        """Return the shapes of the tensor inputs in args.
+
+        The other inputs have None as shape.
+        """
+        sig = []
+        for arg, is_tensor in zip(args, self._tensor_inputs):
+            if is_tensor:
+                sig.append(numpy.shape(arg))
+            else:
+                sig.append(None)
+        return tuple(sig)
+
+    def __call__(self, *args, **kwargs):
+        if kwargs:
+            return self.fn(*args, **kwargs)
+        if self._ready:
+            self._add_ready_variants()
+        sig = self.signature(args)
+        variant = self.variants.pop(sig, None)
+        if variant is not None:
+            self.variants[sig] = variant
+            return variant(*args)
+
+        count = self.shape_counts.get(sig, 0) + 1
+        if count == 1 and len(self.shape_counts) >= self.max_signatures:
+            # Too many different shapes, start counting again.
+            self.shape_counts.clear()
+        self.shape_counts[sig] = count
+        if count == self.min_calls:
+            if self.background:
+                thread = threading.Thread(target=self._compile,
+                                          args=(sig,))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+            else:
+                self._compile(sig)
+                self._add_ready_variants()
+        return self.fn(*args)
+
+    def wait(self):
+        """Wait for the variants being compiled in the background."""
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._add_ready_variants()
+
+    def _add_ready_variants(self):
+        while self._ready:
+            sig, variant = self._ready.pop(0)
+            self.variants[sig] = variant
+            while len(self.variants) > self.max_variants:
+                old_sig, _ = self.variants.popitem(last=False)
+                # Compile it again if it is used often again.
+                self.shape_counts.pop(old_sig, None)
+
+    def _compile(self, sig):
+        try:
+            variant = self.specialize(sig)
+        except Exception:
+            _logger.warning('Failed to compile the variant of %s for'
+                            ' the shapes %s', self.fn.name, sig,
+                            exc_info=True)
+            return
+        self._ready.append((sig, variant))
+
+    def specialize(self, sig):
+        """Compile and return the variant of the function for shapes sig."""
+        maker = self.fn.maker
+        inputs = []
+        replace = {}
+        for inp, shape in zip(maker.inputs, sig):
+            inp = copy.copy(inp)
+            if shape:
+                var = inp.variable.type()
+                var.name = inp.variable.name
+                # The new inputs have no test value.
+                with thread_local_config({'compute_test_value': 'off'}):
+                    replace[inp.variable] = specify_shape(var, shape)
+                inp.variable = var
+            inputs.append(inp)
+        inputs.extend(copy.copy(inp) for inp in maker.inputs[len(sig):])
+
+        outputs = [o.variable for o in maker.outputs]
+        updates = [i.update for i in maker.inputs if i.update is not None]
+        _, cloned, _ = rebuild_collect_shared(outputs + updates,
+                                              replace=replace,
+                                              copy_inputs_over=True,
+                                              no_default_updates=True)
+        outputs = [Out(v, borrow=o.borrow)
+                   for v, o in zip(cloned, maker.outputs)]
+        cloned_updates = iter(cloned[len(maker.outputs):])
+        for inp in inputs:
+            if inp.update is not None:
+                inp.update = next(cloned_updates)
+        if maker.return_none:
+            outputs = None
+        elif maker.unpack_single:
+            outputs = outputs[0]
+
+        fn = orig_function(inputs, outputs, mode=maker.mode,
+                           accept_inplace=maker.accept_inplace,
+                           name=self.fn.name, profile=maker.profile,
+                           on_unused_input='ignore',
+                           output_keys=maker.output_keys)
+        _logger.debug('Compiled the variant of %s for the shapes %s',
+                      self.fn.name, sig)
+        return fn
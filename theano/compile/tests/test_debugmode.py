@@ -224,6 +224,90 @@ def test_badthunkoutput():
     assert False  # an error should have been detected
 
 
+def test_check_sample():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    a = theano.tensor.dvector()
+    b = theano.tensor.dvector()
+
+    # Nothing is checked, only the c code runs.
+    f = theano.function([a, b], inconsistent(a, b),
+                        mode=debugmode.DebugMode(check_sample=0))
+    assert numpy.allclose(f([1.0, 2.0], [2, 3]), [3.5, 5.5])
+
+    f = theano.function([a, b], inconsistent(a, b),
+                        mode=debugmode.DebugMode(check_sample=1))
+    try:
+        f([1.0, 2.0], [2, 3])
+    except debugmode.BadThunkOutput:
+        pass
+    else:
+        assert False  # an error should have been detected
+
+
+class CountedAdd(BROKEN_ON_PURPOSE_Add):
+    """off_by_half that counts the calls to its perform in `calls`."""
+    calls = []
+
+    def perform(self, node, inp, out_):
+        self.calls.append(1)
+        BROKEN_ON_PURPOSE_Add.perform(self, node, inp, out_)
+
+
+def test_check_cache():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    calls = CountedAdd.calls
+    del calls[:]
+
+    a = theano.tensor.dvector()
+    b = theano.tensor.dvector()
+    f = theano.function([a, b], CountedAdd(True)(a, b),
+                        mode=debugmode.DebugMode(check_cache=True))
+    f([1.0, 2.0, 3.0], [2, 3, 4])
+    n_calls = len(calls)
+    assert n_calls > 0
+    # Same signature, not checked again
+    assert numpy.allclose(f([3.0, 2.0, 1.0], [2, 3, 4]), [5.5, 5.5, 5.5])
+    assert len(calls) == n_calls
+    # New shape, checked again
+    f([1.0, 2.0], [2, 3])
+    assert len(calls) > n_calls
+
+    # A failed check is not cached.
+    f = theano.function([a, b], inconsistent(a, b),
+                        mode=debugmode.DebugMode(check_cache=True))
+    for i in range(2):
+        try:
+            f([1.0, 2.0], [2, 3])
+        except debugmode.BadThunkOutput:
+            pass
+        else:
+            assert False  # an error should have been detected
+
+
+def test_check_workers():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    a = theano.tensor.dvector()
+    b = theano.tensor.dvector()
+    mode = debugmode.DebugMode(check_workers=2)
+
+    f_good = theano.function([a, b], off_by_half(a, b) * 2, mode=mode)
+    assert numpy.allclose(f_good([1.0, 2.0, 3.0], [2, 3, 4]), [7, 11, 15])
+
+    f_inconsistent = theano.function([a, b], inconsistent(a, b) * 2,
+                                     mode=mode)
+    try:
+        f_inconsistent([1.0, 2.0, 3.0], [2, 3, 4])
+    except debugmode.BadThunkOutput as e:
+        assert e.r.owner.op is inconsistent
+        assert numpy.allclose(e.val1, [3, 5, 7])
+        assert numpy.allclose(e.val2, [3.5, 5.5, 7.5])
+    else:
+        assert False  # an error should have been detected
+
+
 def test_badoptimization():
     @gof.local_optimizer([theano.tensor.add])
     def insert_broken_add(node):
@@ -1,3 +1,4 @@
+import sys
 import unittest
 
 from nose.plugins.skip import SkipTest
@@ -613,6 +614,45 @@ class Test_pfunc(unittest.TestCase):
         assert f() == 21
         assert f() == 34
 
+    def test_rebuild_clone_unchanged(self):
+        x = tensor.dvector('x')
+        y = tensor.dvector('y')
+        w = shared(numpy.ones(3), 'w')
+        a = tensor.exp(x)
+        b = a * w + y
+
+        # Nothing is replaced, so the graph is reused as it is.
+        inputs, out, (clone_d, update_d, update_expr, s_inputs) = \
+            rebuild_collect_shared([b], clone_unchanged=False)
+        assert out[0] is b
+        assert s_inputs == [w]
+
+        # Only the nodes that depend on a replaced variable are cloned.
+        z = tensor.dvector('z')
+        inputs, out, (clone_d, update_d, update_expr, s_inputs) = \
+            rebuild_collect_shared([b], replace={y: z}, clone_unchanged=False)
+        assert out[0] is not b
+        assert out[0].owner.inputs[1] is z
+        assert out[0].owner.inputs[0] is b.owner.inputs[0]
+
+        # By default, the whole graph is cloned.
+        inputs, out, (clone_d, update_d, update_expr, s_inputs) = \
+            rebuild_collect_shared([b], replace={y: z})
+        assert out[0].owner.inputs[0] is not b.owner.inputs[0]
+
+    def test_rebuild_deep_graph(self):
+        # rebuild_collect_shared does not recurse on the depth of the graph.
+        x = tensor.dscalar('x')
+        w = shared(2., 'w')
+        h = x
+        for i in range(sys.getrecursionlimit() + 100):
+            h = h * w + x
+        z = tensor.dscalar('z')
+        inputs, out, (clone_d, update_d, update_expr, s_inputs) = \
+            rebuild_collect_shared([h], replace={x: z})
+        assert s_inputs == [w]
+        assert theano.gof.graph.inputs(out) == [z, w]
+
     def test_duplicate_inputs(self):
         x = theano.tensor.lscalar('x')
         self.assertRaises(theano.compile.UnusedInputError,
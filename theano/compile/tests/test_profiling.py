@@ -2,6 +2,10 @@
 Test of memory profiling
 
 """
+import copy
+import json
+import os
+import tempfile
 import unittest
 
 import StringIO
@@ -10,7 +14,9 @@ import numpy
 
 import theano
 import theano.tensor as T
+from theano.compile import profiling
 from theano.ifelse import ifelse
+from theano.tests import unittest_tools as utt
 
 
 class Test_profiling(unittest.TestCase):
@@ -105,6 +111,219 @@ class Test_profiling(unittest.TestCase):
             theano.config.profile = config1
             theano.config.profile_memory = config2
 
+    def test_export(self):
+        config1 = theano.config.profiling.output_format
+        try:
+            theano.config.profiling.output_format = 'trace'
+            x = T.fmatrix('x')
+            p = theano.ProfileStats(False, message="test_export")
+            if theano.config.mode in ["DebugMode", "DEBUG_MODE"]:
+                m = "FAST_RUN"
+            else:
+                m = None
+            f = theano.function([x], T.exp(x).sum(axis=0), profile=p,
+                                mode=m)
+            for i in range(3):
+                f(numpy.ones((3, 4), dtype='float32'))
+        finally:
+            theano.config.profiling.output_format = config1
+
+        d = json.loads(json.dumps(p.to_dict()))
+        assert d['message'] == "test_export"
+        assert d['fct_callcount'] == 3
+        assert [a['index'] for a in d['apply']] == range(len(d['apply']))
+        assert all(a['callcount'] == 3 for a in d['apply'])
+
+        merged = profiling.merge_profiles([d, d])
+        assert len(merged) == 1
+        assert merged[0]['fct_callcount'] == 6
+        assert len(merged[0]['processes']) == 2
+        assert all(a['callcount'] == 6 for a in merged[0]['apply'])
+
+        buf = StringIO.StringIO()
+        profiling.dump_chrome_trace([p], buf)
+        events = json.loads(buf.getvalue())['traceEvents']
+        calls = [e for e in events if e.get('cat') == 'function']
+        thunks = [e for e in events if e.get('cat') == 'apply']
+        assert len(calls) == 3
+        assert len(thunks) == 3 * len(d['apply'])
+        for e in thunks:
+            assert e['ph'] == 'X' and e['dur'] >= 0
+            assert any(c['ts'] <= e['ts'] <= c['ts'] + c['dur']
+                       for c in calls)
+
+    def test_compile_phases(self):
+        config1 = theano.config.profiling.output_format
+        try:
+            theano.config.profiling.output_format = 'trace'
+            x = T.fmatrix('x')
+            p = theano.ProfileStats(False, message="test_compile_phases")
+            f = theano.function([x], T.exp(x).sum(axis=0), profile=p,
+                                mode=theano.Mode(linker='c|py',
+                                                 optimizer='fast_run'))
+        finally:
+            theano.config.profiling.output_format = config1
+
+        phases = p.compile_phase_time
+        for name in ['rebuild_collect_shared', 'std_fgraph', 'optimizer',
+                     'insert_deepcopy', 'linker']:
+            assert phases[name] > 0, name
+        assert sum(phases[name] for name in phases
+                   if name not in profiling._nested_compile_phases
+                   ) <= p.compile_time
+        assert phases['optimizer'] <= p.optimizer_time
+        assert phases['linker'] <= p.linker_time
+
+        d = json.loads(json.dumps(p.to_dict()))
+        assert d['compile_phase_time'] == phases
+        merged = profiling.merge_profiles([d, d])
+        utt.assert_allclose(merged[0]['compile_phase_time']['linker'],
+                            2 * phases['linker'])
+
+        buf = StringIO.StringIO()
+        profiling.dump_chrome_trace([p], buf)
+        events = json.loads(buf.getvalue())['traceEvents']
+        compile_events = [e['name'] for e in events
+                          if e.get('cat') == 'compile']
+        assert set(compile_events) == set(phases)
+
+        buf = StringIO.StringIO()
+        p.summary_function(buf)
+        assert 'Compile phases' in buf.getvalue()
+
+    def test_optimizer_db(self):
+        filename = os.path.join(tempfile.mkdtemp(), 'opt.db')
+        config1 = theano.config.profile_optimizer
+        config2 = theano.config.profiling.optimizer_db
+        try:
+            theano.config.profile_optimizer = True
+            theano.config.profiling.optimizer_db = filename
+            x = T.dvector('x')
+            for i in range(2):
+                theano.function([x], T.exp(x) * 2 + 1,
+                                profile=theano.ProfileStats(False),
+                                mode=theano.Mode(optimizer='fast_run'))
+            theano.function([x], T.log(x + 1),
+                            mode=theano.Mode(optimizer='fast_run'),
+                            profile=theano.ProfileStats(False))
+        finally:
+            theano.config.profile_optimizer = config1
+            theano.config.profiling.optimizer_db = config2
+
+        entries = profiling.load_optimizer_profiles(filename)
+        assert len(entries) == 3
+        assert entries[0]['signature'] == entries[1]['signature']
+        assert entries[0]['signature'] != entries[2]['signature']
+        names = [r['name'] for r in entries[0]['optimizers']]
+        assert len(names) > 10
+        assert sum(r['applied'] or 0 for r in entries[0]['optimizers']) > 0
+
+        assert profiling.compare_optimizer_profiles(
+            entries[:1], entries[1:2], threshold=1e6, min_time=0) == []
+        slow = copy.deepcopy(entries[1])
+        slow['optimizers'][0]['time'] += 1000
+        regressions = profiling.compare_optimizer_profiles(
+            entries[:1], [slow], threshold=100)
+        assert [r[0] for r in regressions] == [names[0]]
+        # A graph that is only in one run is not compared.
+        slow['signature'] = 'other'
+        assert profiling.compare_optimizer_profiles(
+            entries[:1], [slow], threshold=100) == []
+
+        unused = profiling.unused_optimizers(entries)
+        assert unused
+        applied = set(r['name'] for e in entries for r in e['optimizers']
+                      if r['applied'])
+        assert not applied.intersection(u[0] for u in unused)
+
+    def test_sampling(self):
+        x = T.fmatrix('x')
+        val = numpy.ones((3, 4), dtype='float32')
+        for linker in ['cvm', 'vm', 'vm_nogc']:
+            mode = theano.Mode(linker=linker, optimizer='fast_run')
+            if linker == 'vm_nogc':
+                # Use the Stack VM
+                mode = theano.Mode(
+                    linker=theano.gof.vm.VM_Linker(allow_gc=False, lazy=True,
+                                                   use_cloop=False),
+                    optimizer='fast_run')
+            p = theano.ProfileStats(False)
+            p.set_sampling(every=4)
+            f = theano.function([x], T.exp(x).sum(axis=0), profile=p,
+                                mode=mode)
+            for i in range(10):
+                f(val)
+            assert p.fct_callcount == 10
+            assert p.sampled_callcount == 2
+            # The 2 timed calls stand for 8 calls.
+            assert all(c == 8 for c in p.apply_callcount.values())
+            assert p.apply_callcount
+
+            p.set_sampling(0)
+            for i in range(10):
+                f(val)
+            assert p.fct_callcount == 20 and p.sampled_callcount == 2
+            assert all(c == 8 for c in p.apply_callcount.values())
+
+            p.set_sampling()
+            for i in range(3):
+                f(val)
+            assert p.sampled_callcount == 5
+            assert all(c == 11 for c in p.apply_callcount.values())
+
+            p.set_sampling(interval=1000)
+            for i in range(3):
+                f(val)
+            assert p.sampled_callcount == 6
+            assert all(c == 12 for c in p.apply_callcount.values())
+        self.assertRaises(ValueError, p.set_sampling, -1)
+
+    def test_latency(self):
+        x = T.fmatrix('x')
+        p = theano.ProfileStats(False, latency=True)
+        f = theano.function([x], T.exp(x).sum(axis=0), profile=p)
+        for i in range(20):
+            f(numpy.ones((3, 4), dtype='float32'))
+        hist = p.latency['call']
+        assert hist.count == 20
+        perc = p.latency_percentiles()
+        for part in ['call', 'input', 'vm', 'output']:
+            assert p.latency[part].count == 20
+            assert 0 <= perc[part][50] <= perc[part][95] <= perc[part][99]
+        assert hist.min <= perc['call'][50] <= hist.max
+        assert perc['vm'][50] <= perc['call'][99]
+
+        buf = StringIO.StringIO()
+        p.summary_function(buf)
+        assert 'Latency per call' in buf.getvalue()
+
+        d = json.loads(json.dumps(p.to_dict()))
+        merged = profiling.merge_profiles([d, d])[0]
+        assert merged['latency']['call']['count'] == 40
+        assert theano.ProfileStats(False).latency_percentiles() is None
+
+
+def test_latency_histogram():
+    hist = profiling.LatencyHistogram()
+    assert hist.percentile(50) is None
+    rng = numpy.random.RandomState(utt.fetch_seed())
+    vals = rng.lognormal(-8, 2, size=5000)
+    for v in vals:
+        hist.record(v)
+    for q in [1, 50, 95, 99, 100]:
+        # Durations below 64ns are exact to the ns, above they are within
+        # 1/64.
+        utt.assert_allclose(hist.percentile(q), numpy.percentile(
+            vals, q, interpolation='higher'), rtol=1. / 64, atol=1e-9)
+    assert hist.percentile(100) == vals.max()
+    assert hist.percentile(0) == vals.min()
+
+    other = profiling.LatencyHistogram.from_dict(hist.to_dict())
+    assert other.counts == hist.counts
+    other.merge(hist)
+    assert other.count == 10000
+    utt.assert_allclose(other.percentile(50), hist.percentile(50))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,97 @@
+import numpy
+import unittest
+
+import theano
+from theano import tensor as T
+from theano.compile.ops import SpecifyShape
+from theano.compile.shape_specialize import ShapeSpecializedFunction
+
+
+def has_specify_shape(fn):
+    return any(isinstance(node.op, SpecifyShape)
+               for node in fn.maker.fgraph.toposort())
+
+
+class T_ShapeSpecializedFunction(unittest.TestCase):
+
+    def test_dispatch(self):
+        x = T.dmatrix('x')
+        y = T.dscalar('y')
+        s = theano.shared(0.)
+        fn = theano.function([x, y], x.sum(axis=1) * y + x.shape[0],
+                             updates=[(s, s + y)])
+        f = ShapeSpecializedFunction(fn, min_calls=3, background=False)
+        a = numpy.arange(6.).reshape(2, 3)
+        b = numpy.ones((4, 2))
+        for i in range(2):
+            f(a, 2.)
+            f(b, 1.)
+        assert not f.variants
+        f(a, 2.)
+        assert f.variants.keys() == [((2, 3), ())]
+        variant = f.variants[((2, 3), ())]
+        assert has_specify_shape(variant)
+        assert not has_specify_shape(fn)
+        # The shape was constant folded.
+        assert not any(isinstance(node.op, theano.compile.Shape_i)
+                       for node in variant.maker.fgraph.toposort())
+
+        assert numpy.all(f(a, 2.) == fn(a, 2.))
+        assert numpy.all(f(b, 1.) == fn(b, 1.))
+        # Both functions updated the shared variable: 5 calls with y=2
+        # and 4 calls with y=1.
+        assert s.get_value() == 5 * 2. + 4 * 1.
+
+    def test_lru(self):
+        x = T.dvector('x')
+        fn = theano.function([x], x * 2)
+        f = ShapeSpecializedFunction(fn, min_calls=1, max_variants=2,
+                                     background=False)
+        for n in [1, 2, 3, 2, 4]:
+            assert numpy.all(f(numpy.ones(n)) == 2)
+        assert f.variants.keys() == [((2,),), ((4,),)]
+        # Evicted variants are compiled again when used again.
+        f(numpy.ones(1))
+        assert f.variants.keys() == [((4,),), ((1,),)]
+
+    def test_background(self):
+        x = T.dmatrix('x')
+        fn = theano.function([x], [x.T, x.shape])
+        f = ShapeSpecializedFunction(fn, min_calls=2, background=True)
+        a = numpy.ones((2, 3))
+        f(a)
+        f(a)
+        f.wait()
+        assert f.variants.keys() == [((2, 3),)]
+        out = f(a)
+        assert numpy.all(out[0] == a.T) and numpy.all(out[1] == [2, 3])
+        # The keyword arguments go to the original function.
+        out = f(x=numpy.ones((3, 1)))
+        assert numpy.all(out[1] == [3, 1])
+
+    def test_background_and_main_thread(self):
+        # Compile a variant in the background while the main thread builds
+        # graphs with test values and compiles functions.
+        compute_test_value = theano.config.compute_test_value
+        limit = theano.config.traceback.limit
+        x = T.dmatrix('x')
+        fn = theano.function([x], T.exp(x).sum(axis=0) * x.shape[0])
+        f = ShapeSpecializedFunction(fn, min_calls=1, background=True)
+        a = numpy.ones((2, 3))
+        theano.config.compute_test_value = 'raise'
+        try:
+            f(a)
+            for i in range(5):
+                y = T.dvector('y')
+                y.tag.test_value = numpy.ones(3)
+                z = T.tanh(y) + i
+                assert z.tag.test_value.shape == (3,)
+                assert z.tag.trace
+                g = theano.function([y], z)
+                assert numpy.allclose(g(numpy.zeros(3)), i)
+            f.wait()
+        finally:
+            theano.config.compute_test_value = compute_test_value
+        assert theano.config.traceback.limit == limit
+        assert f.variants.keys() == [((2, 3),)]
+        assert numpy.allclose(f(a), fn(a))
@@ -5,6 +5,7 @@ import logging
 import theano
 from theano.configparser import (AddConfigVar, BoolParam, ConfigParam, EnumStr,
                                  IntParam, StrParam, TheanoConfigParser)
+from theano.misc import probe_cache
 from theano.misc.cpucount import cpuCount
 from theano.misc.windows import call_subprocess_Popen
 
@@ -155,23 +156,27 @@ AddConfigVar(
 
 param = "g++"
 
+
+def compiler_works(cxx):
+    """Return 0 if the compiler `cxx` can be run, like its return code."""
+    def probe():
+        try:
+            return call_subprocess_Popen([cxx, '-v'])
+        except OSError:
+            return 1
+    return probe_cache.cached('cxx_works', probe, probe_cache.file_key(cxx))
+
 # Test whether or not g++ is present: disable C code if it is not.
-try:
-    rc = call_subprocess_Popen(['g++', '-v'])
-except OSError:
-    rc = 1
+rc = compiler_works('g++')
 
 if rc != 0:
     param = ""
 
 # On Mac we test for 'clang++' and use it by default
 if sys.platform == 'darwin':
-    try:
-        rc = call_subprocess_Popen(['clang++', '-v'])
-        if rc == 0:
-            param = "clang++"
-    except OSError:
-        pass
+    if compiler_works('clang++') == 0:
+        rc = 0
+        param = "clang++"
 
 # Try to find the full compiler path from the name
 if param != "":
@@ -326,7 +331,8 @@ AddConfigVar(
 
 AddConfigVar(
     'traceback.limit',
-    "The number of stack to trace. -1 mean all.",
+    ("The number of stack to trace. -1 mean all. 0 disables the "
+     "trace, which makes building big graphs faster."),
     # We default to 6 to be able to know where v1 + v2 is created in the
     # user script. The bigger this number is, the more run time it takes.
     # We need to default to 7 to support theano.tensor.tensor(...).
@@ -525,6 +531,15 @@ AddConfigVar('compute_test_value_opt',
              EnumStr('off', 'ignore', 'warn', 'raise', 'pdb'),
              in_c_key=False)
 
+AddConfigVar('compute_test_value_lazy',
+             ("If True, with compute_test_value, the test values are "
+              "computed when they are first used (for instance by "
+              "get_test_value or by a test value check) instead of when "
+              "each node is built. Errors in the test values, like shape "
+              "mismatches, are raised at that time."),
+             BoolParam(False),
+             in_c_key=False)
+
 AddConfigVar('unpickle_function',
              ("Replace unpickled Theano functions with None. "
               "This is useful to unpickle old graphs that pickled"
@@ -602,11 +617,28 @@ AddConfigVar('openmp',
 AddConfigVar('openmp_elemwise_minsize',
              "If OpenMP is enabled, this is the minimum size of vectors "
              "for which the openmp parallelization is enabled "
-             "in element wise ops.",
+             "in element wise ops and in the pooling ops of "
+             "theano.tensor.signal.downsample.",
              IntParam(200000),
              in_c_key=False,
              )
 
+AddConfigVar('openmp_sparse_minsize',
+             "If OpenMP is enabled, this is the minimum number of non-zero "
+             "elements of a sparse matrix for which the openmp "
+             "parallelization is enabled in the sparse-dense products.",
+             IntParam(100000),
+             in_c_key=False,
+             )
+
+AddConfigVar('openmp_sparse_buffer_size',
+             "If OpenMP is enabled, this is the maximum number of elements "
+             "of the buffers that the threads use to accumulate their part "
+             "of the sparse-dense products in csc format.",
+             IntParam(4194304),
+             in_c_key=False,
+             )
+
 AddConfigVar(
     'check_input',
     "Specify if types should check their input in their C code. "
@@ -623,3 +655,21 @@ AddConfigVar(
     "the first optimization, and could possibly still contains some bugs. "
     "Use at your own risks.",
     BoolParam(False))
+
+
+def good_seed_param(seed):
+    if seed == "random":
+        return True
+    try:
+        int(seed)
+    except Exception:
+        return False
+    return True
+
+# Defined here and not in theano.tests.unittest_tools, as theano.tests is
+# only imported when it is used, but DebugMode uses it.
+AddConfigVar('unittests.rseed',
+             "Seed to use for randomized unit tests. "
+             "Special value 'random' means using a seed of None.",
+             StrParam(666, is_valid=good_seed_param),
+             in_c_key=False)
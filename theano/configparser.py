@@ -3,11 +3,13 @@ from __future__ import print_function
 # as False, and the string s'True', 'true', '1' as True.
 # We also accept the bool type as its corresponding value!
 
+from contextlib import contextmanager
 import inspect
 import logging
 import os
 import shlex
 import sys
+import threading
 import warnings
 
 from theano.compat.six import StringIO
@@ -126,6 +128,55 @@ def fetch_val_for_key(key):
         raise KeyError(key)
 
 _config_var_list = []
+# Full name -> ConfigParam
+_config_var_dict = {}
+
+
+class _ThreadValues(threading.local):
+    # The values of the config variables set by thread_local_config in the
+    # current thread (full name -> value).
+    values = None
+
+_thread_values = _ThreadValues()
+# Number of thread_local_config blocks in progress in all the threads. The
+# thread values are only looked up when there is one, as the config
+# variables are read very often.
+_n_thread_blocks = 0
+_thread_blocks_lock = threading.Lock()
+
+
+@contextmanager
+def thread_local_config(values):
+    """Set config variables for the current thread only, in a with block.
+
+    :param values: dict full name of the variable (e.g. 'traceback.limit')
+        -> value.
+
+    The other threads keep seeing the global values. In the block, this
+    thread can also set these variables without changing them for the
+    other threads.
+    """
+    global _n_thread_blocks
+    orig = _thread_values.values
+    new = dict(orig or {})
+    for name, val in values.items():
+        param = _config_var_dict[name]
+        if not param.allow_override:
+            raise Exception(
+                "Can't change the value of this config parameter "
+                "after initialization!")
+        if param.filter:
+            val = param.filter(val)
+        new[name] = val
+    _thread_values.values = new
+    with _thread_blocks_lock:
+        _n_thread_blocks += 1
+    try:
+        yield
+    finally:
+        _thread_values.values = orig
+        with _thread_blocks_lock:
+            _n_thread_blocks -= 1
 
 
 def _config_print(thing, buf):
@@ -247,6 +298,7 @@ def AddConfigVar(name, doc, configparam, root=config, in_c_key=True):
                 pass
         setattr(root.__class__, sections[0], configparam)
         _config_var_list.append(configparam)
+        _config_var_dict[configparam.fullname] = configparam
 
 
 class ConfigParam(object):
@@ -270,6 +322,10 @@ class ConfigParam(object):
         # invalid and causes a crash or has unwanted side effects.
 
     def __get__(self, *args):
+        if _n_thread_blocks:
+            thread_values = _thread_values.values
+            if thread_values and self.fullname in thread_values:
+                return thread_values[self.fullname]
         if not hasattr(self, 'val'):
             try:
                 val_str = fetch_val_for_key(self.fullname)
@@ -293,7 +349,10 @@ class ConfigParam(object):
                 "after initialization!")
         # print "SETTING PARAM", self.fullname,(cls), val
         if self.filter:
-            self.val = self.filter(val)
+            val = self.filter(val)
+        thread_values = _n_thread_blocks and _thread_values.values
+        if thread_values and self.fullname in thread_values:
+            thread_values[self.fullname] = val
         else:
             self.val = val
 
@@ -27,9 +27,10 @@ import numpy.distutils  # TODO: TensorType should handle this
 import theano
 from theano.compat import PY3, next, decode, decode_iter
 from theano.compat.six import b, BytesIO, StringIO
-from theano.gof.utils import flatten
+from theano.gof.utils import flatten, compile_phase, time_compile_phase
 from theano.configparser import config
 from theano.gof.cc import hash_from_code
+from theano.misc import probe_cache
 from theano.misc.windows import (subprocess_Popen, call_subprocess_Popen,
                                  output_subprocess_Popen)
 
@@ -249,6 +250,7 @@ static struct PyModuleDef moduledef = {{
     # TODO: add_type
 
 
+@compile_phase('dlimport')
 def dlimport(fullpath, suffix=None):
     """Dynamically load a .so, .pyd, .dll, or .py file
 
@@ -636,6 +638,7 @@ class ModuleCache(object):
             self.stats[0] += 1
         return self.module_from_name[name]
 
+    @compile_phase('cache_refresh')
     def refresh(self, age_thresh_use=None, delete_if_problem=False,
                 cleanup=True):
         """Update cache data by walking the cache directory structure.
@@ -1537,18 +1540,22 @@ def gcc_llvm():
     It don't support all g++ parameters even if it support many of them.
     """
     if gcc_llvm.is_llvm is None:
-        try:
-            p_out = output_subprocess_Popen([theano.config.cxx, '--version'])
-            output = p_out[0] + p_out[1]
-        except OSError:
-            # Typically means g++ cannot be found.
-            # So it is not an llvm compiler.
-
-            # Normally this should not happen as we should not try to
-            # compile when g++ is not available. If this happen, it
-            # will crash later so supposing it is not llvm is "safe".
-            output = b('')
-        gcc_llvm.is_llvm = b("llvm") in output
+        def probe():
+            try:
+                p_out = output_subprocess_Popen([theano.config.cxx,
+                                                 '--version'])
+                output = p_out[0] + p_out[1]
+            except OSError:
+                # Typically means g++ cannot be found.
+                # So it is not an llvm compiler.
+
+                # Normally this should not happen as we should not try to
+                # compile when g++ is not available. If this happen, it
+                # will crash later so supposing it is not llvm is "safe".
+                output = b('')
+            return b("llvm") in output
+        gcc_llvm.is_llvm = probe_cache.cached(
+            'gcc_llvm', probe, probe_cache.file_key(theano.config.cxx))
     return gcc_llvm.is_llvm
 
 gcc_llvm.is_llvm = None
@@ -1572,10 +1579,29 @@ class Compiler(object):
         If try_run is False, returns the compilation status.
         If try_run is True, returns a (compile_status, run_status) pair.
         If output is there, we append the stdout and stderr to the output.
+
+        The results without output are cached, see theano.misc.probe_cache.
         """
         if not compiler:
             return False
+        if output:
+            return Compiler._run_compile_tmp(src_code, tmp_prefix, flags,
+                                             try_run, output, compiler)
+        key = [probe_cache.file_key(compiler), hash_from_code(src_code),
+               list(flags), try_run]
+        rval = probe_cache.get('try_compile', key)
+        if rval is None:
+            rval = Compiler._run_compile_tmp(src_code, tmp_prefix, flags,
+                                             try_run, output, compiler)
+            probe_cache.put('try_compile', rval, key)
+        if isinstance(rval, list):
+            rval = tuple(rval)
+        return rval
 
+    @staticmethod
+    def _run_compile_tmp(src_code, tmp_prefix, flags, try_run, output,
+                         compiler):
+        """Compile (and run) a test program. See _try_compile_tmp."""
         flags = list(flags)
         compilation_ok = True
         run_ok = False
@@ -1672,6 +1698,12 @@ class GCC_compiler(Compiler):
         # http://en.gentoo-wiki.com/wiki/Safe_Cflags#-march.3Dnative
         # http://en.gentoo-wiki.com/wiki/Hardware_CFLAGS
         detect_march = GCC_compiler.march_flags is None
+        march_key = probe_cache.file_key(theano.config.cxx)
+        if detect_march:
+            march_flags = probe_cache.get('march_flags', march_key)
+            if march_flags is not None:
+                GCC_compiler.march_flags = march_flags
+                detect_march = False
         if detect_march:
             for f in cxxflags:
                 # If the user give an -march=X parameter, don't add one ourself
@@ -1860,6 +1892,8 @@ class GCC_compiler(Compiler):
                             break
                     _logger.info("g++ -march=native equivalent flags: %s",
                                  GCC_compiler.march_flags)
+            probe_cache.put('march_flags', GCC_compiler.march_flags,
+                            march_key)
 
         # Add the detected -march=native equivalent flags
         if GCC_compiler.march_flags:
@@ -2021,7 +2055,8 @@ class GCC_compiler(Compiler):
             print(' '.join(cmd), file=sys.stderr)
 
         try:
-            p_out = output_subprocess_Popen(cmd)
+            with time_compile_phase('cxx', nested=True):
+                p_out = output_subprocess_Popen(cmd)
             compile_stderr = decode(p_out[1])
         except Exception:
             # An exception can occur e.g. if `g++` is not found.
@@ -17,17 +17,23 @@ import numpy
 import theano
 from theano.configparser import config, AddConfigVar, ConfigParam, StrParam
 from theano.gof.utils import flatten
+from theano.misc import probe_cache
 from theano.misc.windows import output_subprocess_Popen
 
 
 _logger = logging.getLogger("theano.gof.compiledir")
 
-try:
-    p_out = output_subprocess_Popen([theano.config.cxx, '-dumpversion'])
-    gcc_version_str = p_out[0].strip().decode()
-except OSError:
-    # Typically means gcc cannot be found.
-    gcc_version_str = 'GCC_NOT_FOUND'
+
+
+def _gcc_version():
+    try:
+        p_out = output_subprocess_Popen([theano.config.cxx, '-dumpversion'])
+        return p_out[0].strip().decode()
+    except OSError:
+        # Typically means gcc cannot be found.
+        return 'GCC_NOT_FOUND'
+gcc_version_str = probe_cache.cached(
+    'gcc_version', _gcc_version, probe_cache.file_key(theano.config.cxx))
 
 
 def local_bitwidth():
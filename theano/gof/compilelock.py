@@ -11,6 +11,7 @@ import logging
 from contextlib import contextmanager
 
 from theano import config
+from theano.gof.utils import compile_phase
 from theano.configparser import AddConfigVar, IntParam
 
 _logger = logging.getLogger("theano.gof.compilelock")
@@ -140,6 +141,7 @@ def set_lock_status(use_lock):
 notset = object()
 
 
+@compile_phase('lock_wait')
 def lock(tmp_dir, timeout=notset, min_wait=None, max_wait=None, verbosity=1):
     """
     Obtain lock access by creating a given temporary directory (whose base will
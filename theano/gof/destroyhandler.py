@@ -177,6 +177,190 @@ def _contains_cycle(fgraph, orderings):
     return visited != len(parent_counts)
 
 
+class _DynamicToposort(object):
+    """
+    Topological order of a directed acyclic graph, maintained while edges
+    and nodes are added and removed.
+
+    Every node has a position, and every edge goes from a lower to a
+    higher position. When a new edge u -> v goes against the order, the
+    descendants of v placed before u (the forward region) and the
+    ancestors of u placed after v (the backward region) are searched at
+    the same time, one node at a time, like in the algorithm of Pearce and
+    Kelly. The search finding u (or v) means the edge closes a cycle.
+    Otherwise, the region that is fully explored first (usually the
+    smallest) is moved to the other side: this is valid as positions are
+    floats, and there is always room between the predecessors of the
+    backward region and v (or between u and the successors of the forward
+    region). All the positions are recomputed in the rare case where the
+    floats become too close. Nodes that are not connected may end up with
+    the same position.
+
+    So the cost of an edge insertion only depends on the part of the graph
+    that has to be reordered, not on the size of the graph.
+
+    Edges that would close a cycle are not inserted, but kept in
+    `pending` until they are removed or `retry_pending` succeeds.
+    """
+
+    def __init__(self):
+        self.pos = {}  # node -> position
+        self.succ = {}  # node -> successor -> number of edges
+        self.pred = {}  # node -> predecessor -> number of edges
+        self.pending = {}  # (u, v) -> number of edges
+        self.last = 0.0  # highest position
+
+    def add_node(self, node):
+        self.last += 1.0
+        self.pos[node] = self.last
+        self.succ[node] = {}
+        self.pred[node] = {}
+
+    def remove_node(self, node):
+        for v in self.succ.pop(node):
+            del self.pred[v][node]
+        for u in self.pred.pop(node):
+            del self.succ[u][node]
+        del self.pos[node]
+        if self.pending:
+            for e in [e for e in self.pending if node in e]:
+                del self.pending[e]
+
+    def add_edge(self, u, v):
+        """Add the edge u -> v, return False if it closes a cycle."""
+        if u not in self.pos or v not in self.pos:
+            return True
+        succ_u = self.succ[u]
+        if v in succ_u:
+            succ_u[v] += 1
+            self.pred[v][u] += 1
+            return True
+        if (u, v) in self.pending or not self._reorder(u, v):
+            self.pending[(u, v)] = self.pending.get((u, v), 0) + 1
+            return False
+        succ_u[v] = 1
+        self.pred[v][u] = 1
+        return True
+
+    def remove_edge(self, u, v):
+        """Remove the edge u -> v, if it is still there."""
+        e = (u, v)
+        if e in self.pending:
+            self.pending[e] -= 1
+            if not self.pending[e]:
+                del self.pending[e]
+            return
+        succ_u = self.succ.get(u)
+        if succ_u is None or v not in succ_u:
+            # It went away with one of its nodes.
+            return
+        succ_u[v] -= 1
+        if not succ_u[v]:
+            del succ_u[v]
+            del self.pred[v][u]
+        else:
+            self.pred[v][u] -= 1
+
+    def retry_pending(self):
+        """Try to insert the pending edges again, return True if there are
+        no pending edges left."""
+        for (u, v), count in self.pending.items():
+            if v in self.succ[u] or self._reorder(u, v):
+                del self.pending[(u, v)]
+                self.succ[u][v] = self.succ[u].get(v, 0) + count
+                self.pred[v][u] = self.pred[v].get(u, 0) + count
+        return not self.pending
+
+    def _reorder(self, u, v):
+        """Update the positions so that u is before v, return False if
+        there is a path from v to u."""
+        pos = self.pos
+        pos_u = pos[u]
+        pos_v = pos[v]
+        if pos_u < pos_v:
+            return True
+        if u is v:
+            return False
+        succ = self.succ
+        pred = self.pred
+        # Nodes on a path from v to u have positions in [pos_v, pos_u].
+        fwd = [v]
+        fwd_seen = set(fwd)
+        fwd_todo = [v]
+        bwd = [u]
+        bwd_seen = set(bwd)
+        bwd_todo = [u]
+        while fwd_todo and bwd_todo:
+            for y in succ[fwd_todo.pop()]:
+                if y is u:
+                    return False
+                if pos[y] < pos_u and y not in fwd_seen:
+                    fwd_seen.add(y)
+                    fwd.append(y)
+                    fwd_todo.append(y)
+            for y in pred[bwd_todo.pop()]:
+                if y is v:
+                    return False
+                if pos[y] > pos_v and y not in bwd_seen:
+                    bwd_seen.add(y)
+                    bwd.append(y)
+                    bwd_todo.append(y)
+
+        if not fwd_todo:
+            # Move the forward region just after u.
+            nodes = fwd
+            low = pos_u
+            high = min([pos[y] for x in nodes for y in succ[x]
+                        if y not in fwd_seen] or [None])
+        else:
+            # Move the backward region just before v.
+            nodes = bwd
+            low = max([pos[y] for x in nodes for y in pred[x]
+                       if y not in bwd_seen] or [None])
+            high = pos_v
+        nodes.sort(key=pos.__getitem__)
+        n = len(nodes)
+        if high is None:
+            new_pos = [self.last + i + 1 for i in xrange(n)]
+            self.last = new_pos[-1]
+        else:
+            if low is None:
+                low = high - n - 1
+            step = (high - low) / (n + 1)
+            new_pos = [low + step * (i + 1) for i in xrange(n)]
+            if not (low < new_pos[0] and new_pos[-1] < high and
+                    all(a < b for a, b in zip(new_pos, new_pos[1:]))):
+                self._renumber((u, v))
+                return True
+        for node, p in zip(nodes, new_pos):
+            pos[node] = p
+        return True
+
+    def _renumber(self, extra_edge):
+        """Give integer positions to all the nodes, taking into account the
+        edges of the graph plus `extra_edge`, which must not close a
+        cycle."""
+        u, v = extra_edge
+        n_pred = dict((x, len(p)) for x, p in self.pred.iteritems())
+        n_pred[v] += 1
+        todo = deque(sorted([x for x, c in n_pred.iteritems() if not c],
+                            key=self.pos.__getitem__))
+        i = 0
+        while todo:
+            x = todo.popleft()
+            i += 1
+            self.pos[x] = float(i)
+            children = list(self.succ[x])
+            if x is u:
+                children.append(v)
+            for y in children:
+                n_pred[y] -= 1
+                if not n_pred[y]:
+                    todo.append(y)
+        assert i == len(self.pos)
+        self.last = float(i)
+
+
 def getroot(r, view_i):
     """
     TODO: what is view_i ? based on add_impact's docstring, IG is guessing
@@ -652,10 +836,14 @@ class DestroyHandler(toolbox.Bookkeeper):
 
     It is a work in progress. The following data structures have been
     converted to use the incremental strategy:
-        <none>
+        the topological order used to detect cycles (`_DynamicToposort`,
+        updated by on_import, on_prune and on_change_input)
+        the orderings used by validate (`root_orderings`, recomputed only
+        for the view trees touched by a change, see `dirty_roots`)
 
     The following data structures remain to be converted:
-        <unknown>
+        droot, impact and root_destroyer, which are rebuilt by
+        refresh_droot_impact for orderings()
     """
     pickle_rm_attr = ["destroyers"]
 
@@ -725,7 +913,20 @@ class DestroyHandler(toolbox.Bookkeeper):
         self.view_o = OrderedDict()  # variable -> set of variables that use this one as a direct input
         # clients: how many times does an apply use a given variable
         self.clients = OrderedDict()  # variable -> apply -> ninputs
+        # variable -> set of (apply, input index) that destroy it
+        self.destroyed_by = OrderedDict()
         self.stale_droot = True
+        # Topological order of the Apply nodes, with an edge for each
+        # input and for each ordering.
+        self.toposort = _DynamicToposort()
+        # foundation -> the (before, after) pairs of the orderings of the
+        # destroyer of its view tree, as added to toposort
+        self.root_orderings = OrderedDict()
+        # foundations whose view tree changed since the last validate
+        self.dirty_roots = OrderedSet()
+        # Apply instances pruned since the last validate. Their edges went
+        # away with them, even if they were imported back.
+        self.pruned = set()
 
         self.debug_all_apps = OrderedSet()
         if self.do_imports_on_attach:
@@ -733,13 +934,33 @@ class DestroyHandler(toolbox.Bookkeeper):
 
     def unpickle(self, fgraph):
         def get_destroyers_of(r):
-            droot, impact, root_destroyer = self.refresh_droot_impact()
-            try:
-                return [root_destroyer[droot[r]]]
-            except Exception:
-                return []
+            # Only look at the view tree of r instead of rebuilding droot
+            # for all the destroyers: the inplace optimizers call this after
+            # each replacement, when droot is stale.
+            root = getroot(r, self.view_i)
+            rval = []
+            for app, destroyed_idx in self.tree_destroyers(
+                    self.view_tree(root)):
+                if app not in rval:
+                    rval.append(app)
+            return rval
         fgraph.destroyers = get_destroyers_of
 
+    def view_tree(self, root):
+        """Return `root` and all the variables that are views of it."""
+        tree = OrderedSet([root])
+        tree.update(get_impact(root, self.view_o))
+        return tree
+
+    def tree_destroyers(self, tree):
+        """Return the (app, input index) pairs of the destroyed inputs
+        that are in `tree`."""
+        rval = []
+        for v in tree:
+            if v in self.destroyed_by:
+                rval.extend(self.destroyed_by[v])
+        return rval
+
     def refresh_droot_impact(self):
         """
         Makes sure self.droot, self.impact, and self.root_destroyer are
@@ -781,7 +1002,12 @@ class DestroyHandler(toolbox.Bookkeeper):
         del self.view_i
         del self.view_o
         del self.clients
+        del self.destroyed_by
         del self.stale_droot
+        del self.toposort
+        del self.root_orderings
+        del self.dirty_roots
+        del self.pruned
         assert self.fgraph.destroyer_handler is self
         delattr(self.fgraph, 'destroyers')
         delattr(self.fgraph, 'destroy_handler')
@@ -798,6 +1024,11 @@ class DestroyHandler(toolbox.Bookkeeper):
         # If it's a destructive op, add it to our watch list
         if getattr(app.op, 'destroy_map', OrderedDict()):
             self.destroyers.add(app)
+            for input_idx_list in app.op.destroy_map.values():
+                input_idx = input_idx_list[0]
+                self.destroyed_by.setdefault(app.inputs[input_idx],
+                                             OrderedSet()).add(
+                    (app, input_idx))
 
         # add this symbol to the forward and backward maps
         for o_idx, i_idx_list in getattr(app.op, 'view_map',
@@ -819,6 +1050,13 @@ class DestroyHandler(toolbox.Bookkeeper):
         for i, output in enumerate(app.outputs):
             self.clients.setdefault(output, OrderedDict())
 
+        # The nodes are imported after their inputs.
+        self.toposort.add_node(app)
+        for input in app.inputs:
+            if input.owner:
+                self.toposort.add_edge(input.owner, app)
+            self.dirty_roots.add(getroot(input, self.view_i))
+
         self.stale_droot = True
 
     def on_prune(self, fgraph, app, reason):
@@ -827,12 +1065,24 @@ class DestroyHandler(toolbox.Bookkeeper):
             raise ProtocolError("prune without import")
         self.debug_all_apps.remove(app)
 
+        # The orderings that involve app belong to the view trees of its
+        # inputs. validate will recompute them.
+        self.toposort.remove_node(app)
+        self.pruned.add(app)
+
         # UPDATE self.clients
         for i, input in enumerate(OrderedSet(app.inputs)):
             del self.clients[input][app]
+            self.dirty_roots.add(getroot(input, self.view_i))
 
         if getattr(app.op, 'destroy_map', OrderedDict()):
             self.destroyers.remove(app)
+            for input_idx_list in app.op.destroy_map.values():
+                input_idx = input_idx_list[0]
+                input = app.inputs[input_idx]
+                self.destroyed_by[input].remove((app, input_idx))
+                if not self.destroyed_by[input]:
+                    del self.destroyed_by[input]
 
         # Note: leaving empty client dictionaries in the struct.
         # Why? It's a pain to remove them. I think they aren't doing any harm, they will be
@@ -873,6 +1123,21 @@ class DestroyHandler(toolbox.Bookkeeper):
             self.clients.setdefault(new_r, OrderedDict()).setdefault(app, 0)
             self.clients[new_r][app] += 1
 
+            # UPDATE self.destroyed_by
+            if app in self.destroyers and (app, i) in self.destroyed_by.get(
+                    old_r, ()):
+                self.destroyed_by[old_r].remove((app, i))
+                if not self.destroyed_by[old_r]:
+                    del self.destroyed_by[old_r]
+                self.destroyed_by.setdefault(new_r, OrderedSet()).add((app, i))
+
+            # UPDATE self.toposort. This may close a cycle, which validate
+            # will report.
+            if old_r.owner:
+                self.toposort.remove_edge(old_r.owner, app)
+            if new_r.owner:
+                self.toposort.add_edge(new_r.owner, app)
+
             # UPDATE self.view_i, self.view_o
             for o_idx, i_idx_list in getattr(app.op, 'view_map',
                                              OrderedDict()).items():
@@ -893,6 +1158,9 @@ class DestroyHandler(toolbox.Bookkeeper):
 
                     self.view_o.setdefault(new_r, OrderedSet()).add(output)
 
+            self.dirty_roots.add(getroot(old_r, self.view_i))
+            self.dirty_roots.add(getroot(new_r, self.view_i))
+
         self.stale_droot = True
 
     def validate(self, fgraph):
@@ -904,25 +1172,57 @@ class DestroyHandler(toolbox.Bookkeeper):
 
         """
 
-        if self.destroyers:
-            ords = self.orderings(fgraph)
-
-            if _contains_cycle(fgraph, ords):
-                raise InconsistencyError("Dependency graph contains cycles")
-        else:
-            # James's Conjecture:
-            # If there are no destructive ops, then there can be no cycles.
-
-            # FB: This isn't always True. It can happend that
-            # optimization introduce node that depend on itself. This
-            # is very rare and should not happen in general. It will be
-            # caught later. The error will be far from the source. But
-            # doing this conjecture should speed up compilation most of
-            # the time. The user should create such dependency except
-            # if he mess too much with the internal.
-            pass
+        # The edges of the inputs are already in self.toposort, only the
+        # orderings of the view trees that changed have to be updated. The
+        # cost of this only depends on the part of the graph that changed
+        # and has to be reordered.
+        toposort = self.toposort
+        pruned = self.pruned
+        while self.dirty_roots:
+            root = next(iter(self.dirty_roots))
+            # This raises InconsistencyError with root still dirty.
+            edges = self.root_ordering_edges(root)
+            old_edges = self.root_orderings.pop(root, ())
+            if pruned:
+                old_edges = set(e for e in old_edges
+                                if e[0] not in pruned and e[1] not in pruned)
+            for before, app in old_edges:
+                if (before, app) not in edges:
+                    toposort.remove_edge(before, app)
+            for before, app in edges:
+                if (before, app) not in old_edges:
+                    toposort.add_edge(before, app)
+            if edges:
+                self.root_orderings[root] = edges
+            self.dirty_roots.remove(root)
+        pruned.clear()
+        if toposort.pending and not toposort.retry_pending():
+            raise InconsistencyError("Dependency graph contains cycles")
         return True
 
+    def root_ordering_edges(self, root):
+        """Return the orderings induced by the destroyer of the view tree
+        of `root` as a set of (before, after) pairs.
+
+        Raise InconsistencyError like `orderings`.
+        """
+        tree = self.view_tree(root)
+        destroyed = self.tree_destroyers(tree)
+        if not destroyed:
+            return set()
+        if len(destroyed) > 1:
+            raise InconsistencyError("Multiple destroyers of %s" % root)
+        illegal_destroy = [r for r in tree
+                           if getattr(r.tag, 'indestructible', False) or
+                           isinstance(r, graph.Constant)]
+        if illegal_destroy:
+            raise InconsistencyError(
+                "Attempting to destroy indestructible variables: %s" %
+                illegal_destroy)
+        app, destroyed_idx = destroyed[0]
+        return set((before, app) for before in
+                   self.destroyer_prereqs(app, destroyed_idx, tree))
+
     def orderings(self, fgraph):
         """Return orderings induced by destructive operations.
 
@@ -953,71 +1253,83 @@ class DestroyHandler(toolbox.Bookkeeper):
                 # for each destroyed input...
                 for output_idx, input_idx_list in app.op.destroy_map.items():
                     destroyed_idx = input_idx_list[0]
-                    destroyed_variable = app.inputs[destroyed_idx]
-                    root = droot[destroyed_variable]
+                    root = droot[app.inputs[destroyed_idx]]
                     root_impact = impact[root]
-                    # we generally want to put all clients of things which depend on root
-                    # as pre-requisites of app.
-                    # But, app is itself one such client!
-                    # App will always be a client of the node we're destroying
-                    # (destroyed_variable, but the tricky thing is when it is also a client of
-                    # *another variable* viewing on the root.  Generally this is illegal, (e.g.,
-                    # add_inplace(x, x.T).  In some special cases though, the in-place op will
-                    # actually be able to work properly with multiple destroyed inputs (e.g,
-                    # add_inplace(x, x).  An Op that can still work in this case should declare
-                    # so via the 'destroyhandler_tolerate_same' attribute or
-                    # 'destroyhandler_tolerate_aliased' attribute.
-                    #
-                    # destroyhandler_tolerate_same should be a list of pairs of the form
-                    # [(idx0, idx1), (idx0, idx2), ...]
-                    # The first element of each pair is the input index of a destroyed
-                    # variable.
-                    # The second element of each pair is the index of a different input where
-                    # we will permit exactly the same variable to appear.
-                    # For example, add_inplace.tolerate_same might be [(0,1)] if the destroyed
-                    # input is also allowed to appear as the second argument.
-                    #
-                    # destroyhandler_tolerate_aliased is the same sort of list of
-                    # pairs.
-                    # op.destroyhandler_tolerate_aliased = [(idx0, idx1)] tells the
-                    # destroyhandler to IGNORE an aliasing between a destroyed
-                    # input idx0 and another input idx1.
-                    # This is generally a bad idea, but it is safe in some
-                    # cases, such as
-                    # - the op reads from the aliased idx1 before modifying idx0
-                    # - the idx0 and idx1 are guaranteed not to overlap (e.g.
-                    #   they are pointed at different rows of a matrix).
-                    #
-
-                    # CHECK FOR INPUT ALIASING
-                    # OPT: pre-compute this on import
-                    tolerate_same = getattr(app.op, 'destroyhandler_tolerate_same', [])
-                    assert isinstance(tolerate_same, list)
-                    tolerated = OrderedSet(idx1 for idx0, idx1 in tolerate_same
-                            if idx0 == destroyed_idx)
-                    tolerated.add(destroyed_idx)
-                    tolerate_aliased = getattr(app.op, 'destroyhandler_tolerate_aliased', [])
-                    assert isinstance(tolerate_aliased, list)
-                    ignored = OrderedSet(idx1 for idx0, idx1 in tolerate_aliased
-                            if idx0 == destroyed_idx)
-                    # print 'tolerated', tolerated
-                    # print 'ignored', ignored
-                    for i, input in enumerate(app.inputs):
-                        if i in ignored:
-                            continue
-                        if input in root_impact \
-                                and (i not in tolerated or input is not destroyed_variable):
-                            raise InconsistencyError("Input aliasing: %s (%i, %i)"
-                                    % (app, destroyed_idx, i))
-
-                    # add the rule: app must be preceded by all other Apply instances that
-                    # depend on destroyed_input
-                    root_clients = OrderedSet()
-                    for r in root_impact:
-                        assert not [a for a, c in self.clients[r].items() if not c]
-                        root_clients.update([a for a, c in self.clients[r].items() if c])
-                    root_clients.remove(app)
+                    root_clients = self.destroyer_prereqs(app, destroyed_idx,
+                                                          root_impact)
                     if root_clients:
                         rval[app] = root_clients
 
         return rval
+
+    def destroyer_prereqs(self, app, destroyed_idx, root_impact):
+        """Return the Apply instances that must be computed before `app`,
+        which destroys its input `destroyed_idx` whose view tree is
+        `root_impact`.
+
+        Raise InconsistencyError if app illegally destroys one of its own
+        inputs by aliasing.
+        """
+        destroyed_variable = app.inputs[destroyed_idx]
+        # we generally want to put all clients of things which depend on root
+        # as pre-requisites of app.
+        # But, app is itself one such client!
+        # App will always be a client of the node we're destroying
+        # (destroyed_variable, but the tricky thing is when it is also a client of
+        # *another variable* viewing on the root.  Generally this is illegal, (e.g.,
+        # add_inplace(x, x.T).  In some special cases though, the in-place op will
+        # actually be able to work properly with multiple destroyed inputs (e.g,
+        # add_inplace(x, x).  An Op that can still work in this case should declare
+        # so via the 'destroyhandler_tolerate_same' attribute or
+        # 'destroyhandler_tolerate_aliased' attribute.
+        #
+        # destroyhandler_tolerate_same should be a list of pairs of the form
+        # [(idx0, idx1), (idx0, idx2), ...]
+        # The first element of each pair is the input index of a destroyed
+        # variable.
+        # The second element of each pair is the index of a different input where
+        # we will permit exactly the same variable to appear.
+        # For example, add_inplace.tolerate_same might be [(0,1)] if the destroyed
+        # input is also allowed to appear as the second argument.
+        #
+        # destroyhandler_tolerate_aliased is the same sort of list of
+        # pairs.
+        # op.destroyhandler_tolerate_aliased = [(idx0, idx1)] tells the
+        # destroyhandler to IGNORE an aliasing between a destroyed
+        # input idx0 and another input idx1.
+        # This is generally a bad idea, but it is safe in some
+        # cases, such as
+        # - the op reads from the aliased idx1 before modifying idx0
+        # - the idx0 and idx1 are guaranteed not to overlap (e.g.
+        #   they are pointed at different rows of a matrix).
+        #
+
+        # CHECK FOR INPUT ALIASING
+        # OPT: pre-compute this on import
+        tolerate_same = getattr(app.op, 'destroyhandler_tolerate_same', [])
+        assert isinstance(tolerate_same, list)
+        tolerated = OrderedSet(idx1 for idx0, idx1 in tolerate_same
+                if idx0 == destroyed_idx)
+        tolerated.add(destroyed_idx)
+        tolerate_aliased = getattr(app.op, 'destroyhandler_tolerate_aliased', [])
+        assert isinstance(tolerate_aliased, list)
+        ignored = OrderedSet(idx1 for idx0, idx1 in tolerate_aliased
+                if idx0 == destroyed_idx)
+        # print 'tolerated', tolerated
+        # print 'ignored', ignored
+        for i, input in enumerate(app.inputs):
+            if i in ignored:
+                continue
+            if input in root_impact \
+                    and (i not in tolerated or input is not destroyed_variable):
+                raise InconsistencyError("Input aliasing: %s (%i, %i)"
+                        % (app, destroyed_idx, i))
+
+        # add the rule: app must be preceded by all other Apply instances that
+        # depend on destroyed_input
+        root_clients = OrderedSet()
+        for r in root_impact:
+            assert not [a for a, c in self.clients[r].items() if not c]
+            root_clients.update([a for a, c in self.clients[r].items() if c])
+        root_clients.remove(app)
+        return root_clients
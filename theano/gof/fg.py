@@ -5,7 +5,6 @@ types that it can raise
 """
 from __future__ import print_function
 import StringIO
-import sys
 import time
 import traceback
 
@@ -172,7 +171,6 @@ class FunctionGraph(utils.object2):
                             " the values must be tuples or lists." % (
                                 str(node.op), str(node.op.destroy_map)))
         node.fgraph = self
-        node.deps = {}
         #self.execute_callbacks('on_setup_node', node)
 
     def disown(self):
@@ -188,7 +186,6 @@ class FunctionGraph(utils.object2):
         """
         for apply_node in self.apply_nodes:
             del apply_node.fgraph
-            del apply_node.deps
         for variable in self.variables:
             del variable.fgraph
             del variable.clients
@@ -213,14 +210,12 @@ class FunctionGraph(utils.object2):
         new_clients -> list of (node, i) pairs such that node.inputs[i] is r.
 
         Updates the list of clients of r with new_clients.
+
+        The (node, i) pairs are not checked against the current clients,
+        as that is linear in their number. They can't already be there:
+        the nodes are new, or their input i was another variable.
+        check_integrity() checks that there are no duplicates.
         """
-        if set(r.clients).intersection(set(new_clients)):
-            print('ERROR: clients intersect!', file=sys.stderr)
-            print('  RCLIENTS of', r, [(n, i, type(n), id(n))
-                                                      for n, i in r.clients], file=sys.stderr)
-            print('  NCLIENTS of', r, [(n, i, type(n), id(n))
-                                                      for n, i in new_clients], file=sys.stderr)
-        assert not set(r.clients).intersection(set(new_clients))
         r.clients += new_clients
 
     def __remove_clients__(self, r, clients_to_remove,
@@ -233,11 +228,6 @@ class FunctionGraph(utils.object2):
         """
         for entry in clients_to_remove:
             r.clients.remove(entry)
-            if entry in r.clients:
-                print('ERROR: DUPLICATE CLIENT ENTRY...', file=sys.stderr)
-                print('  ENTRY', repr(entry), type(entry[0]), file=sys.stderr)
-                print('  CLIENTS', repr(r.clients), file=sys.stderr)
-            assert entry not in r.clients  # an op,i pair should be unique
         if not r.clients:
             if prune:
                 self.__prune_r__([r], reason)
@@ -696,6 +686,9 @@ class FunctionGraph(utils.object2):
             if variable.fgraph is not self:
                 raise Exception("Variable should belong to the FunctionGraph.",
                                 variable)
+            if len(set(variable.clients)) != len(variable.clients):
+                raise Exception("Duplicate entries in the clients list.",
+                                variable, variable.clients)
             for node, i in variable.clients:
                 if node == 'output':
                     if self.outputs[i] is not variable:
@@ -35,7 +35,18 @@ class Node(utils.object2):
     Instead each Node keeps track of its parents via
     Variable.owner / Apply.inputs and its children
     via Variable.clients / Apply.outputs.
+
+    The `tag` of a Node is only created when it is first used, as most
+    nodes of big graphs never use it.
     """
+    def __getattr__(self, name):
+        # Only called when the normal attribute lookup fails
+        if name == 'tag':
+            self.tag = utils.scratchpad()
+            return self.tag
+        raise AttributeError("'%s' object has no attribute '%s'" %
+                             (type(self).__name__, name))
+
     def get_parents(self):
         """ Return a list of the parents of this node.
         Should return a copy--i.e., modifying the return
@@ -92,7 +103,6 @@ class Apply(Node):
         """
         self.op = op
         self.inputs = []
-        self.tag = utils.scratchpad()
 
         if not isinstance(inputs, (list, tuple)):
             raise TypeError("The inputs of an Apply must be a list or tuple")
@@ -180,7 +190,8 @@ class Apply(Node):
         """
         cp = self.__class__(self.op, self.inputs,
                             [output.clone() for output in self.outputs])
-        cp.tag = copy(self.tag)
+        if 'tag' in self.__dict__:
+            cp.tag = copy(self.tag)
         return cp
 
     def clone_with_new_inputs(self, inputs, strict=True):
@@ -215,7 +226,8 @@ class Apply(Node):
                     remake_node = True
         if remake_node:
             new_node = self.op.make_node(*new_inputs)
-            new_node.tag = copy(self.tag).__update__(new_node.tag)
+            if 'tag' in self.__dict__:
+                new_node.tag = copy(self.tag).__update__(new_node.tag)
         else:
             new_node = self.clone()
             new_node.inputs = new_inputs
@@ -333,7 +345,6 @@ class Variable(Node):
         """
         super(Variable, self).__init__()
 
-        self.tag = utils.scratchpad()
         self.type = type
         if owner is not None and not isinstance(owner, Apply):
             raise TypeError("owner must be an Apply instance", owner)
@@ -373,7 +384,8 @@ class Variable(Node):
         """
         # return copy(self)
         cp = self.__class__(self.type, None, None, self.name)
-        cp.tag = copy(self.tag)
+        if 'tag' in self.__dict__:
+            cp.tag = copy(self.tag)
         return cp
 
     def __lt__(self, other):
@@ -469,7 +481,8 @@ class Constant(Variable):
         We suppose that the data will never change.
         """
         cp = self.__class__(self.type, self.data, self.name)
-        cp.tag = copy(self.tag)
+        if 'tag' in self.__dict__:
+            cp.tag = copy(self.tag)
         return cp
 
     def __set_owner(self, value):
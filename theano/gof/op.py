@@ -448,6 +448,10 @@ class PureOp(object):
             return v.value
         elif isinstance(v, SharedVariable):
             return v.get_value(borrow=True, return_internal_type=True)
+        elif (isinstance(v, graph.Variable) and
+              'lazy_test_value' in v.tag.__dict__):
+            # Compute it here, as hasattr would hide the errors.
+            return v.tag.test_value
         elif isinstance(v, graph.Variable) and hasattr(v.tag, 'test_value'):
             # ensure that the test value is correct
             try:
@@ -508,14 +512,16 @@ class PureOp(object):
 
         if config.compute_test_value != 'off':
             run_perform = True
+            lazy = config.compute_test_value_lazy
 
             # build test input-values
-            storage_map = {}
-            compute_map = {}
+            input_values = []
             for i, ins in enumerate(node.inputs):
                 try:
-                    storage_map[ins] = [self._get_test_value(ins)]
-                    compute_map[ins] = [True]
+                    if not lazy:
+                        input_values.append(self._get_test_value(ins))
+                    elif not _has_test_value(ins):
+                        raise AttributeError('%s has no test value' % ins)
                 except AttributeError:
                     # no test-value was specified, act accordingly
                     if config.compute_test_value == 'warn':
@@ -534,37 +540,15 @@ class PureOp(object):
 
             # if all inputs have test-values, run the actual op
             if run_perform:
-                # Original values should not be destroyed:
-                # copy the values of the inputs in destroy_map
-                destroyed_inputs_idx = set()
-                if getattr(node.op, 'destroy_map', None):
-                    for i_pos_list in node.op.destroy_map.itervalues():
-                        destroyed_inputs_idx.update(i_pos_list)
-                for inp_idx in destroyed_inputs_idx:
-                    inp = node.inputs[inp_idx]
-                    storage_map[inp] = [storage_map[inp][0].copy()]
-
-                # Prepare storage_map and compute_map for the outputs
-                for o in node.outputs:
-                    storage_map[o] = [None]
-                    compute_map[o] = [False]
-
-                # compute output value once with test inputs to validate graph
-                thunk = node.op.make_thunk(node, storage_map, compute_map,
-                        no_recycling=[])
-                thunk.inputs = [storage_map[v] for v in node.inputs]
-                thunk.outputs = [storage_map[v] for v in node.outputs]
-
-                required = thunk()
-                assert not required  # We provided all inputs
-
-                for output in node.outputs:
-                    # Check that the output has been computed
-                    assert compute_map[output][0], (output, storage_map[output][0])
-
-                    # add 'test_value' to output tag, so that downstream ops can use these
-                    # numerical values as inputs to their perform method.
-                    output.tag.test_value = storage_map[output][0]
+                if lazy:
+                    # The values are computed when they are first used,
+                    # see utils.scratchpad.
+                    for i, output in enumerate(node.outputs):
+                        output.tag.lazy_test_value = _LazyTestValue(node, i)
+                else:
+                    # compute output value once with test inputs to
+                    # validate graph
+                    _compute_test_values(node, input_values)
 
         if self.default_output is not None:
             rval = node.outputs[self.default_output]
@@ -620,6 +604,30 @@ class PureOp(object):
                 "own op, implement the R_op method." %
                 (self, self.__class__.__name__))
 
+    def batch_apply(self, inputs, batched):
+        """
+
+        This method is used by the vectorized tensor.jacobian
+
+        Apply the op to a batch of inputs, like a loop over the batch
+        would do but without the loop.
+
+        inputs: a list of Variables. When batched[i] is True, inputs[i]
+                has an additional leading dimension over the batch (its
+                element j is the input i of the element j of the batch),
+                otherwise inputs[i] is the same for the whole batch.
+        batched: a list of bools with the same length as inputs. At
+                 least one of them is True.
+
+        returns: a list of Variables, the outputs of the op with an
+                 additional leading dimension over the batch.
+
+        """
+        raise NotImplementedError(
+                "%s of class %s does not "
+                "implement batch_apply." %
+                (self, self.__class__.__name__))
+
     def perform(self, node, inputs, output_storage):
         """
         Required:  Calculate the function on the inputs and put the variables in the
@@ -799,6 +807,143 @@ class Op(utils.object2, PureOp, CLinkerOp):
         return rval
 
 
+def _has_test_value(v):
+    """Return True if `v` has a test value, without computing it."""
+    from theano.compile.sharedvalue import SharedVariable
+    return (isinstance(v, (graph.Constant, SharedVariable)) or
+            'lazy_test_value' in v.tag.__dict__ or
+            hasattr(v.tag, 'test_value'))
+
+
+# Thunks computing test values, shared by the nodes with the same op,
+# input types (or constants) and output types. See _test_value_thunk.
+_test_value_thunks = {}
+_test_value_thunks_max_size = 2000
+
+
+def _test_value_thunk(node):
+    """Return a thunk computing the outputs of `node` on test values.
+
+    Return (thunk, input storage, output storage, output compute map).
+    The thunk is built on a copy of `node` with new inputs and outputs,
+    so that the thunk cache doesn't keep the graph of `node` alive.
+    """
+    key = None
+    if node.run_context() is graph.NoContext:
+        try:
+            key = (node.op,
+                   tuple(i.signature() if isinstance(i, graph.Constant)
+                         else i.type for i in node.inputs),
+                   tuple(o.type for o in node.outputs))
+            rval = _test_value_thunks.get(key)
+        except TypeError:
+            # Something is not hashable
+            key = rval = None
+        if rval is not None:
+            return rval
+
+    inputs = [i if isinstance(i, graph.Constant) else i.type()
+              for i in node.inputs]
+    new_node = graph.Apply(node.op, inputs,
+                           [o.type() for o in node.outputs])
+    storage_map = {}
+    compute_map = {}
+    for v in new_node.inputs:
+        storage_map[v] = [None]
+        compute_map[v] = [True]
+    for v in new_node.outputs:
+        storage_map[v] = [None]
+        compute_map[v] = [False]
+    thunk = node.op.make_thunk(new_node, storage_map, compute_map,
+                               no_recycling=[])
+    rval = (thunk,
+            [storage_map[v] for v in new_node.inputs],
+            [storage_map[v] for v in new_node.outputs],
+            [compute_map[v] for v in new_node.outputs])
+    if key is not None:
+        if len(_test_value_thunks) >= _test_value_thunks_max_size:
+            _test_value_thunks.clear()
+        _test_value_thunks[key] = rval
+    return rval
+
+
+def _compute_test_values(node, input_values):
+    """Run `node` on `input_values` and set the test values of its outputs.
+    """
+    thunk, input_storage, output_storage, output_compute = \
+        _test_value_thunk(node)
+
+    # Original values should not be destroyed:
+    # copy the values of the inputs in destroy_map
+    destroyed_inputs_idx = set()
+    if getattr(node.op, 'destroy_map', None):
+        for i_pos_list in node.op.destroy_map.itervalues():
+            destroyed_inputs_idx.update(i_pos_list)
+
+    try:
+        for i, (storage, value) in enumerate(zip(input_storage,
+                                                 input_values)):
+            if i in destroyed_inputs_idx:
+                value = value.copy()
+            storage[0] = value
+        for storage, compute in zip(output_storage, output_compute):
+            storage[0] = None
+            compute[0] = False
+
+        required = thunk()
+        assert not required  # We provided all inputs
+
+        for output, storage, compute in zip(node.outputs, output_storage,
+                                            output_compute):
+            # Check that the output has been computed
+            assert compute[0], (output, storage[0])
+
+            # add 'test_value' to output tag, so that downstream ops can use
+            # these numerical values as inputs to their perform method.
+            output.tag.test_value = storage[0]
+            output.tag.__dict__.pop('lazy_test_value', None)
+    finally:
+        # Don't keep the values alive in the cached thunk
+        for storage in input_storage + output_storage:
+            storage[0] = None
+
+
+class _LazyTestValue(object):
+    """Test value of an output of `node`, computed when it is first used.
+
+    The test values of the ancestors of `node` that are also lazy are
+    computed first, from the inputs to the outputs, without recursion.
+    """
+    def __init__(self, node, idx):
+        self.node = node
+        self.idx = idx
+
+    def __call__(self):
+        order = []
+        seen = set()
+        stack = [(self.node, False)]
+        while stack:
+            node, inputs_done = stack.pop()
+            if inputs_done:
+                order.append(node)
+                continue
+            if node in seen:
+                continue
+            seen.add(node)
+            stack.append((node, True))
+            for i in node.inputs:
+                lazy = i.tag.__dict__.get('lazy_test_value')
+                if lazy is not None:
+                    stack.append((lazy.node, False))
+
+        for node in order:
+            if any('lazy_test_value' in o.tag.__dict__
+                   for o in node.outputs):
+                _compute_test_values(
+                    node, [PureOp._get_test_value(i) for i in node.inputs])
+        return self.node.outputs[self.idx].tag.test_value
+
+
 def get_test_value(v):
     """
     Extract test value from `v`. Raises AttributeError if there is none.
@@ -103,6 +103,27 @@ class Optimizer(object):
                 "The function print_profile must be overrided if the"
                 " optimizer return profiling information.")
 
+    def profile_records(self, prof, path=''):
+        """Return the statistics of the sub-optimizers in `prof`.
+
+        Return a list of dicts with the keys 'name' (the path of the
+        optimizer from the root optimizer, separated with '/'), 'class',
+        'time', 'applied' (number of times the optimizer changed the
+        graph) and 'node_created'. The values that the optimizer does not
+        collect are None.
+        """
+        return []
+
+
+def _profile_record_name(path, opt):
+    if not isinstance(opt, basestring):
+        opt = str(getattr(opt, "name", None) or
+                  getattr(opt, "__name__", None) or
+                  opt.__class__.__name__)
+    if path:
+        return path + '/' + opt
+    return opt
+
 
 class FromFunctionOptimizer(Optimizer):
     """WRITEME"""
@@ -276,6 +297,21 @@ class SeqOptimizer(Optimizer, list):
                                             level=level + 1)
         print(file=stream)
 
+    @staticmethod
+    def profile_records(prof, path=''):
+        (opts, prof, validate_time, callback_time, nb_node_before,
+         nb_node_after, sub_profs, sub_validate_time) = prof
+        records = []
+        for opt, t, sub_prof in zip(opts, prof, sub_profs):
+            name = _profile_record_name(path, opt)
+            records.append({'name': name,
+                            'class': opt.__class__.__name__,
+                            'time': t, 'applied': None,
+                            'node_created': None})
+            if sub_prof and hasattr(opt, 'profile_records'):
+                records.extend(opt.profile_records(sub_prof, name))
+        return records
+
     @staticmethod
     def merge_profile(prof1, prof2):
         """
@@ -1940,6 +1976,27 @@ class EquilibriumOptimizer(NavigatorOptimizer):
                     print(blanc + "  ", '  %.3fs - %s' % (t, opt), file=stream)
             print(file=stream)
 
+    @staticmethod
+    def profile_records(prof, path=''):
+        (opt, loop_timing, loop_process_count,
+         (start_nb_nodes, end_nb_nodes, max_nb_nodes),
+         global_opt_timing, nb_nodes, time_opts, io_toposort_timing,
+         node_created) = prof
+        process_count = dict((o, 0) for o in time_opts)
+        for count in loop_process_count:
+            for o, v in count.iteritems():
+                process_count[o] += v
+        records = [{'name': _profile_record_name(path, 'io_toposort'), 'class': 'io_toposort',
+                    'time': sum(io_toposort_timing), 'applied': None,
+                    'node_created': None}]
+        for o, t in time_opts.iteritems():
+            records.append({'name': _profile_record_name(path, o),
+                            'class': o.__class__.__name__,
+                            'time': t, 'applied': process_count[o],
+                            'node_created': node_created[o]})
+        records.sort(key=lambda r: r['name'])
+        return records
+
     @staticmethod
     def merge_profile(prof1, prof2):
         #(opt, loop_timing, loop_process_count, max_nb_nodes,
@@ -289,8 +289,8 @@ class TestComputeTestValue(unittest.TestCase):
             except ValueError as e:
                 # Get traceback
                 tb = sys.exc_info()[2]
-                # Get frame info 4 layers up
-                frame_info = traceback.extract_tb(tb)[-5]
+                # Get frame info 5 layers up
+                frame_info = traceback.extract_tb(tb)[-6]
                 # We should be in the "fx" function defined above
                 assert os.path.split(frame_info[0])[1] == 'test_compute_test_value.py'
                 assert frame_info[2] == 'fx'
@@ -419,3 +419,77 @@ class TestComputeTestValue(unittest.TestCase):
             f = theano.function([], outputs=[init_Mu1])
         finally:
             theano.config.compute_test_value = orig_compute_test_value
+
+    def test_thunk_cache(self):
+        orig_compute_test_value = theano.config.compute_test_value
+        try:
+            theano.config.compute_test_value = 'raise'
+            x = T.matrix('x')
+            x.tag.test_value = numpy.random.rand(3, 4).astype(config.floatX)
+            y = T.matrix('y')
+            y.tag.test_value = numpy.random.rand(3, 4).astype(config.floatX)
+
+            z1 = T.exp(x)
+            thunk = theano.gof.op._test_value_thunk(z1.owner)
+            z2 = T.exp(y)
+            # Same op and types, same thunk
+            assert theano.gof.op._test_value_thunk(z2.owner) is thunk
+            # The thunk doesn't keep the values
+            assert all(s[0] is None for s in thunk[1] + thunk[2])
+            assert _allclose(z1.tag.test_value, numpy.exp(x.tag.test_value))
+            assert _allclose(z2.tag.test_value, numpy.exp(y.tag.test_value))
+            assert z1.tag.test_value is not z2.tag.test_value
+
+            # Destroyed inputs are copied
+            x_val = x.tag.test_value.copy()
+            z3 = T.inplace.exp_inplace(x)
+            assert _allclose(x.tag.test_value, x_val)
+            assert _allclose(z3.tag.test_value, numpy.exp(x_val))
+        finally:
+            theano.config.compute_test_value = orig_compute_test_value
+
+    def test_lazy(self):
+        orig_compute_test_value = theano.config.compute_test_value
+        orig_lazy = theano.config.compute_test_value_lazy
+        try:
+            theano.config.compute_test_value = 'raise'
+            theano.config.compute_test_value_lazy = True
+            x = T.matrix('x')
+            x.tag.test_value = numpy.random.rand(3, 4).astype(config.floatX)
+            y = T.matrix('y')
+            y.tag.test_value = numpy.random.rand(4, 5).astype(config.floatX)
+
+            z = T.dot(x, y) + 1
+            assert 'test_value' not in z.tag.__dict__
+            assert 'test_value' not in z.owner.inputs[0].tag.__dict__
+            assert _allclose(theano.gof.op.get_test_value(z),
+                             numpy.dot(x.tag.test_value,
+                                       y.tag.test_value) + 1)
+            assert 'lazy_test_value' not in z.tag.__dict__
+
+            # The error is raised when the test value is used
+            w = T.dot(y, x)
+            self.assertRaises(ValueError, theano.gof.op.get_test_value, w)
+
+            # Missing test values are still detected when building
+            self.assertRaises(ValueError, T.dot, x, T.matrix())
+        finally:
+            theano.config.compute_test_value = orig_compute_test_value
+            theano.config.compute_test_value_lazy = orig_lazy
+
+    def test_lazy_deep(self):
+        # The test values of a deep graph are computed without recursion
+        orig_compute_test_value = theano.config.compute_test_value
+        orig_lazy = theano.config.compute_test_value_lazy
+        try:
+            theano.config.compute_test_value = 'raise'
+            theano.config.compute_test_value_lazy = True
+            x = T.vector('x')
+            x.tag.test_value = numpy.zeros(3, dtype=config.floatX)
+            y = x
+            for i in range(sys.getrecursionlimit()):
+                y = y + 1
+            assert _allclose(y.tag.test_value, sys.getrecursionlimit())
+        finally:
+            theano.config.compute_test_value = orig_compute_test_value
+            theano.config.compute_test_value_lazy = orig_lazy
@@ -1,5 +1,6 @@
 from __future__ import print_function
 
+import random
 import unittest
 
 from theano.gof.type import Type
@@ -427,3 +428,81 @@ def test_value_repl_2():
     consistent(g)
     g.replace(sy, transpose_view(MyConstant("abc")))
     consistent(g)
+
+
+def test_usage_loop_replace():
+    # A replacement that makes a reader of a destroyed variable depend on
+    # its destroyer must be caught by the incremental toposort.
+    x, y, z = inputs()
+    r = dot(x, z)
+    aip = add_in_place(x, y)
+    e = dot(aip, r)
+    g = Env([x, y, z], [e])
+    consistent(g)
+    try:
+        g.replace_validate(z, sigmoid(aip))
+        raise Exception("Shouldn't have reached this point.")
+    except InconsistencyError:
+        pass
+    consistent(g)
+
+
+def check_dynamic_toposort(ts, edges):
+    pos = ts.pos
+    for u, v in edges:
+        assert pos[u] < pos[v], (u, v)
+
+
+def test_dynamic_toposort():
+    rng = random.Random(2345)
+    n = 60
+    ts = destroyhandler._DynamicToposort()
+    for i in xrange(n):
+        ts.add_node(i)
+    # A random DAG, given by a hidden order, whose edges are added in a
+    # random order.
+    order = range(n)
+    rng.shuffle(order)
+    all_edges = [(order[i], order[j]) for i in xrange(n)
+                 for j in xrange(i + 1, n) if rng.random() < 0.1]
+    rng.shuffle(all_edges)
+    edges = []
+    for e in all_edges:
+        assert ts.add_edge(*e)
+        edges.append(e)
+        check_dynamic_toposort(ts, edges)
+    assert not ts.pending
+    # Remove some edges and reverse them.
+    for e in edges[:30]:
+        ts.remove_edge(*e)
+    edges = edges[30:]
+    for u, v in all_edges[:30]:
+        if ts.add_edge(v, u):
+            edges.append((v, u))
+        else:
+            # It must really close a cycle.
+            assert ts.pending
+            ts.remove_edge(v, u)
+        check_dynamic_toposort(ts, edges)
+    assert not ts.pending
+
+
+def test_dynamic_toposort_cycle():
+    ts = destroyhandler._DynamicToposort()
+    for i in xrange(4):
+        ts.add_node(i)
+    assert ts.add_edge(0, 1)
+    assert ts.add_edge(1, 2)
+    assert ts.add_edge(2, 3)
+    assert not ts.add_edge(3, 1)
+    assert ts.pending
+    assert not ts.retry_pending()
+    # Once the cycle is broken, the pending edge can be inserted.
+    ts.remove_edge(1, 2)
+    assert ts.retry_pending()
+    check_dynamic_toposort(ts, [(0, 1), (2, 3), (3, 1)])
+    assert not ts.add_edge(1, 2)
+    # The pending edges of a removed node go away with it.
+    ts.remove_node(2)
+    assert not ts.pending
+    check_dynamic_toposort(ts, [(0, 1)])
@@ -18,6 +18,19 @@ class TFunctionGraph(unittest.TestCase):
         assert v.cached
         FunctionGraph([], [v + 1])
 
+    def test_many_clients(self):
+        # Adding and removing clients doesn't depend on their number
+        v = tt.vector()
+        outs = [tt.exp(v) for i in range(2000)]
+        fg = FunctionGraph([v], outs, clone=False)
+        assert len(fg.clients(v)) == 2000
+        fg.replace(outs[0], tt.log(v))
+        assert len(fg.clients(v)) == 2000
+        fg.check_integrity()
+
+        fg.inputs[0].clients.append(fg.inputs[0].clients[0])
+        self.assertRaises(Exception, fg.check_integrity)
+
     def test_pickle(self):
         v = tt.vector()
         func = theano.gof.FunctionGraph([v], [v + 1])
@@ -157,6 +157,21 @@ class TestClone(X):
         assert self.str(inputs(new_node.outputs), new_node.outputs) == ["MyOp(R7, R8)"]
         assert self.str(inputs(node.outputs), node.outputs) == ["MyOp(MyOp(R1, R2), R5)"]
 
+    def test_tag(self):
+        # The tags are created when they are used, and copied by clone
+        r1, r2 = MyVariable(1), MyVariable(2)
+        node = MyOp.make_node(r1, r2)
+        assert 'tag' not in node.__dict__
+        assert 'tag' not in r1.__dict__
+        assert not hasattr(node, 'fgraph')
+        assert node.clone().__dict__.get('tag') is None
+        node.tag.a = 1
+        r1.tag.b = 2
+        assert node.clone().tag.a == 1
+        assert node.clone().tag is not node.tag
+        assert r1.clone().tag.b == 2
+        assert pickle.loads(pickle.dumps(r1)).tag.b == 2
+
 
 ############
 # toposort #
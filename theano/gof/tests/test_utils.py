@@ -1,4 +1,8 @@
+import threading
+import time
+
 import theano
+from theano.gof import utils
 from theano.gof.utils import give_variables_names, unique, remove
 
 
@@ -41,3 +45,50 @@ def test_remove():
     # The list are neede as with python 3, remove and filter return generators
     # and we can't compare generators.
     assert list(remove(even, range(5))) == list(filter(odd, range(5)))
+
+
+def test_add_tag_trace():
+    x = theano.tensor.matrix('x')
+    assert x.tag.trace
+
+    orig_limit = theano.config.traceback.limit
+    theano.config.traceback.limit = 0
+    try:
+        y = theano.tensor.matrix('y')
+        z = x + y
+    finally:
+        theano.config.traceback.limit = orig_limit
+    assert 'tag' not in y.__dict__
+    assert 'tag' not in z.__dict__
+    assert 'tag' not in z.owner.__dict__
+
+
+def test_time_compile_phase_threads():
+    # A phase in another thread is not nested in the one of this thread,
+    # and each thread only sees its own phases.
+    started = threading.Event()
+    done = threading.Event()
+    other = {}
+
+    def compile_other():
+        started.wait()
+        snapshot = utils.compile_phase_snapshot()
+        with utils.time_compile_phase('test_other'):
+            time.sleep(0.01)
+        other['times'] = utils.compile_phases_since(snapshot)[0]
+        done.set()
+
+    thread = threading.Thread(target=compile_other)
+    thread.start()
+    snapshot = utils.compile_phase_snapshot()
+    total = utils.compile_phase_time.get('test_other', 0.0)
+    with utils.time_compile_phase('test_main'):
+        started.set()
+        done.wait()
+        time.sleep(0.01)
+    thread.join()
+    times = utils.compile_phases_since(snapshot)[0]
+    assert list(times) == ['test_main']
+    assert list(other['times']) == ['test_other']
+    assert utils.compile_phase_time['test_other'] > total
+    assert utils._thread_compile_phases().depth == 0
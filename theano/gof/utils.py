@@ -1,8 +1,12 @@
 from __future__ import print_function
+from contextlib import contextmanager
+from functools import wraps
 import linecache
 import traceback
 import re
 import sys
+import threading
+import time
 
 from theano import config
 
@@ -59,10 +63,12 @@ def add_tag_trace(thing, user_line=1):
     :param user_line: The max number of user line to keep.
 
     :note: we alse use config.traceback.limit for the maximum number
-        of stack level we look.
+        of stack level we look. If it is 0, no trace is added.
 
     """
     limit = config.traceback.limit
+    if limit == 0:
+        return thing
     if limit == -1:
         limit = None
     tr = simple_extract_stack(limit=limit)[:-1]
@@ -132,6 +138,23 @@ class scratchpad:
     def clear(self):
         self.__dict__.clear()
 
+    def __copy__(self):
+        # Much faster than the generic copy of old-style instances, that
+        # looks up several special methods through __getattr__.
+        rval = self.__class__()
+        rval.__dict__.update(self.__dict__)
+        return rval
+
+    def __getattr__(self, name):
+        # With config.compute_test_value_lazy, the test value is computed
+        # when it is first used (see theano.gof.op.PureOp.__call__).
+        if name == 'test_value' and 'lazy_test_value' in self.__dict__:
+            value = self.lazy_test_value()
+            self.__dict__.pop('lazy_test_value', None)
+            self.test_value = value
+            return value
+        raise AttributeError(name)
+
     def __update__(self, other):
         self.__dict__.update(other.__dict__)
         return self
@@ -171,6 +194,104 @@ def memoize(f):
     return rval
 
 
+# Total time spent by the process in each phase of the compilation of
+# functions (phase name -> seconds), in all the threads.
+compile_phase_time = {}
+_compile_phase_lock = threading.Lock()
+
+# If True, the (phase, start time, duration) of each phase are recorded
+# for the Chrome trace of the profiles.
+record_compile_phase_events = False
+
+# The compilation phases of the current thread. FunctionMaker adds to the
+# profile of a function the difference of these before and after
+# compiling it, so functions compiled at the same time in other threads
+# don't count. See _thread_compile_phases.
+_compile_phases = threading.local()
+
+
+def _thread_compile_phases():
+    """Return the compilation phases state of the current thread.
+
+    It has the attributes `depth`, the number of outer phases in progress,
+    `time`, the time spent in each phase, and `events`, the events recorded
+    if record_compile_phase_events is True.
+    """
+    state = _compile_phases
+    if not hasattr(state, 'depth'):
+        state.depth = 0
+        state.time = {}
+        state.events = []
+    return state
+
+
+@contextmanager
+def time_compile_phase(name, nested=False):
+    """Add the time spent in the with block to compile_phase_time[name].
+
+    If `nested` is False, the time isn't recorded when another phase with
+    nested=False is already in progress in the same thread. Functions can
+    be compiled while another one is compiled (e.g. by the optimizer), and
+    the time of the inner phases is already included in the outer one.
+    """
+    state = _thread_compile_phases()
+    if not nested:
+        state.depth += 1
+        if state.depth > 1:
+            try:
+                yield
+            finally:
+                state.depth -= 1
+            return
+    t0 = time.time()
+    try:
+        yield
+    finally:
+        dt = time.time() - t0
+        if not nested:
+            state.depth -= 1
+        state.time[name] = state.time.get(name, 0.0) + dt
+        if record_compile_phase_events:
+            state.events.append((name, t0, dt))
+        with _compile_phase_lock:
+            compile_phase_time[name] = compile_phase_time.get(name, 0.0) + dt
+
+
+def compile_phase(name, nested=True):
+    """Decorator that adds the time spent in a function to
+    compile_phase_time[name]. See time_compile_phase."""
+    def decorator(f):
+        @wraps(f)
+        def rval(*args, **kwargs):
+            with time_compile_phase(name, nested):
+                return f(*args, **kwargs)
+        return rval
+    return decorator
+
+
+def compile_phase_snapshot():
+    """Return the state to give to compile_phases_since."""
+    state = _thread_compile_phases()
+    return dict(state.time), len(state.events)
+
+
+def compile_phases_since(snapshot):
+    """Return the phases of the current thread since `snapshot`.
+
+    `snapshot` is the return value of compile_phase_snapshot(). This
+    returns a dict phase name -> time spent and the list of events
+    recorded since then.
+    """
+    start_time, start_event = snapshot
+    state = _thread_compile_phases()
+    times = {}
+    for name, t in state.time.items():
+        dt = t - start_time.get(name, 0.0)
+        if dt > 0:
+            times[name] = dt
+    return times, state.events[start_event:]
+
+
 def deprecated(filename, msg=''):
     """Decorator which will print a warning message on the first call.
 
@@ -162,8 +162,13 @@ class VM(object):
         must implement the feedback from output storage to input
         storage. False means it *must not* repeat that feedback.
 
+    timeline - None or list of (node, start time, duration) of each thunk
+        call. Only the Stack VM records it.
+
     """
 
+    timeline = None
+
     def __init__(self, nodes, thunks, pre_call_clear):
         """
         Allocate a virtual machine.
@@ -208,15 +213,17 @@ class VM(object):
         """
         raise NotImplementedError('override me')
 
-    def update_profile(self, profile):
+    def update_profile(self, profile, weight=1):
         # accumulate into the profile object
+        # weight is the number of calls that the timed ones stand for,
+        # when the profile samples the calls.
         for node, thunk, t, c in zip(self.nodes, self.thunks,
                                      self.call_times, self.call_counts):
             profile.apply_time.setdefault(node, 0.0)
-            profile.apply_time[node] += t
+            profile.apply_time[node] += t * weight
 
             profile.apply_callcount.setdefault(node, 0)
-            profile.apply_callcount[node] += c
+            profile.apply_callcount[node] += c * weight
 
             profile.apply_cimpl[node] = hasattr(thunk, 'cthunk')
 
@@ -233,6 +240,11 @@ class VM(object):
         if hasattr(self, 'dependencies'):
             profile.dependencies = self.dependencies
 
+        if self.timeline:
+            if profile.apply_timeline is not None:
+                profile.apply_timeline.extend(self.timeline)
+            del self.timeline[:]
+
         # clear the timer info out of the buffers
         for i in xrange(len(self.call_times)):
             self.call_times[i] = 0.0
@@ -348,8 +360,10 @@ class Stack(VM):
 
     def __init__(self, nodes, thunks, pre_call_clear,
                  storage_map, compute_map, fgraph, allow_gc,
-                 dependencies=None, callback=None):
+                 dependencies=None, callback=None, timeline=False):
         super(Stack, self).__init__(nodes, thunks, pre_call_clear)
+        if timeline:
+            self.timeline = []
 
         self.allow_gc = allow_gc
         self.message = ""
@@ -406,6 +420,8 @@ class Stack(VM):
         # Profile output looks buggy if a node has run but takes 0 time.
         # (and profile code might hide real bugs if it rounds up 0)
         dt = max(time.time() - t0, 1e-10)
+        if self.timeline is not None and self.time_thunks:
+            self.timeline.append((node, t0, dt))
         if self.callback is not None:
             self.callback(
                 node=node,
@@ -482,10 +498,11 @@ class Stack(VM):
                     try:
                         _, dt = self.run_thunk_of_node(current_apply)
                         del _
-                        if config.profile:
-                            current_idx = self.node_idx[current_apply]
+                        current_idx = self.node_idx[current_apply]
+                        if self.time_thunks:
                             self.call_counts[current_idx] += 1
                             self.call_times[current_idx] += dt
+                        if config.profile:
                             # Computing the memory footprint of the the op
                             # ?? What about inplace .. if the op is inplace
                             # you don't actually ask for more memory!
@@ -574,8 +591,9 @@ class Stack(VM):
                 try:
                     requires, dt = self.run_thunk_of_node(current_apply)
                     current_idx = self.node_idx[current_apply]
-                    self.call_counts[current_idx] += 1
-                    self.call_times[current_idx] += dt
+                    if self.time_thunks:
+                        self.call_counts[current_idx] += 1
+                        self.call_times[current_idx] += dt
 
                 except Exception:
                     link.raise_with_op(current_apply,
@@ -720,7 +738,10 @@ class VM_Linker(link.LocalLinker):
         :returns: self if fgraph is the first FunctionGraph that has ever been
             associated to self, else, a new VM_Linker associated to fgraph.
         """
+        # When sampling, the profile only has the launch time of GPU ops.
         if (config.profile and
+                config.profiling.sample_every == 1 and
+                config.profiling.sample_interval == 0 and
                 hasattr(theano, 'sandbox') and
                 hasattr(theano.sandbox, 'cuda') and
                 theano.sandbox.cuda.cuda_enabled):
@@ -758,6 +779,12 @@ class VM_Linker(link.LocalLinker):
         # admittedly confusing, and it could use some cleaning up. The base
         # Linker object should probably go away completely.
 
+    def record_timeline(self):
+        """Return True if the profile of the graph wants a thunk timeline.
+        """
+        profile = getattr(self.fgraph, 'profile', None)
+        return getattr(profile, 'apply_timeline', None) is not None
+
     def compute_gc_dependencies(self, variables):
         """
         Returns dict: variable K -> list of variables [v1, v2, v3, ...]
@@ -804,8 +831,9 @@ class VM_Linker(link.LocalLinker):
                 ):
 
         pre_call_clear = [storage_map[v] for v in self.no_recycling]
+        timeline = self.record_timeline()
 
-        if (self.callback is not None or
+        if (self.callback is not None or timeline or
                 (config.profile and config.profile_memory)):
 
             if self.use_cloop and self.callback is not None:
@@ -813,6 +841,9 @@ class VM_Linker(link.LocalLinker):
             if self.use_cloop and config.profile_memory:
                 warnings.warn(
                     'CVM does not support memory profile, using Stack VM.')
+            if self.use_cloop and timeline:
+                warnings.warn(
+                    'CVM does not support thunk timelines, using Stack VM.')
             # Needed for allow_gc=True, profiling and storage_map reuse
             deps = self.compute_gc_dependencies(storage_map)
             vm = Stack(
@@ -820,7 +851,8 @@ class VM_Linker(link.LocalLinker):
                 storage_map, compute_map,
                 self.fgraph, self.allow_gc,
                 dependencies=deps,
-                callback=self.callback)
+                callback=self.callback,
+                timeline=timeline)
         elif self.use_cloop:
             # create a map from nodes to ints and vars to ints
             nodes_idx = {}
@@ -1014,7 +1046,8 @@ class VM_Linker(link.LocalLinker):
             lazy = config.vm.lazy
         if lazy is None:
             lazy = not all([(not th.lazy) for th in thunks])
-        if not (lazy or (config.profile and config.profile_memory) or self.use_cloop or self.callback):
+        if not (lazy or (config.profile and config.profile_memory) or
+                self.use_cloop or self.callback or self.record_timeline()):
             for pair in reallocated_info.values():
                 storage_map[pair[1]] = storage_map[pair[0]]
 
@@ -806,10 +806,22 @@ def _populate_var_to_app_to_idx(outputs, wrt, consider_constant):
                 raise TypeError('Elements of consider_constant must be '
                                 'variables, but got ' + str(type(elem)))
 
+    # Variables are compared by identity, a set makes the lookups constant
+    # time.
+    consider_constant = set(consider_constant)
+
     # var_to_app_to_idx[var][node] = [i,j] means node has
     # var as input at positions i and j
     var_to_app_to_idx = OrderedDict()
 
+    # The connection patterns of the nodes, computed once per node.
+    patterns = {}
+
+    def node_to_pattern(node):
+        if node not in patterns:
+            patterns[node] = _node_to_pattern(node)
+        return patterns[node]
+
     # Set of variables that have been added to their true parents
     # ('true' here means that the elements of the variable are a function
     #  of the elements of the parent, according to the op's
@@ -819,6 +831,13 @@ def _populate_var_to_app_to_idx(outputs, wrt, consider_constant):
     #       different subsets of the inputs.
     accounted_for = set([])
 
+    # The graph is walked depth first with an explicit stack instead of
+    # recursive calls, so that deep graphs don't hit the recursion limit.
+    # Each frame is [app, var_idx, index of the next input of app]. The
+    # variables are accounted for in the same order as a recursive walk,
+    # which determines the order in which the gradient terms are added.
+    frames = []
+
     def account_for(var):
         # Don't visit the same variable twice
         if var in accounted_for:
@@ -829,63 +848,62 @@ def _populate_var_to_app_to_idx(outputs, wrt, consider_constant):
         if var in consider_constant:
             return
 
-        # Recursively add the variables that this variable is
-        # a function of.
+        # Add the variables that this variable is a function of.
         if var.owner is not None:
-            app = var.owner
-
-            connection_pattern = _node_to_pattern(app)
-
-            var_idx = app.outputs.index(var)
-
-            for i, ipt in enumerate(app.inputs):
-
-                # don't process ipt if it is not a true
-                # parent of var
-                if not connection_pattern[i][var_idx]:
-                    continue
-
-                if ipt not in var_to_app_to_idx:
-                    # This object here *must* be an OrderedDict, because
-                    # we iterate over its keys when adding up the terms of the
-                    # gradient on ipt. If it is a regular dict, the grad method
-                    # will return something that is analytically correct, but
-                    # whose order of doing additions depends on the memory
-                    # location of the apply nodes.
-                    var_to_app_to_idx[ipt] = OrderedDict()
-                app_to_idx = var_to_app_to_idx[ipt]
-                if app not in app_to_idx:
-                    app_to_idx[app] = []
-                idx = app_to_idx[app]
-                if i not in idx:
-                    idx.append(i)
-                account_for(ipt)
+            frames.append([var.owner, var.owner.outputs.index(var), 0])
 
     # add all variables that are true ancestors of the cost
     for output in outputs:
         account_for(output)
+        while frames:
+            frame = frames[-1]
+            app, var_idx, i = frame
+            if i == len(app.inputs):
+                frames.pop()
+                continue
+            frame[2] = i + 1
+
+            # don't process ipt if it is not a true
+            # parent of var
+            if not node_to_pattern(app)[i][var_idx]:
+                continue
+
+            ipt = app.inputs[i]
+            if ipt not in var_to_app_to_idx:
+                # This object here *must* be an OrderedDict, because
+                # we iterate over its keys when adding up the terms of the
+                # gradient on ipt. If it is a regular dict, the grad method
+                # will return something that is analytically correct, but
+                # whose order of doing additions depends on the memory
+                # location of the apply nodes.
+                var_to_app_to_idx[ipt] = OrderedDict()
+            app_to_idx = var_to_app_to_idx[ipt]
+            if app not in app_to_idx:
+                app_to_idx[app] = []
+            idx = app_to_idx[app]
+            if i not in idx:
+                idx.append(i)
+            account_for(ipt)
 
     # determine which variables have elements of wrt as a true
     # ancestor. Do this with an upward pass starting from wrt,
     # following only true connections
     visited = set([])
-
-    def visit(var):
+    to_visit = list(wrt)
+    while to_visit:
+        var = to_visit.pop()
         if var in visited:
-            return
+            continue
         if var not in var_to_app_to_idx:
-            return
+            continue
         visited.add(var)
         nodes = var_to_app_to_idx[var]
         for node in nodes:
-            connection_pattern = _node_to_pattern(node)
+            connection_pattern = node_to_pattern(node)
             for idx in nodes[node]:
                 for ii, output in enumerate(node.outputs):
                     if connection_pattern[idx][ii]:
-                        visit(output)
-
-    for elem in wrt:
-        visit(elem)
+                        to_visit.append(output)
 
     # Remove variables that don't have wrt as a true ancestor
     orig_vars = list(var_to_app_to_idx.keys())
@@ -943,13 +961,16 @@ def _populate_grad_dict(var_to_app_to_idx,
     term_dict = OrderedDict()
 
     def access_term_cache(node):
-        """ Populates term_dict[node] and returns it """
+        """ Populates term_dict[node] and returns it
+
+        The gradients on the outputs of node must be in grad_dict.
+        """
 
         if node not in term_dict:
 
             inputs = node.inputs
 
-            output_grads = [access_grad_cache(var) for var in node.outputs]
+            output_grads = [grad_dict[var] for var in node.outputs]
 
             # list of bools indicating if each output is connected to the cost
             outputs_connected = [not isinstance(g.type, DisconnectedType)
@@ -1233,6 +1254,7 @@ def _populate_grad_dict(var_to_app_to_idx,
         return term_dict[node]
 
     # populate grad_dict[var] and return it
+    # The terms of the nodes using var must be in term_dict.
     def access_grad_cache(var):
         if var not in grad_dict:
             # If var is not in grad_dict already, we must compute it
@@ -1242,7 +1264,7 @@ def _populate_grad_dict(var_to_app_to_idx,
                 for node in node_to_idx:
                     for idx in node_to_idx[node]:
 
-                        term = access_term_cache(node)[idx]
+                        term = term_dict[node][idx]
 
                         if not isinstance(term, gof.Variable):
                             raise TypeError(
@@ -1284,7 +1306,42 @@ def _populate_grad_dict(var_to_app_to_idx,
         # end if cache miss
         return grad_dict[var]
 
-    rval = [access_grad_cache(elem) for elem in wrt]
+    # The gradients are computed on demand, in the order of a depth first
+    # walk from wrt, but with an explicit stack instead of recursive calls
+    # so that deep graphs don't hit the recursion limit.
+    # The gradient on a variable needs the terms of the nodes that use it,
+    # and the terms of a node need the gradients on its outputs. An entry
+    # (is_node, var or node, ready) is pushed back with ready=True above
+    # the entries of its dependencies, and is computed when popped again.
+    def populate(var):
+        stack = [(False, var, False)]
+        while stack:
+            is_node, r, ready = stack.pop()
+            if is_node:
+                if r in term_dict:
+                    continue
+                if ready:
+                    access_term_cache(r)
+                    continue
+                stack.append((True, r, True))
+                stack.extend((False, out, False)
+                             for out in reversed(r.outputs)
+                             if out not in grad_dict)
+            else:
+                if r in grad_dict:
+                    continue
+                if ready:
+                    access_grad_cache(r)
+                    continue
+                stack.append((False, r, True))
+                if r in var_to_app_to_idx:
+                    stack.extend((True, node, False)
+                                 for node in reversed(
+                                     list(var_to_app_to_idx[r].keys()))
+                                 if node not in term_dict)
+        return grad_dict[var]
+
+    rval = [populate(elem) for elem in wrt]
 
     return rval
 
@@ -1712,8 +1769,80 @@ Exception args: %s""" % (self.err_pos, self.arg,
 verify_grad.E_grad = GradientError
 
 
+def _batch_graph(outputs, batched_vars):
+    """
+    Helper function for the vectorized jacobian.
+
+    batched_vars: a dictionary mapping variables to their batched
+        version, which has an additional leading dimension over the
+        batch. It is updated with the batched version of the variables
+        of the graph of `outputs` that depend on them, built with
+        Op.batch_apply.
+
+    Raises NotImplementedError if an op that must be batched doesn't
+    implement batch_apply.
+    """
+    for node in gof.graph.io_toposort(list(batched_vars.keys()), outputs):
+        batched = [ipt in batched_vars for ipt in node.inputs]
+        if True not in batched:
+            continue
+        inputs = [batched_vars.get(ipt, ipt) for ipt in node.inputs]
+        new_outputs = node.op.batch_apply(inputs, batched)
+        assert len(new_outputs) == len(node.outputs)
+        for out, new_out in zip(node.outputs, new_outputs):
+            assert new_out.ndim == out.ndim + 1
+            # The ops using out may depend on its broadcastable pattern.
+            if new_out.broadcastable[1:] != out.broadcastable:
+                new_out = theano.tensor.patternbroadcast(
+                    new_out, new_out.broadcastable[:1] + out.broadcastable)
+            batched_vars[out] = new_out
+
+
+def _vectorized_jacobian(expression, wrt, consider_constant,
+                         disconnected_inputs):
+    """
+    Helper function for jacobian.
+
+    Returns the list of the jacobians of the vector `expression` with
+    respect to the elements of `wrt`, or None for the elements whose
+    gradient graph can't be batched.
+
+    The gradient with respect to wrt is built once for a symbolic
+    gradient on `expression`, which is then replaced by the rows of the
+    identity matrix: row i of the result is the gradient of
+    expression[i].
+    """
+    from theano.tensor import alloc, eye, patternbroadcast
+    if expression.type.dtype not in theano.tensor.float_dtypes:
+        return [None] * len(wrt)
+
+    g_expression = expression.type()
+    grads = grad(None, wrt, consider_constant=consider_constant,
+                 disconnected_inputs=disconnected_inputs,
+                 known_grads=OrderedDict([(expression, g_expression)]))
+
+    n = expression.shape[0]
+    identity = patternbroadcast(eye(n, dtype=expression.type.dtype),
+                                (False,) + expression.broadcastable)
+    batched_vars = {g_expression: identity}
+    rval = []
+    for g in grads:
+        try:
+            _batch_graph([g], batched_vars)
+        except NotImplementedError:
+            rval.append(None)
+            continue
+        if g in batched_vars:
+            rval.append(batched_vars[g])
+        else:
+            # The gradient doesn't depend on the gradient on expression,
+            # it is zero.
+            rval.append(alloc(g, n, *[g.shape[i] for i in xrange(g.ndim)]))
+    return rval
+
+
 def jacobian(expression, wrt, consider_constant=None,
-             disconnected_inputs='raise'):
+             disconnected_inputs='raise', vectorize=False):
     """
     :type expression: Vector (1-dimensional) Variable
     :type wrt: Variable or list of Variables
@@ -1729,6 +1858,15 @@ def jacobian(expression, wrt, consider_constant=None,
         - 'warn': consider the gradient zero, and print a warning.
         - 'raise': raise an exception.
 
+    :type vectorize: bool
+    :param vectorize: If True, build all the rows of the jacobian at once
+        by backpropagating the rows of an identity matrix as a batch of
+        gradients on `expression` (see Op.batch_apply), instead of a scan
+        over the rows. This is faster, but the intermediate results of
+        the gradient are as big as the jacobian. The elements of `wrt`
+        whose gradient uses an op that doesn't implement batch_apply fall
+        back to the scan.
+
     :return: either a instance of Variable or list/tuple of Variables
             (depending upon `wrt`) repesenting the jacobian of `expression`
             with respect to (elements of) `wrt`. If an element of `wrt` is not
@@ -1760,6 +1898,15 @@ def jacobian(expression, wrt, consider_constant=None,
                               consider_constant=consider_constant,
                               disconnected_inputs=disconnected_inputs))
 
+    if vectorize:
+        jacobs = _vectorized_jacobian(expression, wrt, consider_constant,
+                                      disconnected_inputs)
+    else:
+        jacobs = [None] * len(wrt)
+    scan_wrt = [inp for inp, jacob in zip(wrt, jacobs) if jacob is None]
+    if not scan_wrt:
+        return format_as(using_list, using_tuple, jacobs)
+
     def inner_function(*args):
         idx = args[0]
         expr = args[1]
@@ -1775,18 +1922,23 @@ def jacobian(expression, wrt, consider_constant=None,
     # generator used n expression (because during computing gradients we are
     # just backtracking over old values. (rp Jan 2012 - if anyone has a
     # counter example please show me)
-    jacobs, updates = theano.scan(inner_function,
-                                  sequences=arange(expression.shape[0]),
-                                  non_sequences=[expression] + wrt)
+    scan_jacobs, updates = theano.scan(inner_function,
+                                       sequences=arange(expression.shape[0]),
+                                       non_sequences=[expression] + scan_wrt)
     assert not updates, \
         ("Scan has returned a list of updates. This should not "
          "happen! Report this to theano-users (also include the "
          "script that generated the error)")
+    if not isinstance(scan_jacobs, list):
+        scan_jacobs = [scan_jacobs]
+    scan_jacobs = iter(scan_jacobs)
+    jacobs = [next(scan_jacobs) if jacob is None else jacob
+              for jacob in jacobs]
     return format_as(using_list, using_tuple, jacobs)
 
 
 def hessian(cost, wrt, consider_constant=None,
-            disconnected_inputs='raise'):
+            disconnected_inputs='raise', vectorize=False):
     """
     :type cost: Scalar (0-dimensional) Variable.
     :type wrt: Vector (1-dimensional tensor) 'Variable' or list of
@@ -1803,6 +1955,10 @@ def hessian(cost, wrt, consider_constant=None,
         - 'warn': consider the gradient zero, and print a warning.
         - 'raise': raise an exception.
 
+    :type vectorize: bool
+    :param vectorize: If True, build the Hessians like jacobian with
+        vectorize=True instead of with a scan over their rows.
+
     :return: either a instance of Variable or list/tuple of Variables
             (depending upon `wrt`) repressenting the Hessian of the `cost`
             with respect to (elements of) `wrt`. If an element of `wrt` is not
@@ -1838,6 +1994,12 @@ def hessian(cost, wrt, consider_constant=None,
         # It is possible that the inputs are disconnected from expr,
         # even if they are connected to cost.
         # This should not be an error.
+        if vectorize:
+            hessians.append(jacobian(expr, input,
+                                     consider_constant=consider_constant,
+                                     disconnected_inputs='ignore',
+                                     vectorize=True))
+            continue
         hess, updates = theano.scan(lambda i, y, x: grad(
             y[i],
             x,
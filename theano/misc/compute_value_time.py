@@ -0,0 +1,73 @@
+"""
+Measure the time to build a graph with compute_test_value.
+
+The graph is a chain of layers tanh(dot(h, W) + b) on small matrices,
+built without test values, with test values computed when each node is
+built, and with compute_test_value_lazy, where they are only computed
+when the test value of the output is used:
+
+    python compute_value_time.py -d 100,500
+"""
+from __future__ import print_function
+from optparse import OptionParser
+import sys
+import time
+
+import numpy
+
+parser = OptionParser(usage='%prog <options>\n Compute the time to build'
+                      ' graphs with and without compute_test_value')
+parser.add_option('-d', '--depths', action='store', type='string',
+                  dest='depths', default='100,500,1000',
+                  help="Comma separated depths of the graphs"
+                  " (default 100,500,1000)")
+
+
+def build_time(depth, compute_test_value, lazy=False):
+    """Return the time to build a graph of `depth` layers and get the
+    test value of its output."""
+    import theano
+    import theano.tensor as T
+    floatX = theano.config.floatX
+    orig = (theano.config.compute_test_value,
+            theano.config.compute_test_value_lazy)
+    theano.config.compute_test_value = compute_test_value
+    theano.config.compute_test_value_lazy = lazy
+    try:
+        rng = numpy.random.RandomState(0)
+        h = T.matrix('h')
+        W = T.matrix('W')
+        b = T.vector('b')
+        h.tag.test_value = rng.rand(10, 20).astype(floatX)
+        W.tag.test_value = rng.rand(20, 20).astype(floatX) / 20
+        b.tag.test_value = rng.rand(20).astype(floatX)
+        t0 = time.time()
+        for i in range(depth):
+            h = T.tanh(T.dot(h, W) + b)
+        if compute_test_value != 'off':
+            theano.gof.op.get_test_value(h)
+        return time.time() - t0
+    finally:
+        (theano.config.compute_test_value,
+         theano.config.compute_test_value_lazy) = orig
+
+
+def compare(depths, file=sys.stdout):
+    """Print the times to build the graphs for each depth.
+
+    Return the list of (off, eager, lazy) times.
+    """
+    times = []
+    print('%8s %10s %10s %10s' % ('depth', 'off', 'eager', 'lazy'),
+          file=file)
+    for depth in depths:
+        t = (build_time(depth, 'off'), build_time(depth, 'raise'),
+             build_time(depth, 'raise', lazy=True))
+        times.append(t)
+        print('%8d %9.3fs %9.3fs %9.3fs' % ((depth,) + t), file=file)
+    return times
+
+
+if __name__ == '__main__':
+    options, arguments = parser.parse_args(sys.argv)
+    compare([int(d) for d in options.depths.split(',')])
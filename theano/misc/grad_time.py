@@ -0,0 +1,68 @@
+"""
+Measure the time `theano.grad` takes to build the gradient of a deep graph.
+
+The graph is a chain of layers tanh(h * w + h) applied to a vector, so
+there are 3 apply nodes per layer. The time should grow linearly with
+the depth:
+
+    python grad_time.py -d 100,1000,5000
+"""
+from __future__ import print_function
+from optparse import OptionParser
+import sys
+import time
+
+parser = OptionParser(usage='%prog <options>\n Compute the time theano.grad'
+                      ' takes to build the gradient of graphs of'
+                      ' increasing depth')
+parser.add_option('-d', '--depths', action='store', type='string',
+                  dest='depths', default='100,500,1000,2000',
+                  help="Comma separated depths of the graphs"
+                  " (default 100,500,1000,2000)")
+parser.add_option('-n', action='store', type='int', dest='n', default=1,
+                  help="Number of times each gradient is built (default 1)")
+
+
+def deep_graph(depth):
+    """Return the cost of a graph of `depth` layers and its inputs."""
+    import theano.tensor as T
+    x = T.dvector('x')
+    w = T.dscalar('w')
+    h = x
+    for i in range(depth):
+        h = T.tanh(h * w + h)
+    return h.sum(), [x, w]
+
+
+def grad_time(depth, n=1):
+    """Return the best time of n calls to theano.grad on a deep graph."""
+    import theano
+    cost, wrt = deep_graph(depth)
+    best = None
+    for i in range(n):
+        t0 = time.time()
+        theano.grad(cost, wrt)
+        t = time.time() - t0
+        if best is None or t < best:
+            best = t
+    return best
+
+
+def compare(depths, n=1, file=sys.stdout):
+    """Print the time to build the gradient for each depth.
+
+    Return the list of times.
+    """
+    times = []
+    print('%8s %10s %14s' % ('depth', 'time', 'time per layer'), file=file)
+    for depth in depths:
+        t = grad_time(depth, n)
+        times.append(t)
+        print('%8d %9.3fs %13.3fms' % (depth, t, t / depth * 1000),
+              file=file)
+    return times
+
+
+if __name__ == '__main__':
+    options, arguments = parser.parse_args(sys.argv)
+    compare([int(d) for d in options.depths.split(',')], options.n)
@@ -0,0 +1,81 @@
+"""
+Measure the time and memory used to build a big graph and a
+FunctionGraph on it, with and without the stack traces of the variables.
+
+Each measure is done in a new process. The graph has n layers
+h * x + x that all use the same input x, so x has 2 * n clients:
+
+    python graph_memory.py -n 10000,50000
+
+With traceback.limit=0, no stack trace is captured and the variables
+and nodes of the graph have no tag.
+"""
+from __future__ import print_function
+from optparse import OptionParser
+import os
+import subprocess
+import sys
+
+parser = OptionParser(usage='%prog <options>\n Compute the time and memory'
+                      ' used to build big graphs')
+parser.add_option('-n', '--sizes', action='store', type='string',
+                  dest='sizes', default='10000,50000',
+                  help="Comma separated number of layers of the graphs"
+                  " (default 10000,50000)")
+
+_measure_code = """
+import resource, time
+import theano, theano.tensor as T
+def rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024.
+x = T.vector('x')
+r0 = rss()
+t0 = time.time()
+h = x
+for i in range(%(n)d):
+    h = h * x + x
+t1 = time.time()
+r1 = rss()
+fgraph = theano.gof.FunctionGraph([x], [h], clone=False)
+t2 = time.time()
+print('%%f %%f %%f %%f' %% (t1 - t0, t2 - t1, (r1 - r0) / (2 * %(n)d),
+                          (rss() - r1) / (2 * %(n)d)))
+"""
+
+
+def measure(n, limit):
+    """Return the time to build the graph, to build the FunctionGraph,
+    and the memory per node of the graph and of the FunctionGraph."""
+    env = dict(os.environ)
+    flags = 'traceback.limit=%d' % limit
+    if env.get('THEANO_FLAGS'):
+        flags = env['THEANO_FLAGS'] + ',' + flags
+    env['THEANO_FLAGS'] = flags
+    out = subprocess.Popen([sys.executable, '-c', _measure_code % dict(n=n)],
+                           env=env, stdout=subprocess.PIPE).communicate()[0]
+    return [float(v) for v in out.decode().split()]
+
+
+def compare(sizes, file=sys.stdout):
+    """Print the measures for each size, with the default
+    traceback.limit and with 0.
+
+    Return the list of (limit, size, measures).
+    """
+    import theano
+    rval = []
+    print('%16s %8s %10s %10s %12s %12s' % (
+        'traceback.limit', 'layers', 'graph', 'fgraph', 'graph mem',
+        'fgraph mem'), file=file)
+    for limit in [theano.config.traceback.limit, 0]:
+        for n in sizes:
+            m = measure(n, limit)
+            rval.append((limit, n, m))
+            print('%16d %8d %9.3fs %9.3fs %6.0f B/node %6.0f B/node' % (
+                (limit, n) + tuple(m)), file=file)
+    return rval
+
+
+if __name__ == '__main__':
+    options, arguments = parser.parse_args(sys.argv)
+    compare([int(n) for n in options.sizes.split(',')])
@@ -0,0 +1,66 @@
+"""
+Measure the time of `import theano` with and without the probe cache.
+
+Each import is done in a new process. The cold imports run with
+probe_cache=False, so the compiler and the BLAS library are probed
+again, while the warm imports reuse the results stored in
+base_compiledir/probe_cache.json by the previous imports:
+
+    python import_time.py -n 5
+
+Most probes only happen before the first compilation. With --compile,
+the time includes the compilation of a small function using BLAS (it
+comes from the compilation cache after the first run).
+"""
+from __future__ import print_function
+from optparse import OptionParser
+import os
+import subprocess
+import sys
+import time
+
+parser = OptionParser(usage='%prog <options>\n Compute the time of'
+                      ' "import theano" with and without the probe cache')
+parser.add_option('-n', action='store', type='int', dest='n', default=3,
+                  help="Number of imports of each kind (default 3)")
+parser.add_option('-c', '--compile', action='store_true', dest='compile',
+                  default=False,
+                  help="Also compile a function after the import")
+
+_compile_code = ('import theano.tensor as T; x = T.fmatrix();'
+                 ' theano.function([x], T.dot(x, x) + 1)')
+
+
+def import_time(probe_cache, compile=False):
+    """Return the time of `import theano` in a new process."""
+    env = dict(os.environ)
+    flags = 'probe_cache=%s' % probe_cache
+    if env.get('THEANO_FLAGS'):
+        flags = env['THEANO_FLAGS'] + ',' + flags
+    env['THEANO_FLAGS'] = flags
+    t0 = time.time()
+    code = 'import theano'
+    if compile:
+        code += '; ' + _compile_code
+    subprocess.check_call([sys.executable, '-c', code], env=env)
+    return time.time() - t0
+
+
+def compare(n, compile=False, file=sys.stdout):
+    """Print the best time of n cold and n warm imports.
+
+    Return the (cold, warm) times.
+    """
+    # Fill the cache, it is not counted.
+    import_time(True, compile)
+    cold = min(import_time(False, compile) for i in range(n))
+    warm = min(import_time(True, compile) for i in range(n))
+    print('import theano without the probe cache: %.3fs' % cold, file=file)
+    print('import theano with the probe cache:    %.3fs' % warm, file=file)
+    print('speedup: %.2fx' % (cold / warm), file=file)
+    return cold, warm
+
+
+if __name__ == '__main__':
+    options, arguments = parser.parse_args(sys.argv)
+    compare(options.n, options.compile)
@@ -0,0 +1,73 @@
+"""
+Compare the time of the jacobians built with a scan over their rows
+(the default) and with vectorize=True.
+
+The jacobian is the one of tanh(dot(W, x)) * x[:n] with respect to x and
+W, for a vector x of size m and a matrix W of shape (n, m):
+
+    python jacobian_time.py -s 10,100,500
+"""
+from __future__ import print_function
+from optparse import OptionParser
+import sys
+import time
+
+import numpy
+
+parser = OptionParser(usage='%prog <options>\n Compare the time of the'
+                      ' jacobians built with a scan and with'
+                      ' vectorize=True')
+parser.add_option('-s', '--sizes', action='store', type='string',
+                  dest='sizes', default='10,50,150',
+                  help="Comma separated sizes n (m is 2 * n) of the"
+                  " jacobians (default 10,50,150)")
+parser.add_option('-n', action='store', type='int', dest='n', default=5,
+                  help="Number of calls of each function (default 5)")
+
+
+def jacobian_time(size, vectorize, n=5):
+    """Return the compilation time and the best time of n calls."""
+    import theano
+    import theano.tensor as T
+    x = T.vector('x')
+    W = T.matrix('W')
+    y = T.tanh(T.dot(W, x)) * x[:W.shape[0]]
+    t0 = time.time()
+    J = theano.gradient.jacobian(y, [x, W], vectorize=vectorize)
+    f = theano.function([x, W], J)
+    compile_time = time.time() - t0
+
+    rng = numpy.random.RandomState(0)
+    vx = rng.randn(2 * size).astype(theano.config.floatX)
+    vW = rng.randn(size, 2 * size).astype(theano.config.floatX)
+    best = None
+    for i in range(n):
+        t0 = time.time()
+        f(vx, vW)
+        t = time.time() - t0
+        if best is None or t < best:
+            best = t
+    return compile_time, best
+
+
+def compare(sizes, n=5, file=sys.stdout):
+    """Print the times of the two jacobians for each size.
+
+    Return the list of (scan time, vectorized time) of the calls.
+    """
+    times = []
+    print('%6s %22s %22s %8s' % ('size', 'scan (compile, call)',
+                                 'vectorized', 'speedup'), file=file)
+    for size in sizes:
+        scan = jacobian_time(size, False, n)
+        vec = jacobian_time(size, True, n)
+        times.append((scan[1], vec[1]))
+        print('%6d %9.3fs %10.5fs %9.3fs %10.5fs %7.1fx' % (
+            size, scan[0], scan[1], vec[0], vec[1], scan[1] / vec[1]),
+            file=file)
+    return times
+
+
+if __name__ == '__main__':
+    options, arguments = parser.parse_args(sys.argv)
+    compare([int(s) for s in options.sizes.split(',')], options.n)
@@ -0,0 +1,52 @@
+"""
+Merge the profiles written by several processes.
+
+The inputs are files written with profiling.output_format=json or
+profiling.output_format=trace. The JSON profiles of the same function are
+summed (see theano.compile.profiling.merge_profiles) and the trace events
+are concatenated, so that the timelines of all processes can be viewed
+together in chrome://tracing.
+
+    python merge_profiles.py -o merged.json prof.1.json prof.2.json
+"""
+from __future__ import print_function
+from optparse import OptionParser
+import json
+import sys
+
+from theano.compile import profiling
+
+parser = OptionParser(usage='%prog <options> profile_files\n Merge the json'
+                      ' profiles or the Chrome traces of many processes')
+parser.add_option('-o', '--output', action='store', dest='output',
+                  default=None,
+                  help="Destination file (default to stdout)")
+
+
+def merge_files(filenames):
+    """Return the merge of the JSON content of the files."""
+    profiles = []
+    events = []
+    for filename in filenames:
+        with open(filename) as f:
+            content = json.load(f)
+        profiles.extend(content.get('profiles', []))
+        events.extend(content.get('traceEvents', []))
+    if profiles and events:
+        raise ValueError("Can't merge json profiles with Chrome traces")
+    if events:
+        return {'traceEvents': events}
+    return {'profiles': profiling.merge_profiles(profiles)}
+
+
+if __name__ == '__main__':
+    options, arguments = parser.parse_args(sys.argv)
+    if len(arguments) < 2:
+        parser.print_help()
+        sys.exit(1)
+    merged = merge_files(arguments[1:])
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(merged, f, indent=1)
+    else:
+        json.dump(merged, sys.stdout, indent=1)
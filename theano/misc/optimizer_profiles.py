@@ -0,0 +1,84 @@
+"""
+Compare the optimizer profiles of different runs.
+
+The inputs are files written with profile=True, profile_optimizer=True and
+profiling.optimizer_db=<file>, which contain one line per compiled
+function. To find the optimizers that got slower, for example after an
+upgrade:
+
+    python optimizer_profiles.py compare before.db after.db
+
+Only the graphs compiled in both runs are compared. To list the
+optimizers that took the most time without ever changing the graph:
+
+    python optimizer_profiles.py unused after.db
+"""
+from __future__ import print_function
+from optparse import OptionParser
+import sys
+
+from theano.compile import profiling
+
+parser = OptionParser(usage='%prog <options> compare OLD_FILE NEW_FILE\n'
+                      '       %prog <options> unused FILE...\n'
+                      ' Compare the optimizer profiles of different runs')
+parser.add_option('-t', '--threshold', action='store', type='float',
+                  dest='threshold', default=1.5,
+                  help="Report the optimizers whose time was multiplied"
+                  " by more than this (default 1.5)")
+parser.add_option('-m', '--min-time', action='store', type='float',
+                  dest='min_time', default=0.01,
+                  help="Ignore the optimizers that take less than this"
+                  " number of seconds in the new run (default 0.01)")
+parser.add_option('-n', action='store', type='int', dest='n', default=20,
+                  help="Number of unused optimizers to print (default 20)")
+
+
+def compare(old_file, new_file, threshold, min_time, file=sys.stdout):
+    """Print the optimizers that got slower. Return their number."""
+    old = profiling.load_optimizer_profiles(old_file)
+    new = profiling.load_optimizer_profiles(new_file)
+    common = (set(e['signature'] for e in old) &
+              set(e['signature'] for e in new))
+    print('%d graphs in common (%d and %d graphs in each file)' % (
+        len(common), len(set(e['signature'] for e in old)),
+        len(set(e['signature'] for e in new))), file=file)
+    slower = profiling.compare_optimizer_profiles(old, new, threshold,
+                                                  min_time)
+    if slower:
+        print('  old time - new time - ratio - name', file=file)
+    for name, t_old, t_new in slower:
+        if t_old > 0:
+            ratio = '%.1fx' % (t_new / t_old)
+        else:
+            ratio = 'new'
+        print('  %.3fs - %.3fs - %s - %s' % (t_old, t_new, ratio, name),
+              file=file)
+    return len(slower)
+
+
+def unused(filenames, n, file=sys.stdout):
+    """Print the n slowest optimizers that never changed the graph."""
+    entries = []
+    for filename in filenames:
+        entries.extend(profiling.load_optimizer_profiles(filename))
+    rval = profiling.unused_optimizers(entries)
+    print('Optimizers that never changed the graph of %d functions' %
+          len(entries), file=file)
+    print('  time - nb functions - name', file=file)
+    for name, t, count in rval[:n]:
+        print('  %.3fs - %d - %s' % (t, count, name), file=file)
+
+
+if __name__ == '__main__':
+    options, arguments = parser.parse_args(sys.argv)
+    if len(arguments) == 4 and arguments[1] == 'compare':
+        nb = compare(arguments[2], arguments[3], options.threshold,
+                     options.min_time)
+        # Return an error code on regressions, for use in scripts.
+        sys.exit(1 if nb else 0)
+    elif len(arguments) > 2 and arguments[1] == 'unused':
+        unused(arguments[2:], options.n)
+    else:
+        parser.print_help()
+        sys.exit(1)
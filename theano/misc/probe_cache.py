@@ -0,0 +1,183 @@
+"""
+Cache of the results of the probes of the toolchain.
+
+At import and before the first compilation, Theano runs the compiler to
+find its version, the flags equivalent to -march=native, whether some
+flags or test programs work, and which BLAS flags can be used. Each of
+these spawns processes. Their results are stored in a file of the base
+compiledir, so that the next processes with the same compiler and
+environment don't have to probe again.
+
+The results are keyed by the modification time and size of the compiler
+binary, the environment variables that change the behavior of the
+compiler and the linker, the Python, NumPy and Theano versions, and the
+host and CPU (the compiledir can be shared between computers).
+"""
+import hashlib
+import json
+import logging
+import os
+import platform
+import socket
+import sys
+import tempfile
+
+from theano.compat import PY3
+from theano.compat.six import text_type
+from theano.configparser import (AddConfigVar, BoolParam, config,
+                                 fetch_val_for_key)
+
+_logger = logging.getLogger('theano.misc.probe_cache')
+
+AddConfigVar('probe_cache',
+             "Cache the results of the probes of the compiler and of the"
+             " BLAS library in base_compiledir/probe_cache.json.",
+             BoolParam(True),
+             in_c_key=False)
+
+# The environment variables that can change the result of the probes.
+_env_vars = ['PATH', 'LD_LIBRARY_PATH', 'LIBRARY_PATH', 'CPATH',
+             'C_INCLUDE_PATH', 'CPLUS_INCLUDE_PATH', 'COMPILER_PATH',
+             'GCC_EXEC_PREFIX', 'DYLD_LIBRARY_PATH',
+             'DYLD_FALLBACK_LIBRARY_PATH', 'MKL_THREADING_LAYER']
+
+# The content of the cache file, loaded on the first use.
+_probes = None
+_environment = None
+
+
+def cache_filename():
+    """Return the name of the file of the cache."""
+    try:
+        base = config.base_compiledir
+    except AttributeError:
+        # The probes of configdefaults happen before base_compiledir is
+        # defined in theano/gof/compiledir.py. Use the same default.
+        try:
+            base = fetch_val_for_key('base_compiledir')
+        except KeyError:
+            if (sys.platform == 'win32' and
+                    os.getenv('LOCALAPPDATA') is not None):
+                base = os.path.join(os.getenv('LOCALAPPDATA'), 'Theano')
+            else:
+                home = os.getenv('HOME') or os.path.expanduser('~')
+                base = os.path.join(home, '.theano')
+        base = os.path.expanduser(base)
+    return os.path.join(base, 'probe_cache.json')
+
+
+def _cpu_model():
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name') or line.startswith('flags'):
+                    return line.strip()
+    except IOError:
+        pass
+    return platform.processor()
+
+
+def environment():
+    """Return the description of the environment the probes depend on."""
+    global _environment
+    if _environment is None:
+        import numpy
+        from theano.version import version
+        _environment = ([sys.executable, sys.version, numpy.__version__,
+                         version, socket.gethostname(),
+                         platform.platform(), _cpu_model()] +
+                        [os.getenv(v) for v in _env_vars])
+    return _environment
+
+
+def file_key(path):
+    """Return a key of the state of the file or executable `path`."""
+    if not os.path.isabs(path):
+        import distutils.spawn
+        full_path = distutils.spawn.find_executable(path)
+        if full_path is not None:
+            path = full_path
+    try:
+        st = os.stat(path)
+    except OSError:
+        return [path, None, None]
+    return [path, st.st_mtime, st.st_size]
+
+
+def _key(name, extra):
+    msg = json.dumps([name, extra, environment()], sort_keys=True)
+    return name + '-' + hashlib.md5(msg.encode('utf-8')).hexdigest()
+
+
+def _load():
+    global _probes
+    if _probes is None:
+        try:
+            with open(cache_filename()) as f:
+                _probes = json.load(f)
+        except (IOError, ValueError):
+            _probes = {}
+    return _probes
+
+
+def _from_json(value):
+    # JSON returns unicode strings in Python 2, but the flags end up in
+    # the keys of the compiled modules, which must not change.
+    if isinstance(value, list):
+        return [_from_json(v) for v in value]
+    if not PY3 and isinstance(value, text_type):
+        return value.encode('utf-8')
+    return value
+
+
+def get(name, extra=()):
+    """Return the cached result of the probe `name`, or None.
+
+    `extra` is a JSON value that identifies the probe with `name`, like
+    the compiler (see file_key) and the flags used.
+    """
+    if not config.probe_cache:
+        return None
+    return _from_json(_load().get(_key(name, extra)))
+
+
+def put(name, value, extra=()):
+    """Store the JSON value `value` as the result of the probe `name`."""
+    if not config.probe_cache:
+        return
+    probes = _load()
+    probes[_key(name, extra)] = value
+    filename = cache_filename()
+    try:
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        # Write a temporary file and rename it, so that other processes
+        # never read a partial file.
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename),
+                                   prefix='probe_cache')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(probes, f, indent=0, sort_keys=True)
+        if sys.platform == 'win32' and os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tmp, filename)
+    except (IOError, OSError) as e:
+        _logger.debug('Could not write the probe cache %s: %s', filename, e)
+
+
+def cached(name, fct, extra=()):
+    """Return the cached result of `fct()`, calling it if needed."""
+    value = get(name, extra)
+    if value is None:
+        value = fct()
+        put(name, value, extra)
+    return value
+
+
+def clear():
+    """Remove the cache file and forget the cached probes."""
+    global _probes
+    _probes = None
+    try:
+        os.remove(cache_filename())
+    except OSError:
+        pass
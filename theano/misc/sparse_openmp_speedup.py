@@ -0,0 +1,95 @@
+"""
+Compare the time of the sparse-dense products with and without OpenMP
+against SciPy.
+
+Use the ``OMP_NUM_THREADS`` environment variable to choose the number of
+threads and the ``-N`` option to tune ``openmp_sparse_minsize``.
+"""
+from __future__ import print_function
+from optparse import OptionParser
+import sys
+import time
+
+import numpy
+import scipy.sparse
+
+import theano
+import theano.tensor as T
+from theano import sparse
+from theano.sparse import opt
+
+parser = OptionParser(usage='%prog <options>\n Compute time for'
+                      ' sparse-dense products with and without openmp')
+parser.add_option('-N', '--N', action='store', dest='N',
+                  default=theano.config.openmp_sparse_minsize, type="int",
+                  help="Number of non-zero elements of the sparse matrix")
+parser.add_option('-k', action='store', dest='k', default=64, type="int",
+                  help="Number of columns of the dense matrix")
+parser.add_option('--loops', action='store', dest='loops', default=100,
+                  type="int", help="Number of times each product is run")
+
+
+def evalTime(f, args, loops):
+    min = 1e10
+    for i in xrange(loops):
+        t0 = time.time()
+        f(*args)
+        dt = time.time() - t0
+        min = dt if dt < min else min
+    return min
+
+
+def compile(op, inputs):
+    sym = [T.TensorType(i.dtype, [d == 1 for d in i.shape])()
+           for i in inputs]
+    return theano.function(sym, op(*sym),
+                           mode=theano.compile.mode.get_default_mode())
+
+
+def products(N, k):
+    """Yield (name, op builder, inputs, scipy function) for each product."""
+    rng = numpy.random.RandomState(1235)
+    n = int(numpy.sqrt(N * 100))
+    dtype = theano.config.floatX
+    a = scipy.sparse.rand(n, n, density=float(N) / n ** 2, format='csr',
+                          random_state=rng).astype(dtype)
+    b = rng.rand(n, k).astype(dtype)
+    csc = a.tocsc()
+
+    yield ('StructuredDotCSR', lambda omp: opt.StructuredDotCSR(openmp=omp),
+           (a.data, a.indices, a.indptr, b), lambda: a * b)
+    yield ('StructuredDotCSC', lambda omp: opt.StructuredDotCSC(openmp=omp),
+           (csc.data, csc.indices, csc.indptr,
+            numpy.asarray(n, dtype='int32'), b), lambda: csc * b)
+    yield ('SamplingDotCSR', lambda omp: opt.SamplingDotCSR(openmp=omp),
+           (b, b, a.data, a.indices, a.indptr,
+            numpy.asarray(n, dtype='int32')),
+           lambda: a.multiply(numpy.dot(b, b.T)))
+    yield ('StructuredDotGradCSR',
+           lambda omp: sparse.basic.StructuredDotGradCSR(openmp=omp),
+           (a.indices, a.indptr, b, b),
+           lambda: (b[a.indices] *
+                    numpy.repeat(b, numpy.diff(a.indptr), 0)).sum(1))
+    if theano.config.blas.ldflags:
+        alpha = numpy.ones((1, 1), dtype=dtype)
+        yield ('UsmmCscDense',
+               lambda omp: opt.UsmmCscDense(inplace=False, openmp=omp),
+               (alpha, csc.data, csc.indices, csc.indptr,
+                numpy.asarray(n, dtype='int32'), b, b),
+               lambda: b + csc * b)
+
+
+if __name__ == '__main__':
+    options, arguments = parser.parse_args(sys.argv)
+    if hasattr(options, "help"):
+        print(options.help)
+        sys.exit(0)
+
+    for name, make_op, inputs, scipy_fn in products(options.N, options.k):
+        t = evalTime(compile(make_op(False), inputs), inputs, options.loops)
+        t_omp = evalTime(compile(make_op(True), inputs), inputs,
+                         options.loops)
+        t_scipy = evalTime(scipy_fn, (), options.loops)
+        print("%-20s without openmp %fs with openmp %fs scipy %fs"
+              " openmp speedup %2.2f" % (name, t, t_omp, t_scipy,
+                                         t / t_omp))
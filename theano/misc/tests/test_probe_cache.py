@@ -0,0 +1,65 @@
+import json
+import os
+import shutil
+import tempfile
+
+import theano
+from theano.misc import probe_cache
+
+
+class TestProbeCache(object):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.orig_cache_filename = probe_cache.cache_filename
+        self.orig_probes = probe_cache._probes
+        filename = os.path.join(self.tmpdir, 'probe_cache.json')
+        probe_cache.cache_filename = lambda: filename
+        probe_cache._probes = None
+
+    def tearDown(self):
+        probe_cache.cache_filename = self.orig_cache_filename
+        probe_cache._probes = self.orig_probes
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_put(self):
+        assert probe_cache.get('a') is None
+        probe_cache.put('a', ['-O3', 1], ['g++'])
+        assert probe_cache.get('a') is None
+        assert probe_cache.get('a', ['g++']) == ['-O3', 1]
+        assert isinstance(probe_cache.get('a', ['g++'])[0], str)
+
+        # Other processes read it from the file.
+        probe_cache._probes = None
+        assert probe_cache.get('a', ['g++']) == ['-O3', 1]
+        with open(probe_cache.cache_filename()) as f:
+            assert len(json.load(f)) == 1
+
+        probe_cache.clear()
+        assert not os.path.exists(probe_cache.cache_filename())
+        assert probe_cache.get('a', ['g++']) is None
+
+    def test_cached(self):
+        calls = []
+
+        def probe():
+            calls.append(1)
+            return True
+        assert probe_cache.cached('b', probe) is True
+        assert probe_cache.cached('b', probe) is True
+        assert len(calls) == 1
+
+        orig = theano.config.probe_cache
+        theano.config.probe_cache = False
+        try:
+            assert probe_cache.cached('b', probe) is True
+            assert len(calls) == 2
+        finally:
+            theano.config.probe_cache = orig
+
+    def test_file_key(self):
+        filename = os.path.join(self.tmpdir, 'cxx')
+        assert probe_cache.file_key(filename) == [filename, None, None]
+        with open(filename, 'w') as f:
+            f.write('abc')
+        assert probe_cache.file_key(filename)[2] == 3
@@ -10,7 +10,7 @@ import warnings
 
 import numpy
 
-from theano import Op, Apply, shared, config, Variable, Out
+from theano import Op, OpenMPOp, Apply, shared, config, Variable, Out
 from theano import gradient, function
 from theano import tensor
 from theano.tensor import (raw_random, TensorType, as_tensor_variable,
@@ -35,6 +35,19 @@ def matVecModM(A, s, m):
     return numpy.int32(numpy.sum((A*s) % m, 1) % m)
 
 
+def matMatModM(A, B, m):
+    """
+    Return the product of the matrices A and B modulo m.
+
+    The entries of A and B must be smaller than 2**31, so that the products
+    of two entries fit in int64. Like matVecModM, each product is reduced
+    before the sum.
+    """
+    A = numpy.asarray(A, dtype='int64')
+    B = numpy.asarray(B, dtype='int64')
+    return numpy.sum((A[:, :, None] * B[None, :, :]) % m, 1) % m
+
+
 def multMatVect(v, A, m1, B, m2):
     """
     multiply the first half of v by A with a modulo of m1
@@ -234,6 +247,47 @@ def ff_2p72(rstate):
     return multMatVect(rstate, A1p72, M1, A2p72, M2)
 
 
+def mrg_next_values(rstate):
+    """
+    Vectorized version of mrg_next_value: advance each row of the
+    (n_streams, 6) int32 matrix rstate by one step, inplace, and return the
+    n_streams samples as float64.
+
+    The int32 arithmetic wraps around exactly like the scalar version, so
+    the results are bit-identical. Call it with numpy.seterr(over='ignore').
+    """
+    x11, x12, x13, x21, x22, x23 = rstate.T
+    assert rstate.dtype == numpy.int32
+
+    i0, i7, i9, i15, i16, i22, i24 = np_int32_vals
+
+    def reduce(y, m):
+        return numpy.where((y < 0) | (y >= m), y - m, y)
+
+    # first component
+    y1 = (((x12 & MASK12) << i22) + (x12 >> i9) +
+          ((x13 & MASK13) << i7) + (x13 >> i24))
+    y1 = reduce(reduce(y1, M1) + x13, M1)
+    new_x1 = y1
+
+    # second component
+    y1 = reduce(((x21 & MASK2) << i15) + (MULT2 * (x21 >> i16)), M2)
+    y2 = reduce(((x23 & MASK2) << i15) + (MULT2 * (x23 >> i16)), M2)
+    y2 = reduce(reduce(y2 + x23, M2) + y1, M2)
+
+    rstate[:, 2] = x12
+    rstate[:, 1] = x11
+    rstate[:, 0] = new_x1
+    rstate[:, 5] = x22
+    rstate[:, 4] = x21
+    rstate[:, 3] = y2
+
+    # Must never return either 0 or M1+1
+    x11 = rstate[:, 0]
+    x21 = rstate[:, 3]
+    return numpy.where(x11 <= x21, x11 - x21 + M1, x11 - x21) * NORM
+
+
 def mrg_next_value(rstate, new_rstate):
     x11, x12, x13, x21, x22, x23 = rstate
     assert type(x11) == numpy.int32
@@ -326,8 +380,13 @@ class mrg_uniform_base(Op):
         return [None for i in eval_points]
 
 
-class mrg_uniform(mrg_uniform_base):
+class mrg_uniform(mrg_uniform_base, OpenMPOp):
     # CPU VERSION
+    # The C code advances the streams in parallel when OpenMP is enabled.
+
+    def __init__(self, output_type, inplace=False, openmp=None):
+        mrg_uniform_base.__init__(self, output_type, inplace)
+        OpenMPOp.__init__(self, openmp=openmp)
 
     @classmethod
     def new(cls, rstate, ndim, dtype, size):
@@ -362,12 +421,13 @@ class mrg_uniform(mrg_uniform_base):
 
         rval = numpy.zeros(n_elements, dtype=self.output_type.dtype)
 
+        # Sample i comes from stream i % n_streams: advance all the streams
+        # at once, n_streams samples at a time.
         err_orig = numpy.seterr(over='ignore')
         try:
-            for i in xrange(n_elements):
-                sample = mrg_next_value(rstate[i % n_streams],
-                                        rstate[i % n_streams])
-                rval[i] = sample
+            for i in xrange(0, n_elements, n_streams):
+                n = min(n_streams, n_elements - i)
+                rval[i:i + n] = mrg_next_values(rstate[:n])
         finally:
             numpy.seterr(**err_orig)
 
@@ -393,6 +453,13 @@ class mrg_uniform(mrg_uniform_base):
         else:
             otype = 'double'
             NORM = '4.656612873077392578125e-10'
+        if self.openmp:
+            # Like Elemwise, only start threads for big enough outputs.
+            omp_parallel = ('#pragma omp parallel for schedule(static) '
+                            'if(n_elements >= %d)' %
+                            config.openmp_elemwise_minsize)
+        else:
+            omp_parallel = ''
         return """
         //////// <code generated by mrg_uniform>
 
@@ -471,21 +538,33 @@ class mrg_uniform(mrg_uniform_base):
             %(fail)s
         }
         n_streams = PyArray_DIMS(%(o_rstate)s)[0];
+        if (n_streams == 0 && n_elements > 0)
+        {
+            PyErr_SetString(PyExc_ValueError, "rstate must have at least one row");
+            %(fail)s
+        }
 
         sample_data = (%(otype)s *) PyArray_DATA(%(o_sample)s);
         state_data = (npy_int32 *) PyArray_DATA(%(o_rstate)s);
-        for (int i = 0; i < n_elements; ++i)
+        // Sample i comes from stream i %% n_streams. Each stream is only
+        // used by one iteration of the outer loop, so the streams can be
+        // advanced in parallel while giving the same samples as a serial
+        // loop over i.
+        %(omp_parallel)s
+        for (int s = 0; s < std::min(n_streams, n_elements); ++s)
         {
-            npy_int32 * state_data_i = state_data + (i%%n_streams)*6;
-            npy_int32 y1, y2, x11, x12, x13, x21, x22, x23;
-
-            x11 = state_data_i[0];
-            x12 = state_data_i[1];
-            x13 = state_data_i[2];
-            x21 = state_data_i[3];
-            x22 = state_data_i[4];
-            x23 = state_data_i[5];
-
+          npy_int32 * state_data_i = state_data + s*6;
+          npy_int32 y1, y2, x11, x12, x13, x21, x22, x23;
+
+          x11 = state_data_i[0];
+          x12 = state_data_i[1];
+          x13 = state_data_i[2];
+          x21 = state_data_i[3];
+          x22 = state_data_i[4];
+          x23 = state_data_i[5];
+
+          for (int i = s; i < n_elements; i += n_streams)
+          {
             y1 = ((x12 & MASK12) << i22) + (x12 >> i9) + ((x13 & MASK13) << i7) + (x13 >> i24);
             if ((y1 < 0 || y1 >= M1))     //must also check overflow
                 y1 -= M1;
@@ -522,19 +601,23 @@ class mrg_uniform(mrg_uniform_base):
                 assert(x11 - x21 <= M1);
                 sample_data[i] = (x11 - x21) * %(NORM)s;
             }
+          }
 
-            state_data_i[0]= x11;
-            state_data_i[1]= x12;
-            state_data_i[2]= x13;
-            state_data_i[3]= x21;
-            state_data_i[4]= x22;
-            state_data_i[5]= x23;
+          state_data_i[0]= x11;
+          state_data_i[1]= x12;
+          state_data_i[2]= x13;
+          state_data_i[3]= x21;
+          state_data_i[4]= x22;
+          state_data_i[5]= x23;
         }
         //////// </ code generated by mrg_uniform>
         """ % locals()
 
+    def c_headers(self):
+        return ['<algorithm>'] + OpenMPOp.c_headers(self)
+
     def c_code_cache_version(self):
-        return (2,)
+        return (3, self.openmp, config.openmp_elemwise_minsize)
 
 
 class GPU_mrg_uniform(mrg_uniform_base, GpuOp):
@@ -1108,24 +1191,19 @@ class MRG_RandomStreams(object):
         rval = numpy.zeros((n_streams, 6), dtype='int32')
         rval[0] = self.rstate
 
-        # If multMatVect.dot_modulo isn't compiled, compile it.
-        if multMatVect.dot_modulo is None:
-            multMatVect(rval[0], A1p72, M1, A2p72, M2)
-
-        # This way of calling the Theano fct is done to bypass Theano overhead.
-        f = multMatVect.dot_modulo
-        f.input_storage[0].storage[0] = A1p72
-        f.input_storage[2].storage[0] = M1
-        f.input_storage[3].storage[0] = A2p72
-        f.input_storage[5].storage[0] = M2
-        for i in xrange(1, n_streams):
-            # Inline the following call to bypass Python overhead
-            #rval[i] = ff_2p72(rval[i - 1])
-            v = rval[i - 1]
-            f.input_storage[1].storage[0] = v[:3]
-            f.input_storage[4].storage[0] = v[3:]
-            f.fn()
-            rval[i] = f.output_storage[0].storage[0]
+        # Row i is ff_2p72 applied i times to row 0. Rather than looping
+        # over the rows, fill them by doubling: rows [n, 2n) are rows
+        # [0, n) jumped ahead by n * 2**72 steps, i.e. multiplied by the
+        # n-th power of the jump matrices. This gives the same states.
+        A1, A2 = A1p72, A2p72
+        n = 1
+        while n < n_streams:
+            end = min(2 * n, n_streams)
+            rval[n:end, :3] = matMatModM(rval[:end - n, :3], A1.T, M1)
+            rval[n:end, 3:] = matMatModM(rval[:end - n, 3:], A2.T, M2)
+            A1 = matMatModM(A1, A1, M1)
+            A2 = matMatModM(A2, A2, M2)
+            n = end
 
         if inc_rstate:
             self.inc_rstate()
@@ -1401,7 +1479,11 @@ def mrg_random_make_inplace(node):
     op = node.op
     if isinstance(op, MRG_RNGs) and not op.inplace:
         # op might be gpu version
-        new_op = op.__class__(op.output_type, inplace=True)
+        if isinstance(op, mrg_uniform):
+            new_op = mrg_uniform(op.output_type, inplace=True,
+                                 openmp=op.openmp)
+        else:
+            new_op = op.__class__(op.output_type, inplace=True)
         return new_op.make_node(*node.inputs).outputs
     return False
 optdb.register('random_make_inplace_mrg',
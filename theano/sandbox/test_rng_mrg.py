@@ -932,6 +932,53 @@ def test_multMatVect():
     assert numpy.allclose(r_a2, r_b[3:])
 
 
+def test_get_substream_rstates():
+    # The substreams are filled by doubling, they must match the
+    # sequential application of ff_2p72.
+    rng = MRG_RandomStreams(234)
+    for n_streams in [1, 2, 3, 7, 64, 100]:
+        rstates = rng.get_substream_rstates(n_streams, inc_rstate=False)
+        expected = [rng.rstate]
+        for i in range(1, n_streams):
+            expected.append(rng_mrg.ff_2p72(expected[-1]))
+        assert rstates.dtype == 'int32'
+        assert numpy.all(rstates == numpy.asarray(expected))
+
+
+def test_mrg_next_values():
+    rng = MRG_RandomStreams(234)
+    rstates = rng.get_substream_rstates(5, inc_rstate=False)
+    vec_rstates = rstates.copy()
+    expected = [rng_mrg.mrg_next_value(rstates[i], rstates[i])
+                for i in range(5)]
+    samples = rng_mrg.mrg_next_values(vec_rstates)
+    assert numpy.all(samples == numpy.asarray(expected))
+    assert numpy.all(vec_rstates == rstates)
+
+
+def test_mrg_uniform_c_perform():
+    # The C code must give exactly the same states and samples as perform,
+    # also when the number of samples is not a multiple of the number of
+    # streams, with and without OpenMP.
+    rng = MRG_RandomStreams(234)
+    for openmp in [False, True]:
+        for size in [(5,), (20,), (3, 7), (1000,)]:
+            rstate = theano.shared(rng.get_substream_rstates(
+                7, inc_rstate=False))
+            op = rng_mrg.mrg_uniform(
+                tensor.TensorType('float64', (False,) * len(size)),
+                openmp=openmp)
+            new_rstate, sample = op(rstate, tensor.as_tensor_variable(
+                numpy.asarray(size, dtype='int32')))
+            outs = []
+            for linker in ['c', 'py']:
+                f = theano.function([], [new_rstate, sample],
+                                    mode=theano.Mode(linker=linker))
+                outs.append(f())
+            assert numpy.all(outs[0][0] == outs[1][0])
+            assert numpy.all(outs[0][1] == outs[1][1])
+
+
 if __name__ == "__main__":
     rng = MRG_RandomStreams(numpy.random.randint(2147462579))
     import time
@@ -3439,7 +3439,21 @@ def structured_dot(x, y):
         return _structured_dot(y.T, x.T).T
 
 
-class StructuredDotGradCSC(gof.Op):
+def _omp_parallel_for(openmp, clauses=''):
+    """Return the pragma to put before the loop over the rows (columns for
+    csc) of a sparse matrix in the C code of the sparse-dense products.
+
+    The loop is only run in parallel when the sparse matrix has at least
+    `config.openmp_sparse_minsize` non-zero elements, which the C code must
+    have stored in `nnz`.
+    """
+    if not openmp:
+        return ''
+    return ('#pragma omp parallel for schedule(guided) if(nnz >= %d) %s' %
+            (config.openmp_sparse_minsize, clauses))
+
+
+class StructuredDotGradCSC(gof.OpenMPOp):
     # Op that produces the grad of StructuredDot.
 
     # :param a_indices: Matrix indicies
@@ -3486,12 +3500,13 @@ class StructuredDotGradCSC(gof.Op):
         out[0] = g_a_data
 
     def c_code_cache_version(self):
-        return (1,)
+        return (2, self.openmp, config.openmp_sparse_minsize)
 
     def c_code(self, node, name, inputs, outputs, sub):
 
         (_indices, _indptr, _d, _g) = inputs
         (_zout,) = outputs
+        omp_for = _omp_parallel_for(self.openmp, 'reduction(|:err)')
         if node.inputs[2].type.dtype in ('complex64', 'complex128'):
             raise NotImplementedError('Complex types are not supported for b')
         if node.inputs[3].type.dtype in ('complex64', 'complex128'):
@@ -3535,12 +3550,15 @@ class StructuredDotGradCSC(gof.Op):
             const npy_int32 * __restrict__ indptr = (npy_int32 *)PyArray_DATA(%(_indptr)s);
             const npy_int32 * __restrict__ indices = (npy_int32 *)PyArray_DATA(%(_indices)s);
 
+            npy_int32 err = 0;
+
             // loop over columns
+            %(omp_for)s
             for (npy_int32 j = 0; j < N; ++j)
             {
                 // extract j-th row of dense matrix
                 const dtype_%(_d)s* __restrict__ d_row = (dtype_%(_d)s*)(PyArray_BYTES(%(_d)s) + PyArray_STRIDES(%(_d)s)[0] * j);
-                if(j >= PyArray_DIMS(%(_d)s)[0]) {PyErr_SetString(PyExc_NotImplementedError, "G"); %(fail)s;}
+                if(j >= PyArray_DIMS(%(_d)s)[0]) {err |= 1; continue;}
 
                 // for each non-null value in the sparse column
                 for (npy_int32 i_idx = indptr[j * Sindptr]; i_idx < indptr[(j+1) * Sindptr]; ++i_idx)
@@ -3556,7 +3574,7 @@ class StructuredDotGradCSC(gof.Op):
                     // Note: wouldn't the above operation fail if that were the case ?
                     //       when would this ever be true anyway ?
                     if (i >= PyArray_DIMS(%(_g)s)[0])
-                    {PyErr_SetString(PyExc_NotImplementedError, "H"); %(fail)s;}
+                    {err |= 2; continue;}
 
                     // perform dot product of dense and sparse rows
                     for(int k = 0; k < K; ++k)
@@ -3568,6 +3586,9 @@ class StructuredDotGradCSC(gof.Op):
                     ((dtype_%(_zout)s* __restrict__)(PyArray_BYTES(%(_zout)s) + i_idx * PyArray_STRIDES(%(_zout)s)[0]))[0] = ip;
                 }
             }
+            // The errors can't be raised from the parallel loop.
+            if (err & 1) {PyErr_SetString(PyExc_NotImplementedError, "G"); %(fail)s;}
+            if (err & 2) {PyErr_SetString(PyExc_NotImplementedError, "H"); %(fail)s;}
         }
 
         """ % dict(locals(), **sub)
@@ -3577,7 +3598,7 @@ class StructuredDotGradCSC(gof.Op):
 sdg_csc = StructuredDotGradCSC()
 
 
-class StructuredDotGradCSR(gof.Op):
+class StructuredDotGradCSR(gof.OpenMPOp):
     # Op that produces the grad of StructuredDot.
 
     # :param a_indices: Matrix indicies
@@ -3626,12 +3647,13 @@ class StructuredDotGradCSR(gof.Op):
         out[0] = g_a_data
 
     def c_code_cache_version(self):
-        return (1,)
+        return (2, self.openmp, config.openmp_sparse_minsize)
 
     def c_code(self, node, name, inputs, outputs, sub):
 
         (_indices, _indptr, _d, _g) = inputs
         (_zout,) = outputs
+        omp_for = _omp_parallel_for(self.openmp, 'reduction(|:err)')
         if node.inputs[2].type.dtype in ('complex64', 'complex128'):
             raise NotImplementedError('Complex types are not supported for b')
         if node.inputs[3].type.dtype in ('complex64', 'complex128'):
@@ -3676,7 +3698,10 @@ class StructuredDotGradCSR(gof.Op):
             const npy_int32 * __restrict__ indptr = (npy_int32 *)PyArray_DATA(%(_indptr)s);
             const npy_int32 * __restrict__ indices = (npy_int32 *)PyArray_DATA(%(_indices)s);
 
-            // loop over columns of sparse matrix
+            npy_int32 err = 0;
+
+            // loop over rows of sparse matrix
+            %(omp_for)s
             for (npy_int32 i = 0; i < N; ++i)
             {
                 // for each non-null value in the sparse row
@@ -3687,7 +3712,7 @@ class StructuredDotGradCSR(gof.Op):
 
                     // extract j-th row of dense matrix
                     const dtype_%(_d)s* __restrict__ d_row = (dtype_%(_d)s*)(PyArray_BYTES(%(_d)s) + PyArray_STRIDES(%(_d)s)[0] * j);
-                    if(j >= PyArray_DIMS(%(_d)s)[0]) {PyErr_SetString(PyExc_NotImplementedError, "G"); %(fail)s;}
+                    if(j >= PyArray_DIMS(%(_d)s)[0]) {err |= 1; continue;}
 
                     // extract corresponding row in gradient
                     const dtype_%(_g)s* __restrict__ g_row = (dtype_%(_g)s*)(PyArray_BYTES(%(_g)s) + PyArray_STRIDES(%(_g)s)[0] * i);
@@ -3697,7 +3722,7 @@ class StructuredDotGradCSR(gof.Op):
                     // Note: wouldn't the above operation fail if that were the case ?
                     //       when would this ever be true anyway ?
                     if (i >= PyArray_DIMS(%(_g)s)[0])
-                    {PyErr_SetString(PyExc_NotImplementedError, "H"); %(fail)s;}
+                    {err |= 2; continue;}
 
                     // perform dot product of dense and sparse rows
                     for(int k = 0; k < K; ++k)
@@ -3709,6 +3734,9 @@ class StructuredDotGradCSR(gof.Op):
                     ((dtype_%(_zout)s* __restrict__)(PyArray_BYTES(%(_zout)s) + j_idx * PyArray_STRIDES(%(_zout)s)[0]))[0] = ip;
                 }
             }
+            // The errors can't be raised from the parallel loop.
+            if (err & 1) {PyErr_SetString(PyExc_NotImplementedError, "G"); %(fail)s;}
+            if (err & 2) {PyErr_SetString(PyExc_NotImplementedError, "H"); %(fail)s;}
         }
 
         """ % dict(locals(), **sub)
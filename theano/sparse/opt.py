@@ -4,9 +4,10 @@ import numpy
 import scipy
 
 import theano
-from theano import gof, scalar, tensor
+from theano import gof, scalar, tensor, config
 from theano.tensor import blas
-from theano.tensor.opt import register_specialize, register_canonicalize
+from theano.tensor.opt import (register_specialize, register_canonicalize,
+                               register_specialize_device)
 from theano.sparse import (CSC, CSR, csm_properties,
                            csm_grad, usmm, csm_indices, csm_indptr,
                            csm_data)
@@ -206,7 +207,7 @@ theano.compile.optdb.register('local_addsd_ccode',
                               61, 'fast_run')
 
 
-class StructuredDotCSC(gof.Op):
+class StructuredDotCSC(gof.OpenMPOp):
     """Structured Dot CSC is like dot, except that only the
     gradient wrt non-zero elements of the sparse matrix
     `a` are calculated and propagated.
@@ -221,6 +222,9 @@ class StructuredDotCSC(gof.Op):
 
     :note: The grad implemented is structured.
     :note: This op is used as an optimization for StructuredDot.
+    :note: With OpenMP, the columns of `a` are split between the threads,
+           which each accumulate their part of the product in a private
+           buffer of at most `config.openmp_sparse_buffer_size` elements.
     """
 
     def __eq__(self, other):
@@ -272,6 +276,21 @@ class StructuredDotCSC(gof.Op):
         typenum_a_val = node.inputs[0].type.dtype_specs()[2]  # retrieve dtype number
         typenum_b = node.inputs[4].type.dtype_specs()[2]  # retrieve dtype number
 
+        buf_size = config.openmp_sparse_buffer_size
+        if self.openmp:
+            get_n_threads = """
+            if (nnz >= %d)
+                n_threads = omp_get_max_threads();
+            """ % config.openmp_sparse_minsize
+            omp_parallel = ('#pragma omp parallel num_threads(n_threads) '
+                            'reduction(|:err)')
+            thread_num = 'omp_get_thread_num()'
+            omp_for = '#pragma omp for schedule(guided)'
+            omp_reduce = '#pragma omp parallel for schedule(static)'
+        else:
+            get_n_threads = omp_parallel = omp_for = omp_reduce = ''
+            thread_num = '0'
+
         rval = """
 
         if (PyArray_NDIM(%(a_val)s) != 1) {PyErr_SetString(PyExc_NotImplementedError, "rank(a_val) != 1"); %(fail)s;}
@@ -331,11 +350,43 @@ class StructuredDotCSC(gof.Op):
             // pointers to access actual data in the arrays passed as params.
             dtype_%(z)s*     __restrict__ Dz   = (dtype_%(z)s*)PyArray_DATA(%(z)s);
             const dtype_%(a_val)s* __restrict__ Dval = (dtype_%(a_val)s*)PyArray_DATA(%(a_val)s);
-            const npy_int32 * __restrict__ Dind = (npy_int32*)PyArray_DATA(%(a_ind)s;
-            const npy_int32 * __restrict__ Dptr = (npy_int32*)PyArray_DATA(%(a_ptr)s;
+            const npy_int32 * __restrict__ Dind = (npy_int32*)PyArray_DATA(%(a_ind)s);
+            const npy_int32 * __restrict__ Dptr = (npy_int32*)PyArray_DATA(%(a_ptr)s);
 
             //npy_intp nnz = PyArray_DIMS(%(a_ind)s)[0];
 
+            npy_intp nnz = Dptr[K * Sptr];
+
+            // The columns of a are split between the threads. As they
+            // scatter into the same rows of z, all the threads but the
+            // first accumulate into their own buffer, and the buffers are
+            // added to z at the end. The buffers hold nb columns of z, and
+            // at most %(buf_size)s elements in total: the columns of z are
+            // computed in several passes if needed, and fewer threads are
+            // used when even one column of z does not fit.
+            int n_threads = 1;
+            %(get_n_threads)s
+            if (M == 0 || N == 0)
+                n_threads = 1;
+            else if ((n_threads - 1) * M > %(buf_size)s)
+                n_threads = 1 + %(buf_size)s / M;
+            npy_intp nb = N;
+            dtype_%(z)s* __restrict__ bufs = NULL;
+            if (n_threads > 1)
+            {
+                nb = %(buf_size)s / ((n_threads - 1) * M);
+                if (nb > N)
+                    nb = N;
+                // The reduction sets the buffers back to 0.
+                bufs = (dtype_%(z)s*)calloc((n_threads - 1) * M * nb,
+                                            sizeof(dtype_%(z)s));
+                if (!bufs)
+                {
+                    n_threads = 1;
+                    nb = N;
+                }
+            }
+
             //clear the output array
             memset(Dz, 0, M*N*sizeof(dtype_%(z)s));
 
@@ -352,11 +403,21 @@ class StructuredDotCSC(gof.Op):
             //     for n
             //        z[m, n] += a[m, k] * b[k, n]
 
+            int err = 0;
+            for (npy_intp n0 = 0; n0 < N; n0 += nb)
+            {
+            const npy_intp nn = N - n0 < nb ? N - n0 : nb;
+
+            %(omp_parallel)s
+            {
+            const int t = %(thread_num)s;
+
             // loop over inner dimension
+            %(omp_for)s
             for (npy_int32 k = 0; k < K; ++k)
             {
                 // get pointer to k-th row of dense matrix
-                const dtype_%(b)s* __restrict__ bk = (dtype_%(b)s*)(PyArray_BYTES(%(b)s) + PyArray_STRIDES(%(b)s)[0] * k);
+                const dtype_%(b)s* __restrict__ bk = (dtype_%(b)s*)(PyArray_BYTES(%(b)s) + PyArray_STRIDES(%(b)s)[0] * k) + n0 * Sbn;
 
                 // loop over sparse column indices through index pointer array
                 // (amounts to looping over rows M of sparse matrix)
@@ -366,40 +427,80 @@ class StructuredDotCSC(gof.Op):
                     npy_int32 m = Dind[m_idx * Sind]; // row index of non-null value for column K
                     const dtype_%(a_val)s Amk = Dval[m_idx * Sval]; // actual value at that location
 
-                    // pointer to m-th row of the output matrix Z
-                    dtype_%(z)s* __restrict__ zm = (dtype_%(z)s*)(PyArray_BYTES(%(z)s) + PyArray_STRIDES(%(z)s)[0] * m);
-
                     //RESOLVE: a.shape[0] equals z.shape[0], why is this not an equality constraint?
-                    if (m >= PyArray_DIMS(%(z)s)[0])
-                    {PyErr_SetString(PyExc_NotImplementedError, "illegal row index in a"); %(fail)s;}
+                    if (m >= M)
+                    {
+                        err = 1;
+                        continue;
+                    }
+
+                    // pointer to m-th row of the output matrix Z, or of
+                    // the buffer of this thread
+                    dtype_%(z)s* __restrict__ zm;
+                    npy_intp Sn;
+                    if (t == 0)
+                    {
+                        zm = (dtype_%(z)s*)(PyArray_BYTES(%(z)s) + PyArray_STRIDES(%(z)s)[0] * m) + n0 * Szn;
+                        Sn = Szn;
+                    }
+                    else
+                    {
+                        zm = bufs + ((t - 1) * M + m) * nb;
+                        Sn = 1;
+                    }
 
                     // loop over final dimension (cols of dense matrix) and perform dot product
-                    if ((Szn == 1) && (Sbn == 1)) {
-                        for(npy_int32 n = 0; n < N; ++n)
+                    if ((Sn == 1) && (Sbn == 1)) {
+                        for(npy_int32 n = 0; n < nn; ++n)
                         {
                             zm[n] += Amk * bk[n];
                         }
                     }
                     else
                     {
-                        for(npy_int32 n = 0; n < N; ++n)
+                        for(npy_int32 n = 0; n < nn; ++n)
+                        {
+                            zm[n*Sn] += Amk * bk[n*Sbn];
+                        }
+                    }
+                }
+            }
+            }
+
+            if (n_threads > 1)
+            {
+                %(omp_reduce)s
+                for (npy_intp m = 0; m < M; ++m)
+                {
+                    dtype_%(z)s* __restrict__ zm = (dtype_%(z)s*)(PyArray_BYTES(%(z)s) + PyArray_STRIDES(%(z)s)[0] * m) + n0 * Szn;
+                    for (int t = 1; t < n_threads; ++t)
+                    {
+                        dtype_%(z)s* __restrict__ buf = bufs + ((t - 1) * M + m) * nb;
+                        for (npy_intp n = 0; n < nn; ++n)
                         {
-                            zm[n*Szn] += Amk * bk[n*Sbn];
+                            zm[n*Szn] += buf[n];
+                            buf[n] = 0;
                         }
                     }
                 }
             }
+            }
+            free(bufs);
+            // The error can't be raised from the parallel loop.
+            if (err)
+            {PyErr_SetString(PyExc_NotImplementedError, "illegal row index in a"); %(fail)s;}
         }
         """ % dict(locals(), **sub)
 
         return rval
 
     def c_code_cache_version(self):
-        return (2,)
+        return (5, self.openmp, config.openmp_sparse_minsize,
+                config.openmp_sparse_buffer_size)
 sd_csc = StructuredDotCSC()
 
 
-class StructuredDotCSR(gof.Op):
+class StructuredDotCSR(gof.OpenMPOp):
     """Structured Dot CSR is like dot, except that only the
     gradient wrt non-zero elements of the sparse matrix
     `a` are calculated and propagated.
@@ -414,6 +515,7 @@ class StructuredDotCSR(gof.Op):
 
     :note: The grad implemented is structured.
     :note: This op is used as an optimization for StructuredDot.
+    :note: With OpenMP, the rows of `a` are split between the threads.
     """
 
     def __eq__(self, other):
@@ -464,6 +566,7 @@ class StructuredDotCSR(gof.Op):
             raise NotImplementedError('Complex types are not supported for a_val')
         if node.inputs[3].type.dtype in ('complex64', 'complex128'):
             raise NotImplementedError('Complex types are not supported for b')
+        omp_for = sparse._omp_parallel_for(self.openmp, 'reduction(|:err)')
 
         return """
         if (PyArray_NDIM(%(a_val)s) != 1) {PyErr_SetString(PyExc_NotImplementedError, "rank(a_val) != 1"); %(fail)s;}
@@ -513,7 +616,7 @@ class StructuredDotCSR(gof.Op):
             const npy_int32 * __restrict__ Dind = (npy_int32*)PyArray_DATA(%(a_ind)s);
             const npy_int32 * __restrict__ Dptr = (npy_int32*)PyArray_DATA(%(a_ptr)s);
 
-            //npy_intp nnz = PyArray_DIMS(%(a_ind)s)[0];
+            npy_intp nnz = Dptr[M * Sptr];
 
             //clear the output array
             memset(Dz, 0, M*N*sizeof(dtype_%(z)s));
@@ -530,7 +633,10 @@ class StructuredDotCSR(gof.Op):
             //     for n
             //        z[m, n] += a[m, k] * b[k, n]
 
+            int err = 0;
+
             // loop over inner dimension
+            %(omp_for)s
             for (npy_int64 m = 0; m < M; ++m)
             {
                 // pointer to m-th row of the output matrix Z
@@ -543,6 +649,12 @@ class StructuredDotCSR(gof.Op):
                     npy_int32 k = Dind[k_idx * Sind]; // col index of non-null value for row m
                     const dtype_%(a_val)s Amk = Dval[k_idx * Sval]; // actual value at that location
 
+                    if (k >= K)
+                    {
+                        err = 1;
+                        continue;
+                    }
+
                     // get pointer to k-th row of dense matrix
                     const dtype_%(b)s* __restrict__ bk = (dtype_%(b)s*)(PyArray_BYTES(%(b)s) + PyArray_STRIDES(%(b)s)[0] * k);
 
@@ -553,12 +665,15 @@ class StructuredDotCSR(gof.Op):
                     }
                 }
             }
+            // The error can't be raised from the parallel loop.
+            if (err)
+            {PyErr_SetString(PyExc_NotImplementedError, "illegal column index in a"); %(fail)s;}
         }
 
         """ % dict(locals(), **sub)
 
     def c_code_cache_version(self):
-        return (1,)
+        return (2, self.openmp, config.openmp_sparse_minsize)
 sd_csr = StructuredDotCSR()
 
 
@@ -586,7 +701,47 @@ def local_structured_dot(node):
 # register_specialize(local_structured_dot)
 
 
-class UsmmCscDense(gof.Op):
+# With OpenMP, the C code is much faster than scipy on big matrices, so
+# StructuredDot and Dot of a sparse and a dense matrix are replaced.
+# dot(dense, sparse) is computed as dot(sparse.T, dense.T).T, where the
+# transpose of a csr matrix is a csc matrix with the same properties.
+# This is tested in tests/test_opt.py:test_local_structured_dot_openmp
+@gof.local_optimizer([sparse._structured_dot, sparse._dot])
+def local_structured_dot_openmp(node):
+    if node.op not in (sparse._structured_dot, sparse._dot):
+        return False
+    if (node.outputs[0].type.ndim != 2 or
+            node.outputs[0].dtype in ('complex64', 'complex128')):
+        return False
+    a, b = node.inputs
+    transpose = False
+    if not _is_sparse_variable(a):
+        # Only Dot accepts a dense first input.
+        a, b = b, a.T
+        transpose = True
+    elif _is_sparse_variable(b):
+        return False
+    if b.type.ndim != 2:
+        return False
+    a_val, a_ind, a_ptr, a_shape = csm_properties(a)
+    # The properties of the transpose are those of the other format.
+    if (a.type.format == 'csc') != transpose:
+        op = StructuredDotCSC()
+        a_nrows = a_shape[1] if transpose else a_shape[0]
+        args = (a_val, a_ind, a_ptr, a_nrows, b)
+    else:
+        op = StructuredDotCSR()
+        args = (a_val, a_ind, a_ptr, b)
+    if not op.openmp:
+        return False
+    rval = op(*args)
+    if transpose:
+        rval = rval.T
+    return [tensor.patternbroadcast(rval, node.outputs[0].broadcastable)]
+register_specialize(local_structured_dot_openmp, 'cxx_only')
+
+
+class UsmmCscDense(gof.OpenMPOp):
     """Performs the expression is `alpha` * `x` `y` + `z`.
 
     :param x: Matrix variable.
@@ -599,9 +754,13 @@ class UsmmCscDense(gof.Op):
     :note: The grad is not implemented for this op.
     :note: Optimized version os Usmm when `x` is in csc format and
            `y` is dense.
+    :note: With OpenMP, the columns of `x` are split between the threads,
+           which each accumulate their part of the product in a private
+           buffer of at most `config.openmp_sparse_buffer_size` elements.
     """
 
-    def __init__(self, inplace):
+    def __init__(self, inplace, openmp=None):
+        super(UsmmCscDense, self).__init__(openmp=openmp)
         self.inplace = inplace
         if inplace:
             self.destroy_map = {0: [6]}
@@ -665,7 +824,8 @@ class UsmmCscDense(gof.Op):
         return blas.ldflags()
 
     def c_compile_args(self):
-        return blas.ldflags(libs=False, flags=True)
+        return (blas.ldflags(libs=False, flags=True) +
+                super(UsmmCscDense, self).c_compile_args())
 
     def c_lib_dirs(self):
         return blas.ldflags(libs=False, libs_dir=True)
@@ -699,6 +859,20 @@ class UsmmCscDense(gof.Op):
 
         inplace = int(self.inplace)
 
+        buf_size = config.openmp_sparse_buffer_size
+        if self.openmp:
+            get_n_threads = """
+            if (nnz >= %d)
+                n_threads = omp_get_max_threads();
+            """ % config.openmp_sparse_minsize
+            omp_parallel = '#pragma omp parallel num_threads(n_threads)'
+            thread_num = 'omp_get_thread_num()'
+            omp_for = '#pragma omp for schedule(guided)'
+            omp_reduce = '#pragma omp parallel for schedule(static)'
+        else:
+            get_n_threads = omp_parallel = omp_for = omp_reduce = ''
+            thread_num = '0'
+
         rval = """
 
         if (PyArray_NDIM(%(x_val)s) != 1) {PyErr_SetString(PyExc_NotImplementedError, "rank(x_val) != 1"); %(fail)s;}
@@ -802,6 +976,48 @@ class UsmmCscDense(gof.Op):
                 }
             }
 
+            npy_intp nnz = Dptr[K * Sptr];
+
+            // The columns of x are split between the threads. As they
+            // scatter into the same rows of zn, all the threads but the
+            // first accumulate into their own buffer, and the buffers are
+            // added to zn at the end. The buffers hold nb columns of zn,
+            // and at most %(buf_size)s elements in total: the columns of
+            // zn are computed in several passes if needed, and fewer
+            // threads are used when even one column of zn does not fit.
+            int n_threads = 1;
+            %(get_n_threads)s
+            if (M == 0 || N == 0)
+                n_threads = 1;
+            else if ((n_threads - 1) * M > %(buf_size)s)
+                n_threads = 1 + %(buf_size)s / M;
+            npy_intp nb = N;
+            dtype_%(zn)s* __restrict__ bufs = NULL;
+            if (n_threads > 1)
+            {
+                nb = %(buf_size)s / ((n_threads - 1) * M);
+                if (nb > N)
+                    nb = N;
+                // The reduction sets the buffers back to 0.
+                bufs = (dtype_%(zn)s*)calloc((n_threads - 1) * M * nb,
+                                             sizeof(dtype_%(zn)s));
+                if (!bufs)
+                {
+                    n_threads = 1;
+                    nb = N;
+                }
+            }
+
+            for (npy_intp n0 = 0; n0 < N; n0 += nb)
+            {
+            const npy_intp nn = N - n0 < nb ? N - n0 : nb;
+
+            %(omp_parallel)s
+            {
+            const int t = %(thread_num)s;
+            npy_intp Sout = t ? 1 : Szn;
+
+            %(omp_for)s
             for (npy_int32 k = 0; k < K; ++k)
             {
                 for (npy_int32 m_idx = Dptr[k * Sptr]; m_idx < Dptr[(k+1)*Sptr]; ++m_idx)
@@ -810,27 +1026,58 @@ class UsmmCscDense(gof.Op):
 
                     const dtype_%(x_val)s Amk = alpha * Dval[m_idx * Sval]; // actual value at that location
 
-                    dtype_%(y)s* y_row = (dtype_%(y)s*)(PyArray_BYTES(%(y)s) + PyArray_STRIDES(%(y)s)[0] * k);
+                    dtype_%(y)s* y_row = (dtype_%(y)s*)(PyArray_BYTES(%(y)s) + PyArray_STRIDES(%(y)s)[0] * k) + n0 * Sy;
                     // axpy expects pointer to the beginning of memory arrays,
                     // so when the stride is negative, we need to get the
                     // last element
                     if (Sy < 0)
-                        y_row += (K - 1) * Sy;
+                        y_row += (nn - 1) * Sy;
+
+                    dtype_%(zn)s* z_row;
+                    if (t == 0)
+                    {
+                        z_row = (dtype_%(zn)s*)(PyArray_BYTES(%(zn)s) + PyArray_STRIDES(%(zn)s)[0] * m) + n0 * Szn;
+                        if (Szn < 0)
+                            z_row += (nn - 1) * Szn;
+                    }
+                    else
+                    {
+                        z_row = bufs + ((t - 1) * M + m) * nb;
+                    }
 
-                    dtype_%(zn)s* z_row = (dtype_%(zn)s*)(PyArray_BYTES(%(zn)s) + PyArray_STRIDES(%(zn)s)[0] * m);
-                    if (Szn < 0)
-                        z_row += (N - 1) * Szn;
+                    %(axpy)s((int*)&nn, (%(conv_type)s*)&Amk, (%(conv_type)s*)y_row, (int*)&Sy, (%(conv_type)s*)z_row, (int*)&Sout);
+                }
+            }
+            }
 
-                    %(axpy)s((int*)&N, (%(conv_type)s*)&Amk, (%(conv_type)s*)y_row, (int*)&Sy, (%(conv_type)s*)z_row, (int*)&Szn);
+            if (n_threads > 1)
+            {
+                %(omp_reduce)s
+                for (npy_intp m = 0; m < M; ++m)
+                {
+                    dtype_%(zn)s* __restrict__ z_row = (dtype_%(zn)s*)(PyArray_BYTES(%(zn)s) + PyArray_STRIDES(%(zn)s)[0] * m) + n0 * Szn;
+                    for (int t = 1; t < n_threads; ++t)
+                    {
+                        dtype_%(zn)s* __restrict__ buf = bufs + ((t - 1) * M + m) * nb;
+                        for (npy_intp n = 0; n < nn; ++n)
+                        {
+                            z_row[n * Szn] += buf[n];
+                            buf[n] = 0;
+                        }
+                    }
                 }
             }
+            }
+            free(bufs);
         }
         """ % dict(locals(), **sub)
 
         return rval
 
     def c_code_cache_version(self):
-        return (1, blas.blas_header_version())
+        return (4, blas.blas_header_version(), self.openmp,
+                config.openmp_sparse_minsize,
+                config.openmp_sparse_buffer_size)
 usmm_csc_dense = UsmmCscDense(inplace=False)
 usmm_csc_dense_inplace = UsmmCscDense(inplace=True)
 
@@ -847,13 +1094,20 @@ local_usmm = gof.opt.PatternSub(
 register_specialize(local_usmm, name="local_usmm")
 
 
-# register a specialization to replace usmm_csc_dense -> usmm_csc_dense_inplace
+# register an optimization to replace usmm_csc_dense -> usmm_csc_dense_inplace
+# It is done with the other inplace optimizations, as the specialize phase
+# doesn't check that the destroyed input may be destroyed.
 # This is tested in tests/test_basic.py:UsmmTests
 @gof.local_optimizer([usmm_csc_dense])
 def local_usmm_csc_dense_inplace(node):
-    if node.op == usmm_csc_dense:
-        return [usmm_csc_dense_inplace(*node.inputs)]
-register_specialize(local_usmm_csc_dense_inplace, 'cxx_only', 'inplace')
+    if isinstance(node.op, UsmmCscDense) and not node.op.inplace:
+        new_op = UsmmCscDense(inplace=True, openmp=node.op.openmp)
+        return [new_op(*node.inputs)]
+theano.compile.optdb.register('local_usmm_csc_dense_inplace',
+                              gof.TopoOptimizer(
+                                  local_usmm_csc_dense_inplace,
+    failure_callback=gof.TopoOptimizer.warn_inplace),
+                              60, 'fast_run', 'inplace', 'cxx_only')
 
 
 # This is tested in tests/test_basic.py:UsmmTests
@@ -1600,7 +1854,7 @@ def local_structured_add_s_v(node):
 register_specialize(local_structured_add_s_v, 'cxx_only')
 
 
-class SamplingDotCSR(gof.Op):
+class SamplingDotCSR(gof.OpenMPOp):
     """Operand optimized for calculating the dot product dot(`x`, `y`.T) = `z`
     when you only want to calculate a subset of `z`.
 
@@ -1632,6 +1886,7 @@ class SamplingDotCSR(gof.Op):
            in the graph to be able to call blas function as they don't
            allow mixed dtype.
     :note: This op is used as an optimization for SamplingDot.
+    :note: With OpenMP, the rows of `p` are split between the threads.
     """
 
     def __eq__(self, other):
@@ -1668,7 +1923,8 @@ class SamplingDotCSR(gof.Op):
         ])
 
     def c_code_cache_version(self):
-        return (2, blas.blas_header_version())
+        return (3, blas.blas_header_version(), self.openmp,
+                config.openmp_sparse_minsize)
 
     def c_support_code(self):
         return blas.blas_header_text()
@@ -1677,7 +1933,8 @@ class SamplingDotCSR(gof.Op):
         return blas.ldflags()
 
     def c_compile_args(self):
-        return blas.ldflags(libs=False, flags=True)
+        return (blas.ldflags(libs=False, flags=True) +
+                super(SamplingDotCSR, self).c_compile_args())
 
     def c_lib_dirs(self):
         return blas.ldflags(libs=False, libs_dir=True)
@@ -1717,6 +1974,8 @@ class SamplingDotCSR(gof.Op):
         typenum_zp = tensor.TensorType(node.outputs[2].dtype,
                                        []).dtype_specs()[2]
 
+        omp_for = sparse._omp_parallel_for(self.openmp)
+
         rval = """
         if (PyArray_NDIM(%(x)s) != 2) {
 PyErr_SetString(PyExc_NotImplementedError, "rank(x) != 2"); %(fail)s;}
@@ -1811,6 +2070,9 @@ PyErr_SetString(PyExc_NotImplementedError, "rank(y) != 2"); %(fail)s;}
             memcpy(Dzi, Dpi, PyArray_DIMS(%(p_ind)s)[0]*sizeof(dtype_%(p_ind)s));
             memcpy(Dzp, Dpp, PyArray_DIMS(%(p_ptr)s)[0]*sizeof(dtype_%(p_ptr)s));
 
+            npy_intp nnz = Dpp[M * Sdpp];
+
+            %(omp_for)s
             for (npy_int32 m = 0; m < M; ++m) {
                 for (npy_int32 n_idx = Dpp[m * Sdpp]; n_idx < Dpp[(m+1)*Sdpp]; ++n_idx) {
                     const npy_int32 n = Dpi[n_idx * Sdpi]; // row index of non-null value for column K
@@ -1849,3 +2111,997 @@ def local_sampling_dot_csr(node):
 register_specialize(local_sampling_dot_csr,
                     'cxx_only',
                     name='local_sampling_dot_csr')
+
+
+def _csm_c_checks(data, indices, indptr, fail):
+    """Return C code that checks the properties of a sparse matrix."""
+    return """
+        if (PyArray_NDIM(%(data)s) != 1 || PyArray_NDIM(%(indices)s) != 1 ||
+            PyArray_NDIM(%(indptr)s) != 1) {
+            PyErr_SetString(PyExc_NotImplementedError,
+                            "data, indices and indptr must be vectors");
+            %(fail)s;
+        }
+        if (PyArray_TYPE(%(indices)s) != NPY_INT32 ||
+            PyArray_TYPE(%(indptr)s) != NPY_INT32) {
+            PyErr_SetString(PyExc_NotImplementedError,
+                            "indices and indptr must be int32");
+            %(fail)s;
+        }
+        if (PyArray_DIMS(%(indptr)s)[0] < 1 ||
+            PyArray_DIMS(%(data)s)[0] < ((npy_int32*)PyArray_GETPTR1(
+                %(indptr)s, PyArray_DIMS(%(indptr)s)[0] - 1))[0] ||
+            PyArray_DIMS(%(indices)s)[0] < ((npy_int32*)PyArray_GETPTR1(
+                %(indptr)s, PyArray_DIMS(%(indptr)s)[0] - 1))[0]) {
+            PyErr_SetString(PyExc_ValueError,
+                            "indptr does not match data and indices");
+            %(fail)s;
+        }
+        """ % locals()
+
+
+def _c_shape(shape, i):
+    """Return a C expression for element `i` of the shape vector."""
+    return ("((npy_intp)*(dtype_%(shape)s*)PyArray_GETPTR1(%(shape)s, %(i)d))"
+            % locals())
+
+
+def _c_new_vector(var, size, typenum, fail):
+    """Return C code that allocates a new vector in `var`, and runs `fail`
+    if that fails."""
+    return """
+        {
+            npy_intp dims[1] = {%(size)s};
+            Py_XDECREF(%(var)s);
+            %(var)s = (PyArrayObject*) PyArray_SimpleNew(1, dims, %(typenum)s);
+            if (!%(var)s) {
+                %(fail)s;
+            }
+        }
+        """ % locals()
+
+
+def _typenum(dtype):
+    return tensor.TensorType(dtype, []).dtype_specs()[2]
+
+
+class ElemwiseSSCSx(gof.Op):
+    """Elementwise addition or multiplication of two sparse matrices of
+    the same format.
+
+    :param a_data: Sparse matrix data.
+    :param a_indices: Sparse matrix indices.
+    :param a_indptr: Sparse matrix indptr.
+    :param a_shape: Sparse matrix shape.
+    :param b_data: Sparse matrix data.
+    :param b_indices: Sparse matrix indices.
+    :param b_indptr: Sparse matrix indptr.
+    :param b_shape: Sparse matrix shape.
+
+    :return: The data, indices and indptr of the result, which has
+             sorted indices and no explicit zeros, like the result of
+             SciPy.
+
+    :note: The rows (columns for csc) whose indices are sorted are
+           merged, the others go through a dense accumulator.
+    :note: The dtype of the sparse matrices cannot be complex.
+    :note: This op is used as an optimization of add_s_s and mul_s_s.
+    """
+    __props__ = ('operation', 'format')
+
+    def __init__(self, operation, format):
+        if operation not in ('add', 'mul'):
+            raise ValueError('operation must be "add" or "mul"', operation)
+        if format not in ('csr', 'csc'):
+            raise ValueError('format must be "csr" or "csc"', format)
+        self.operation = operation
+        self.format = format
+
+    def __str__(self):
+        return '%s{%s,%s}' % (self.__class__.__name__, self.operation,
+                              self.format)
+
+    def make_node(self, a_data, a_indices, a_indptr, a_shape,
+                  b_data, b_indices, b_indptr, b_shape):
+        inputs = map(tensor.as_tensor_variable,
+                     [a_data, a_indices, a_indptr, a_shape,
+                      b_data, b_indices, b_indptr, b_shape])
+        assert all(i.type.ndim == 1 for i in inputs)
+        out_dtype = scalar.upcast(inputs[0].dtype, inputs[4].dtype)
+        return gof.Apply(self, inputs,
+                         [tensor.tensor(out_dtype, (False,)),
+                          tensor.ivector(), tensor.ivector()])
+
+    def c_code_cache_version(self):
+        return (2,)
+
+    def c_code(self, node, name, inputs, outputs, sub):
+        (a_data, a_ind, a_ptr, a_shape, b_data, b_ind, b_ptr, b_shape) = inputs
+        (z_data, z_ind, z_ptr) = outputs
+        if node.outputs[0].dtype in ('complex64', 'complex128'):
+            raise NotImplementedError('Complex types are not supported')
+        fail = sub['fail']
+        checks = (_csm_c_checks(a_data, a_ind, a_ptr, fail) +
+                  _csm_c_checks(b_data, b_ind, b_ptr, fail))
+        a_rows, a_cols = _c_shape(a_shape, 0), _c_shape(a_shape, 1)
+        b_rows, b_cols = _c_shape(b_shape, 0), _c_shape(b_shape, 1)
+        if self.format == 'csr':
+            n_major, n_minor = a_rows, a_cols
+        else:
+            n_major, n_minor = a_cols, a_rows
+        if self.operation == 'add':
+            op = '+'
+            nnz_bound = 'nnz_a + nnz_b'
+        else:
+            op = '*'
+            nnz_bound = 'std::min(nnz_a, nnz_b)'
+        add = int(self.operation == 'add')
+        typenum_z = _typenum(node.outputs[0].dtype)
+        alloc_data = _c_new_vector(z_data, 'bound', typenum_z, fail)
+        alloc_ind = _c_new_vector(z_ind, 'bound', 'NPY_INT32', fail)
+        alloc_ptr = _c_new_vector(z_ptr, 'n_major + 1', 'NPY_INT32', fail)
+        return """
+        %(checks)s
+        if (PyArray_DIMS(%(a_shape)s)[0] != 2 ||
+            PyArray_DIMS(%(b_shape)s)[0] != 2) {
+            PyErr_SetString(PyExc_ValueError, "shape must have length 2");
+            %(fail)s;
+        }
+        if (%(a_rows)s != %(b_rows)s || %(a_cols)s != %(b_cols)s) {
+            PyErr_SetString(PyExc_ValueError, "inconsistent shapes");
+            %(fail)s;
+        }
+        {
+        const npy_intp n_major = %(n_major)s;
+        const npy_intp n_minor = %(n_minor)s;
+        if (PyArray_DIMS(%(a_ptr)s)[0] != n_major + 1 ||
+            PyArray_DIMS(%(b_ptr)s)[0] != n_major + 1) {
+            PyErr_SetString(PyExc_ValueError,
+                            "indptr does not match the shape");
+            %(fail)s;
+        }
+        %(alloc_ptr)s
+        {
+        const npy_int32* a_ptr = (npy_int32*)PyArray_DATA(%(a_ptr)s);
+        const npy_intp Sap = PyArray_STRIDES(%(a_ptr)s)[0] / 4;
+        const npy_int32* b_ptr = (npy_int32*)PyArray_DATA(%(b_ptr)s);
+        const npy_intp Sbp = PyArray_STRIDES(%(b_ptr)s)[0] / 4;
+        npy_int32* z_ptr = (npy_int32*)PyArray_DATA(%(z_ptr)s);
+
+        const npy_intp nnz_a = a_ptr[n_major * Sap];
+        const npy_intp nnz_b = b_ptr[n_major * Sbp];
+        // The result is built in outputs of the largest possible size,
+        // which are shrunk at the end.
+        const npy_intp bound = %(nnz_bound)s;
+        %(alloc_data)s
+        %(alloc_ind)s
+        // The merge loops are much faster on contiguous data.
+        PyArrayObject* a_data_c = PyArray_GETCONTIGUOUS(%(a_data)s);
+        PyArrayObject* a_ind_c = PyArray_GETCONTIGUOUS(%(a_ind)s);
+        PyArrayObject* b_data_c = PyArray_GETCONTIGUOUS(%(b_data)s);
+        PyArrayObject* b_ind_c = PyArray_GETCONTIGUOUS(%(b_ind)s);
+        if (!a_data_c || !a_ind_c || !b_data_c || !b_ind_c) {
+            Py_XDECREF(a_data_c);
+            Py_XDECREF(a_ind_c);
+            Py_XDECREF(b_data_c);
+            Py_XDECREF(b_ind_c);
+            %(fail)s;
+        }
+        {
+        const dtype_%(a_data)s* a_data = (dtype_%(a_data)s*)PyArray_DATA(a_data_c);
+        const npy_int32* a_ind = (npy_int32*)PyArray_DATA(a_ind_c);
+        const dtype_%(b_data)s* b_data = (dtype_%(b_data)s*)PyArray_DATA(b_data_c);
+        const npy_int32* b_ind = (npy_int32*)PyArray_DATA(b_ind_c);
+        dtype_%(z_data)s* t_data = (dtype_%(z_data)s*)PyArray_DATA(%(z_data)s);
+        npy_int32* t_ind = (npy_int32*)PyArray_DATA(%(z_ind)s);
+        // Workspace of the rows with unsorted indices, allocated if needed.
+        dtype_%(z_data)s* acc_a = NULL;
+        dtype_%(z_data)s* acc_b = NULL;
+        npy_intp* mark = NULL;
+        char* where = NULL;
+        npy_int32* cols = NULL;
+        int err = 0;
+        npy_intp nz = 0;
+        z_ptr[0] = 0;
+        for (npy_intp r = 0; r < n_major && !err; ++r) {
+            const npy_intp a_beg = a_ptr[r * Sap], a_end = a_ptr[(r + 1) * Sap];
+            const npy_intp b_beg = b_ptr[r * Sbp], b_end = b_ptr[(r + 1) * Sbp];
+            bool is_sorted = true;
+            for (npy_intp k = a_beg + 1; k < a_end && is_sorted; ++k)
+                is_sorted = a_ind[k - 1] < a_ind[k];
+            for (npy_intp k = b_beg + 1; k < b_end && is_sorted; ++k)
+                is_sorted = b_ind[k - 1] < b_ind[k];
+            if (is_sorted) {
+                npy_intp ka = a_beg, kb = b_beg;
+                while (ka < a_end && kb < b_end) {
+                    const npy_int32 ja = a_ind[ka];
+                    const npy_int32 jb = b_ind[kb];
+                    dtype_%(z_data)s v;
+                    npy_int32 j;
+                    if (ja == jb) {
+                        j = ja;
+                        v = (dtype_%(z_data)s)a_data[ka++] %(op)s
+                            (dtype_%(z_data)s)b_data[kb++];
+                    } else if (!%(add)s) {
+                        // Only the common elements can be non-zero.
+                        if (ja < jb) ++ka; else ++kb;
+                        continue;
+                    } else if (ja < jb) {
+                        j = ja;
+                        v = (dtype_%(z_data)s)a_data[ka++];
+                    } else {
+                        j = jb;
+                        v = (dtype_%(z_data)s)b_data[kb++];
+                    }
+                    if (v != 0) {
+                        t_data[nz] = v;
+                        t_ind[nz] = j;
+                        ++nz;
+                    }
+                }
+                for (; %(add)s && ka < a_end; ++ka) {
+                    const dtype_%(z_data)s v = a_data[ka];
+                    if (v != 0) {
+                        t_data[nz] = v;
+                        t_ind[nz] = a_ind[ka];
+                        ++nz;
+                    }
+                }
+                for (; %(add)s && kb < b_end; ++kb) {
+                    const dtype_%(z_data)s v = b_data[kb];
+                    if (v != 0) {
+                        t_data[nz] = v;
+                        t_ind[nz] = b_ind[kb];
+                        ++nz;
+                    }
+                }
+            } else {
+                if (!mark) {
+                    acc_a = (dtype_%(z_data)s*)malloc(
+                        (n_minor + 1) * sizeof(dtype_%(z_data)s));
+                    acc_b = (dtype_%(z_data)s*)malloc(
+                        (n_minor + 1) * sizeof(dtype_%(z_data)s));
+                    mark = (npy_intp*)malloc((n_minor + 1) * sizeof(npy_intp));
+                    where = (char*)malloc(n_minor + 1);
+                    cols = (npy_int32*)malloc(
+                        (n_minor + 1) * sizeof(npy_int32));
+                    if (!acc_a || !acc_b || !mark || !where || !cols) {
+                        PyErr_NoMemory();
+                        err = 1;
+                        break;
+                    }
+                    for (npy_intp j = 0; j < n_minor; ++j)
+                        mark[j] = -1;
+                }
+                npy_intp ncols = 0;
+                for (int side = 0; side < 2 && !err; ++side) {
+                    const npy_intp beg = side ? b_beg : a_beg;
+                    const npy_intp end = side ? b_end : a_end;
+                    for (npy_intp k = beg; k < end; ++k) {
+                        npy_int32 j = side ? b_ind[k] : a_ind[k];
+                        if (j < 0 || j >= n_minor) {
+                            PyErr_SetString(PyExc_ValueError,
+                                            "index out of bounds");
+                            err = 1;
+                            break;
+                        }
+                        if (mark[j] != r) {
+                            mark[j] = r;
+                            acc_a[j] = acc_b[j] = 0;
+                            where[j] = 0;
+                            cols[ncols++] = j;
+                        }
+                        if (side) {
+                            acc_b[j] += (dtype_%(z_data)s)b_data[k];
+                            where[j] |= 2;
+                        } else {
+                            acc_a[j] += (dtype_%(z_data)s)a_data[k];
+                            where[j] |= 1;
+                        }
+                    }
+                }
+                if (err)
+                    break;
+                std::sort(cols, cols + ncols);
+                for (npy_intp c = 0; c < ncols; ++c) {
+                    npy_int32 j = cols[c];
+                    if (!%(add)s && where[j] != 3)
+                        continue;
+                    dtype_%(z_data)s v = acc_a[j] %(op)s acc_b[j];
+                    if (v != 0) {
+                        t_data[nz] = v;
+                        t_ind[nz] = j;
+                        ++nz;
+                    }
+                }
+            }
+            z_ptr[r + 1] = nz;
+        }
+        free(acc_a);
+        free(acc_b);
+        free(mark);
+        free(where);
+        free(cols);
+        Py_DECREF(a_data_c);
+        Py_DECREF(a_ind_c);
+        Py_DECREF(b_data_c);
+        Py_DECREF(b_ind_c);
+        if (!err && nz < bound) {
+            PyArray_Dims new_shape = {&nz, 1};
+            PyObject* r;
+            r = PyArray_Resize(%(z_data)s, &new_shape, 0, NPY_CORDER);
+            err = !r;
+            Py_XDECREF(r);
+            if (!err) {
+                r = PyArray_Resize(%(z_ind)s, &new_shape, 0, NPY_CORDER);
+                err = !r;
+                Py_XDECREF(r);
+            }
+        }
+        if (err) {
+            %(fail)s;
+        }
+        }
+        }
+        }
+        """ % dict(locals(), **sub)
+
+    def c_headers(self):
+        return ['<algorithm>']
+
+
+# register a specialization to replace add_s_s and mul_s_s -> ElemwiseSSCSx
+@gof.local_optimizer([sparse.add_s_s, sparse.mul_s_s])
+def local_elemwise_s_s(node):
+    if node.op == sparse.add_s_s:
+        operation = 'add'
+    elif node.op == sparse.mul_s_s:
+        operation = 'mul'
+    else:
+        return False
+    x, y = node.inputs
+    if (x.type.format != y.type.format or
+            node.outputs[0].dtype in ('complex64', 'complex128')):
+        return False
+    x_data, x_ind, x_ptr, x_shape = sparse.csm_properties(x)
+    y_data, y_ind, y_ptr, y_shape = sparse.csm_properties(y)
+    z_data, z_ind, z_ptr = ElemwiseSSCSx(operation, x.type.format)(
+        x_data, x_ind, x_ptr, x_shape, y_data, y_ind, y_ptr, y_shape)
+    CSx = sparse.CSM(x.type.format)
+    return [CSx(z_data, z_ind, z_ptr, x_shape)]
+register_specialize(local_elemwise_s_s, 'cxx_only')
+
+
+class SpSumCSx(gof.Op):
+    """Sum of a sparse matrix along an axis.
+
+    :param a_data: Sparse matrix data.
+    :param a_indices: Sparse matrix indices.
+    :param a_indptr: Sparse matrix indptr.
+    :param a_shape: Sparse matrix shape.
+
+    :return: The sum as a dense tensor, like `SpSum`.
+
+    :note: The dtype of the sparse matrix cannot be complex.
+    :note: This op is used as an optimization of SpSum.
+    """
+    __props__ = ('axis', 'format')
+
+    def __init__(self, axis, format):
+        if axis not in (None, 0, 1):
+            raise ValueError('Illegal value for self.axis.')
+        if format not in ('csr', 'csc'):
+            raise ValueError('format must be "csr" or "csc"', format)
+        self.axis = axis
+        self.format = format
+
+    def __str__(self):
+        return '%s{axis=%s,%s}' % (self.__class__.__name__, self.axis,
+                                   self.format)
+
+    def make_node(self, a_data, a_indices, a_indptr, a_shape):
+        inputs = map(tensor.as_tensor_variable,
+                     [a_data, a_indices, a_indptr, a_shape])
+        assert all(i.type.ndim == 1 for i in inputs)
+        b = ()
+        if self.axis is not None:
+            b = (False,)
+        return gof.Apply(self, inputs,
+                         [tensor.TensorType(inputs[0].dtype, b)()])
+
+    def c_code_cache_version(self):
+        return (1,)
+
+    def c_code(self, node, name, inputs, outputs, sub):
+        a_data, a_ind, a_ptr, a_shape = inputs
+        z, = outputs
+        if node.outputs[0].dtype in ('complex64', 'complex128'):
+            raise NotImplementedError('Complex types are not supported')
+        fail = sub['fail']
+        checks = _csm_c_checks(a_data, a_ind, a_ptr, fail)
+        n_rows, n_cols = _c_shape(a_shape, 0), _c_shape(a_shape, 1)
+        if self.format == 'csr':
+            n_major, n_minor = n_rows, n_cols
+        else:
+            n_major, n_minor = n_cols, n_rows
+        # The compressed axis is reduced row by row, the other one is
+        # scattered into the output.
+        if self.axis is None:
+            reduce_major = 0
+            n_out = 1
+        elif (self.axis == 1) == (self.format == 'csr'):
+            reduce_major = 1
+            n_out = 'n_major'
+        else:
+            reduce_major = 0
+            n_out = 'n_minor'
+        scatter = int(self.axis is not None and not reduce_major)
+        ndim = int(self.axis is not None)
+        typenum_z = _typenum(node.outputs[0].dtype)
+        return """
+        %(checks)s
+        if (PyArray_DIMS(%(a_shape)s)[0] != 2) {
+            PyErr_SetString(PyExc_ValueError, "shape must have length 2");
+            %(fail)s;
+        }
+        {
+        const npy_intp n_major = %(n_major)s;
+        const npy_intp n_minor = %(n_minor)s;
+        if (PyArray_DIMS(%(a_ptr)s)[0] != n_major + 1) {
+            PyErr_SetString(PyExc_ValueError,
+                            "indptr does not match the shape");
+            %(fail)s;
+        }
+        npy_intp dims[1] = {%(n_out)s};
+        if (!%(z)s || PyArray_NDIM(%(z)s) != %(ndim)s ||
+            (%(ndim)s && PyArray_DIMS(%(z)s)[0] != dims[0]) ||
+            !PyArray_ISCONTIGUOUS(%(z)s)) {
+            Py_XDECREF(%(z)s);
+            %(z)s = (PyArrayObject*) PyArray_SimpleNew(%(ndim)s, dims,
+                                                       %(typenum_z)s);
+            if (!%(z)s) {
+                %(fail)s;
+            }
+        }
+        {
+        const dtype_%(a_data)s* a_data = (dtype_%(a_data)s*)PyArray_DATA(%(a_data)s);
+        const npy_intp Sad = PyArray_STRIDES(%(a_data)s)[0] / PyArray_DESCR(%(a_data)s)->elsize;
+        const npy_int32* a_ind = (npy_int32*)PyArray_DATA(%(a_ind)s);
+        const npy_intp Sai = PyArray_STRIDES(%(a_ind)s)[0] / 4;
+        const npy_int32* a_ptr = (npy_int32*)PyArray_DATA(%(a_ptr)s);
+        const npy_intp Sap = PyArray_STRIDES(%(a_ptr)s)[0] / 4;
+        dtype_%(z)s* z = (dtype_%(z)s*)PyArray_DATA(%(z)s);
+        const npy_intp nnz = a_ptr[n_major * Sap];
+
+        if (%(reduce_major)s) {
+            for (npy_intp r = 0; r < n_major; ++r) {
+                dtype_%(z)s acc = 0;
+                for (npy_intp k = a_ptr[r * Sap]; k < a_ptr[(r + 1) * Sap]; ++k)
+                    acc += a_data[k * Sad];
+                z[r] = acc;
+            }
+        } else if (%(scatter)s) {
+            memset(z, 0, n_minor * sizeof(dtype_%(z)s));
+            for (npy_intp k = 0; k < nnz; ++k) {
+                npy_int32 j = a_ind[k * Sai];
+                if (j < 0 || j >= n_minor) {
+                    PyErr_SetString(PyExc_ValueError, "index out of bounds");
+                    %(fail)s;
+                }
+                z[j] += a_data[k * Sad];
+            }
+        } else {
+            dtype_%(z)s acc = 0;
+            for (npy_intp k = 0; k < nnz; ++k)
+                acc += a_data[k * Sad];
+            z[0] = acc;
+        }
+        }
+        }
+        """ % dict(locals(), **sub)
+
+
+# register a specialization to replace SpSum -> SpSumCSx
+@gof.local_optimizer([sparse.SpSum])
+def local_sp_sum(node):
+    if not isinstance(node.op, sparse.SpSum):
+        return False
+    x, = node.inputs
+    if (x.type.format not in ('csr', 'csc') or
+            x.dtype in ('complex64', 'complex128')):
+        return False
+    return [SpSumCSx(node.op.axis, x.type.format)(
+        *sparse.csm_properties(x))]
+register_specialize(local_sp_sum, 'cxx_only')
+
+
+class StackCSx(gof.Op):
+    """Concatenate sparse matrices of the same format along their
+    compressed axis, i.e. vstack of csr matrices or hstack of csc
+    matrices.
+
+    :param *args: The data, indices, indptr and shape of each sparse
+                  matrix.
+
+    :return: The data, indices, indptr and shape of the result.
+
+    :note: The data is cast to `dtype`, which cannot be complex.
+    :note: This op is used as an optimization of VStack and HStack.
+    """
+    __props__ = ('format', 'dtype')
+
+    def __init__(self, format, dtype):
+        if format not in ('csr', 'csc'):
+            raise ValueError('format must be "csr" or "csc"', format)
+        self.format = format
+        self.dtype = dtype
+
+    def __str__(self):
+        return '%s{%s,%s}' % (self.__class__.__name__, self.format,
+                              self.dtype)
+
+    def make_node(self, *args):
+        inputs = map(tensor.as_tensor_variable, args)
+        if not inputs or len(inputs) % 4:
+            raise ValueError('Expected the 4 properties of each matrix')
+        assert all(i.type.ndim == 1 for i in inputs)
+        return gof.Apply(self, inputs,
+                         [tensor.tensor(self.dtype, (False,)),
+                          tensor.ivector(), tensor.ivector(),
+                          tensor.ivector()])
+
+    def c_code_cache_version(self):
+        return (2,)
+
+    def c_code(self, node, name, inputs, outputs, sub):
+        z_data, z_ind, z_ptr, z_shape = outputs
+        if self.dtype in ('complex64', 'complex128'):
+            raise NotImplementedError('Complex types are not supported')
+        fail = sub['fail']
+        major, minor = (0, 1) if self.format == 'csr' else (1, 0)
+        blocks = [inputs[i:i + 4] for i in range(0, len(inputs), 4)]
+        checks = []
+        sizes = []
+        copies = []
+        for i, (b_data, b_ind, b_ptr, b_shape) in enumerate(blocks):
+            checks.append(_csm_c_checks(b_data, b_ind, b_ptr, fail))
+            b_major = _c_shape(b_shape, major)
+            b_minor = _c_shape(b_shape, minor)
+            # The other dimension is taken from the first block, once its
+            # shape is known to have length 2.
+            first = int(i == 0)
+            checks.append("""
+        if (PyArray_DIMS(%(b_shape)s)[0] != 2) {
+            PyErr_SetString(PyExc_ValueError, "shape must have length 2");
+            %(fail)s;
+        }
+        if (PyArray_DIMS(%(b_ptr)s)[0] != %(b_major)s + 1) {
+            PyErr_SetString(PyExc_ValueError,
+                            "indptr does not match the shape");
+            %(fail)s;
+        }
+        if (%(first)s)
+            n_minor = %(b_minor)s;
+        if (%(b_minor)s != n_minor) {
+            PyErr_SetString(PyExc_ValueError, "inconsistent shapes");
+            %(fail)s;
+        }
+        """ % locals())
+            sizes.append("""
+        n_major += %(b_major)s;
+        nnz += ((npy_int32*)PyArray_GETPTR1(%(b_ptr)s, %(b_major)s))[0];
+        """ % locals())
+            copies.append("""
+        {
+            const npy_intp b_major = %(b_major)s;
+            const dtype_%(b_data)s* b_data = (dtype_%(b_data)s*)PyArray_DATA(%(b_data)s);
+            const npy_intp Sbd = PyArray_STRIDES(%(b_data)s)[0] / PyArray_DESCR(%(b_data)s)->elsize;
+            const npy_int32* b_ind = (npy_int32*)PyArray_DATA(%(b_ind)s);
+            const npy_intp Sbi = PyArray_STRIDES(%(b_ind)s)[0] / 4;
+            const npy_int32* b_ptr = (npy_int32*)PyArray_DATA(%(b_ptr)s);
+            const npy_intp Sbp = PyArray_STRIDES(%(b_ptr)s)[0] / 4;
+            const npy_intp b_nnz = b_ptr[b_major * Sbp];
+            for (npy_intp k = 0; k < b_nnz; ++k) {
+                z_data[nz + k] = (dtype_%(z_data)s)b_data[k * Sbd];
+                z_ind[nz + k] = b_ind[k * Sbi];
+            }
+            for (npy_intp r = 0; r < b_major; ++r)
+                z_ptr[row + r + 1] = nz + b_ptr[(r + 1) * Sbp];
+            nz += b_nnz;
+            row += b_major;
+        }
+        """ % locals())
+        checks = ''.join(checks)
+        sizes = ''.join(sizes)
+        copies = ''.join(copies)
+        typenum_z = _typenum(self.dtype)
+        alloc_data = _c_new_vector(z_data, 'nnz', typenum_z, fail)
+        alloc_ind = _c_new_vector(z_ind, 'nnz', 'NPY_INT32', fail)
+        alloc_ptr = _c_new_vector(z_ptr, 'n_major + 1', 'NPY_INT32', fail)
+        alloc_shape = _c_new_vector(z_shape, '2', 'NPY_INT32', fail)
+        return """
+        {
+        npy_intp n_minor = 0;
+        npy_intp n_major = 0;
+        npy_intp nnz = 0;
+        %(checks)s
+        %(sizes)s
+        %(alloc_data)s
+        %(alloc_ind)s
+        %(alloc_ptr)s
+        %(alloc_shape)s
+        {
+        dtype_%(z_data)s* z_data = (dtype_%(z_data)s*)PyArray_DATA(%(z_data)s);
+        npy_int32* z_ind = (npy_int32*)PyArray_DATA(%(z_ind)s);
+        npy_int32* z_ptr = (npy_int32*)PyArray_DATA(%(z_ptr)s);
+        npy_int32* z_shape = (npy_int32*)PyArray_DATA(%(z_shape)s);
+        npy_intp nz = 0;
+        npy_intp row = 0;
+        z_ptr[0] = 0;
+        %(copies)s
+        z_shape[%(major)d] = n_major;
+        z_shape[%(minor)d] = n_minor;
+        }
+        }
+        """ % dict(locals(), **sub)
+
+
+# register a specialization to replace VStack of csr matrices and HStack
+# of csc matrices -> StackCSx
+@gof.local_optimizer([sparse.HStack, sparse.VStack])
+def local_stack_csx(node):
+    if type(node.op) == sparse.VStack:
+        format = 'csr'
+    elif type(node.op) == sparse.HStack:
+        format = 'csc'
+    else:
+        return False
+    if (node.op.format != format or
+            node.op.dtype in ('complex64', 'complex128') or
+            any(b.type.format != format for b in node.inputs)):
+        return False
+    properties = []
+    for b in node.inputs:
+        properties.extend(sparse.csm_properties(b))
+    z_data, z_ind, z_ptr, z_shape = StackCSx(format, node.op.dtype)(
+        *properties)
+    return [sparse.CSM(format)(z_data, z_ind, z_ptr, z_shape)]
+register_specialize(local_stack_csx, 'cxx_only')
+
+
+class GetItem2dCSx(gof.Op):
+    """Slice of a csr or csc matrix, without step.
+
+    :param a_data: Sparse matrix data.
+    :param a_indices: Sparse matrix indices.
+    :param a_indptr: Sparse matrix indptr.
+    :param a_shape: Sparse matrix shape.
+    :param row_start: First row of the slice.
+    :param row_stop: Row after the last row of the slice.
+    :param col_start: First column of the slice.
+    :param col_stop: Column after the last column of the slice.
+
+    :return: The data, indices, indptr and shape of the result.
+
+    :note: Like in SciPy, negative bounds count from the end, and an
+           IndexError is raised if the bounds are out of range or
+           reversed.
+    :note: The order of the indices and the explicit zeros are kept.
+    :note: This op is used as an optimization of GetItem2d.
+    """
+    __props__ = ('format',)
+
+    def __init__(self, format):
+        if format not in ('csr', 'csc'):
+            raise ValueError('format must be "csr" or "csc"', format)
+        self.format = format
+
+    def __str__(self):
+        return '%s{%s}' % (self.__class__.__name__, self.format)
+
+    def make_node(self, a_data, a_indices, a_indptr, a_shape,
+                  row_start, row_stop, col_start, col_stop):
+        properties = map(tensor.as_tensor_variable,
+                         [a_data, a_indices, a_indptr, a_shape])
+        assert all(i.type.ndim == 1 for i in properties)
+        bounds = map(tensor.as_tensor_variable,
+                     [row_start, row_stop, col_start, col_stop])
+        assert all(b.type.ndim == 0 and b.dtype in tensor.discrete_dtypes
+                   for b in bounds)
+        return gof.Apply(self, properties + bounds,
+                         [tensor.tensor(properties[0].dtype, (False,)),
+                          tensor.ivector(), tensor.ivector(),
+                          tensor.ivector()])
+
+    def c_code_cache_version(self):
+        return (1,)
+
+    def c_code(self, node, name, inputs, outputs, sub):
+        (a_data, a_ind, a_ptr, a_shape,
+         row_start, row_stop, col_start, col_stop) = inputs
+        z_data, z_ind, z_ptr, z_shape = outputs
+        if node.outputs[0].dtype in ('complex64', 'complex128'):
+            raise NotImplementedError('Complex types are not supported')
+        fail = sub['fail']
+        checks = _csm_c_checks(a_data, a_ind, a_ptr, fail)
+        n_rows, n_cols = _c_shape(a_shape, 0), _c_shape(a_shape, 1)
+        if self.format == 'csr':
+            n_major, n_minor = 'n_rows', 'n_cols'
+            major_start, major_stop = 'r0', 'r1'
+            minor_start, minor_stop = 'c0', 'c1'
+        else:
+            n_major, n_minor = 'n_cols', 'n_rows'
+            major_start, major_stop = 'c0', 'c1'
+            minor_start, minor_stop = 'r0', 'r1'
+        typenum_z = _typenum(node.outputs[0].dtype)
+        alloc_data = _c_new_vector(z_data, 'nnz', typenum_z, fail)
+        alloc_ind = _c_new_vector(z_ind, 'nnz', 'NPY_INT32', fail)
+        alloc_ptr = _c_new_vector(z_ptr, 'm1 - m0 + 1', 'NPY_INT32', fail)
+        alloc_shape = _c_new_vector(z_shape, '2', 'NPY_INT32', fail)
+        return """
+        %(checks)s
+        if (PyArray_DIMS(%(a_shape)s)[0] != 2) {
+            PyErr_SetString(PyExc_ValueError, "shape must have length 2");
+            %(fail)s;
+        }
+        {
+        const npy_intp n_rows = %(n_rows)s;
+        const npy_intp n_cols = %(n_cols)s;
+        if (PyArray_DIMS(%(a_ptr)s)[0] != %(n_major)s + 1) {
+            PyErr_SetString(PyExc_ValueError,
+                            "indptr does not match the shape");
+            %(fail)s;
+        }
+        npy_intp r0 = ((dtype_%(row_start)s*)PyArray_DATA(%(row_start)s))[0];
+        npy_intp r1 = ((dtype_%(row_stop)s*)PyArray_DATA(%(row_stop)s))[0];
+        npy_intp c0 = ((dtype_%(col_start)s*)PyArray_DATA(%(col_start)s))[0];
+        npy_intp c1 = ((dtype_%(col_stop)s*)PyArray_DATA(%(col_stop)s))[0];
+        // Like SciPy, count negative bounds from the end and reject the
+        // bounds that are then out of range or reversed.
+        if (r0 < 0) r0 += n_rows;
+        if (r1 < 0) r1 += n_rows;
+        if (c0 < 0) c0 += n_cols;
+        if (c1 < 0) c1 += n_cols;
+        if (r0 < 0 || r1 < r0 || n_rows < r1 ||
+            c0 < 0 || c1 < c0 || n_cols < c1) {
+            PyErr_SetString(PyExc_IndexError, "index out of bounds");
+            %(fail)s;
+        }
+        const npy_intp m0 = %(major_start)s, m1 = %(major_stop)s;
+        const npy_intp n0 = %(minor_start)s, n1 = %(minor_stop)s;
+        // Whether all the minor indices are kept.
+        const bool all_minor = (n0 == 0 && n1 == %(n_minor)s);
+
+        const dtype_%(a_data)s* a_data = (dtype_%(a_data)s*)PyArray_DATA(%(a_data)s);
+        const npy_intp Sad = PyArray_STRIDES(%(a_data)s)[0] / PyArray_DESCR(%(a_data)s)->elsize;
+        const npy_int32* a_ind = (npy_int32*)PyArray_DATA(%(a_ind)s);
+        const npy_intp Sai = PyArray_STRIDES(%(a_ind)s)[0] / 4;
+        const npy_int32* a_ptr = (npy_int32*)PyArray_DATA(%(a_ptr)s);
+        const npy_intp Sap = PyArray_STRIDES(%(a_ptr)s)[0] / 4;
+
+        npy_intp nnz = 0;
+        if (all_minor) {
+            nnz = a_ptr[m1 * Sap] - a_ptr[m0 * Sap];
+        } else {
+            for (npy_intp k = a_ptr[m0 * Sap]; k < a_ptr[m1 * Sap]; ++k) {
+                const npy_int32 j = a_ind[k * Sai];
+                nnz += (j >= n0 && j < n1);
+            }
+        }
+        %(alloc_data)s
+        %(alloc_ind)s
+        %(alloc_ptr)s
+        %(alloc_shape)s
+        {
+        dtype_%(z_data)s* z_data = (dtype_%(z_data)s*)PyArray_DATA(%(z_data)s);
+        npy_int32* z_ind = (npy_int32*)PyArray_DATA(%(z_ind)s);
+        npy_int32* z_ptr = (npy_int32*)PyArray_DATA(%(z_ptr)s);
+        npy_int32* z_shape = (npy_int32*)PyArray_DATA(%(z_shape)s);
+        npy_intp nz = 0;
+        z_ptr[0] = 0;
+        for (npy_intp r = m0; r < m1; ++r) {
+            for (npy_intp k = a_ptr[r * Sap]; k < a_ptr[(r + 1) * Sap]; ++k) {
+                const npy_int32 j = a_ind[k * Sai];
+                if (all_minor || (j >= n0 && j < n1)) {
+                    z_data[nz] = a_data[k * Sad];
+                    z_ind[nz] = j - n0;
+                    ++nz;
+                }
+            }
+            z_ptr[r - m0 + 1] = nz;
+        }
+        z_shape[0] = r1 - r0;
+        z_shape[1] = c1 - c0;
+        }
+        }
+        """ % dict(locals(), **sub)
+
+
+# register a specialization to replace GetItem2d without step -> GetItem2dCSx
+@gof.local_optimizer([sparse.GetItem2d])
+def local_get_item_2d(node):
+    if not isinstance(node.op, sparse.GetItem2d):
+        return False
+    x = node.inputs[0]
+    if (x.type.format not in ('csr', 'csc') or
+            x.dtype in ('complex64', 'complex128')):
+        return False
+
+    def is_none(v):
+        return isinstance(v, gof.Constant) and v.data is None
+
+    a_data, a_ind, a_ptr, a_shape = sparse.csm_properties(x)
+    bounds = []
+    for i, (start, stop, step) in enumerate([node.inputs[1:4],
+                                             node.inputs[4:7]]):
+        if not is_none(step):
+            return False
+        if is_none(start):
+            start = tensor.constant(0, dtype='int64')
+        if is_none(stop):
+            stop = a_shape[i]
+        bounds.extend([tensor.cast(start, 'int64'),
+                       tensor.cast(stop, 'int64')])
+    z_data, z_ind, z_ptr, z_shape = GetItem2dCSx(x.type.format)(
+        a_data, a_ind, a_ptr, a_shape, *bounds)
+    return [sparse.CSM(x.type.format)(z_data, z_ind, z_ptr, z_shape)]
+register_specialize(local_get_item_2d, 'cxx_only')
+
+
+class DotCSx(gof.Op):
+    """Dense product of two csr or two csc matrices.
+
+    :param a_data: Sparse matrix data.
+    :param a_indices: Sparse matrix indices.
+    :param a_indptr: Sparse matrix indptr.
+    :param a_shape: Sparse matrix shape.
+    :param b_data: Sparse matrix data.
+    :param b_indices: Sparse matrix indices.
+    :param b_indptr: Sparse matrix indptr.
+    :param b_shape: Sparse matrix shape.
+
+    :return: The dense matrix `a` `b`.
+
+    :note: Each product of an element of one matrix with a row (a column
+           for csc) of the other is added directly to the output, which
+           avoids building the sparse product that SciPy converts to
+           a dense matrix.
+    :note: The dtype of the sparse matrices cannot be complex.
+    :note: This op is used as an optimization of Dot.
+    """
+    __props__ = ('format',)
+
+    def __init__(self, format):
+        if format not in ('csr', 'csc'):
+            raise ValueError('format must be "csr" or "csc"', format)
+        self.format = format
+
+    def __str__(self):
+        return '%s{%s}' % (self.__class__.__name__, self.format)
+
+    def make_node(self, a_data, a_indices, a_indptr, a_shape,
+                  b_data, b_indices, b_indptr, b_shape):
+        inputs = map(tensor.as_tensor_variable,
+                     [a_data, a_indices, a_indptr, a_shape,
+                      b_data, b_indices, b_indptr, b_shape])
+        assert all(i.type.ndim == 1 for i in inputs)
+        out_dtype = scalar.upcast(inputs[0].dtype, inputs[4].dtype)
+        return gof.Apply(self, inputs,
+                         [tensor.tensor(out_dtype, (False, False))])
+
+    def c_code_cache_version(self):
+        return (1,)
+
+    def c_code(self, node, name, inputs, outputs, sub):
+        (a_data, a_ind, a_ptr, a_shape, b_data, b_ind, b_ptr, b_shape) = inputs
+        z, = outputs
+        if node.outputs[0].dtype in ('complex64', 'complex128'):
+            raise NotImplementedError('Complex types are not supported')
+        fail = sub['fail']
+        checks = (_csm_c_checks(a_data, a_ind, a_ptr, fail) +
+                  _csm_c_checks(b_data, b_ind, b_ptr, fail))
+        a_rows, a_cols = _c_shape(a_shape, 0), _c_shape(a_shape, 1)
+        b_rows, b_cols = _c_shape(b_shape, 0), _c_shape(b_shape, 1)
+        # For csc matrices, z.T = b.T a.T is computed, where the
+        # transposes are csr matrices with the same properties. p is the
+        # outer matrix and q the inner one.
+        if self.format == 'csr':
+            p_data, p_ind, p_ptr = a_data, a_ind, a_ptr
+            q_data, q_ind, q_ptr = b_data, b_ind, b_ptr
+            n_p_major, n_q_minor = 'M', 'N'
+            Szi, Szj = 'Szm', 'Szn'
+        else:
+            p_data, p_ind, p_ptr = b_data, b_ind, b_ptr
+            q_data, q_ind, q_ptr = a_data, a_ind, a_ptr
+            n_p_major, n_q_minor = 'N', 'M'
+            Szi, Szj = 'Szn', 'Szm'
+        typenum_z = _typenum(node.outputs[0].dtype)
+        return """
+        %(checks)s
+        if (PyArray_DIMS(%(a_shape)s)[0] != 2 ||
+            PyArray_DIMS(%(b_shape)s)[0] != 2) {
+            PyErr_SetString(PyExc_ValueError, "shape must have length 2");
+            %(fail)s;
+        }
+        {
+        const npy_intp M = %(a_rows)s;
+        const npy_intp K = %(a_cols)s;
+        const npy_intp N = %(b_cols)s;
+        if (%(b_rows)s != K) {
+            PyErr_SetString(PyExc_ValueError, "inconsistent shapes");
+            %(fail)s;
+        }
+        if (PyArray_DIMS(%(p_ptr)s)[0] != %(n_p_major)s + 1 ||
+            PyArray_DIMS(%(q_ptr)s)[0] != K + 1) {
+            PyErr_SetString(PyExc_ValueError,
+                            "indptr does not match the shape");
+            %(fail)s;
+        }
+        npy_intp dims[2] = {M, N};
+        if (!%(z)s || PyArray_NDIM(%(z)s) != 2 ||
+            PyArray_DIMS(%(z)s)[0] != M || PyArray_DIMS(%(z)s)[1] != N ||
+            !PyArray_ISCONTIGUOUS(%(z)s)) {
+            Py_XDECREF(%(z)s);
+            %(z)s = (PyArrayObject*) PyArray_SimpleNew(2, dims, %(typenum_z)s);
+            if (!%(z)s) {
+                %(fail)s;
+            }
+        }
+        {
+        const dtype_%(p_data)s* p_data = (dtype_%(p_data)s*)PyArray_DATA(%(p_data)s);
+        const npy_intp Spd = PyArray_STRIDES(%(p_data)s)[0] / PyArray_DESCR(%(p_data)s)->elsize;
+        const npy_int32* p_ind = (npy_int32*)PyArray_DATA(%(p_ind)s);
+        const npy_intp Spi = PyArray_STRIDES(%(p_ind)s)[0] / 4;
+        const npy_int32* p_ptr = (npy_int32*)PyArray_DATA(%(p_ptr)s);
+        const npy_intp Spp = PyArray_STRIDES(%(p_ptr)s)[0] / 4;
+        const dtype_%(q_data)s* q_data = (dtype_%(q_data)s*)PyArray_DATA(%(q_data)s);
+        const npy_intp Sqd = PyArray_STRIDES(%(q_data)s)[0] / PyArray_DESCR(%(q_data)s)->elsize;
+        const npy_int32* q_ind = (npy_int32*)PyArray_DATA(%(q_ind)s);
+        const npy_intp Sqi = PyArray_STRIDES(%(q_ind)s)[0] / 4;
+        const npy_int32* q_ptr = (npy_int32*)PyArray_DATA(%(q_ptr)s);
+        const npy_intp Sqp = PyArray_STRIDES(%(q_ptr)s)[0] / 4;
+        dtype_%(z)s* z = (dtype_%(z)s*)PyArray_DATA(%(z)s);
+        const npy_intp Szm = PyArray_STRIDES(%(z)s)[0] / PyArray_DESCR(%(z)s)->elsize;
+        const npy_intp Szn = PyArray_STRIDES(%(z)s)[1] / PyArray_DESCR(%(z)s)->elsize;
+
+        memset(z, 0, M * N * sizeof(dtype_%(z)s));
+        for (npy_intp i = 0; i < %(n_p_major)s; ++i) {
+            for (npy_intp kp = p_ptr[i * Spp]; kp < p_ptr[(i + 1) * Spp]; ++kp) {
+                const npy_int32 k = p_ind[kp * Spi];
+                if (k < 0 || k >= K) {
+                    PyErr_SetString(PyExc_ValueError, "index out of bounds");
+                    %(fail)s;
+                }
+                const dtype_%(z)s v = p_data[kp * Spd];
+                for (npy_intp kq = q_ptr[k * Sqp]; kq < q_ptr[(k + 1) * Sqp]; ++kq) {
+                    const npy_int32 j = q_ind[kq * Sqi];
+                    if (j < 0 || j >= %(n_q_minor)s) {
+                        PyErr_SetString(PyExc_ValueError,
+                                        "index out of bounds");
+                        %(fail)s;
+                    }
+                    z[i * %(Szi)s + j * %(Szj)s] += v * q_data[kq * Sqd];
+                }
+            }
+        }
+        }
+        }
+        """ % dict(locals(), **sub)
+
+
+# register an optimization to replace Dot of two csr or two csc
+# matrices -> DotCSx. It runs after specialize, so that local_usmm can
+# first fuse the product into Usmm.
+@gof.local_optimizer([sparse._dot])
+def local_dot_s_s(node):
+    if node.op != sparse._dot:
+        return False
+    a, b = node.inputs
+    if (not _is_sparse_variable(a) or not _is_sparse_variable(b) or
+            a.type.format not in ('csr', 'csc') or
+            b.type.format != a.type.format or
+            node.outputs[0].dtype in ('complex64', 'complex128')):
+        return False
+    return [DotCSx(a.type.format)(*(sparse.csm_properties(a) +
+                                    sparse.csm_properties(b)))]
+register_specialize_device(local_dot_s_s, 'cxx_only')
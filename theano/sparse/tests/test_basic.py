@@ -48,7 +48,8 @@ from theano.sparse import (
 # from theano.sparse import (
 #    Poisson, poisson, Binomial, Multinomial, multinomial)
 
-from theano.sparse.opt import (StructuredDotCSC, UsmmCscDense, CSMGradC)
+from theano.sparse.opt import (StructuredDotCSC, StructuredDotCSR,
+                               UsmmCscDense, CSMGradC)
 
 from theano.tests import unittest_tools as utt
 
@@ -320,7 +321,7 @@ class SparseInferShapeTester(utt.InferShapeTester):
                                                config.floatX, 3)),
                                  sp.csr_matrix(random_lil((10, 40),
                                                config.floatX, 3))],
-                                AddSS)
+                                AddSS, excluding=["local_elemwise_s_s"])
 
     def test_add_sd(self):
         x = SparseType('csr', dtype=config.floatX)()
@@ -341,7 +342,7 @@ class SparseInferShapeTester(utt.InferShapeTester):
                                 [sp.csr_matrix(random_lil((10, 40),
                                                config.floatX, 3)),
                                 ] * 2,
-                                MulSS)
+                                MulSS, excluding=["local_elemwise_s_s"])
 
     def test_mul_sd(self):
         x = SparseType('csr', dtype=config.floatX)()
@@ -372,7 +373,7 @@ class SparseInferShapeTester(utt.InferShapeTester):
                                config.floatX, 3)),
                  sp.csc_matrix(random_lil((5, 3),
                                config.floatX, 3))],
-                Dot)
+                Dot, excluding=["local_dot_s_s"])
 
     def test_structured_dot(self):
         x = SparseType('csc', dtype=config.floatX)()
@@ -1246,7 +1247,8 @@ class DotTests(utt.InferShapeTester):
             # Test infer_shape
             self._compile_and_check([x, y], [theano.sparse.dot(x, y)],
                                     [x_v, y_v],
-                                    (Dot, Usmm, UsmmCscDense))
+                                    (Dot, Usmm, UsmmCscDense,
+                                     StructuredDotCSC, StructuredDotCSR))
 
     def test_csc_dense(self):
         x = theano.sparse.csc_matrix('x')
@@ -1265,7 +1267,8 @@ class DotTests(utt.InferShapeTester):
             # Test infer_shape
             self._compile_and_check([x, y], [theano.sparse.dot(x, y)],
                                     [x_v, y_v],
-                                    (Dot, Usmm, UsmmCscDense))
+                                    (Dot, Usmm, UsmmCscDense,
+                                     StructuredDotCSC, StructuredDotCSR))
 
     def test_sparse_sparse(self):
         for d1, d2 in [('float32', 'float32'),
@@ -1778,7 +1781,8 @@ class SpSumTester(utt.InferShapeTester):
                 self._compile_and_check(variable,
                                         [self.op(variable[0], axis=axis)],
                                         data,
-                                        self.op_class)
+                                        self.op_class,
+                                        excluding=['local_sp_sum'])
 
     def test_grad(self):
         for format in sparse.sparse_formats:
@@ -2433,7 +2437,8 @@ class _HVStackTester(utt.InferShapeTester):
                                     [self.op_class(dtype='float64')
                                      (*self.x[format])],
                                     self.mat[format],
-                                    self.op_class)
+                                    self.op_class,
+                                    excluding=['local_stack_csx'])
 
     def test_grad(self):
         for format in sparse.sparse_formats:
@@ -8,11 +8,12 @@ except ImportError:
 
 import theano
 from theano import sparse, config, tensor
+from theano.tests import unittest_tools as utt
 from theano.sparse import enable_sparse
 if not enable_sparse:
     raise SkipTest('Optional package sparse disabled')
 
-from theano.sparse.tests.test_basic import random_lil
+from theano.sparse.tests.test_basic import random_lil, sparse_random_inputs
 
 
 def test_local_csm_properties_csm():
@@ -140,6 +141,252 @@ def test_local_sampling_dot_csr():
                        in f.maker.fgraph.toposort())
 
 
+def sp_random_like(val, shape):
+    return sparse_random_inputs(val.format, shape,
+                                out_dtype=str(val.dtype))[1][0]
+
+
+def test_local_elemwise_s_s():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    mode = theano.compile.mode.get_default_mode()
+    mode = mode.including("specialize", "local_elemwise_s_s")
+
+    for sp_format in sparse.sparse_formats:
+        for op, sp_op in [(sparse.add_s_s, lambda a, b: a + b),
+                          (sparse.mul_s_s, lambda a, b: a.multiply(b))]:
+            for unsorted in [False, True]:
+                inputs, vals = sparse_random_inputs(
+                    sp_format, (6, 8), n=2, explicit_zero=True,
+                    unsorted_indices=unsorted)
+                f = theano.function(inputs, op(*inputs), mode=mode)
+                assert not any(isinstance(node.op, (sparse.AddSS,
+                                                     sparse.MulSS))
+                               for node in f.maker.fgraph.toposort())
+                out = f(*vals)
+                expected = sp_op(*vals)
+                assert out.format == sp_format
+                assert out.has_sorted_indices
+                assert 0 not in out.data
+                utt.assert_allclose(out.toarray(), expected.toarray())
+            other = sp_random_like(vals[1], (6, 7))
+            try:
+                f(vals[0], other)
+                assert False
+            except ValueError:
+                pass
+
+
+def test_local_sp_sum():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    mode = theano.compile.mode.get_default_mode()
+    mode = mode.including("specialize", "local_sp_sum")
+
+    for sp_format in sparse.sparse_formats:
+        (x,), (val,) = sparse_random_inputs(sp_format, (6, 8),
+                                            unsorted_indices=True)
+        for axis in [None, 0, 1]:
+            f = theano.function([x], sparse.sp_sum(x, axis), mode=mode)
+            assert not any(isinstance(node.op, sparse.SpSum)
+                           for node in f.maker.fgraph.toposort())
+            expected = numpy.asarray(val.sum(axis)).reshape(
+                f.maker.fgraph.outputs[0].type.ndim * (-1,))
+            utt.assert_allclose(f(val), expected)
+
+
+def test_local_stack_csx():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    mode = theano.compile.mode.get_default_mode()
+    mode = mode.including("specialize", "local_stack_csx")
+
+    for stack, sp_stack, sp_format, shapes in [
+            (sparse.vstack, sp.vstack, 'csr', [(3, 5), (1, 5), (4, 5)]),
+            (sparse.hstack, sp.hstack, 'csc', [(3, 5), (3, 1), (3, 2)])]:
+        inputs = []
+        vals = []
+        for shape, dtype in zip(shapes, ['float64', 'float32', 'int8']):
+            (x,), (val,) = sparse_random_inputs(sp_format, shape,
+                                                out_dtype=dtype)
+            inputs.append(x)
+            vals.append(val)
+        f = theano.function(inputs, stack(inputs, format=sp_format),
+                            mode=mode)
+        assert not any(isinstance(node.op, sparse.HStack)
+                       for node in f.maker.fgraph.toposort())
+        out = f(*vals)
+        expected = sp_stack(vals, format=sp_format)
+        assert out.format == sp_format
+        assert out.dtype == 'float64'
+        assert out.shape == expected.shape
+        utt.assert_allclose(out.toarray(), expected.toarray())
+        # The blocks must agree on the other dimension.
+        try:
+            f(vals[0], vals[1], sp_random_like(vals[2], (4, 6)))
+            assert False
+        except ValueError:
+            pass
+
+
+def test_local_get_item_2d():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    mode = theano.compile.mode.get_default_mode()
+    mode = mode.including("specialize", "local_get_item_2d")
+
+    a = tensor.iscalar('a')
+    b = tensor.lscalar('b')
+    for sp_format in sparse.sparse_formats:
+        (x,), (val,) = sparse_random_inputs(sp_format, (6, 8),
+                                            explicit_zero=True,
+                                            unsorted_indices=True)
+        f = theano.function([x, a, b], [x[a:b], x[a:, :b], x[:, a:b],
+                                        x[a:b, a:b]], mode=mode)
+        assert not any(isinstance(node.op, sparse.GetItem2d)
+                       for node in f.maker.fgraph.toposort())
+        for start, stop in [(1, 5), (0, 6), (-3, -1), (2, 2)]:
+            outs = f(val, start, stop)
+            expected = [val[start:stop], val[start:, :stop],
+                        val[:, start:stop], val[start:stop, start:stop]]
+            for out, exp in zip(outs, expected):
+                assert out.format == sp_format
+                assert out.shape == exp.shape
+                utt.assert_allclose(out.toarray(), exp.toarray())
+        for start, stop in [(0, 7), (-7, 2), (4, 2)]:
+            try:
+                f(val, start, stop)
+                assert False
+            except IndexError:
+                pass
+
+    # A slice with a step is left to GetItem2d.
+    (x,), (val,) = sparse_random_inputs('csr', (6, 8))
+    f = theano.function([x], x[::2], mode=mode)
+    assert any(isinstance(node.op, sparse.GetItem2d)
+               for node in f.maker.fgraph.toposort())
+
+
+def test_local_dot_s_s():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    mode = theano.compile.mode.get_default_mode()
+    mode = mode.including("specialize_device", "local_dot_s_s")
+
+    for sp_format in sparse.sparse_formats:
+        for dtypes in [('float64', 'float64'), ('float32', 'int8')]:
+            x = sparse.matrix(sp_format, dtype=dtypes[0])
+            y = sparse.matrix(sp_format, dtype=dtypes[1])
+            f = theano.function([x, y], sparse.dot(x, y), mode=mode)
+            assert not any(isinstance(node.op, sparse.Dot)
+                           for node in f.maker.fgraph.toposort())
+            x_val = sparse_random_inputs(sp_format, (5, 7),
+                                         out_dtype=dtypes[0],
+                                         unsorted_indices=True)[1][0]
+            y_val = sparse_random_inputs(sp_format, (7, 4),
+                                         out_dtype=dtypes[1])[1][0]
+            out = f(x_val, y_val)
+            assert out.dtype == f.maker.fgraph.outputs[0].dtype
+            utt.assert_allclose(out, (x_val * y_val).toarray())
+            try:
+                f(x_val, sp_random_like(y_val, (6, 4)))
+                assert False
+            except ValueError:
+                pass
+
+
+def test_local_structured_dot_openmp():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    mode = theano.compile.mode.get_default_mode()
+    mode = mode.including("specialize", "local_structured_dot_openmp")
+
+    orig_openmp = theano.config.openmp
+    orig_minsize = theano.config.openmp_sparse_minsize
+    try:
+        theano.config.openmp = True
+        theano.config.openmp_sparse_minsize = 0
+        for sp_format in ['csr', 'csc']:
+            (x,), (x_val,) = sparse_random_inputs(sp_format, (9, 7))
+            y = tensor.matrix()
+            y_val = numpy.random.randn(7, 4).astype(config.floatX)
+            z = tensor.matrix()
+            z_val = numpy.random.randn(3, 9).astype(config.floatX)
+            f = theano.function([x, y, z], [sparse.dot(x, y),
+                                            sparse.structured_dot(x, y),
+                                            sparse.dot(z, x)],
+                                mode=mode)
+            assert not any(isinstance(node.op, (sparse.Dot,
+                                                sparse.StructuredDot))
+                           for node in f.maker.fgraph.toposort())
+            for out, expected in zip(f(x_val, y_val, z_val),
+                                     [x_val * y_val, x_val * y_val,
+                                      z_val * x_val]):
+                utt.assert_allclose(out, expected)
+    finally:
+        theano.config.openmp = orig_openmp
+        theano.config.openmp_sparse_minsize = orig_minsize
+
+
+def test_sparse_dense_products_openmp():
+    # The OpenMP version of the ops must compute the same thing as the
+    # sequential one.
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    orig_minsize = theano.config.openmp_sparse_minsize
+    orig_buffer_size = theano.config.openmp_sparse_buffer_size
+    try:
+        theano.config.openmp_sparse_minsize = 0
+        a = sp.csr_matrix(random_lil((30, 20), 'float64', 60))
+        b = numpy.random.randn(20, 5)
+        g = numpy.random.randn(30, 5)
+        z = numpy.random.randn(30, 5)
+        a_csc = sp.csc_matrix(a)
+        for a_val, op_class, inputs in [
+                (a, sparse.opt.StructuredDotCSR, [b]),
+                (a_csc, sparse.opt.StructuredDotCSC, [numpy.int32(30), b]),
+                (a, sparse.StructuredDotGradCSR, [b, g]),
+                (a_csc, sparse.StructuredDotGradCSC, [b, g]),
+                (a_csc, sparse.opt.UsmmCscDense, [numpy.int32(30), b, z]),
+                (a, sparse.opt.SamplingDotCSR, [g, b, numpy.int32(20)])]:
+            if op_class is sparse.opt.UsmmCscDense:
+                if not theano.config.blas.ldflags:
+                    continue
+                args = [numpy.ones((1, 1)), a_val.data, a_val.indices,
+                        a_val.indptr] + inputs
+            elif op_class is sparse.opt.SamplingDotCSR:
+                if not theano.config.blas.ldflags:
+                    continue
+                args = inputs[:2] + [a_val.data, a_val.indices,
+                                     a_val.indptr, inputs[2]]
+            elif op_class in (sparse.StructuredDotGradCSR,
+                              sparse.StructuredDotGradCSC):
+                args = [a_val.indices, a_val.indptr] + inputs
+            else:
+                args = [a_val.data, a_val.indices, a_val.indptr] + inputs
+            variables = [tensor.as_tensor_variable(arg).type()
+                         for arg in args]
+            outs = []
+            # With small buffers, the csc products compute the columns of
+            # the output in several passes.
+            for openmp, buffer_size in [(False, orig_buffer_size),
+                                        (True, orig_buffer_size),
+                                        (True, 40)]:
+                theano.config.openmp_sparse_buffer_size = buffer_size
+                if op_class is sparse.opt.UsmmCscDense:
+                    op = op_class(inplace=False, openmp=openmp)
+                else:
+                    op = op_class(openmp=openmp)
+                f = theano.function(variables, op(*variables))
+                outs.append(f(*args))
+            for outs_openmp in outs[1:]:
+                for out, out_openmp in zip(outs[0], outs_openmp):
+                    utt.assert_allclose(out, out_openmp)
+    finally:
+        theano.config.openmp_sparse_minsize = orig_minsize
+        theano.config.openmp_sparse_buffer_size = orig_buffer_size
+
+
 def test_local_dense_from_sparse_sparse_from_dense():
     mode = theano.compile.mode.get_default_mode()
     mode = mode.including("local_dense_from_sparse_sparse_from_dense")
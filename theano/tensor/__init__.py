@@ -40,7 +40,7 @@ from theano.gradient import Rop, Lop, grad, numeric_grad, verify_grad, \
 from theano.tensor.sort import sort, argsort
 from theano.tensor.extra_ops import (DiffOp, bincount, squeeze,
                        repeat, bartlett, fill_diagonal, fill_diagonal_offset,
-                       cumsum, cumprod)
+                       cumsum, cumprod, merge_duplicate_rows)
 
 # SpecifyShape is defined in theano.compile, but should be available in tensor
 from theano.compile import SpecifyShape, specify_shape
@@ -2108,6 +2108,63 @@ class Nonzero(gof.Op):
 
         out[0] = result.astype('int64')
 
+    def c_code(self, node, name, inp, out_, sub):
+        if node.inputs[0].dtype in complex_dtypes:
+            raise NotImplementedError()
+        a, = inp
+        out, = out_
+        fail = sub['fail']
+        return """
+        {
+        npy_intp count = PyArray_CountNonzero(%(a)s);
+        npy_intp dims[2];
+        if (count < 0) {
+            %(fail)s;
+        }
+        dims[0] = PyArray_NDIM(%(a)s);
+        dims[1] = count;
+        if (%(out)s == NULL ||
+                !PyArray_CompareLists(PyArray_DIMS(%(out)s), dims, 2) ||
+                !PyArray_ISCONTIGUOUS(%(out)s)) {
+            Py_XDECREF(%(out)s);
+            %(out)s = (PyArrayObject*)PyArray_EMPTY(2, dims, NPY_INT64, 0);
+            if (%(out)s == NULL) {
+                %(fail)s;
+            }
+        }
+        if (count > 0) {
+            // Visit the elements in C order, like numpy.
+            const int nd = PyArray_NDIM(%(a)s);
+            const npy_intp size = PyArray_SIZE(%(a)s);
+            npy_intp coord[NPY_MAXDIMS];
+            npy_int64* o = (npy_int64*)PyArray_DATA(%(out)s);
+            npy_intp j = 0;
+            memset(coord, 0, sizeof(coord));
+            for (npy_intp f = 0; f < size; f++) {
+                char* ptr = PyArray_BYTES(%(a)s);
+                for (int d = 0; d < nd; d++) {
+                    ptr += coord[d] * PyArray_STRIDES(%(a)s)[d];
+                }
+                if (((dtype_%(a)s*)ptr)[0] != 0) {
+                    for (int d = 0; d < nd; d++) {
+                        o[d * count + j] = coord[d];
+                    }
+                    j++;
+                }
+                for (int d = nd - 1; d >= 0; d--) {
+                    if (++coord[d] < PyArray_DIMS(%(a)s)[d]) {
+                        break;
+                    }
+                    coord[d] = 0;
+                }
+            }
+        }
+        }
+        """ % locals()
+
+    def c_code_cache_version(self):
+        return (1,)
+
     def grad(self, inp, grads):
         return [grad_undefined(self, 0, inp[0])]
 
@@ -2224,6 +2281,71 @@ def nonzero_values(a):
     return a.flatten()[flatnonzero(a)]
 
 
+def _tri_eye_c_code(op, node, inp, out_, sub, cond):
+    """C code of Tri and Eye: element (i, j) is 1 if `cond`, 0 otherwise."""
+    if op.dtype in complex_dtypes:
+        raise NotImplementedError()
+    n, m, k = inp
+    out, = out_
+    fail = sub['fail']
+    typenum = node.outputs[0].type.dtype_specs()[2]
+    return """
+    {
+    npy_intp dims[2];
+    npy_intp k = ((dtype_%(k)s*)PyArray_DATA(%(k)s))[0];
+    dims[0] = ((dtype_%(n)s*)PyArray_DATA(%(n)s))[0];
+    dims[1] = ((dtype_%(m)s*)PyArray_DATA(%(m)s))[0];
+    if (dims[0] < 0 || dims[1] < 0) {
+        PyErr_SetString(PyExc_ValueError, "negative dimensions are not"
+                        " allowed");
+        %(fail)s;
+    }
+    if (%(out)s == NULL ||
+            !PyArray_CompareLists(PyArray_DIMS(%(out)s), dims, 2) ||
+            !PyArray_ISCONTIGUOUS(%(out)s)) {
+        Py_XDECREF(%(out)s);
+        %(out)s = (PyArrayObject*)PyArray_EMPTY(2, dims,
+                                                %(typenum)s, 0);
+        if (%(out)s == NULL) {
+            %(fail)s;
+        }
+    }
+    dtype_%(out)s* o = (dtype_%(out)s*)PyArray_DATA(%(out)s);
+    for (npy_intp i = 0; i < dims[0]; i++) {
+        for (npy_intp j = 0; j < dims[1]; j++) {
+            o[i * dims[1] + j] = (%(cond)s) ? 1 : 0;
+        }
+    }
+    }
+    """ % locals()
+
+
+def _tri_eye_make_thunk(op, node, storage_map, compute_map, no_recycling):
+    """Thunk of Tri and Eye that calls perform when M is None.
+
+    Like numpy.tri and numpy.eye, the ops accept None as the number of
+    columns at run time, which the C code can not receive.
+
+    """
+    thunk = gof.Op.make_thunk(op, node, storage_map, compute_map,
+                              no_recycling)
+    if not hasattr(thunk, 'cthunk'):
+        return thunk
+    input_storage = [storage_map[r] for r in node.inputs]
+    output_storage = [storage_map[r] for r in node.outputs]
+
+    def rval():
+        if input_storage[1][0] is not None:
+            return thunk()
+        op.perform(node, [x[0] for x in input_storage], output_storage)
+        for o in node.outputs:
+            compute_map[o][0] = True
+    rval.inputs = input_storage
+    rval.outputs = output_storage
+    rval.lazy = False
+    return rval
+
+
 class Tri(gof.Op):
     def __init__(self, dtype=None):
         if dtype is None:
@@ -2244,6 +2366,16 @@ class Tri(gof.Op):
         out, = out_
         out[0] = numpy.tri(N, M, k, dtype=self.dtype)
 
+    def c_code(self, node, name, inp, out_, sub):
+        return _tri_eye_c_code(self, node, inp, out_, sub, 'j <= i + k')
+
+    def make_thunk(self, node, storage_map, compute_map, no_recycling):
+        return _tri_eye_make_thunk(self, node, storage_map, compute_map,
+                                   no_recycling)
+
+    def c_code_cache_version(self):
+        return (2,)
+
     def infer_shape(self, node, in_shapes):
         out_shape = [node.inputs[0], node.inputs[1]]
         return [out_shape]
@@ -2355,6 +2487,16 @@ class Eye(gof.Op):
         out, = out_
         out[0] = numpy.eye(n, m, k, dtype=self.dtype)
 
+    def c_code(self, node, name, inp, out_, sub):
+        return _tri_eye_c_code(self, node, inp, out_, sub, 'j == i + k')
+
+    def make_thunk(self, node, storage_map, compute_map, no_recycling):
+        return _tri_eye_make_thunk(self, node, storage_map, compute_map,
+                                   no_recycling)
+
+    def c_code_cache_version(self):
+        return (2,)
+
     def infer_shape(self, node, in_shapes):
         out_shape = [node.inputs[0], node.inputs[1]]
         return [out_shape]
@@ -2574,6 +2716,16 @@ class Alloc(gof.Op):
             return [None]
         return self(eval_points[0], *inputs[1:], **dict(return_list=True))
 
+    def batch_apply(self, inputs, batched):
+        if True in batched[1:]:
+            raise NotImplementedError()
+        v = inputs[0]
+        shape = inputs[1:]
+        # Alloc aligns the dimensions of v on the last ones of the shape.
+        v = v.dimshuffle([0] + ['x'] * (len(shape) - v.ndim + 1) +
+                         range(1, v.ndim))
+        return [self(v, v.shape[0], *shape)]
+
     def do_constant_folding(self, node):
         if not getattr(node.outputs[0], 'clients', []):
             # If there are no clients then there is no point doing constant
@@ -3180,6 +3332,14 @@ class Split(Op):
 
     def __init__(self, len_splits):
         self.len_splits = int(len_splits)
+        # The outputs are views of the input.
+        self.view_map = dict((i, [0]) for i in xrange(self.len_splits))
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        # Old pickled Split copied their outputs.
+        if 'view_map' not in d:
+            self.view_map = dict((i, [0]) for i in xrange(self.len_splits))
 
     def __eq__(self, other):
         return (type(self) == type(other) and
@@ -3247,9 +3407,85 @@ class Split(Op):
         for i in xrange(self.len_splits):
             upper_idx = lower_idx + splits[i]
             general_key[axis] = slice(lower_idx, upper_idx, None)
-            outputs[i][0] = x.__getitem__(tuple(general_key)).copy()
+            outputs[i][0] = x.__getitem__(tuple(general_key))
             lower_idx = upper_idx
 
+    def c_code(self, node, name, inputs, outputs, sub):
+        x, axis, splits = inputs
+        fail = sub['fail']
+        len_splits = self.len_splits
+        make_views = []
+        for i, out in enumerate(outputs):
+            make_views.append("""
+            dims[axis] = ((dtype_%(splits)s*)PyArray_GETPTR1(
+                %(splits)s, %(i)s))[0];
+            Py_XDECREF(%(out)s);
+            %(out)s = (PyArrayObject*)PyArray_New(
+                &PyArray_Type, ndim, dims, PyArray_TYPE(%(x)s),
+                PyArray_STRIDES(%(x)s),
+                PyArray_BYTES(%(x)s) + offset * PyArray_STRIDES(%(x)s)[axis],
+                PyArray_ITEMSIZE(%(x)s),
+                NPY_ARRAY_WRITEABLE * PyArray_ISWRITEABLE(%(x)s), NULL);
+            if (%(out)s == NULL) {
+                %(fail)s;
+            }
+            PyArray_UpdateFlags(%(out)s, NPY_ARRAY_UPDATE_ALL);
+            Py_INCREF(%(x)s);
+#if NPY_API_VERSION < 0x00000007
+            PyArray_BASE(%(out)s) = (PyObject*)%(x)s;
+#else
+            PyArray_SetBaseObject(%(out)s, (PyObject*)%(x)s);
+#endif
+            offset += dims[axis];
+            """ % locals())
+        make_views = ''.join(make_views)
+        return """
+        {
+        int ndim = PyArray_NDIM(%(x)s);
+        int axis = ((dtype_%(axis)s*)PyArray_DATA(%(axis)s))[0];
+        npy_intp dims[NPY_MAXDIMS];
+        npy_intp offset = 0, total = 0;
+        if (axis < 0) {
+            axis += ndim;
+        }
+        if (axis < 0 || axis >= ndim) {
+            PyErr_Format(PyExc_ValueError,
+                         "Split: invalid axis %%d for an input with %%d"
+                         " dimensions", axis, ndim);
+            %(fail)s;
+        }
+        if (PyArray_DIMS(%(splits)s)[0] != %(len_splits)s) {
+            PyErr_Format(PyExc_ValueError,
+                         "In Split, len(splits) (%%ld) != len_splits"
+                         " (%(len_splits)s)",
+                         (long)PyArray_DIMS(%(splits)s)[0]);
+            %(fail)s;
+        }
+        for (npy_intp i = 0; i < %(len_splits)s; i++) {
+            npy_intp nb = ((dtype_%(splits)s*)PyArray_GETPTR1(
+                %(splits)s, i))[0];
+            if (nb < 0) {
+                PyErr_SetString(PyExc_ValueError,
+                                "Split: you tried to make an ndarray with a"
+                                " negative number of elements.");
+                %(fail)s;
+            }
+            total += nb;
+        }
+        if (total != PyArray_DIMS(%(x)s)[axis]) {
+            PyErr_Format(PyExc_ValueError,
+                         "The splits sum to %%ld, expected %%ld",
+                         (long)total, (long)PyArray_DIMS(%(x)s)[axis]);
+            %(fail)s;
+        }
+        memcpy(dims, PyArray_DIMS(%(x)s), ndim * sizeof(npy_intp));
+        %(make_views)s
+        }
+        """ % locals()
+
+    def c_code_cache_version(self):
+        return (1,)
+
     def infer_shape(self, node, in_shapes):
         axis = node.inputs[1]
         splits = node.inputs[2]
@@ -3939,6 +4175,13 @@ class Reshape(Op):
             return [None]
         return self(eval_points[0], *inputs[1:], **dict(return_list=True))
 
+    def batch_apply(self, inputs, batched):
+        x, shp = inputs
+        if batched[1]:
+            raise NotImplementedError()
+        shp = join(0, x.shape[:1], shp)
+        return [Reshape(self.ndim + 1)(x, shp)]
+
     def infer_shape(self, node, ishapes):
         # inputs[1] can contain at most one value of '-1', meaning the actual
         # shape of the output will be automatically computed by reshape, so
@@ -4272,6 +4515,76 @@ class Tile(Op):
                 res = res.copy()
         out[0] = res
 
+    def c_code(self, node, name, inp, out_, sub):
+        # The C code copies x through views of shape (reps[0], shp[0],
+        # reps[1], shp[1], ...), with strides 0 on the reps dimensions of x.
+        if node.inputs[0].ndim != self.ndim or 2 * self.ndim > 32:
+            raise NotImplementedError()
+        x, reps = inp
+        out, = out_
+        fail = sub['fail']
+        ndim = self.ndim
+        return """
+        {
+        npy_intp dims[%(ndim)s + 1];
+        npy_intp dims2[2 * %(ndim)s + 1], x_strides[2 * %(ndim)s + 1];
+        npy_intp out_strides[2 * %(ndim)s + 1];
+        PyArrayObject *x_view, *out_view;
+        if (PyArray_DIMS(%(reps)s)[0] != %(ndim)s) {
+            PyErr_SetString(PyExc_ValueError,
+                            "Tile: len(reps) must be equal to ndim");
+            %(fail)s;
+        }
+        for (int d = 0; d < %(ndim)s; d++) {
+            npy_intp r = ((dtype_%(reps)s*)PyArray_GETPTR1(%(reps)s, d))[0];
+            if (r < 0) {
+                PyErr_SetString(PyExc_ValueError, "Tile: negative reps");
+                %(fail)s;
+            }
+            dims[d] = r * PyArray_DIMS(%(x)s)[d];
+            dims2[2 * d] = r;
+            dims2[2 * d + 1] = PyArray_DIMS(%(x)s)[d];
+            x_strides[2 * d] = 0;
+            x_strides[2 * d + 1] = PyArray_STRIDES(%(x)s)[d];
+        }
+        if (%(out)s == NULL ||
+                !PyArray_CompareLists(PyArray_DIMS(%(out)s), dims,
+                                      %(ndim)s) ||
+                !PyArray_ISCONTIGUOUS(%(out)s)) {
+            Py_XDECREF(%(out)s);
+            %(out)s = (PyArrayObject*)PyArray_EMPTY(%(ndim)s, dims,
+                                                    PyArray_TYPE(%(x)s), 0);
+            if (%(out)s == NULL) {
+                %(fail)s;
+            }
+        }
+        for (int d = 0; d < %(ndim)s; d++) {
+            out_strides[2 * d + 1] = PyArray_STRIDES(%(out)s)[d];
+            out_strides[2 * d] = (PyArray_STRIDES(%(out)s)[d] *
+                                  PyArray_DIMS(%(x)s)[d]);
+        }
+        x_view = (PyArrayObject*)PyArray_New(
+            &PyArray_Type, 2 * %(ndim)s, dims2, PyArray_TYPE(%(x)s),
+            x_strides, PyArray_DATA(%(x)s), PyArray_ITEMSIZE(%(x)s), 0,
+            NULL);
+        out_view = (PyArrayObject*)PyArray_New(
+            &PyArray_Type, 2 * %(ndim)s, dims2, PyArray_TYPE(%(out)s),
+            out_strides, PyArray_DATA(%(out)s), PyArray_ITEMSIZE(%(out)s),
+            NPY_ARRAY_WRITEABLE, NULL);
+        if (x_view == NULL || out_view == NULL ||
+                PyArray_CopyInto(out_view, x_view) != 0) {
+            Py_XDECREF(x_view);
+            Py_XDECREF(out_view);
+            %(fail)s;
+        }
+        Py_DECREF(x_view);
+        Py_DECREF(out_view);
+        }
+        """ % locals()
+
+    def c_code_cache_version(self):
+        return (1,)
+
     def infer_shape(self, node, in_shapes):
         # Note: in contrast with numpy, it is assumed that x.shape and reps
         # have equal length;  see also tile function below
@@ -4411,6 +4724,41 @@ class ARange(Op):
         step = step.item()
         out[0] = numpy.arange(start, stop, step, dtype=self.dtype)
 
+    def c_code(self, node, name, inp, out_, sub):
+        start, stop, step = inp
+        out, = out_
+        fail = sub['fail']
+        typenum = node.outputs[0].type.dtype_specs()[2]
+        return """
+        {
+        // Like perform, use Python scalars so that the length is computed
+        // like numpy.arange does.
+        PyObject* py_start = PyArray_GETITEM(%(start)s,
+                                             PyArray_BYTES(%(start)s));
+        PyObject* py_stop = PyArray_GETITEM(%(stop)s,
+                                            PyArray_BYTES(%(stop)s));
+        PyObject* py_step = PyArray_GETITEM(%(step)s,
+                                            PyArray_BYTES(%(step)s));
+        PyArray_Descr* descr = PyArray_DescrFromType(%(typenum)s);
+        PyObject* rval = NULL;
+        if (py_start && py_stop && py_step && descr) {
+            rval = PyArray_ArangeObj(py_start, py_stop, py_step, descr);
+        }
+        Py_XDECREF(py_start);
+        Py_XDECREF(py_stop);
+        Py_XDECREF(py_step);
+        Py_XDECREF(descr);
+        if (rval == NULL) {
+            %(fail)s;
+        }
+        Py_XDECREF(%(out)s);
+        %(out)s = (PyArrayObject*)rval;
+        }
+        """ % locals()
+
+    def c_code_cache_version(self):
+        return (1,)
+
     def connection_pattern(self, node):
 
         return [[True], [False], [True]]
@@ -4863,6 +5211,22 @@ class Dot(Op):
         else:
             return [t2]
 
+    def batch_apply(self, inputs, batched):
+        x, y = inputs
+        if batched[0] and batched[1]:
+            raise NotImplementedError()
+        if batched[0]:
+            # Each x[i] is multiplied by y.
+            return [dot(x, y)]
+        if y.ndim == 2:
+            # y is a batch of vectors.
+            return [dot(y, x.T)]
+        # y is a batch of matrices.
+        rval = tensordot(x, y, [[x.ndim - 1], [1]])
+        if x.ndim == 2:
+            rval = rval.dimshuffle(1, 0, 2)
+        return [rval]
+
     def infer_shape(self, node, shapes):
         xshp, yshp = shapes
         x, y = node.inputs
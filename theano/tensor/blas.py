@@ -146,6 +146,7 @@ from theano.gof import (utils, Op, view_roots,
                         EquilibriumOptimizer, Apply,
                         ReplacementDidntRemovedError)
 from theano.gof.cmodule import GCC_compiler
+from theano.misc import probe_cache
 from theano.printing import pprint, FunctionPrinter, debugprint
 from theano.compile.mode import optdb
 import theano.scalar
@@ -171,8 +172,15 @@ def default_blas_ldflags():
     case the software change. This also enables the test for all
     cases.
 
+    The result of the test is cached, see theano.misc.probe_cache.
+
     """
     flags = static_default_blas_flags()
+    key = [flags, probe_cache.file_key(config.cxx)]
+    cached = probe_cache.get('blas_ldflags', key)
+    if cached is not None:
+        yield cached
+        return
     yield flags
 
     # Now test it!
@@ -182,7 +190,9 @@ def default_blas_ldflags():
                         profile=False)
     except Exception as e:
         print(e)
-        yield ""
+        flags = ""
+        yield flags
+    probe_cache.put('blas_ldflags', flags, key)
 
 
 def static_default_blas_flags():
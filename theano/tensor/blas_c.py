@@ -1,6 +1,7 @@
 import numpy
 
 from theano import config
+from theano.configparser import thread_local_config
 
 from theano.tensor.opt import in2out
 from theano.tensor.blas import ldflags, blas_header_text, blas_header_version
@@ -719,11 +720,8 @@ def check_force_gemv_init():
         beta*aa which will result in NaN's in the result, then we need intialize
         the memory to zeros.
         """
-        tv = theano.config.compute_test_value
-        tvo = theano.config.compute_test_value_opt
-        theano.config.compute_test_value = 'off'
-        theano.config.compute_test_value_opt = 'off'
-        try:
+        with thread_local_config({'compute_test_value': 'off',
+                                  'compute_test_value_opt': 'off'}):
             aa = T.vector('aa')
             yy = T.vector('yy')
             xx = T.matrix('xx')
@@ -732,9 +730,6 @@ def check_force_gemv_init():
                 gemv_no_inplace(aa, 1., xx, yy, 0.),
                 theano.compile.Mode(optimizer='fast_compile')
                 )
-        finally:
-            theano.config.compute_test_value = tv
-            theano.config.compute_test_value_opt = tvo
 
         # Here we introduce NaNs into the data, if they are returned by the BLAS
         # then we want gemv_c_code to initiliaze the memory to 0 so that we
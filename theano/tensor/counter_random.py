@@ -0,0 +1,1265 @@
+"""Define counter-based random number Op (`CounterRandomFunction`) and
+streams (`CounterRandomStreams`).
+
+The state of a counter-based generator is a key, that identifies the
+stream, and a counter, that is incremented by each call. The random bits
+are a pure function of the key and the counter (Philox4x32-10, from Salmon
+et al., "Parallel Random Numbers: As Easy as 1, 2, 3", SC 2011). So, unlike
+the numpy RandomState used by `raw_random.RandomFunction`:
+
+* the state is a plain uint32 vector of 4 elements: the 2 words of the key
+  followed by the 2 words of the counter. Copying it is free, and the Op
+  updates it inplace once the inplace optimization ran;
+* every sampler has a C implementation, so there is no Python overhead
+  for small draws, like in the inner function of a scan;
+* each element of the output is drawn from its own sub-stream, so the
+  result does not depend on the order in which the elements are computed.
+"""
+__docformat__ = "restructuredtext en"
+
+import math
+
+import numpy
+
+import theano
+from theano import gof, tensor
+from theano.compile import optdb
+from theano.compile.sharedvalue import shared
+from theano.tensor import opt
+from theano.tensor.raw_random import _infer_ndim_bcast
+
+STATE_SIZE = 4
+
+_MASK32 = numpy.uint64(0xFFFFFFFF)
+_SHIFT32 = numpy.uint64(32)
+_PHILOX_M0 = numpy.uint64(0xD2511F53)
+_PHILOX_M1 = numpy.uint64(0xCD9E8D57)
+_PHILOX_W0 = numpy.uint64(0x9E3779B9)
+_PHILOX_W1 = numpy.uint64(0xBB67AE85)
+
+
+def philox4x32(ctr, key, rounds=10):
+    """Return the 4 words of the Philox4x32 block of counter `ctr` and key
+    `key`.
+
+    :param ctr: 4 uint32 values or arrays of the same shape
+    :param key: 2 uint32 values or arrays broadcastable to `ctr`
+
+    :returns: a list of 4 uint64 arrays holding 32-bit words
+    """
+    c0, c1, c2, c3 = [numpy.atleast_1d(numpy.asarray(c, dtype='uint64'))
+                      for c in ctr]
+    k0, k1 = [numpy.atleast_1d(numpy.asarray(k, dtype='uint64'))
+              for k in key]
+    for r in xrange(rounds):
+        if r:
+            k0 = (k0 + _PHILOX_W0) & _MASK32
+            k1 = (k1 + _PHILOX_W1) & _MASK32
+        p0 = c0 * _PHILOX_M0
+        p1 = c2 * _PHILOX_M1
+        c0, c1, c2, c3 = ((p1 >> _SHIFT32) ^ c1 ^ k0, p1 & _MASK32,
+                          (p0 >> _SHIFT32) ^ c3 ^ k1, p0 & _MASK32)
+    return [c0, c1, c2, c3]
+
+
+def seed_state(seed):
+    """Return the state of a new stream, with key `seed` and counter 0."""
+    seed = int(seed)
+    if seed < 0 or seed >= 2 ** 64:
+        raise ValueError('seed must be in [0, 2**64)', seed)
+    return numpy.asarray([seed & 0xFFFFFFFF, seed >> 32, 0, 0],
+                         dtype='uint32')
+
+
+def _next_state(state):
+    """Return `state` with its 64-bit counter incremented."""
+    ctr = (int(state[2]) | (int(state[3]) << 32)) + 1
+    return numpy.asarray([state[0], state[1], ctr & 0xFFFFFFFF,
+                          (ctr >> 32) & 0xFFFFFFFF], dtype='uint32')
+
+
+def _element_blocks(state, n_elements, draw=0):
+    """Return the words of block `draw` of the sub-streams of the first
+    `n_elements` elements."""
+    elements = numpy.arange(n_elements, dtype='uint64')
+    return philox4x32((elements, numpy.zeros_like(elements) + draw,
+                       numpy.zeros_like(elements) + state[2],
+                       numpy.zeros_like(elements) + state[3]),
+                      (state[0], state[1]))
+
+
+def _uniform01(w0, w1):
+    """Uniform float64 in [0, 1) from 53 bits of the words w0 and w1.
+    Like theano_philox_double in the C code."""
+    return (((w0 >> numpy.uint64(5)).astype('float64') * 67108864.0 +
+             (w1 >> numpy.uint64(6)).astype('float64')) *
+            (1.0 / 9007199254740992.0))
+
+
+class _PhiloxStream(object):
+    """The sub-stream of 32-bit words of one element of the output.
+
+    This mirrors the theano_philox_stream of the C code, so perform draws
+    the same numbers as the C implementation.
+    """
+    n_blocks = 8
+
+    def __init__(self, state, element):
+        self.state = state
+        self.element = element
+        self.draw = 0
+        self.words = []
+        self.pos = 0
+
+    def next_word(self):
+        if self.pos == len(self.words):
+            draws = numpy.arange(self.draw, self.draw + self.n_blocks,
+                                 dtype='uint64')
+            w = philox4x32((numpy.zeros_like(draws) + self.element, draws,
+                            numpy.zeros_like(draws) + self.state[2],
+                            numpy.zeros_like(draws) + self.state[3]),
+                           (self.state[0], self.state[1]))
+            self.words = [int(x) for x in numpy.asarray(w).T.ravel()]
+            self.draw += self.n_blocks
+            self.pos = 0
+        self.pos += 1
+        return self.words[self.pos - 1]
+
+    def uniform(self):
+        a = self.next_word() >> 5
+        b = self.next_word() >> 6
+        return (a * 67108864.0 + b) * (1.0 / 9007199254740992.0)
+
+    def below(self, m):
+        """Uniform integer in [0, m), m < 2**32 (Lemire's method)."""
+        prod = self.next_word() * m
+        low = prod & 0xFFFFFFFF
+        if low < m:
+            t = (2 ** 32 - m) % m
+            while low < t:
+                prod = self.next_word() * m
+                low = prod & 0xFFFFFFFF
+        return prod >> 32
+
+    def binomial(self, n, p):
+        """Like theano_philox_binomial in the C code."""
+        pp = p if p <= 0.5 else 1.0 - p
+        if n <= 0 or pp <= 0:
+            x = 0
+        elif n * pp < 30.0:
+            x = self._binomial_inversion(n, pp)
+        else:
+            x = self._binomial_btpe(n, pp)
+        if p <= 0.5:
+            return x
+        return n - x
+
+    def _binomial_inversion(self, n, p):
+        """Like theano_philox_binomial_inversion in the C code."""
+        q = 1.0 - p
+        qn = math.pow(q, float(n))
+        r = p / q
+        g = r * (n + 1)
+        bound = n * p + 10.0 * math.sqrt(n * p * q + 1.0)
+        if bound > n:
+            bound = float(n)
+        while True:
+            u = self.uniform()
+            f = qn
+            x = 0
+            while u > f:
+                u -= f
+                x += 1
+                if x > bound:
+                    break
+                f *= g / x - r
+            if x <= bound:
+                return x
+
+    def _binomial_btpe(self, n, p):
+        """Like theano_philox_binomial_btpe in the C code."""
+        q = 1.0 - p
+        fm = n * p + p
+        m = int(math.floor(fm))
+        nrq = n * p * q
+        p1 = math.floor(2.195 * math.sqrt(nrq) - 4.6 * q) + 0.5
+        xm = m + 0.5
+        xl = xm - p1
+        xr = xm + p1
+        c = 0.134 + 20.5 / (15.3 + m)
+        a = (fm - xl) / (fm - xl * p)
+        laml = a * (1.0 + a / 2.0)
+        a = (xr - fm) / (xr * q)
+        lamr = a * (1.0 + a / 2.0)
+        p2 = p1 * (1.0 + 2.0 * c)
+        p3 = p2 + c / laml
+        p4 = p3 + c / lamr
+        while True:
+            u = self.uniform() * p4
+            v = self.uniform()
+            if u <= p1:
+                # Triangular region, always accepted.
+                return int(math.floor(xm - p1 * v + u))
+            if u <= p2:
+                # Parallelograms.
+                x = xl + (u - p1) / c
+                v = v * c + 1.0 - math.fabs(m - x + 0.5) / p1
+                if v > 1.0:
+                    continue
+                y = int(math.floor(x))
+            elif u <= p3:
+                # Left exponential tail.
+                y = int(math.floor(xl + math.log(v) / laml))
+                if y < 0:
+                    continue
+                v = v * (u - p2) * laml
+            else:
+                # Right exponential tail.
+                y = int(math.floor(xr - math.log(v) / lamr))
+                if y > n:
+                    continue
+                v = v * (u - p3) * lamr
+            k = abs(y - m)
+            if k <= 20 or k >= nrq / 2.0 - 1:
+                # Evaluate f(y) / f(m) recursively.
+                s = p / q
+                a = s * (n + 1)
+                f = 1.0
+                if m < y:
+                    for i in xrange(m + 1, y + 1):
+                        f *= a / i - s
+                elif m > y:
+                    for i in xrange(y + 1, m + 1):
+                        f /= a / i - s
+                if v <= f:
+                    return y
+                continue
+            # Squeeze using upper and lower bounds on log(f(y) / f(m)).
+            rho = (k / nrq) * ((k * (k / 3.0 + 0.625) + 0.16666666666666666) /
+                               nrq + 0.5)
+            t = -float(k) * k / (2.0 * nrq)
+            alv = math.log(v)
+            if alv < t - rho:
+                return y
+            if alv > t + rho:
+                continue
+            # Final acceptance test with Stirling's formula.
+            x1 = y + 1.0
+            f1 = m + 1.0
+            z = n + 1.0 - m
+            w = n - y + 1.0
+            if alv <= (xm * math.log(f1 / x1) +
+                       (n - m + 0.5) * math.log(z / w) +
+                       (y - m) * math.log(w * p / (x1 * q)) +
+                       _stirling_correction(f1) +
+                       _stirling_correction(z) +
+                       _stirling_correction(x1) +
+                       _stirling_correction(w)):
+                return y
+
+
+def _stirling_correction(x):
+    """Like theano_stirling_correction in the C code."""
+    x2 = x * x
+    return (13680.0 - (462.0 - (132.0 - (99.0 - 140.0 / x2) / x2) / x2) /
+            x2) / x / 166320.0
+
+
+# The C version of the functions above.
+_philox_c_support_code = """
+#ifndef THEANO_PHILOX_SUPPORT
+#define THEANO_PHILOX_SUPPORT
+// The Python version must get the same results: do not let the compiler
+// fuse multiplications and additions.
+#if defined(__clang__)
+#pragma STDC FP_CONTRACT OFF
+#elif defined(__GNUC__)
+#pragma GCC push_options
+#pragma GCC optimize ("fp-contract=off")
+#endif
+typedef struct {
+    npy_uint32 ctr[4];
+    npy_uint32 key[2];
+    npy_uint32 words[4];
+    int pos;
+} theano_philox_stream;
+
+static void theano_philox4x32(const npy_uint32 ctr[4],
+                              const npy_uint32 key[2], npy_uint32 out[4])
+{
+    npy_uint32 c0 = ctr[0], c1 = ctr[1], c2 = ctr[2], c3 = ctr[3];
+    npy_uint32 k0 = key[0], k1 = key[1];
+    for (int r = 0; r < 10; ++r)
+    {
+        if (r)
+        {
+            k0 += 0x9E3779B9U;
+            k1 += 0xBB67AE85U;
+        }
+        npy_uint64 p0 = (npy_uint64)c0 * 0xD2511F53U;
+        npy_uint64 p1 = (npy_uint64)c2 * 0xCD9E8D57U;
+        c0 = (npy_uint32)(p1 >> 32) ^ c1 ^ k0;
+        c1 = (npy_uint32)p1;
+        c2 = (npy_uint32)(p0 >> 32) ^ c3 ^ k1;
+        c3 = (npy_uint32)p0;
+    }
+    out[0] = c0;
+    out[1] = c1;
+    out[2] = c2;
+    out[3] = c3;
+}
+
+// The outputs have less than 2**32 elements (this is checked in c_code),
+// so the index of the element fits in the first word of the counter.
+static void theano_philox_init(theano_philox_stream *s,
+                               const npy_uint32 state[4], npy_intp element)
+{
+    s->ctr[0] = (npy_uint32)element;
+    s->ctr[1] = 0;
+    s->ctr[2] = state[2];
+    s->ctr[3] = state[3];
+    s->key[0] = state[0];
+    s->key[1] = state[1];
+    s->pos = 4;
+}
+
+static npy_uint32 theano_philox_next(theano_philox_stream *s)
+{
+    if (s->pos == 4)
+    {
+        theano_philox4x32(s->ctr, s->key, s->words);
+        s->ctr[1] += 1;
+        s->pos = 0;
+    }
+    return s->words[s->pos++];
+}
+
+static double theano_philox_double(theano_philox_stream *s)
+{
+    npy_uint32 a = theano_philox_next(s) >> 5;
+    npy_uint32 b = theano_philox_next(s) >> 6;
+    return (a * 67108864.0 + b) * (1.0 / 9007199254740992.0);
+}
+
+static float theano_philox_float(theano_philox_stream *s)
+{
+    return (float)(theano_philox_next(s) >> 8) * (1.0f / 16777216.0f);
+}
+
+static npy_uint32 theano_philox_below(theano_philox_stream *s, npy_uint32 m)
+{
+    npy_uint64 prod = (npy_uint64)theano_philox_next(s) * m;
+    npy_uint32 low = (npy_uint32)prod;
+    if (low < m)
+    {
+        npy_uint32 t = (npy_uint32)(0x100000000ULL - m) % m;
+        while (low < t)
+        {
+            prod = (npy_uint64)theano_philox_next(s) * m;
+            low = (npy_uint32)prod;
+        }
+    }
+    return (npy_uint32)(prod >> 32);
+}
+
+// Inversion (BINV) when the mean is small, BTPE otherwise (both from
+// Kachitvichyanukul and Schmeiser, 1988).
+static npy_int64 theano_philox_binomial_inversion(theano_philox_stream *s,
+                                                  npy_int64 n, double p)
+{
+    double q = 1.0 - p;
+    double qn = pow(q, (double)n);
+    double r = p / q;
+    double g = r * (n + 1);
+    double bound = n * p + 10.0 * sqrt(n * p * q + 1.0);
+    if (bound > n)
+        bound = (double)n;
+    for (;;)
+    {
+        double u = theano_philox_double(s);
+        double f = qn;
+        npy_int64 x = 0;
+        while (u > f)
+        {
+            u -= f;
+            ++x;
+            if (x > bound)
+                break;
+            f *= g / x - r;
+        }
+        if (x <= bound)
+            return x;
+    }
+}
+
+static double theano_stirling_correction(double x)
+{
+    double x2 = x * x;
+    return (13680.0 - (462.0 - (132.0 - (99.0 - 140.0 / x2) / x2) / x2) /
+            x2) / x / 166320.0;
+}
+
+static npy_int64 theano_philox_binomial_btpe(theano_philox_stream *s,
+                                             npy_int64 n, double p)
+{
+    double q = 1.0 - p;
+    double fm = n * p + p;
+    npy_int64 m = (npy_int64)floor(fm);
+    double nrq = n * p * q;
+    double p1 = floor(2.195 * sqrt(nrq) - 4.6 * q) + 0.5;
+    double xm = m + 0.5;
+    double xl = xm - p1;
+    double xr = xm + p1;
+    double c = 0.134 + 20.5 / (15.3 + m);
+    double a = (fm - xl) / (fm - xl * p);
+    double laml = a * (1.0 + a / 2.0);
+    a = (xr - fm) / (xr * q);
+    double lamr = a * (1.0 + a / 2.0);
+    double p2 = p1 * (1.0 + 2.0 * c);
+    double p3 = p2 + c / laml;
+    double p4 = p3 + c / lamr;
+    for (;;)
+    {
+        double u = theano_philox_double(s) * p4;
+        double v = theano_philox_double(s);
+        npy_int64 y;
+        if (u <= p1)
+        {
+            // Triangular region, always accepted.
+            return (npy_int64)floor(xm - p1 * v + u);
+        }
+        if (u <= p2)
+        {
+            // Parallelograms.
+            double x = xl + (u - p1) / c;
+            v = v * c + 1.0 - fabs(m - x + 0.5) / p1;
+            if (v > 1.0)
+                continue;
+            y = (npy_int64)floor(x);
+        }
+        else if (u <= p3)
+        {
+            // Left exponential tail.
+            y = (npy_int64)floor(xl + log(v) / laml);
+            if (y < 0)
+                continue;
+            v = v * (u - p2) * laml;
+        }
+        else
+        {
+            // Right exponential tail.
+            y = (npy_int64)floor(xr - log(v) / lamr);
+            if (y > n)
+                continue;
+            v = v * (u - p3) * lamr;
+        }
+        npy_int64 k = y > m ? y - m : m - y;
+        if (k <= 20 || k >= nrq / 2.0 - 1)
+        {
+            // Evaluate f(y) / f(m) recursively.
+            double sr = p / q;
+            double as = sr * (n + 1);
+            double f = 1.0;
+            if (m < y)
+            {
+                for (npy_int64 i = m + 1; i <= y; ++i)
+                    f *= as / i - sr;
+            }
+            else if (m > y)
+            {
+                for (npy_int64 i = y + 1; i <= m; ++i)
+                    f /= as / i - sr;
+            }
+            if (v <= f)
+                return y;
+            continue;
+        }
+        // Squeeze using upper and lower bounds on log(f(y) / f(m)).
+        double rho = (k / nrq) * ((k * (k / 3.0 + 0.625) +
+                                   0.16666666666666666) / nrq + 0.5);
+        double t = -(double)k * k / (2.0 * nrq);
+        double alv = log(v);
+        if (alv < t - rho)
+            return y;
+        if (alv > t + rho)
+            continue;
+        // Final acceptance test with Stirling's formula.
+        double x1 = y + 1.0;
+        double f1 = m + 1.0;
+        double z = n + 1.0 - m;
+        double w = n - y + 1.0;
+        if (alv <= (xm * log(f1 / x1) +
+                    (n - m + 0.5) * log(z / w) +
+                    (y - m) * log(w * p / (x1 * q)) +
+                    theano_stirling_correction(f1) +
+                    theano_stirling_correction(z) +
+                    theano_stirling_correction(x1) +
+                    theano_stirling_correction(w)))
+            return y;
+    }
+}
+
+static npy_int64 theano_philox_binomial(theano_philox_stream *s,
+                                        npy_int64 n, double p)
+{
+    double pp = p <= 0.5 ? p : 1.0 - p;
+    npy_int64 x;
+    if (n <= 0 || pp <= 0)
+        x = 0;
+    else if (n * pp < 30.0)
+        x = theano_philox_binomial_inversion(s, n, pp);
+    else
+        x = theano_philox_binomial_btpe(s, n, pp);
+    return p <= 0.5 ? x : n - x;
+}
+#if defined(__clang__)
+#pragma STDC FP_CONTRACT DEFAULT
+#elif defined(__GNUC__)
+#pragma GCC pop_options
+#endif
+#endif
+"""
+
+
+class CounterRandomFunction(gof.Op):
+    """Op that draws random numbers from a counter-based generator.
+
+    :param dist: one of 'uniform', 'normal', 'binomial', 'multinomial' and
+        'permutation'
+    :param outtype: the theano Type of the samples
+    :param inplace: update the state inplace
+
+    The inputs are the state, the shape of the output (not counting the
+    extra dimension of 'multinomial' and 'permutation') and the parameters
+    of the distribution: (low, high), (avg, std), (n, p), (n, pvals) and
+    (n,) respectively. Each parameter must be a scalar or have the shape
+    of the output, except pvals which is a vector or has the shape of the
+    output. The helper functions of this module take care of broadcasting.
+
+    The outputs are the new state and the samples. Element i of the samples
+    (row i for 'multinomial' and 'permutation') is computed from the blocks
+    (i, j, counter) of the generator, for j = 0, 1, ...
+    """
+    __props__ = ('dist', 'outtype', 'inplace')
+    n_params = {'uniform': 2, 'normal': 2, 'binomial': 2,
+                'multinomial': 2, 'permutation': 1}
+
+    def __init__(self, dist, outtype, inplace=False):
+        if dist not in self.n_params:
+            raise ValueError('Unknown distribution', dist)
+        if dist in ('uniform', 'normal'):
+            if outtype.dtype not in ('float32', 'float64'):
+                raise TypeError('%s samples must be float32 or float64' %
+                                dist, outtype.dtype)
+        elif outtype.dtype not in tensor.discrete_dtypes:
+            raise TypeError('%s samples must be integers' % dist,
+                            outtype.dtype)
+        self.dist = dist
+        self.outtype = outtype
+        self.inplace = inplace
+        if inplace:
+            self.destroy_map = {0: [0]}
+
+    @property
+    def ndim_added(self):
+        if self.dist in ('multinomial', 'permutation'):
+            return 1
+        return 0
+
+    def __str__(self):
+        if self.inplace:
+            return 'CounterRandomFunction{%s,inplace}' % self.dist
+        return 'CounterRandomFunction{%s}' % self.dist
+
+    def make_node(self, state, size, *params):
+        """
+        :param state: a uint32 vector holding the state of the generator
+        :param size: an integer vector, the shape of the samples without
+            the extra dimension of 'multinomial' and 'permutation'
+        :param params: the parameters of the distribution
+        """
+        state = tensor.as_tensor_variable(state)
+        if state.type.ndim != 1 or state.type.dtype != 'uint32':
+            raise TypeError('state must be a uint32 vector', state.type)
+        size = tensor.as_tensor_variable(size, ndim=1)
+        if size.type.dtype not in tensor.discrete_dtypes:
+            raise TypeError('size must be an integer vector', size.type)
+        params = [tensor.as_tensor_variable(p) for p in params]
+        if len(params) != self.n_params[self.dist]:
+            raise TypeError('%s takes %d parameters, got %d' %
+                            (self.dist, self.n_params[self.dist],
+                             len(params)))
+        ndim = self.outtype.ndim - self.ndim_added
+        if self.dist in ('binomial', 'multinomial', 'permutation'):
+            if params[0].type.dtype not in tensor.discrete_dtypes:
+                raise TypeError('n must be an integer', params[0].type)
+        for i, p in enumerate(params):
+            if self.dist == 'permutation':
+                allowed = (0,)
+            elif self.dist == 'multinomial' and i == 1:
+                allowed = (1, ndim + 1)
+            else:
+                allowed = (0, ndim)
+            if p.type.ndim not in allowed:
+                raise TypeError('parameter %d of %s must have %s '
+                                'dimensions, got %d' %
+                                (i, self.dist, ' or '.join(map(str, allowed)),
+                                 p.type.ndim))
+        return gof.Apply(self, [state, size] + params,
+                         [state.type(), self.outtype()])
+
+    def infer_shape(self, node, i_shapes):
+        size = node.inputs[1]
+        shp = [size[i] for i in xrange(self.outtype.ndim - self.ndim_added)]
+        if self.dist == 'multinomial':
+            shp.append(i_shapes[3][-1])
+        elif self.dist == 'permutation':
+            shp.append(tensor.cast(node.inputs[2], 'int64'))
+        return [i_shapes[0], shp]
+
+    def perform(self, node, inputs, out_):
+        rout, out = out_
+        state, size, params = inputs[0], inputs[1], inputs[2:]
+        if state.shape != (STATE_SIZE,):
+            raise ValueError('state must have %d elements' % STATE_SIZE,
+                             state.shape)
+        size = tuple(int(s) for s in size)
+        if len(size) != self.outtype.ndim - self.ndim_added:
+            raise ValueError('size must have length %d (not %d)' %
+                             (self.outtype.ndim - self.ndim_added,
+                              len(size)))
+        # Python ints, as numpy.prod could overflow.
+        n_elements = 1
+        for s in size:
+            n_elements *= s
+        if n_elements >= 2 ** 32:
+            raise ValueError('%s cannot draw more than 2**32 - 1 samples '
+                             'at once' % self.__class__.__name__)
+        for i, p in enumerate(params):
+            if (p.ndim > self._param_min_ndim(i) and
+                    p.shape[:len(size)] != size):
+                raise ValueError('parameter %d of %s has shape %s, which '
+                                 'does not match size %s' %
+                                 (i, self.dist, p.shape, size))
+        dtype = self.outtype.dtype
+        rval = getattr(self, '_perform_' + self.dist)(state, size,
+                                                      n_elements, params,
+                                                      dtype)
+        if self.inplace:
+            state[...] = _next_state(state)
+            rout[0] = state
+        else:
+            rout[0] = _next_state(state)
+        out[0] = numpy.asarray(rval, dtype=dtype)
+
+    def _param_min_ndim(self, i):
+        """Parameter i has one value per sample iff it has more dimensions
+        than this."""
+        if self.dist == 'multinomial' and i == 1:
+            return 1
+        return 0
+
+    @staticmethod
+    def _flat_params(params, dtype):
+        return [numpy.asarray(p, dtype=dtype).ravel() for p in params]
+
+    def _perform_uniform(self, state, size, n_elements, params, dtype):
+        low, high = self._flat_params(params, dtype)
+        w = _element_blocks(state, n_elements)
+        if dtype == 'float32':
+            u = ((w[0] >> numpy.uint64(8)).astype('float32') *
+                 numpy.float32(1.0 / 16777216.0))
+        else:
+            u = _uniform01(w[0], w[1])
+        return (low + (high - low) * u).reshape(size)
+
+    def _perform_normal(self, state, size, n_elements, params, dtype):
+        avg, std = self._flat_params(params, dtype)
+        w = _element_blocks(state, n_elements)
+        u1 = 1.0 - _uniform01(w[0], w[1])
+        u2 = _uniform01(w[2], w[3])
+        z = numpy.sqrt(-2.0 * numpy.log(u1)) * numpy.cos(
+            6.283185307179586 * u2)
+        return (avg + std * z.astype(dtype)).reshape(size)
+
+    def _perform_binomial(self, state, size, n_elements, params, dtype):
+        n = numpy.asarray(params[0], dtype='int64').ravel()
+        p = numpy.asarray(params[1], dtype='float64').ravel()
+        if (n < 0).any() or not ((p >= 0) & (p <= 1)).all():
+            raise ValueError('binomial needs n >= 0 and 0 <= p <= 1')
+        rval = numpy.empty(n_elements, dtype=dtype)
+        for e in xrange(n_elements):
+            rval[e] = _PhiloxStream(state, e).binomial(
+                int(n[e % n.size]), float(p[e % p.size]))
+        return rval.reshape(size)
+
+    def _perform_multinomial(self, state, size, n_elements, params, dtype):
+        n = numpy.asarray(params[0], dtype='int64').ravel()
+        pvals = numpy.asarray(params[1], dtype='float64')
+        n_classes = pvals.shape[-1]
+        pvals = pvals.reshape(-1, n_classes)
+        if (n < 0).any() or not (pvals >= 0).all():
+            raise ValueError('multinomial needs n >= 0 and pvals >= 0')
+        rval = numpy.empty((n_elements, n_classes), dtype=dtype)
+        for e in xrange(n_elements):
+            s = _PhiloxStream(state, e)
+            n_left = int(n[e % n.size])
+            pv = pvals[e % pvals.shape[0]]
+            mass = 0.0
+            for k in xrange(n_classes):
+                mass += pv[k]
+            for k in xrange(n_classes - 1):
+                pk = pv[k] / mass if mass > 0 else 0.0
+                if pk > 1.0:
+                    pk = 1.0
+                x = s.binomial(n_left, pk) if n_left > 0 else 0
+                rval[e, k] = x
+                n_left -= x
+                mass -= pv[k]
+            if n_classes > 0:
+                rval[e, n_classes - 1] = n_left
+        return rval.reshape(size + (n_classes,))
+
+    def _perform_permutation(self, state, size, n_elements, params, dtype):
+        n = int(params[0])
+        if n < 0 or n >= 2 ** 32:
+            raise ValueError('permutation needs 0 <= n < 2**32', n)
+        rval = numpy.empty((n_elements, n), dtype=dtype)
+        for e in xrange(n_elements):
+            s = _PhiloxStream(state, e)
+            row = range(n)
+            for i in xrange(n - 1, 0, -1):
+                j = s.below(i + 1)
+                row[i], row[j] = row[j], row[i]
+            rval[e] = row
+        return rval.reshape(size + (n,))
+
+    def grad(self, inputs, outputs):
+        return [theano.gradient.grad_undefined(
+                    self, k, inp,
+                    'No gradient defined through random sampling op')
+                for k, inp in enumerate(inputs)]
+
+    def R_op(self, inputs, eval_points):
+        return [None for i in eval_points]
+
+    def c_headers(self):
+        return ['<math.h>']
+
+    def c_support_code(self):
+        return _philox_c_support_code
+
+    def c_code(self, node, name, inp, out, sub):
+        state, size = inp[:2]
+        params = inp[2:]
+        o_state, o_sample = out
+        fail = sub['fail']
+        dist = self.dist
+        ndim = self.outtype.ndim - self.ndim_added
+        nd_out = self.outtype.ndim
+        otype = node.outputs[1].type.dtype_specs()[1]
+        o_type_num = node.outputs[1].type.dtype_specs()[2]
+        n_params = len(params)
+        inplace = int(self.inplace)
+        if self.outtype.dtype == 'float32':
+            uniform01 = 'theano_philox_float'
+        else:
+            uniform01 = 'theano_philox_double'
+
+        # The parameters are converted to contiguous arrays of double,
+        # except n which is converted to int64. p<i> points to their data
+        # and s<i> is 0 for scalars and 1 for one value per sample.
+        decls = []
+        convert = []
+        for i, p in enumerate(params):
+            if i == 0 and dist in ('binomial', 'multinomial', 'permutation'):
+                ptype, ptype_num = 'npy_int64', 'NPY_INT64'
+            else:
+                ptype, ptype_num = 'double', 'NPY_FLOAT64'
+            min_nd = self._param_min_ndim(i)
+            decls.append('%(ptype)s *p%(i)d = NULL; npy_intp s%(i)d = 0;'
+                         % locals())
+            convert.append("""
+            params[%(i)d] = (PyArrayObject*)PyArray_FROMANY(
+                (PyObject*)%(p)s, %(ptype_num)s, 0, 0, NPY_ARRAY_IN_ARRAY);
+            if (!params[%(i)d])
+            {
+                err = 1;
+            }
+            else if (PyArray_NDIM(params[%(i)d]) > %(min_nd)s)
+            {
+                p%(i)d = (%(ptype)s*)PyArray_DATA(params[%(i)d]);
+                s%(i)d = 1;
+                for (int d = 0; d < %(ndim)s; ++d)
+                {
+                    if (!err && PyArray_DIMS(params[%(i)d])[d] != odims[d])
+                    {
+                        PyErr_SetString(PyExc_ValueError,
+                            "parameter %(i)d of %(dist)s does not match the"
+                            " shape of the samples");
+                        err = 1;
+                    }
+                }
+            }
+            else
+            {
+                p%(i)d = (%(ptype)s*)PyArray_DATA(params[%(i)d]);
+            }
+            """ % locals())
+        decls = '\n'.join(decls)
+        convert = ''.join(convert)
+
+        extra_dim = ''
+        if dist == 'multinomial':
+            extra_dim = """
+            odims[%(ndim)s] = PyArray_DIMS(params[1])[
+                PyArray_NDIM(params[1]) - 1];
+            """ % locals()
+        elif dist == 'permutation':
+            extra_dim = """
+            if (p0[0] < 0 || p0[0] > 0xFFFFFFFFLL)
+            {
+                PyErr_SetString(PyExc_ValueError,
+                                "permutation needs 0 <= n < 2**32");
+                err = 1;
+            }
+            odims[%(ndim)s] = p0[0];
+            """ % locals()
+
+        body = {
+            'uniform': """
+            for (npy_intp e = 0; e < n_elements; ++e)
+            {
+                theano_philox_stream s;
+                theano_philox_init(&s, st, e);
+                %(otype)s u = %(uniform01)s(&s);
+                %(otype)s low = p0[e * s0];
+                %(otype)s high = p1[e * s1];
+                out[e] = low + (high - low) * u;
+            }
+            """,
+            'normal': """
+            for (npy_intp e = 0; e < n_elements; ++e)
+            {
+                theano_philox_stream s;
+                theano_philox_init(&s, st, e);
+                // Box-Muller
+                double u1 = 1.0 - theano_philox_double(&s);
+                double u2 = theano_philox_double(&s);
+                %(otype)s z = sqrt(-2.0 * log(u1)) *
+                              cos(6.283185307179586 * u2);
+                %(otype)s avg = p0[e * s0];
+                %(otype)s std = p1[e * s1];
+                out[e] = avg + std * z;
+            }
+            """,
+            'binomial': """
+            for (npy_intp e = 0; e < n_elements; ++e)
+            {
+                theano_philox_stream s;
+                npy_int64 n = p0[e * s0];
+                double p = p1[e * s1];
+                if (n < 0 || !(p >= 0 && p <= 1))
+                {
+                    PyErr_SetString(PyExc_ValueError,
+                        "binomial needs n >= 0 and 0 <= p <= 1");
+                    err = 1;
+                    break;
+                }
+                theano_philox_init(&s, st, e);
+                out[e] = theano_philox_binomial(&s, n, p);
+            }
+            """,
+            'multinomial': """
+            npy_intp n_classes = odims[%(ndim)s];
+            for (npy_intp e = 0; e < n_elements; ++e)
+            {
+                theano_philox_stream s;
+                npy_int64 n = p0[e * s0];
+                const double *pv = p1 + e * s1 * n_classes;
+                %(otype)s *row = out + e * n_classes;
+                double mass = 0;
+                int bad = n < 0;
+                for (npy_intp k = 0; k < n_classes; ++k)
+                {
+                    if (!(pv[k] >= 0))
+                        bad = 1;
+                    mass += pv[k];
+                }
+                if (bad)
+                {
+                    PyErr_SetString(PyExc_ValueError,
+                        "multinomial needs n >= 0 and pvals >= 0");
+                    err = 1;
+                    break;
+                }
+                // Draw the classes one after the other, conditionally on
+                // the previous ones.
+                theano_philox_init(&s, st, e);
+                for (npy_intp k = 0; k < n_classes - 1; ++k)
+                {
+                    double pk = mass > 0 ? pv[k] / mass : 0.0;
+                    if (pk > 1.0)
+                        pk = 1.0;
+                    npy_int64 x = n > 0 ? theano_philox_binomial(&s, n, pk)
+                                        : 0;
+                    row[k] = x;
+                    n -= x;
+                    mass -= pv[k];
+                }
+                if (n_classes > 0)
+                    row[n_classes - 1] = n;
+            }
+            """,
+            'permutation': """
+            npy_intp n_perm = odims[%(ndim)s];
+            for (npy_intp e = 0; e < n_elements; ++e)
+            {
+                theano_philox_stream s;
+                %(otype)s *row = out + e * n_perm;
+                theano_philox_init(&s, st, e);
+                for (npy_intp i = 0; i < n_perm; ++i)
+                    row[i] = i;
+                // Fisher-Yates
+                for (npy_intp i = n_perm - 1; i > 0; --i)
+                {
+                    npy_intp j = theano_philox_below(&s, (npy_uint32)(i + 1));
+                    %(otype)s tmp = row[i];
+                    row[i] = row[j];
+                    row[j] = tmp;
+                }
+            }
+            """,
+        }[dist] % locals()
+
+        return """
+        {
+        npy_intp odims[%(nd_out)s + 1];
+        npy_intp n_elements = 1;
+        npy_uint32 st[4];
+        PyArrayObject * params[%(n_params)s] = {NULL};
+        %(decls)s
+        int err = 0;
+        int must_alloc = 0;
+
+        if (PyArray_NDIM(%(size)s) != 1 ||
+            PyArray_DIMS(%(size)s)[0] != %(ndim)s)
+        {
+            PyErr_Format(PyExc_ValueError,
+                         "size must be a vector of length %(ndim)s");
+            %(fail)s
+        }
+        for (int i = 0; i < %(ndim)s; ++i)
+        {
+            odims[i] = ((dtype_%(size)s*)PyArray_GETPTR1(%(size)s, i))[0];
+            if (odims[i] < 0)
+            {
+                PyErr_SetString(PyExc_ValueError, "size must be non-negative");
+                %(fail)s
+            }
+            // Checked before the product, which could overflow. The index
+            // of an element must fit in the first word of its counter.
+            if (odims[i] && n_elements > 0xFFFFFFFFLL / odims[i])
+            {
+                PyErr_SetString(PyExc_ValueError,
+                    "CounterRandomFunction cannot draw more than 2**32 - 1"
+                    " samples at once");
+                %(fail)s
+            }
+            n_elements *= odims[i];
+        }
+        if (PyArray_NDIM(%(state)s) != 1 || PyArray_DIMS(%(state)s)[0] != 4)
+        {
+            PyErr_SetString(PyExc_ValueError, "state must have 4 elements");
+            %(fail)s
+        }
+        for (int i = 0; i < 4; ++i)
+            st[i] = ((npy_uint32*)PyArray_GETPTR1(%(state)s, i))[0];
+
+        %(convert)s
+        if (!err)
+        {
+            %(extra_dim)s
+        }
+        if (!err)
+        {
+            if (%(o_sample)s == NULL ||
+                PyArray_NDIM(%(o_sample)s) != %(nd_out)s ||
+                !PyArray_IS_C_CONTIGUOUS(%(o_sample)s))
+            {
+                must_alloc = 1;
+            }
+            else
+            {
+                for (int i = 0; i < %(nd_out)s; ++i)
+                    if (PyArray_DIMS(%(o_sample)s)[i] != odims[i])
+                        must_alloc = 1;
+            }
+            if (must_alloc)
+            {
+                Py_XDECREF(%(o_sample)s);
+                %(o_sample)s = (PyArrayObject*)PyArray_EMPTY(
+                    %(nd_out)s, odims, %(o_type_num)s, 0);
+                if (!%(o_sample)s)
+                    err = 1;
+            }
+        }
+        if (!err)
+        {
+            %(otype)s *out = (%(otype)s*)PyArray_DATA(%(o_sample)s);
+            %(body)s
+        }
+        for (int i = 0; i < %(n_params)s; ++i)
+            Py_XDECREF(params[i]);
+        if (err)
+        {
+            %(fail)s
+        }
+
+        Py_XDECREF(%(o_state)s);
+        if (%(inplace)s)
+        {
+            %(o_state)s = %(state)s;
+            Py_INCREF(%(o_state)s);
+        }
+        else
+        {
+            %(o_state)s = (PyArrayObject*)PyArray_NewCopy(%(state)s,
+                                                          NPY_ANYORDER);
+            if (!%(o_state)s)
+            {
+                %(fail)s
+            }
+        }
+        {
+            npy_uint64 ctr = (st[2] | ((npy_uint64)st[3] << 32)) + 1;
+            ((npy_uint32*)PyArray_GETPTR1(%(o_state)s, 2))[0] =
+                (npy_uint32)ctr;
+            ((npy_uint32*)PyArray_GETPTR1(%(o_state)s, 3))[0] =
+                (npy_uint32)(ctr >> 32);
+        }
+        }
+        """ % locals()
+
+    def c_code_cache_version(self):
+        return (4,)
+
+
+def _broadcast_param(x, shape, ndim):
+    """Broadcast the non-scalar `x` to the first `ndim` elements of
+    `shape`, as `CounterRandomFunction` only broadcasts scalars."""
+    if x.ndim == 0:
+        return x
+    return tensor.alloc(x, *[shape[i] for i in xrange(ndim)])
+
+
+def uniform(state, size=None, low=0.0, high=1.0, ndim=None, dtype=None):
+    """
+    Sample from a uniform distribution between low and high.
+
+    Same interface as `raw_random.uniform`, but `state` is a uint32 vector
+    holding the state of a counter-based generator.
+    """
+    low = tensor.as_tensor_variable(low)
+    high = tensor.as_tensor_variable(high)
+    if dtype is None:
+        dtype = tensor.scal.upcast(theano.config.floatX, low.dtype, high.dtype)
+    ndim, size, bcast = _infer_ndim_bcast(ndim, size, low, high)
+    op = CounterRandomFunction('uniform', tensor.TensorType(dtype, bcast))
+    return op(state, size, _broadcast_param(low, size, ndim),
+              _broadcast_param(high, size, ndim))
+
+
+def normal(state, size=None, avg=0.0, std=1.0, ndim=None, dtype=None):
+    """
+    Sample from a normal distribution centered on avg with the specified
+    standard deviation (std).
+
+    Same interface as `raw_random.normal`, but `state` is a uint32 vector
+    holding the state of a counter-based generator.
+    """
+    avg = tensor.as_tensor_variable(avg)
+    std = tensor.as_tensor_variable(std)
+    if dtype is None:
+        dtype = tensor.scal.upcast(theano.config.floatX, avg.dtype, std.dtype)
+    ndim, size, bcast = _infer_ndim_bcast(ndim, size, avg, std)
+    op = CounterRandomFunction('normal', tensor.TensorType(dtype, bcast))
+    return op(state, size, _broadcast_param(avg, size, ndim),
+              _broadcast_param(std, size, ndim))
+
+
+def binomial(state, size=None, n=1, p=0.5, ndim=None, dtype='int64'):
+    """
+    Sample n times with probability of success p for each trial, and
+    return the number of successes.
+
+    Same interface as `raw_random.binomial`, but `state` is a uint32 vector
+    holding the state of a counter-based generator.
+    """
+    n = tensor.as_tensor_variable(n)
+    p = tensor.as_tensor_variable(p)
+    ndim, size, bcast = _infer_ndim_bcast(ndim, size, n, p)
+    op = CounterRandomFunction('binomial', tensor.TensorType(dtype, bcast))
+    return op(state, size, _broadcast_param(n, size, ndim),
+              _broadcast_param(p, size, ndim))
+
+
+def multinomial(state, size=None, n=1, pvals=[0.5, 0.5], ndim=None,
+                dtype='int64'):
+    """
+    Sample from one or more multinomial distributions defined by the
+    one-dimensional slices in pvals.
+
+    Same interface as `raw_random.multinomial`, but `state` is a uint32
+    vector holding the state of a counter-based generator. pvals does not
+    need to sum to 1, each slice is normalized.
+    """
+    n = tensor.as_tensor_variable(n)
+    pvals = tensor.as_tensor_variable(pvals)
+    tmp = pvals.T[0].T
+    ndim, size, bcast = _infer_ndim_bcast(ndim, size, n, tmp)
+    bcast = bcast + (pvals.type.broadcastable[-1],)
+    if pvals.ndim > 1:
+        pvals = tensor.alloc(pvals, *([size[i] for i in xrange(ndim)] +
+                                      [pvals.shape[-1]]))
+    op = CounterRandomFunction('multinomial', tensor.TensorType(dtype, bcast))
+    return op(state, size, _broadcast_param(n, size, ndim), pvals)
+
+
+def permutation(state, size=None, n=1, ndim=None, dtype='int64'):
+    """
+    Return permutations of the integers between 0 and n-1, as many times
+    as required by size.
+
+    Same interface as `raw_random.permutation`, but `state` is a uint32
+    vector holding the state of a counter-based generator.
+    """
+    if size is None or size == ():
+        if not(ndim is None or ndim == 1):
+            raise TypeError("You asked for just one permutation but asked "
+                            "for more then 1 dimensions.")
+        ndim = 0
+        size = tensor.constant([], dtype='int32')
+        bcast = ()
+    else:
+        ndim, size, bcast = _infer_ndim_bcast(ndim, size)
+    op = CounterRandomFunction('permutation',
+                               tensor.TensorType(dtype, bcast + (False,)))
+    return op(state, size, n)
+
+
+@gof.local_optimizer([CounterRandomFunction])
+def counter_random_make_inplace(node):
+    op = node.op
+    if isinstance(op, CounterRandomFunction) and not op.inplace:
+        new_op = CounterRandomFunction(op.dist, op.outtype, inplace=True)
+        return new_op.make_node(*node.inputs).outputs
+    return False
+
+optdb.register('random_make_inplace_counter',
+               opt.in2out(counter_random_make_inplace,
+                          ignore_newtrees=True),
+               99, 'fast_run', 'inplace')
+
+
+class CounterRandomStreams(object):
+    """
+    Symbolic stand-in for numpy.random.RandomState, drawing from
+    counter-based generators.
+
+    This has the interface of `shared_randomstreams.RandomStreams`, but
+    each random variable gets a shared uint32 vector of `STATE_SIZE`
+    elements as state instead of a RandomState.
+    """
+
+    def __init__(self, seed=None):
+        """
+        :type seed: None or int
+
+        :param seed: a default seed used to generate the keys of the
+            streams.
+        """
+        super(CounterRandomStreams, self).__init__()
+        # A list of pairs of the form (input_r, output_r).
+        self.state_updates = []
+        self.default_instance_seed = seed
+        # numpy.RandomState instance that gen() uses to make new keys.
+        self.gen_seedgen = numpy.random.RandomState(seed)
+
+    @staticmethod
+    def _new_key(seedgen):
+        return (int(seedgen.randint(2 ** 30)) |
+                (int(seedgen.randint(2 ** 30)) << 32))
+
+    def updates(self):
+        return list(self.state_updates)
+
+    def seed(self, seed=None):
+        """Re-initialize each random stream
+
+        :param seed: each random stream will be assigned a unique key
+            that depends deterministically on this value, and its counter
+            is reset.
+
+        :type seed: None or integer in range 0 to 2**30
+
+        :rtype: None
+        """
+        if seed is None:
+            seed = self.default_instance_seed
+        seedgen = numpy.random.RandomState(seed)
+        for old_r, new_r in self.state_updates:
+            old_r.set_value(seed_state(self._new_key(seedgen)), borrow=True)
+
+    def gen(self, op, *args, **kwargs):
+        """Create a new random stream in this container.
+
+        :param op: a function like `uniform`, that takes the state as
+            first argument
+
+        :returns: The symbolic random draw part of op()'s return value.
+            The update of the state is stored for the `updates` method
+            and as default update of the state.
+        """
+        state = shared(seed_state(self._new_key(self.gen_seedgen)))
+        # Add a reference to distinguish from other shared variables
+        state.tag.is_rng = True
+        new_state, out = op(state, *args, **kwargs)
+        out.rng = state
+        out.update = (state, new_state)
+        self.state_updates.append(out.update)
+        state.default_update = new_state
+        return out
+
+    def uniform(self, size=None, low=0.0, high=1.0, ndim=None, dtype=None):
+        """See `counter_random.uniform`."""
+        return self.gen(uniform, size, low, high, ndim=ndim, dtype=dtype)
+
+    def normal(self, size=None, avg=0.0, std=1.0, ndim=None, dtype=None):
+        """See `counter_random.normal`."""
+        return self.gen(normal, size, avg, std, ndim=ndim, dtype=dtype)
+
+    def binomial(self, size=None, n=1, p=0.5, ndim=None, dtype='int64'):
+        """See `counter_random.binomial`."""
+        return self.gen(binomial, size, n, p, ndim=ndim, dtype=dtype)
+
+    def multinomial(self, size=None, n=1, pvals=[0.5, 0.5], ndim=None,
+                    dtype='int64'):
+        """See `counter_random.multinomial`."""
+        return self.gen(multinomial, size, n, pvals, ndim=ndim, dtype=dtype)
+
+    def permutation(self, size=None, n=1, ndim=None, dtype='int64'):
+        """See `counter_random.permutation`."""
+        return self.gen(permutation, size, n, ndim=ndim, dtype=dtype)
+
+    def shuffle_row_elements(self, input):
+        """Return a variable with every row (rightmost index) shuffled.
+
+        This uses permutation random variable internally, available via
+        the ``.permutation`` attribute of the return value.
+        """
+        perm = self.permutation(size=input.shape[:-1], n=input.shape[-1],
+                                ndim=input.ndim - 1)
+        shuffled = tensor.permute_row_elements(input, perm)
+        shuffled.permutation = perm
+        return shuffled
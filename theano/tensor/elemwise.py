@@ -15,6 +15,7 @@ from theano.tensor.utils import hash_from_dict
 from theano.gradient import DisconnectedType
 from theano.gof.null_type import NullType
 from theano.tensor import elemwise_cgen as cgen
+from theano.configparser import thread_local_config
 
 config = theano.config
 
@@ -273,6 +274,11 @@ class DimShuffle(Op):
             return [None]
         return self(*eval_points, **dict(return_list=True))
 
+    def batch_apply(self, inputs, batched):
+        x, = inputs
+        new_order = [0] + [i if i == 'x' else i + 1 for i in self.new_order]
+        return [x.dimshuffle(new_order)]
+
     def c_code(self, node, name, inp, out, sub):
         input, = inp
         res, = out
@@ -646,6 +652,14 @@ class Elemwise(OpenMPOp):
 
         return rval
 
+    def batch_apply(self, inputs, batched):
+        if self.inplace_pattern:
+            raise NotImplementedError()
+        # The inputs that are the same for the whole batch are broadcasted.
+        inputs = [ipt if b else ipt.dimshuffle(['x'] + range(ipt.ndim))
+                  for ipt, b in zip(inputs, batched)]
+        return self(*inputs, **dict(return_list=True))
+
     def connection_pattern(self, node):
 
         if hasattr(self.scalar_op, 'connection_pattern'):
@@ -722,12 +736,7 @@ class Elemwise(OpenMPOp):
     def _bgrad(self, inputs, ograds):
         # returns grad, with respect to broadcasted versions of inputs
 
-        prev_setting = theano.config.compute_test_value
-
-        try:
-
-            theano.config.compute_test_value = 'off'
-
+        with thread_local_config({'compute_test_value': 'off'}):
             def as_scalar(t):
                 if isinstance(t.type, (NullType, DisconnectedType)):
                     return t
@@ -739,10 +748,6 @@ class Elemwise(OpenMPOp):
             for igrad in scalar_igrads:
                 assert igrad is not None, self.scalar_op
 
-        finally:
-
-            theano.config.compute_test_value = prev_setting
-
         if not isinstance(scalar_igrads, (list, tuple)):
             raise TypeError('%s.grad returned %s instead of list or tuple' %
                     (str(self.scalar_op), str(type(scalar_igrads))))
@@ -1445,6 +1450,15 @@ class CAReduce(Op):
                 for (i, b) in enumerate(node.inputs[0].type.broadcastable)
                 if i not in axis],
 
+    def batch_apply(self, inputs, batched):
+        x, = inputs
+        axis = self.axis
+        if axis is None:
+            axis = range(x.ndim - 1)
+        op = copy(self)
+        op.axis = tuple(a + 1 for a in axis)
+        return [op(x)]
+
     def _c_all(self, node, name, inames, onames, sub):
 
         input = node.inputs[0]
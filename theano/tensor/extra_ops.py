@@ -5,6 +5,7 @@ import theano
 
 from theano.tensor import basic
 from theano.tensor import nlinalg
+from theano.tensor.sort import argsort
 
 from theano import gof, scalar
 from theano.gradient import DisconnectedType
@@ -589,6 +590,29 @@ class RepeatOp(theano.Op):
         z = output_storage[0]
         z[0] = np.repeat(x, repeats=repeats, axis=self.axis)
 
+    def c_code(self, node, name, inames, onames, sub):
+        x, repeats = inames
+        z, = onames
+        fail = sub['fail']
+        if self.axis is None:
+            axis = 'NPY_MAXDIMS'
+        else:
+            axis = self.axis
+        return """
+            {
+                PyObject* t = PyArray_Repeat(%(x)s, (PyObject*)%(repeats)s,
+                                             %(axis)s);
+                if (!t) {
+                    %(fail)s;
+                }
+                Py_XDECREF(%(z)s);
+                %(z)s = (PyArrayObject*)t;
+            }
+        """ % locals()
+
+    def c_code_cache_version(self):
+        return (1,)
+
     def connection_pattern(self, node):
 
         return [[True], [False]]
@@ -1005,3 +1029,38 @@ def to_one_hot(y, nb_class, dtype=None):
     ret = theano.tensor.set_subtensor(ret[theano.tensor.arange(y.shape[0]), y],
                                       1)
     return ret
+
+
+def merge_duplicate_rows(ilist, rows):
+    """Sum the rows that are indexed by the same value of ilist.
+
+    ``(ilist, rows)`` is the sparse representation of the gradient of
+    ``x[ilist]``: it is ``advanced_inc_subtensor1(zeros_like(x), rows,
+    ilist)``. This returns an equivalent representation where the indices
+    are sorted and unique, so it can be used by updates that are not
+    linear in the gradient (e.g. AdaGrad) without materializing the dense
+    gradient.
+
+        :param ilist: A vector of integer indices.
+        :param rows: A tensor with one row for each element of ilist.
+
+        :return: ``(unique_ilist, summed_rows)`` where ``summed_rows[j]`` is
+          the sum of the rows of ``rows`` indexed by ``unique_ilist[j]``.
+
+    """
+    ilist = basic.as_tensor_variable(ilist)
+    rows = basic.as_tensor_variable(rows)
+    order = argsort(ilist)
+    sorted_ilist = ilist[order]
+    # 1 where a new index value starts in sorted_ilist.
+    starts = basic.concatenate([
+        basic.ones_like(sorted_ilist[:1], dtype='int64'),
+        basic.cast(basic.neq(sorted_ilist[1:], sorted_ilist[:-1]), 'int64')])
+    segments = cumsum(starts) - 1
+    unique_ilist = sorted_ilist[starts.nonzero()[0]]
+    summed_rows = basic.zeros(
+        [unique_ilist.shape[0]] + [rows.shape[i] for i in range(1, rows.ndim)],
+        dtype=rows.dtype)
+    summed_rows = theano.tensor.subtensor.advanced_inc_subtensor1(
+        summed_rows, rows[order], segments)
+    return unique_ilist, summed_rows
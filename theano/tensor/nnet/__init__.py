@@ -1,5 +1,9 @@
 from nnet import *
 from conv import conv2d, ConvOp
+# fftconv must come before corr: its optimizer takes precedence for big
+# filters.
+from fftconv import FFTConv2D
+from corr import CorrMM, CorrMM_gradWeights, CorrMM_gradInputs
 from Conv3D import *
 from ConvGrad3D import *
 from ConvTransp3D import *
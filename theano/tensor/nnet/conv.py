@@ -11,22 +11,24 @@ See especially conv2d().
 
 __docformat__ = "restructuredtext en"
 
+import imp
 import logging
 
 import numpy
 
 import theano
 from theano.tensor import (as_tensor_variable, blas, get_scalar_constant_value,
-                           patternbroadcast, NotScalarConstantError)
+                           opt, patternbroadcast, NotScalarConstantError)
 from theano import OpenMPOp, config
+from theano import gof
 from theano.gof import Apply
 
 imported_scipy_signal = False
 try:
-    # TODO: move these back out to global scope when they no longer
-    # cause an atexit error
-    from scipy.signal.signaltools import _valfrommode, _bvalfromboundary
-    from scipy.signal.sigtools import _convolve2d
+    # scipy.signal is slow to import, so it is only imported by perform().
+    # Here we only check that it is there.
+    import scipy
+    imp.find_module('signal', scipy.__path__)
     imported_scipy_signal = True
 except ImportError:
     pass
@@ -668,8 +670,9 @@ class ConvOp(OpenMPOp):
                 "for the python implementation. You can use the C"
                 " implementation instead.")
 
-        # TODO: move these back out to global scope when they no longer
-        #       cause an atexit error
+        from scipy.signal.signaltools import _valfrommode, _bvalfromboundary
+        from scipy.signal.sigtools import _convolve2d
+
         imshp = self.imshp
         if any(x is None for x in imshp):
             imshp = tuple(img2d.shape[1:])
@@ -1319,6 +1322,54 @@ if(kerns_dim[1] != img2d_dim[1]){
             return _conv_op_code_a % d
 
 
+@opt.register_specialize
+@gof.local_optimizer([ConvOp])
+def local_conv_static_shapes(node):
+    """Give to ConvOp the shapes of its inputs that are constant.
+
+    With all the shapes, ConvOp selects the fastest unrolled version of
+    its C code and hardcodes the shapes in it. The shapes are constant
+    e.g. in the functions specialized by
+    theano.compile.shape_specialize.ShapeSpecializedFunction.
+    """
+    op = node.op
+    if (not isinstance(op, ConvOp) or
+            op.has_all_shape(op.imshp, op.kshp, op.nkern, op.bsize) or
+            op.imshp_logical != op.imshp or op.kshp_logical != op.kshp):
+        return False
+    shape_feature = getattr(node.fgraph, 'shape_feature', None)
+    if shape_feature is None:
+        return False
+
+    def constant_shape(var, known):
+        rval = []
+        for k, s in zip(known, shape_feature.shape_of[var]):
+            if k is None:
+                try:
+                    k = int(get_scalar_constant_value(s))
+                except NotScalarConstantError:
+                    pass
+            rval.append(k)
+        return rval
+
+    img, kern = node.inputs
+    bsize, stack, rows, cols = constant_shape(img, (op.bsize,) + op.imshp)
+    nkern, _, krows, kcols = constant_shape(kern,
+                                            (op.nkern, None) + op.kshp)
+    if ((bsize, stack, rows, cols, nkern, krows, kcols) ==
+            ((op.bsize,) + op.imshp + (op.nkern,) + op.kshp)):
+        return False
+    # Let the new op select the unrolling from the new shapes.
+    new_op = ConvOp(imshp=(stack, rows, cols), kshp=(krows, kcols),
+                    nkern=nkern, bsize=bsize, dx=op.dx, dy=op.dy,
+                    output_mode=op.out_mode,
+                    kshp_logical_top_aligned=op.kshp_logical_top_aligned,
+                    verbose=op.verbose,
+                    version=op.version if op.fft_opt else 'no_fft',
+                    direction_hint=op.direction_hint, openmp=op.openmp)
+    return [new_op(img, kern)]
+
+
 _conv_op_code_a = """
 const int mode=%(mode)s;
 int typenum=0, typenum_f=0;
@@ -0,0 +1,712 @@
+"""
+CPU implementation of 2d correlation (and convolution) by unfolding the
+input images (im2col) and calling BLAS gemm.
+
+This mirrors `GpuCorrMM` from :mod:`theano.sandbox.cuda.blas`. The
+legacy :class:`ConvOp <theano.tensor.nnet.conv.ConvOp>` is replaced by
+these ops during optimization when the shapes make it worthwhile, see
+`local_conv2d_corrmm`.
+"""
+import logging
+import os
+
+import numpy
+
+import theano
+from theano import gof
+from theano.configparser import AddConfigVar, IntParam
+from theano.gof import Apply
+from theano.tensor import (as_tensor_variable, blas, opt,
+                           patternbroadcast, TensorType)
+from theano.tensor.blas_headers import blas_header_text, blas_header_version
+from theano.tensor.nnet.conv import ConvOp
+
+_logger = logging.getLogger("theano.tensor.nnet.corr")
+
+AddConfigVar('conv.corrmm_workspace_mb',
+             "Upper bound, in megabytes, on the temporary buffer used by "
+             "CorrMM and its gradients to unfold one image. Bigger images "
+             "are unfolded a few output rows at a time. 0 means no bound.",
+             IntParam(64, lambda i: i >= 0))
+
+
+class BaseCorrMM(gof.Op):
+    """Base class for `CorrMM`, `CorrMM_gradWeights` and
+    `CorrMM_gradInputs`. Cannot be used directly.
+
+    :param border_mode: one of 'valid', 'full', 'half'; additionally, the
+        padding size could be directly specified by an integer or a pair of
+        integers
+    :param subsample: perform subsampling of the output (default: (1, 1))
+
+    """
+    check_broadcast = False
+    __props__ = ('border_mode', 'subsample')
+
+    def __init__(self, border_mode="valid", subsample=(1, 1)):
+        if isinstance(border_mode, int):
+            border_mode = (border_mode, border_mode)
+        if isinstance(border_mode, tuple):
+            pad_h, pad_w = map(int, border_mode)
+            border_mode = (pad_h, pad_w)
+        if not ((isinstance(border_mode, tuple) and min(border_mode) >= 0) or
+                border_mode in ('valid', 'full', 'half')):
+            raise ValueError(
+                'invalid border_mode {}, which must be either '
+                '"valid", "full", "half", an integer or a pair of'
+                ' integers'.format(border_mode))
+        self.border_mode = border_mode
+        if len(subsample) != 2:
+            raise ValueError("subsample must have two elements")
+        self.subsample = tuple(subsample)
+
+    @property
+    def pad(self):
+        if self.border_mode != 'valid':
+            return self.border_mode
+        return (0, 0)
+
+    def __str__(self):
+        return '%s{%s, %s}' % (
+            self.__class__.__name__,
+            self.border_mode,
+            str(self.subsample))
+
+    def _padding(self, kshp):
+        """Return the (rows, columns) padding for filters of shape `kshp`.
+        `kshp` may be symbolic."""
+        if self.border_mode == 'half':
+            return (kshp[0] // 2, kshp[1] // 2)
+        if self.border_mode == 'full':
+            return (kshp[0] - 1, kshp[1] - 1)
+        return self.pad
+
+    def flops(self, inp, outp):
+        """ Useful with the hack in profilemode to print the MFlops"""
+        # if the output shape is correct, then this gives the correct
+        # flops for any direction, sampling, padding, and border mode
+        inputs, filters = inp
+        outputs, = outp
+        assert inputs[1] == filters[1]
+        # nb mul and add by output pixel
+        flops = filters[2] * filters[3] * 2
+        # nb flops by output image
+        flops *= outputs[2] * outputs[3]
+        # nb patch multiplied
+        flops *= inputs[1] * filters[0] * inputs[0]
+        return flops
+
+    def _perform_direction(self, bottom, weights, top, direction):
+        """Python implementation of the three directions, used when no C
+        compiler or no BLAS is available. The array selected by `direction`
+        is overwritten."""
+        dH, dW = self.subsample
+        kH, kW = weights.shape[2:]
+        padH, padW = self._padding((kH, kW))
+        topH, topW = top.shape[2:]
+        padded_shape = (bottom.shape[0], bottom.shape[1],
+                        bottom.shape[2] + 2 * padH,
+                        bottom.shape[3] + 2 * padW)
+        padded = numpy.zeros(padded_shape, dtype=bottom.dtype)
+        if direction != 2:
+            padded[:, :, padH:padH + bottom.shape[2],
+                   padW:padW + bottom.shape[3]] = bottom
+        if direction == 0:
+            top[...] = 0
+        for i in xrange(kH):
+            rows = slice(i, i + dH * (topH - 1) + 1, dH)
+            for j in xrange(kW):
+                cols = slice(j, j + dW * (topW - 1) + 1, dW)
+                if direction == 0:
+                    top += numpy.tensordot(
+                        padded[:, :, rows, cols], weights[:, :, i, j],
+                        axes=([1], [1])).transpose(0, 3, 1, 2)
+                elif direction == 1:
+                    weights[:, :, i, j] = numpy.tensordot(
+                        top, padded[:, :, rows, cols],
+                        axes=([0, 2, 3], [0, 2, 3]))
+                else:
+                    padded[:, :, rows, cols] += numpy.tensordot(
+                        top, weights[:, :, i, j],
+                        axes=([1], [0])).transpose(0, 3, 1, 2)
+        if direction == 2:
+            bottom[...] = padded[:, :, padH:padH + bottom.shape[2],
+                                 padW:padW + bottom.shape[3]]
+
+    def c_headers(self):
+        return ['<stdlib.h>', '<string.h>']
+
+    def c_libraries(self):
+        return blas.ldflags()
+
+    def c_compile_args(self):
+        return blas.ldflags(libs=False, flags=True)
+
+    def c_lib_dirs(self):
+        return blas.ldflags(libs=False, libs_dir=True)
+
+    def c_header_dirs(self):
+        return blas.ldflags(libs=False, include_dir=True)
+
+    def c_code_cache_version(self):
+        # raise this whenever modifying any of the support_code_files
+        return (2, blas_header_version())
+
+    def c_support_code(self):
+        # REMEMBER TO RAISE c_code_cache_version when changing any of
+        # these files
+        code = open(os.path.join(os.path.split(__file__)[0],
+                                 'corr_gemm.c')).read()
+        return (blas_header_text() +
+                code % dict(float_type='npy_float32', gemm='sgemm_') +
+                code % dict(float_type='npy_float64', gemm='dgemm_'))
+
+    def c_code_helper(self, node, bottom, weights, top, direction, sub,
+                      height=None, width=None):
+        """
+        This generates the C code for CorrMM (direction="forward"),
+        CorrMM_gradWeights (direction="backprop weights"), and
+        CorrMM_gradInputs (direction="backprop inputs").
+        Depending on the direction, one of bottom, weights, top will
+        receive the output, while the other two serve as inputs.
+
+        :param bottom: Variable name of the input images in the forward pass,
+            or the gradient of the input images in backprop wrt. inputs
+        :param weights: Variable name of the filters in the forward pass,
+            or the gradient of the filters in backprop wrt. weights
+        :param top: Variable name of the output images / feature maps in the
+            forward pass, or the gradient of the outputs in the backprop passes
+        :param direction: "forward" to correlate bottom with weights and store
+            results in top,
+            "backprop weights" to do a valid convolution of bottom with top
+            (swapping the first two dimensions) and store results in weights,
+            and "backprop inputs" to do a full convolution of top with weights
+            (swapping the first two dimensions) and store results in bottom.
+        :param sub: Dictionary of substitutions useable to help generating the
+            C code.
+        :param height: If self.subsample[0] != 1, a variable giving the height
+            of the filters for direction="backprop weights" or the height of
+            the input images for direction="backprop inputs".
+
+            If self.border_mode == 'half', a variable giving the height of the
+            filters for direction="backprop weights".  Ignored otherwise.
+        :param width: If self.subsample[1] != 1, a variable giving the width
+            of the filters for direction="backprop weights" or the width of the
+            input images for direction="backprop inputs".
+
+            If self.border_mode == 'half', a variable giving the width of the
+            filters for direction="backprop weights".  Ignored otherwise.
+        """
+        if not blas.ldflags():
+            raise gof.utils.MethodNotDefined(
+                "c_code", type(self), self.__class__.__name__,
+                "CorrMM needs a BLAS library to be linked against")
+        dtype = node.outputs[0].dtype
+        if dtype not in ('float32', 'float64'):
+            raise gof.utils.MethodNotDefined(
+                "c_code", type(self), self.__class__.__name__,
+                "CorrMM only has C code for float32 and float64")
+        dH, dW = self.subsample
+        if self.border_mode == "half":
+            padH = padW = -1
+        elif self.border_mode == "full":
+            padH = padW = -2
+        elif isinstance(self.border_mode, tuple):
+            padH, padW = self.border_mode
+        else:
+            assert self.border_mode == "valid"
+            padH = padW = 0
+        if direction == "forward":
+            direction = 0
+            out = top
+        elif direction == "backprop weights":
+            direction = 1
+            out = weights
+        elif direction == "backprop inputs":
+            direction = 2
+            out = bottom
+        else:
+            raise ValueError("direction must be one of 'forward', "
+                             "'backprop weights', 'backprop inputs'")
+        # When subsampling, we cannot unambiguously infer the height and width
+        # of bottom and weights from top, so we require them to be given.
+        # Similarly, when pad="half", we cannot infer the weight size.
+        if (((direction != 0) and (dH != 1)) or
+                ((direction == 1) and (padH == -1))):
+            if not height:
+                raise ValueError("height must be given for backprop with "
+                                 "vertical sampling or pad='half'")
+            height = '((dtype_%s*)(PyArray_DATA(%s)))[0]' % (height, height)
+        else:
+            height = '-1'
+        if (((direction != 0) and (dW != 1)) or
+                ((direction == 1) and (padW == -1))):
+            if not width:
+                raise ValueError("width must be given for backprop with "
+                                 "horizontal sampling or pad='half'")
+            width = '((dtype_%s*)(PyArray_DATA(%s)))[0]' % (width, width)
+        else:
+            width = '-1'
+        typenum = {'float32': 'NPY_FLOAT32', 'float64': 'NPY_FLOAT64'}[dtype]
+        corrMM = {'float32': 'corrMM_npy_float32',
+                  'float64': 'corrMM_npy_float64'}[dtype]
+        workspace = theano.config.conv.corrmm_workspace_mb * 2 ** 20
+        sub = sub.copy()
+        sub.update(locals())
+
+        return """
+{
+    // Mandatory args
+    int direction = %(direction)s;  // forward, bprop weights, bprop inputs
+
+    // Optional args
+    int dH = %(dH)s;
+    int dW = %(dW)s;
+    int padH = %(padH)s;
+    int padW = %(padW)s;
+
+    // The two inputs are made C-contiguous, the output is allocated
+    // C-contiguous below.
+    PyArrayObject * bottom = NULL;
+    PyArrayObject * weights = NULL;
+    PyArrayObject * top = NULL;
+    if (direction != 2) {
+        bottom = PyArray_GETCONTIGUOUS(%(bottom)s);
+    }
+    if (direction != 1) {
+        weights = PyArray_GETCONTIGUOUS(%(weights)s);
+    }
+    if (direction != 0) {
+        top = PyArray_GETCONTIGUOUS(%(top)s);
+    }
+    if ((direction != 2 && NULL == bottom) ||
+        (direction != 1 && NULL == weights) ||
+        (direction != 0 && NULL == top)) {
+        Py_XDECREF(bottom);
+        Py_XDECREF(weights);
+        Py_XDECREF(top);
+        %(fail)s
+    }
+    int kH, kW;
+    npy_intp out_dim[4];
+    {
+    // Obtain or infer kernel width and height
+    // (we need to know it early to be able to handle auto-padding)
+    if (direction != 1) {
+        // weight is an input variable, we can just read its shape
+        kH = PyArray_DIMS(weights)[2];
+        kW = PyArray_DIMS(weights)[3];
+    }
+    else {
+        if ((dH != 1) || (padH == -1)) {
+            // vertical subsampling or half padding, kernel height is specified
+            kH = %(height)s;
+        }
+        else if (padH == -2) {
+            // vertical full padding, we can infer the kernel height
+            kH = 2 - PyArray_DIMS(bottom)[2] + (PyArray_DIMS(top)[2] - 1) * dH;
+        }
+        else {
+            // explicit padding, we can infer the kernel height
+            kH = (PyArray_DIMS(bottom)[2] + 2*padH -
+                  (PyArray_DIMS(top)[2] - 1) * dH);
+        }
+        if ((dW != 1) || (padW == -1)) {
+            kW = %(width)s;
+        }
+        else if (padW == -2) {
+            kW = 2 - PyArray_DIMS(bottom)[3] + (PyArray_DIMS(top)[3] - 1) * dW;
+        }
+        else {
+            kW = (PyArray_DIMS(bottom)[3] + 2*padW -
+                  (PyArray_DIMS(top)[3] - 1) * dW);
+        }
+    }
+
+    // Auto-padding if requested
+    if (padH == -1) {  // vertical half padding
+        padH = kH / 2;
+    }
+    else if (padH == -2) {  // vertical full padding
+        padH = kH - 1;
+    }
+    if (padW == -1) {  // horizontal half padding
+        padW = kW / 2;
+    }
+    else if (padW == -2) {  // horizontal full padding
+        padW = kW - 1;
+    }
+
+    // Infer output shape
+    switch(direction) {
+    case 0:  // forward pass
+        // output is top: (batchsize, num_filters, height, width)
+        // height and width: top = (bottom + 2*pad - weight) / sample + 1
+        out_dim[0] = PyArray_DIMS(bottom)[0];
+        out_dim[1] = PyArray_DIMS(weights)[0];
+        out_dim[2] = (PyArray_DIMS(bottom)[2] + 2*padH - kH) / dH + 1;
+        out_dim[3] = (PyArray_DIMS(bottom)[3] + 2*padW - kW) / dW + 1;
+        break;
+    case 1:  // backprop wrt. weights
+        // output is weights: (num_filters, num_channels, height, width)
+        out_dim[0] = PyArray_DIMS(top)[1];
+        out_dim[1] = PyArray_DIMS(bottom)[1];
+        out_dim[2] = kH;  // already inferred further above
+        out_dim[3] = kW;  // how convenient
+        break;
+    default:  // backprop wrt. inputs
+        // output is bottom: (batchsize, num_channels, height, width)
+        // height and width: bottom = (top - 1) * sample + weights - 2*pad
+        out_dim[0] = PyArray_DIMS(top)[0];
+        out_dim[1] = PyArray_DIMS(weights)[1];
+        out_dim[2] = ((dH != 1) ? %(height)s :
+                      (PyArray_DIMS(top)[2] - 1) * dH + kH - 2*padH);
+        out_dim[3] = ((dW != 1) ? %(width)s :
+                      (PyArray_DIMS(top)[3] - 1) * dW + kW - 2*padW);
+        break;
+    }
+    }
+    if (out_dim[0] < 0 || out_dim[1] < 0 ||
+        out_dim[2] <= 0 || out_dim[3] <= 0)
+    {
+        PyErr_Format(PyExc_ValueError,
+                     "CorrMM: impossible output shape"
+                     " (%%ld, %%ld, %%ld, %%ld)",
+                     (long)out_dim[0], (long)out_dim[1],
+                     (long)out_dim[2], (long)out_dim[3]);
+        Py_XDECREF(bottom);
+        Py_XDECREF(weights);
+        Py_XDECREF(top);
+        %(fail)s
+    }
+
+    // Prepare output array
+    if ( !(%(out)s
+           && PyArray_NDIM(%(out)s)==4
+           && PyArray_IS_C_CONTIGUOUS(%(out)s)
+           && PyArray_DIMS(%(out)s)[0]==out_dim[0]
+           && PyArray_DIMS(%(out)s)[1]==out_dim[1]
+           && PyArray_DIMS(%(out)s)[2]==out_dim[2]
+           && PyArray_DIMS(%(out)s)[3]==out_dim[3]))
+    {
+        Py_XDECREF(%(out)s);
+        %(out)s = (PyArrayObject*)PyArray_EMPTY(4, out_dim, %(typenum)s, 0);
+        if (NULL == %(out)s)
+        {
+            PyErr_Format(PyExc_MemoryError,
+                    "CorrMM: Failed to allocate output of"
+                    " %%ld x %%ld x %%ld x %%ld",
+                    (long)out_dim[0], (long)out_dim[1],
+                    (long)out_dim[2], (long)out_dim[3]);
+            Py_XDECREF(bottom);
+            Py_XDECREF(weights);
+            Py_XDECREF(top);
+            %(fail)s
+        }
+    }
+    switch(direction) {
+    case 0: top = %(out)s; Py_INCREF(top); break;
+    case 1: weights = %(out)s; Py_INCREF(weights); break;
+    default: bottom = %(out)s; Py_INCREF(bottom); break;
+    }
+
+    // Call the correlation code
+    int err = %(corrMM)s(bottom, weights, top, direction,
+                         dH, dW, padH, padW, %(workspace)s);
+    Py_XDECREF(bottom);
+    Py_XDECREF(weights);
+    Py_XDECREF(top);
+    if (err) {
+        %(fail)s
+    }
+}
+""" % sub
+
+
+class CorrMM(BaseCorrMM):
+    """CPU correlation implementation using Matrix Multiplication.
+
+    :param border_mode: the width of a border of implicit zeros to pad the
+        input image with. Should be 'valid' (no padding), 'full' (padding of
+        `(kernel_rows - 1, kernel_columns - 1)`), 'half' (padding of
+        `(kernel_rows // 2, kernel_columns // 2)`), or a tuple of 2 integers
+        giving the numbers of rows and columns to pad on each side.
+    :param subsample: the subsample operation applied to each output image.
+        Should be a tuple with 2 elements.
+        `(sv, sh)` is equivalent to `CorrMM(...)(...)[:,:,::sv, ::sh]`,
+        but faster.
+        Set to `(1, 1)` to disable subsampling.
+
+    :note: The temporary buffer holding the unfolded images is bounded by
+        the Theano flag `conv.corrmm_workspace_mb`.
+
+    :note: `ConvOp` nodes are replaced by `CorrMM` or one of its gradients
+        by the `local_conv2d_corrmm` optimization when this is expected to
+        be faster. It can be disabled with `optimizer_excluding=conv_gemm`.
+        You can also call it directly as `CorrMM(subsample=...)(image,
+        filters)`, but note that it computes a correlation -- if you need to
+        compute a convolution, flip the filters as `filters[:,:,::-1,::-1]`.
+    """
+    def make_node(self, img, kern):
+        img = as_tensor_variable(img)
+        kern = as_tensor_variable(kern)
+        if img.type.ndim != 4:
+            raise TypeError('img must be 4D tensor')
+        if kern.type.ndim != 4:
+            raise TypeError('kern must be 4D tensor')
+        if img.type.dtype != kern.type.dtype:
+            raise TypeError('img and kern must have the same dtype')
+
+        broadcastable = [img.type.broadcastable[0], kern.type.broadcastable[0],
+                         False, False]
+        return Apply(self, [img, kern],
+                     [TensorType(img.type.dtype, broadcastable)()])
+
+    def infer_shape(self, node, input_shapes):
+        imshp, kshp = input_shapes
+        padH, padW = self._padding(kshp[2:])
+        dH, dW = self.subsample
+        return [(imshp[0], kshp[0],
+                 (imshp[2] + 2 * padH - kshp[2]) // dH + 1,
+                 (imshp[3] + 2 * padW - kshp[3]) // dW + 1)]
+
+    def perform(self, node, inp, out_):
+        bottom, weights = inp
+        top, = out_
+        shp = self.infer_shape(node, [bottom.shape, weights.shape])[0]
+        top[0] = numpy.empty(shp, dtype=node.outputs[0].dtype)
+        self._perform_direction(bottom, weights, top[0], 0)
+
+    def c_code(self, node, nodename, inp, out_, sub):
+        bottom, weights = inp
+        top, = out_
+        direction = "forward"
+        return super(CorrMM, self).c_code_helper(node, bottom, weights, top,
+                                                 direction, sub)
+
+    def grad(self, inp, grads):
+        bottom, weights = inp
+        top, = grads
+        d_bottom = CorrMM_gradInputs(self.border_mode, self.subsample)(
+            weights, top, bottom.shape[-2:])
+        d_weights = CorrMM_gradWeights(self.border_mode, self.subsample)(
+            bottom, top, weights.shape[-2:])
+        return d_bottom, d_weights
+
+
+class CorrMM_gradWeights(BaseCorrMM):
+    """Gradient wrt. filters for `CorrMM`.
+
+    :note: You will not want to use this directly, but rely on
+           Theano's automatic differentiation or graph optimization to
+           use it as needed.
+
+    """
+    def make_node(self, img, topgrad, shape=None):
+        img = as_tensor_variable(img)
+        topgrad = as_tensor_variable(topgrad)
+        if img.type.ndim != 4:
+            raise TypeError('img must be 4D tensor')
+        if topgrad.type.ndim != 4:
+            raise TypeError('topgrad must be 4D tensor')
+        if self.subsample != (1, 1) or self.border_mode == "half":
+            if shape is None:
+                raise ValueError('shape must be given if subsample != (1, 1)'
+                                 ' or border_mode == "half"')
+            height_width = [as_tensor_variable(shape[0]),
+                            as_tensor_variable(shape[1])]
+        else:
+            height_width = []
+
+        broadcastable = [topgrad.type.broadcastable[1],
+                         img.type.broadcastable[1],
+                         False, False]
+        return Apply(self, [img, topgrad] + height_width,
+                     [TensorType(img.type.dtype, broadcastable)()])
+
+    def _kshp(self, imshp, topshp, height_width):
+        kshp = []
+        for i, d in enumerate(self.subsample):
+            if d != 1 or self.border_mode == 'half':
+                kshp.append(height_width[i])
+            elif self.border_mode == 'full':
+                kshp.append(2 - imshp[2 + i] + (topshp[2 + i] - 1) * d)
+            else:
+                pad = self.pad[i]
+                kshp.append(imshp[2 + i] + 2 * pad - (topshp[2 + i] - 1) * d)
+        return kshp
+
+    def infer_shape(self, node, input_shapes):
+        imshp, topshp = input_shapes[:2]
+        kshp = self._kshp(imshp, topshp, node.inputs[2:])
+        return [(topshp[1], imshp[1], kshp[0], kshp[1])]
+
+    def perform(self, node, inp, out_):
+        bottom, top = inp[:2]
+        weights, = out_
+        kshp = self._kshp(bottom.shape, top.shape, inp[2:])
+        weights[0] = numpy.empty(
+            (top.shape[1], bottom.shape[1], int(kshp[0]), int(kshp[1])),
+            dtype=node.outputs[0].dtype)
+        self._perform_direction(bottom, weights[0], top, 1)
+
+    def c_code(self, node, nodename, inp, out_, sub):
+        bottom, top = inp[:2]
+        height, width = inp[2:] or (None, None)
+        weights, = out_
+        direction = "backprop weights"
+        return super(CorrMM_gradWeights, self).c_code_helper(
+            node, bottom, weights, top, direction, sub, height, width)
+
+    def grad(self, inp, grads):
+        bottom, top = inp[:2]
+        weights, = grads
+        d_bottom = CorrMM_gradInputs(self.border_mode, self.subsample)(
+            weights, top, bottom.shape[-2:])
+        d_top = CorrMM(self.border_mode, self.subsample)(bottom, weights)
+        d_height_width = ((theano.gradient.DisconnectedType()(),) * 2
+                          if len(inp) == 4 else ())
+        return (d_bottom, d_top) + d_height_width
+
+    def connection_pattern(self, node):
+        if node.nin == 2:
+            return [[1], [1]]
+        else:
+            return [[1], [1], [0], [0]]  # no connection to height, width
+
+
+class CorrMM_gradInputs(BaseCorrMM):
+    """Gradient wrt. inputs for `CorrMM`.
+
+    :note: You will not want to use this directly, but rely on
+           Theano's automatic differentiation or graph optimization to
+           use it as needed.
+
+    """
+    def make_node(self, kern, topgrad, shape=None):
+        kern = as_tensor_variable(kern)
+        topgrad = as_tensor_variable(topgrad)
+        if kern.type.ndim != 4:
+            raise TypeError('kern must be 4D tensor')
+        if topgrad.type.ndim != 4:
+            raise TypeError('topgrad must be 4D tensor')
+        if self.subsample != (1, 1) and shape is None:
+            raise ValueError('shape must be given if subsample != (1, 1)')
+        if self.subsample != (1, 1):
+            height_width = [as_tensor_variable(shape[0]),
+                            as_tensor_variable(shape[1])]
+        else:
+            height_width = []
+
+        broadcastable = [topgrad.type.broadcastable[0],
+                         kern.type.broadcastable[1],
+                         False, False]
+        return Apply(self, [kern, topgrad] + height_width,
+                     [TensorType(kern.type.dtype, broadcastable)()])
+
+    def _imshp(self, kshp, topshp, height_width):
+        padH, padW = self._padding(kshp[2:])
+        imshp = []
+        for i, (d, pad) in enumerate(zip(self.subsample, (padH, padW))):
+            if d != 1:
+                imshp.append(height_width[i])
+            else:
+                imshp.append((topshp[2 + i] - 1) * d + kshp[2 + i] - 2 * pad)
+        return imshp
+
+    def infer_shape(self, node, input_shapes):
+        kshp, topshp = input_shapes[:2]
+        imshp = self._imshp(kshp, topshp, node.inputs[2:])
+        return [(topshp[0], kshp[1], imshp[0], imshp[1])]
+
+    def perform(self, node, inp, out_):
+        weights, top = inp[:2]
+        bottom, = out_
+        imshp = self._imshp(weights.shape, top.shape, inp[2:])
+        bottom[0] = numpy.empty(
+            (top.shape[0], weights.shape[1], int(imshp[0]), int(imshp[1])),
+            dtype=node.outputs[0].dtype)
+        self._perform_direction(bottom[0], weights, top, 2)
+
+    def c_code(self, node, nodename, inp, out_, sub):
+        weights, top = inp[:2]
+        height, width = inp[2:] or (None, None)
+        bottom, = out_
+        direction = "backprop inputs"
+        return super(CorrMM_gradInputs, self).c_code_helper(
+            node, bottom, weights, top, direction, sub, height, width)
+
+    def grad(self, inp, grads):
+        weights, top = inp[:2]
+        bottom, = grads
+        d_weights = CorrMM_gradWeights(self.border_mode, self.subsample)(
+            bottom, top, weights.shape[-2:])
+        d_top = CorrMM(self.border_mode, self.subsample)(bottom, weights)
+        d_height_width = ((theano.gradient.DisconnectedType()(),) * 2
+                          if len(inp) == 4 else ())
+        return (d_weights, d_top) + d_height_width
+
+    def connection_pattern(self, node):
+        if node.nin == 2:
+            return [[1], [1]]
+        else:
+            return [[1], [1], [0], [0]]  # no connection to height, width
+
+
+def corrmm_is_faster(op):
+    """Return True if the `ConvOp` `op` is expected to run faster as
+    `CorrMM`.
+
+    The hand-unrolled C code of `ConvOp` is only competitive when there
+    are few filters and small stacks: the GEMM amortizes the cost of
+    unfolding the images over the number of filters. The thresholds come
+    from benchmark/convolution/conv2d_gemm.py. When no shape is known,
+    `ConvOp` falls back to its generic code, which is slower than `CorrMM`
+    in all the cases we measured.
+
+    When only some of the shapes are given, `ConvOp` is kept as it checks
+    them at run time.
+    """
+    if (op.bsize is None and op.nkern is None and
+            op.imshp == (None, None, None) and op.kshp == (None, None)):
+        return True
+    if not op.has_all_shape(op.imshp, op.kshp, op.nkern, op.bsize):
+        return False
+    stack_size, kshp = op.imshp[0], op.kshp
+    work = op.nkern * stack_size * kshp[0] * kshp[1]
+    if op.out_mode == 'full':
+        return work >= 32
+    return work >= 128
+
+
+@gof.local_optimizer([ConvOp])
+def local_conv2d_corrmm(node):
+    """Replace `ConvOp` by `CorrMM` (or one of its gradients) when BLAS
+    is available and the shapes indicate it should be faster."""
+    if not isinstance(node.op, ConvOp):
+        return
+    if not theano.config.blas.ldflags or not theano.config.cxx:
+        return
+    op = node.op
+    if (op.imshp != op.imshp_logical or op.kshp != op.kshp_logical or
+            node.outputs[0].dtype not in ('float32', 'float64')):
+        return
+    if not corrmm_is_faster(op):
+        return
+    img, kern = node.inputs
+    subsample = (op.dx, op.dy)
+    if op.out_mode == 'valid' or subsample != (1, 1):
+        # need to flip the kernel to get a convolution
+        kern = kern[:, :, ::-1, ::-1]
+        rval = CorrMM(op.out_mode, subsample)(img, kern)
+    else:
+        # A full convolution is the gradient of a valid correlation wrt.
+        # its inputs, which does not need padded images.
+        rval = CorrMM_gradInputs('valid', subsample)(
+            kern.dimshuffle(1, 0, 2, 3), img)
+    rval = patternbroadcast(rval, node.outputs[0].broadcastable)
+    return [rval]
+
+# This must run after the ConvOp have been moved to the GPU, when a GPU is
+# used. It can be disabled by excluding 'conv_gemm'.
+opt.register_specialize_device(local_conv2d_corrmm, 'conv_gemm')
@@ -0,0 +1,195 @@
+// CPU version of the GEMM-based correlation used by GpuCorrMM.
+// The unfolding scheme (im2col / col2im) follows Caffe
+// (http://caffe.berkeleyvision.org/), see sandbox/cuda/corr_gemm.cu for
+// the original license.
+//
+// This file is a template: BaseCorrMM.c_support_code includes it once
+// per dtype (float32 and float64) and fills in the %%(...)s fields.
+
+// Unfold the input patches needed to compute the output rows
+// [row_start, row_end) of one image into data_col, which is a row-major
+// (channels * kernel_h * kernel_w) x ((row_end - row_start) * width_col)
+// matrix.
+static void im2col_%(float_type)s(const %(float_type)s* data_im,
+    const int channels, const int height, const int width,
+    const int kernel_h, const int kernel_w,
+    const int pad_h, const int pad_w,
+    const int stride_h, const int stride_w,
+    const int width_col, const int row_start, const int row_end,
+    %(float_type)s* data_col) {
+  const int n_rows = row_end - row_start;
+  const int channels_col = channels * kernel_h * kernel_w;
+  for (int c = 0; c < channels_col; ++c) {
+    const int w_offset = c %% kernel_w;
+    const int h_offset = (c / kernel_w) %% kernel_h;
+    const int c_im = c / kernel_h / kernel_w;
+    for (int h = 0; h < n_rows; ++h) {
+      const int h_pad = (row_start + h) * stride_h - pad_h + h_offset;
+      %(float_type)s* col = data_col + (c * n_rows + h) * width_col;
+      if (h_pad < 0 || h_pad >= height) {
+        for (int w = 0; w < width_col; ++w)
+          col[w] = 0;
+        continue;
+      }
+      const %(float_type)s* im = data_im + (c_im * height + h_pad) * width;
+      for (int w = 0; w < width_col; ++w) {
+        const int w_pad = w * stride_w - pad_w + w_offset;
+        col[w] = (w_pad >= 0 && w_pad < width) ? im[w_pad] : 0;
+      }
+    }
+  }
+}
+
+// Inverse of im2col: accumulate the column buffer of output rows
+// [row_start, row_end) back into the image. data_im must be initialized
+// by the caller.
+static void col2im_%(float_type)s(const %(float_type)s* data_col,
+    const int channels, const int height, const int width,
+    const int kernel_h, const int kernel_w,
+    const int pad_h, const int pad_w,
+    const int stride_h, const int stride_w,
+    const int width_col, const int row_start, const int row_end,
+    %(float_type)s* data_im) {
+  const int n_rows = row_end - row_start;
+  const int channels_col = channels * kernel_h * kernel_w;
+  for (int c = 0; c < channels_col; ++c) {
+    const int w_offset = c %% kernel_w;
+    const int h_offset = (c / kernel_w) %% kernel_h;
+    const int c_im = c / kernel_h / kernel_w;
+    for (int h = 0; h < n_rows; ++h) {
+      const int h_pad = (row_start + h) * stride_h - pad_h + h_offset;
+      if (h_pad < 0 || h_pad >= height)
+        continue;
+      const %(float_type)s* col = data_col + (c * n_rows + h) * width_col;
+      %(float_type)s* im = data_im + (c_im * height + h_pad) * width;
+      for (int w = 0; w < width_col; ++w) {
+        const int w_pad = w * stride_w - pad_w + w_offset;
+        if (w_pad >= 0 && w_pad < width)
+          im[w_pad] += col[w];
+      }
+    }
+  }
+}
+
+// Compute one of the three directions of the correlation:
+//   direction 0: top = correlate(bottom, weight)
+//   direction 1: weight = grad of top wrt. weight, given bottom and top
+//   direction 2: bottom = grad of top wrt. bottom, given weight and top
+// All three arrays must be C-contiguous and correctly shaped; the one
+// selected by `direction` is overwritten.
+//
+// Each image is unfolded at most `max_rows` output rows at a time, which
+// bounds the size of the temporary column buffer.
+static int corrMM_%(float_type)s(PyArrayObject* bottom,
+                                 PyArrayObject* weight,
+                                 PyArrayObject* top,
+                                 const int direction,
+                                 const int dH, const int dW,
+                                 const int padH, const int padW,
+                                 const npy_intp max_workspace) {
+  const int batchSize = PyArray_DIMS(bottom)[0];
+  const int nChannels = PyArray_DIMS(bottom)[1];
+  const int bottomHeight = PyArray_DIMS(bottom)[2];
+  const int bottomWidth = PyArray_DIMS(bottom)[3];
+  const int nFilters = PyArray_DIMS(weight)[0];
+  const int kH = PyArray_DIMS(weight)[2];
+  const int kW = PyArray_DIMS(weight)[3];
+  const int topHeight = PyArray_DIMS(top)[2];
+  const int topWidth = PyArray_DIMS(top)[3];
+
+  if (PyArray_DIMS(weight)[1] != nChannels) {
+    PyErr_Format(PyExc_ValueError,
+                 "CorrMM: images have %%d channels, but filters have %%d",
+                 nChannels, (int)PyArray_DIMS(weight)[1]);
+    return -1;
+  }
+  if (PyArray_DIMS(top)[0] != batchSize ||
+      PyArray_DIMS(top)[1] != nFilters ||
+      (bottomHeight + 2 * padH - kH) / dH + 1 != topHeight ||
+      (bottomWidth + 2 * padW - kW) / dW + 1 != topWidth) {
+    PyErr_Format(PyExc_ValueError,
+                 "CorrMM: shape mismatch: images (%%d, %%d, %%d, %%d), "
+                 "filters (%%d, %%d, %%d, %%d), outputs (%%d, %%d, %%d, %%d)",
+                 batchSize, nChannels, bottomHeight, bottomWidth,
+                 nFilters, nChannels, kH, kW,
+                 (int)PyArray_DIMS(top)[0], (int)PyArray_DIMS(top)[1],
+                 topHeight, topWidth);
+    return -1;
+  }
+
+  // The column buffer holds (nChannels * kH * kW) rows of
+  // (rows * topWidth) elements.
+  int K = nChannels * kH * kW;
+  int M = nFilters;
+  const int topSize = topHeight * topWidth;
+  const npy_intp row_bytes = (npy_intp)K * topWidth * sizeof(%(float_type)s);
+  int max_rows = topHeight;
+  if (max_workspace > 0 && row_bytes * topHeight > max_workspace) {
+    max_rows = max_workspace / row_bytes;
+    if (max_rows < 1)
+      max_rows = 1;
+  }
+  %(float_type)s* col = (%(float_type)s*)malloc(row_bytes * max_rows + 1);
+  if (NULL == col) {
+    PyErr_Format(PyExc_MemoryError,
+                 "CorrMM: could not allocate a workspace of %%lld bytes",
+                 (long long)(row_bytes * max_rows));
+    return -1;
+  }
+
+  %(float_type)s* bottom_data = (%(float_type)s*)PyArray_DATA(bottom);
+  %(float_type)s* weight_data = (%(float_type)s*)PyArray_DATA(weight);
+  %(float_type)s* top_data = (%(float_type)s*)PyArray_DATA(top);
+  const npy_intp bottom_stride = (npy_intp)nChannels * bottomHeight * bottomWidth;
+  const npy_intp top_stride = (npy_intp)nFilters * topSize;
+  int ldtop = topSize;
+
+  char NTrans = 'N';
+  char Trans = 'T';
+  %(float_type)s one = 1.0;
+  %(float_type)s zero = 0.0;
+
+  if (direction == 1) {
+    memset(weight_data, 0, PyArray_NBYTES(weight));
+  }
+  else if (direction == 2) {
+    memset(bottom_data, 0, PyArray_NBYTES(bottom));
+  }
+
+  for (int n = 0; n < batchSize; ++n) {
+    for (int row = 0; row < topHeight; row += max_rows) {
+      const int row_end = (row + max_rows < topHeight) ?
+                          row + max_rows : topHeight;
+      int N = (row_end - row) * topWidth;
+      %(float_type)s* top_chunk = top_data + n * top_stride + row * topWidth;
+      // BLAS is column-major, so all products below are written for the
+      // transposed, row-major matrices.
+      if (direction == 0) {
+        // top[n] (M x N) = weight (M x K) * col (K x N)
+        im2col_%(float_type)s(bottom_data + n * bottom_stride, nChannels,
+            bottomHeight, bottomWidth, kH, kW, padH, padW, dH, dW,
+            topWidth, row, row_end, col);
+        %(gemm)s(&NTrans, &NTrans, &N, &M, &K, &one, col, &N,
+                 weight_data, &K, &zero, top_chunk, &ldtop);
+      }
+      else if (direction == 1) {
+        // weight (M x K) += top[n] (M x N) * col^T (N x K)
+        im2col_%(float_type)s(bottom_data + n * bottom_stride, nChannels,
+            bottomHeight, bottomWidth, kH, kW, padH, padW, dH, dW,
+            topWidth, row, row_end, col);
+        %(gemm)s(&Trans, &NTrans, &K, &M, &N, &one, col, &N,
+                 top_chunk, &ldtop, &one, weight_data, &K);
+      }
+      else {
+        // col (K x N) = weight^T (K x M) * top[n] (M x N)
+        %(gemm)s(&NTrans, &Trans, &N, &K, &M, &one, top_chunk, &ldtop,
+                 weight_data, &K, &zero, col, &N);
+        col2im_%(float_type)s(col, nChannels, bottomHeight, bottomWidth,
+            kH, kW, padH, padW, dH, dW, topWidth, row, row_end,
+            bottom_data + n * bottom_stride);
+      }
+    }
+  }
+  free(col);
+  return 0;
+}
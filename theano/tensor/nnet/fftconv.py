@@ -0,0 +1,276 @@
+"""
+CPU implementation of 2d convolution through the FFT.
+
+Direct convolution costs O(N * K) for N output pixels and K filter taps,
+while the FFT version costs O(N log N) whatever the size of the filters,
+so it wins for big filters. The legacy
+:class:`ConvOp <theano.tensor.nnet.conv.ConvOp>` is replaced by `FFTConv2D`
+during optimization when the filters are big enough, see
+`local_conv2d_fft`. This is the CPU counterpart of
+:mod:`theano.sandbox.cuda.fftconv`.
+"""
+import logging
+
+import numpy
+
+import theano
+from theano import gof
+from theano.compile.sharedvalue import SharedVariable
+from theano.configparser import AddConfigVar, IntParam
+from theano.gof import Apply, Constant
+from theano.tensor import as_tensor_variable, opt, patternbroadcast, TensorType
+from theano.tensor.nnet.conv import ConvOp
+
+_logger = logging.getLogger("theano.tensor.nnet.fftconv")
+
+AddConfigVar('conv.fft_min_kernel_size',
+             "Smallest number of taps (rows * columns) of the filters of a "
+             "ConvOp for it to be replaced by the CPU FFT convolution. "
+             "0 disables the replacement.",
+             IntParam(121, lambda i: i >= 0))
+
+
+def next_fast_len(n):
+    """Return the smallest integer not smaller than `n` that has no prime
+    factor other than 2, 3 and 5.
+
+    The FFT of such sizes is much faster than the FFT of sizes with large
+    prime factors, and zero-padding the signals to it does not change the
+    result of the convolution.
+    """
+    if n <= 6:
+        return n
+    best = 2 ** (n - 1).bit_length()
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            # smallest power of two such that p2 * p35 >= n
+            p2 = 2 ** ((-(-n // p35)) - 1).bit_length()
+            if p2 * p35 == n:
+                return n
+            best = min(best, p2 * p35)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+if hasattr(numpy, 'matmul'):
+    _batched_dot = numpy.matmul
+else:
+    def _batched_dot(a, b):
+        return numpy.einsum('...ij,...jk->...ik', a, b)
+
+
+class FFTConv2D(gof.Op):
+    """Convolve a batch of multi-channel images with a set of filters by
+    multiplying their spectra. Computes the same thing as `ConvOp` without
+    subsampling: the filters are flipped.
+
+    :param border_mode: 'valid' or 'full'
+    :param cache_filters: keep the spectrum of the filters from one call
+        to the next, and recompute it only when their value changes. This
+        saves one FFT per call when the filters come from shared variables
+        or constants.
+
+    The images and filters are zero-padded to sizes for which the FFT is
+    fast. All the images (and all the filters) are transformed in a single
+    batched numpy call, and the sum over the input channels is done as a
+    batched matrix product in the frequency domain.
+    """
+    __props__ = ('border_mode', 'cache_filters')
+
+    def __init__(self, border_mode='valid', cache_filters=False):
+        if border_mode not in ('valid', 'full'):
+            raise ValueError('invalid border_mode %s, which must be either '
+                             '"valid" or "full"' % str(border_mode))
+        self.border_mode = border_mode
+        self.cache_filters = bool(cache_filters)
+
+    def __str__(self):
+        return '%s{%s}' % (self.__class__.__name__, self.border_mode)
+
+    def make_node(self, img, kern):
+        img = as_tensor_variable(img)
+        kern = as_tensor_variable(kern)
+        if img.type.ndim != 4:
+            raise TypeError('img must be 4D tensor')
+        if kern.type.ndim != 4:
+            raise TypeError('kern must be 4D tensor')
+        dtype = theano.scalar.upcast(img.dtype, kern.dtype)
+        if dtype not in ('float32', 'float64'):
+            raise TypeError('%s: only float32 and float64 are supported, '
+                            'got %s' % (self.__class__.__name__, dtype))
+        broadcastable = [img.type.broadcastable[0],
+                         kern.type.broadcastable[0], False, False]
+        return Apply(self, [img, kern], [TensorType(dtype, broadcastable)()])
+
+    def infer_shape(self, node, input_shapes):
+        imshp, kshp = input_shapes
+        if self.border_mode == 'valid':
+            out = [imshp[i] - kshp[i] + 1 for i in (2, 3)]
+        else:
+            out = [imshp[i] + kshp[i] - 1 for i in (2, 3)]
+        return [(imshp[0], kshp[0]) + tuple(out)]
+
+    def fft_shape(self, imshp, kshp):
+        """Return the size of the transforms for images of shape `imshp`
+        and filters of shape `kshp`.
+
+        The valid part of a linear convolution is not affected by the
+        wrap-around of a circular convolution as long as the transform is
+        at least as big as the images, so 'valid' needs less padding than
+        'full'.
+        """
+        if self.border_mode == 'valid':
+            return tuple(next_fast_len(imshp[i]) for i in (2, 3))
+        return tuple(next_fast_len(imshp[i] + kshp[i] - 1) for i in (2, 3))
+
+    @staticmethod
+    def filter_spectrum(kern, fft_shape):
+        """Return the spectrum of `kern`, laid out as
+        (rows, columns, channels, filters) for `_batched_dot`."""
+        f = numpy.fft.rfft2(kern, s=fft_shape)
+        return numpy.ascontiguousarray(f.transpose(2, 3, 1, 0))
+
+    def check_shapes(self, imshp, kshp):
+        if imshp[1] != kshp[1]:
+            raise ValueError('%s: images have %d channels, but filters have '
+                             '%d' % (self.__class__.__name__, imshp[1],
+                                     kshp[1]))
+        if (self.border_mode == 'valid' and
+                (imshp[2] < kshp[2] or imshp[3] < kshp[3])):
+            raise ValueError('%s: the filters (%d, %d) are bigger than the '
+                             'images (%d, %d) in valid mode' %
+                             (self.__class__.__name__, kshp[2], kshp[3],
+                              imshp[2], imshp[3]))
+
+    def convolve(self, img, kshp, kern_f, fft_shape, dtype):
+        """Convolve `img` with the filters of shape `kshp` whose spectrum,
+        as returned by `filter_spectrum`, is `kern_f`."""
+        img_f = numpy.fft.rfft2(img, s=fft_shape).transpose(2, 3, 0, 1)
+        out_f = _batched_dot(img_f, kern_f).transpose(2, 3, 0, 1)
+        # The inverse transform is much faster along contiguous axes.
+        out = numpy.fft.irfft2(numpy.ascontiguousarray(out_f), s=fft_shape)
+        if self.border_mode == 'valid':
+            out = out[:, :, kshp[2] - 1:img.shape[2],
+                      kshp[3] - 1:img.shape[3]]
+        else:
+            out = out[:, :, :img.shape[2] + kshp[2] - 1,
+                      :img.shape[3] + kshp[3] - 1]
+        return numpy.ascontiguousarray(out, dtype=dtype)
+
+    def perform(self, node, inp, out_):
+        img, kern = inp
+        out, = out_
+        self.check_shapes(img.shape, kern.shape)
+        fft_shape = self.fft_shape(img.shape, kern.shape)
+        out[0] = self.convolve(img, kern.shape,
+                               self.filter_spectrum(kern, fft_shape),
+                               fft_shape, node.outputs[0].dtype)
+
+    def make_thunk(self, node, storage_map, compute_map, no_recycling):
+        if not self.cache_filters:
+            return super(FFTConv2D, self).make_thunk(
+                node, storage_map, compute_map, no_recycling)
+
+        inputs = [storage_map[v] for v in node.inputs]
+        outputs = [storage_map[v] for v in node.outputs]
+        dtype = node.outputs[0].dtype
+
+        # A copy of the filters the spectrum was computed from, the size of
+        # the transform and the spectrum. The filters are compared by value
+        # as the buffer of a shared variable can be updated inplace.
+        cache = [None, None, None]
+
+        def thunk():
+            img, kern = inputs[0][0], inputs[1][0]
+            self.check_shapes(img.shape, kern.shape)
+            fft_shape = self.fft_shape(img.shape, kern.shape)
+            if (cache[1] != fft_shape or cache[0].shape != kern.shape or
+                    not numpy.array_equal(cache[0], kern)):
+                cache[:] = [kern.copy(), fft_shape,
+                            self.filter_spectrum(kern, fft_shape)]
+            outputs[0][0] = self.convolve(img, kern.shape, cache[2],
+                                          fft_shape, dtype)
+            for o in node.outputs:
+                compute_map[o][0] = True
+
+        thunk.inputs = inputs
+        thunk.outputs = outputs
+        thunk.lazy = False
+        return thunk
+
+    def grad(self, inp, grads):
+        img, kern = inp
+        top, = grads
+        top = as_tensor_variable(top)
+        # The gradients of a convolution are convolutions of the output
+        # gradient with the flipped filters or images, where the batch and
+        # channel axes play each other's role.
+        kern_t = kern.dimshuffle(1, 0, 2, 3)[:, :, ::-1, ::-1]
+        if self.border_mode == 'valid':
+            d_img = FFTConv2D('full')(top, kern_t)
+            d_kern = FFTConv2D('valid')(
+                img.dimshuffle(1, 0, 2, 3),
+                top.dimshuffle(1, 0, 2, 3)[:, :, ::-1, ::-1])
+            d_kern = d_kern.dimshuffle(1, 0, 2, 3)[:, :, ::-1, ::-1]
+        else:
+            d_img = FFTConv2D('valid')(top, kern_t)
+            d_kern = FFTConv2D('valid')(
+                top.dimshuffle(1, 0, 2, 3),
+                img.dimshuffle(1, 0, 2, 3)[:, :, ::-1, ::-1])
+        d_img = patternbroadcast(d_img.astype(img.dtype),
+                                 img.broadcastable)
+        d_kern = patternbroadcast(d_kern.astype(kern.dtype),
+                                  kern.broadcastable)
+        return d_img, d_kern
+
+
+def fftconv_is_faster(op):
+    """Return True if the `ConvOp` `op` is expected to run faster as
+    `FFTConv2D`.
+
+    The cost of the FFT does not depend on the size of the filters, so
+    this only looks at the number of taps of the filters, compared to the
+    `conv.fft_min_kernel_size` flag. The default comes from
+    benchmark/convolution/conv2d_fft.py. All the shapes must be known, as
+    `ConvOp` checks them at run time.
+    """
+    min_size = theano.config.conv.fft_min_kernel_size
+    if not min_size:
+        return False
+    if not op.has_all_shape(op.imshp, op.kshp, op.nkern, op.bsize):
+        return False
+    return op.kshp[0] * op.kshp[1] >= min_size
+
+
+@gof.local_optimizer([ConvOp])
+def local_conv2d_fft(node):
+    """Replace `ConvOp` by `FFTConv2D` when the filters are big.
+
+    The spectrum of the filters is cached between calls when they only
+    depend on shared variables and constants.
+    """
+    if not isinstance(node.op, ConvOp):
+        return
+    op = node.op
+    if (op.imshp != op.imshp_logical or op.kshp != op.kshp_logical or
+            (op.dx, op.dy) != (1, 1) or
+            node.outputs[0].dtype not in ('float32', 'float64')):
+        return
+    if not fftconv_is_faster(op):
+        return
+    img, kern = node.inputs
+    cache_filters = all(isinstance(v, (SharedVariable, Constant))
+                        for v in gof.graph.inputs([kern]))
+    rval = FFTConv2D(op.out_mode, cache_filters)(img, kern)
+    if rval.dtype != node.outputs[0].dtype:
+        rval = rval.astype(node.outputs[0].dtype)
+    rval = patternbroadcast(rval, node.outputs[0].broadcastable)
+    return [rval]
+
+# Like local_conv2d_corrmm, this must run after the ConvOp have been moved
+# to the GPU. It is registered first, so it gets to try the big filters
+# before the gemm version. It can be disabled by excluding 'conv_fft'.
+opt.register_specialize_device(local_conv2d_fft, 'conv_fft')
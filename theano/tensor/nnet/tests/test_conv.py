@@ -13,7 +13,8 @@ from theano.tensor.basic import _allclose, NotScalarConstantError
 
 
 class TestConv2D(utt.InferShapeTester):
-    mode = None
+    # This tests the C code of ConvOp, so CorrMM must not replace it.
+    mode = theano.compile.get_default_mode().excluding('conv_gemm')
     dtype = theano.config.floatX
 
     def setUp(self):
@@ -473,6 +474,22 @@ class TestConv2D(utt.InferShapeTester):
         self.assertRaises(ValueError, out, numpy.ones((2, 1, 10, 10),
                                                       dtype='float32'))
 
+    def test_static_shapes(self):
+        # The shapes made constant by specify_shape are given to ConvOp.
+        im = T.dtensor4()
+        k = theano.shared(numpy.random.rand(4, 2, 3, 3))
+        out = T.nnet.conv2d(T.specify_shape(im, (5, 2, 8, 8)),
+                            T.specify_shape(k, (4, 2, 3, 3)))
+        f = theano.function([im], out, mode=self.mode)
+        ops = [node.op for node in f.maker.fgraph.toposort()
+               if isinstance(node.op, conv.ConvOp)]
+        assert len(ops) == 1
+        assert ops[0].bsize == 5 and ops[0].nkern == 4
+        assert ops[0].imshp == (2, 8, 8) and ops[0].kshp == (3, 3)
+        val = numpy.random.rand(5, 2, 8, 8)
+        g = theano.function([im], T.nnet.conv2d(im, k), mode=self.mode)
+        utt.assert_allclose(f(val), g(val))
+
     def test_infer_shape(self):
     # Note: infer_shape is incomplete and thus input and filter shapes
     # must be provided explicitly
@@ -0,0 +1,149 @@
+from nose.plugins.skip import SkipTest
+import numpy
+
+import theano
+import theano.tensor as T
+from theano.tests import unittest_tools as utt
+from theano.tensor.nnet import conv, corr
+
+
+class TestCorr2D(utt.InferShapeTester):
+    mode = None
+    dtype = theano.config.floatX
+
+    def setUp(self):
+        super(TestCorr2D, self).setUp()
+        self.input = T.tensor4('input', dtype=self.dtype)
+        self.filters = T.tensor4('filters', dtype=self.dtype)
+        if not theano.config.blas.ldflags or not theano.config.cxx:
+            raise SkipTest("CorrMM tests need a BLAS library and a c++ "
+                           "compiler")
+
+    def validate(self, image_shape, filter_shape,
+                 border_mode='valid', subsample=(1, 1), verify_grad=True):
+        """Compare conv2d lifted to CorrMM with conv2d computed by ConvOp,
+        then check the gradients of the CorrMM graph."""
+        image_data = numpy.random.random(image_shape).astype(self.dtype)
+        filter_data = numpy.random.random(filter_shape).astype(self.dtype)
+
+        def sym_conv2d(input, filters):
+            return conv.conv2d(input, filters, border_mode=border_mode,
+                               subsample=subsample)
+        output = sym_conv2d(self.input, self.filters)
+
+        mode = self.mode.including('conv_gemm')
+        f = theano.function([self.input, self.filters], output, mode=mode)
+        assert any(isinstance(node.op, corr.BaseCorrMM)
+                   for node in f.maker.fgraph.toposort())
+        f_ref = theano.function([self.input, self.filters], output,
+                                mode=self.mode.excluding('conv_gemm'))
+        assert not any(isinstance(node.op, corr.BaseCorrMM)
+                       for node in f_ref.maker.fgraph.toposort())
+        utt.assert_allclose(f_ref(image_data, filter_data),
+                            f(image_data, filter_data))
+
+        if verify_grad:
+            utt.verify_grad(sym_conv2d, [image_data, filter_data],
+                            mode=mode)
+
+    def test_basic(self):
+        self.validate((3, 2, 8, 8), (4, 2, 5, 5), 'valid', verify_grad=False)
+        self.validate((3, 2, 7, 5), (5, 2, 2, 3), 'valid')
+        self.validate((3, 2, 8, 8), (4, 2, 5, 5), 'full', verify_grad=False)
+        self.validate((3, 2, 7, 5), (5, 2, 2, 3), 'full')
+
+    def test_img_kernel_same_shape(self):
+        self.validate((3, 2, 3, 3), (4, 2, 3, 3), 'full')
+        self.validate((3, 2, 3, 3), (4, 2, 3, 3), 'valid')
+
+    def test_subsample(self):
+        self.validate((3, 2, 7, 5), (5, 2, 2, 3), 'valid', (2, 2),
+                      verify_grad=False)
+        self.validate((3, 2, 7, 5), (5, 2, 2, 3), 'valid', (1, 3),
+                      verify_grad=False)
+        self.validate((3, 2, 7, 5), (5, 2, 2, 3), 'full', (3, 1),
+                      verify_grad=False)
+
+    def test_workspace_chunks(self):
+        # A workspace smaller than one unfolded image makes CorrMM process
+        # the output a few rows at a time.
+        old = theano.config.conv.corrmm_workspace_mb
+        theano.config.conv.corrmm_workspace_mb = 1
+        try:
+            self.validate((2, 16, 140, 130), (3, 16, 3, 3), 'valid',
+                          verify_grad=False)
+            self.validate((2, 16, 140, 130), (3, 16, 3, 3), 'full',
+                          verify_grad=False)
+        finally:
+            theano.config.conv.corrmm_workspace_mb = old
+
+    def test_grad_ops(self):
+        # Check the gradients of the three ops directly, with padding and
+        # subsampling that conv2d does not produce.
+        for border_mode in ['valid', 'full', 'half', (1, 2)]:
+            for subsample in [(1, 1), (2, 1)]:
+                image_data = numpy.random.random((2, 3, 6, 7))
+                filter_data = numpy.random.random((4, 3, 3, 2))
+
+                def f(img, kern):
+                    return corr.CorrMM(border_mode, subsample)(img, kern)
+                utt.verify_grad(f, [image_data, filter_data])
+
+                top = corr.CorrMM(border_mode, subsample)(
+                    image_data, filter_data).eval()
+
+                def f_w(img, top):
+                    return corr.CorrMM_gradWeights(border_mode, subsample)(
+                        img, top, filter_data.shape[-2:])
+                utt.verify_grad(f_w, [image_data, top])
+
+                def f_i(kern, top):
+                    return corr.CorrMM_gradInputs(border_mode, subsample)(
+                        kern, top, image_data.shape[-2:])
+                utt.verify_grad(f_i, [filter_data, top])
+
+    def test_perform(self):
+        # The python implementation must agree with the C one.
+        image_data = numpy.random.random((2, 3, 6, 7))
+        filter_data = numpy.random.random((4, 3, 3, 2))
+        img = T.dtensor4()
+        kern = T.dtensor4()
+        for border_mode in ['valid', 'full', 'half', (1, 2)]:
+            for subsample in [(1, 1), (2, 3)]:
+                out = corr.CorrMM(border_mode, subsample)(img, kern)
+                outs = [out] + T.grad(out.sum(), [img, kern])
+                f_c = theano.function([img, kern], outs,
+                                      mode=self.mode)
+                f_py = theano.function([img, kern], outs,
+                                       mode=theano.Mode(linker='py',
+                                                        optimizer='fast_run'))
+                for a, b in zip(f_c(image_data, filter_data),
+                                f_py(image_data, filter_data)):
+                    utt.assert_allclose(a, b)
+
+    def test_infer_shape(self):
+        adtens = T.dtensor4()
+        bdtens = T.dtensor4()
+        cdtens = T.dtensor4()
+        adtens_val = numpy.random.rand(4, 5, 9, 7)
+        bdtens_val = numpy.random.rand(6, 5, 3, 2)
+        for border_mode in ['valid', 'full', 'half', (1, 2)]:
+            for subsample in [(1, 1), (2, 3)]:
+                op = corr.CorrMM(border_mode, subsample)
+                self._compile_and_check([adtens, bdtens],
+                                        [op(adtens, bdtens)],
+                                        [adtens_val, bdtens_val], corr.CorrMM,
+                                        warn=False)
+                top_val = op(adtens_val, bdtens_val).eval()
+                self._compile_and_check(
+                    [adtens, cdtens],
+                    [corr.CorrMM_gradWeights(border_mode, subsample)(
+                        adtens, cdtens, bdtens_val.shape[-2:])],
+                    [adtens_val, top_val], corr.CorrMM_gradWeights,
+                    warn=False)
+                self._compile_and_check(
+                    [bdtens, cdtens],
+                    [corr.CorrMM_gradInputs(border_mode, subsample)(
+                        bdtens, cdtens, adtens_val.shape[-2:])],
+                    [bdtens_val, top_val], corr.CorrMM_gradInputs,
+                    warn=False)
@@ -0,0 +1,164 @@
+import numpy
+
+import theano
+import theano.tensor as T
+from theano.tests import unittest_tools as utt
+from theano.tensor.nnet import conv, fftconv
+from theano.tensor.signal import conv as signal_conv
+
+
+class TestFFTConv2D(utt.InferShapeTester):
+    mode = None
+    dtype = theano.config.floatX
+
+    def setUp(self):
+        super(TestFFTConv2D, self).setUp()
+        self.input = T.tensor4('input', dtype=self.dtype)
+        self.filters = T.tensor4('filters', dtype=self.dtype)
+        self.mode = theano.compile.get_default_mode()
+
+    def validate(self, image_shape, filter_shape, border_mode='valid',
+                 verify_grad=True):
+        """Compare conv2d lifted to FFTConv2D with conv2d computed by
+        ConvOp, then check the gradients of the FFTConv2D graph."""
+        image_data = numpy.random.random(image_shape).astype(self.dtype)
+        filter_data = numpy.random.random(filter_shape).astype(self.dtype)
+
+        def sym_conv2d(input, filters):
+            return conv.conv2d(input, filters, border_mode=border_mode,
+                               image_shape=image_shape,
+                               filter_shape=filter_shape)
+        output = sym_conv2d(self.input, self.filters)
+
+        old = theano.config.conv.fft_min_kernel_size
+        theano.config.conv.fft_min_kernel_size = 1
+        try:
+            mode = self.mode.including('conv_fft')
+            f = theano.function([self.input, self.filters], output,
+                                mode=mode)
+            assert any(isinstance(node.op, fftconv.FFTConv2D)
+                       for node in f.maker.fgraph.toposort())
+            f_ref = theano.function(
+                [self.input, self.filters], output,
+                mode=self.mode.excluding('conv_fft', 'conv_gemm'))
+            assert not any(isinstance(node.op, fftconv.FFTConv2D)
+                           for node in f_ref.maker.fgraph.toposort())
+            utt.assert_allclose(f_ref(image_data, filter_data),
+                                f(image_data, filter_data))
+
+            if verify_grad:
+                utt.verify_grad(sym_conv2d, [image_data, filter_data],
+                                mode=mode)
+        finally:
+            theano.config.conv.fft_min_kernel_size = old
+
+    def test_basic(self):
+        self.validate((3, 2, 8, 8), (4, 2, 5, 5), 'valid', verify_grad=False)
+        self.validate((3, 2, 7, 5), (5, 2, 2, 3), 'valid')
+        self.validate((3, 2, 8, 8), (4, 2, 5, 5), 'full', verify_grad=False)
+        self.validate((3, 2, 7, 5), (5, 2, 2, 3), 'full')
+
+    def test_img_kernel_same_shape(self):
+        self.validate((3, 2, 3, 3), (4, 2, 3, 3), 'full')
+        self.validate((3, 2, 3, 3), (4, 2, 3, 3), 'valid')
+
+    def test_1d(self):
+        self.validate((2, 3, 1, 67), (4, 3, 1, 13), 'valid')
+        self.validate((2, 3, 1, 67), (4, 3, 1, 13), 'full')
+
+    def test_threshold(self):
+        # Only filters with at least conv.fft_min_kernel_size taps are
+        # replaced.
+        output = conv.conv2d(self.input, self.filters,
+                             image_shape=(2, 3, 40, 40),
+                             filter_shape=(4, 3, 11, 11))
+        mode = self.mode.including('conv_fft')
+        old = theano.config.conv.fft_min_kernel_size
+        try:
+            for min_size, used in [(121, True), (122, False), (0, False)]:
+                theano.config.conv.fft_min_kernel_size = min_size
+                f = theano.function([self.input, self.filters], output,
+                                    mode=mode)
+                assert used == any(isinstance(node.op, fftconv.FFTConv2D)
+                                   for node in f.maker.fgraph.toposort())
+        finally:
+            theano.config.conv.fft_min_kernel_size = old
+
+    def test_signal_conv(self):
+        # signal.conv2d is also lifted, and the spectrum of shared filters
+        # is cached.
+        image_data = numpy.random.random((5, 30, 30)).astype(self.dtype)
+        filter_data = numpy.random.random((2, 12, 12)).astype(self.dtype)
+        filters = theano.shared(filter_data)
+        img = T.tensor3(dtype=self.dtype)
+        output = signal_conv.conv2d(img, filters, image_shape=(5, 30, 30),
+                                    filter_shape=(2, 12, 12))
+        f = theano.function([img], output,
+                            mode=self.mode.including('conv_fft'))
+        ops = [node.op for node in f.maker.fgraph.toposort()
+               if isinstance(node.op, fftconv.FFTConv2D)]
+        assert len(ops) == 1 and ops[0].cache_filters
+        f_ref = theano.function(
+            [img], output, mode=self.mode.excluding('conv_fft', 'conv_gemm'))
+        utt.assert_allclose(f_ref(image_data), f(image_data))
+
+    def test_cache_filters(self):
+        # The cached spectrum must follow the value of the filters, even
+        # when they are updated inplace.
+        image_data = numpy.random.random((2, 3, 9, 8))
+        filter_data = numpy.random.random((4, 3, 3, 2))
+        filters = theano.shared(filter_data)
+        img = T.dtensor4()
+        for border_mode in ['valid', 'full']:
+            out = fftconv.FFTConv2D(border_mode, cache_filters=True)(
+                img, filters)
+            f = theano.function([img], out, mode=self.mode)
+            ref = fftconv.FFTConv2D(border_mode)(img, filters)
+            f_ref = theano.function([img], ref, mode=self.mode)
+            utt.assert_allclose(f_ref(image_data), f(image_data))
+            utt.assert_allclose(f_ref(image_data), f(image_data))
+            filters.get_value(borrow=True)[0, 1, 2, 1] += 1
+            utt.assert_allclose(f_ref(image_data), f(image_data))
+            filters.set_value(numpy.random.random((2, 3, 4, 4)))
+            utt.assert_allclose(f_ref(image_data), f(image_data))
+            filters.set_value(filter_data)
+
+    def test_grad(self):
+        for border_mode in ['valid', 'full']:
+            utt.verify_grad(fftconv.FFTConv2D(border_mode),
+                            [numpy.random.random((2, 3, 6, 7)),
+                             numpy.random.random((4, 3, 3, 2))])
+
+    def test_bad_shapes(self):
+        img = T.dtensor4()
+        kern = T.dtensor4()
+        f = theano.function([img, kern], fftconv.FFTConv2D('valid')(img,
+                                                                    kern))
+        self.assertRaises(ValueError, f, numpy.zeros((2, 3, 6, 7)),
+                          numpy.zeros((4, 2, 3, 3)))
+        self.assertRaises(ValueError, f, numpy.zeros((2, 3, 6, 7)),
+                          numpy.zeros((4, 3, 7, 3)))
+
+    def test_infer_shape(self):
+        adtens = T.dtensor4()
+        bdtens = T.dtensor4()
+        adtens_val = numpy.random.rand(4, 5, 9, 7)
+        bdtens_val = numpy.random.rand(6, 5, 3, 2)
+        for border_mode in ['valid', 'full']:
+            self._compile_and_check([adtens, bdtens],
+                                    [fftconv.FFTConv2D(border_mode)(adtens,
+                                                                    bdtens)],
+                                    [adtens_val, bdtens_val],
+                                    fftconv.FFTConv2D)
+
+
+def test_next_fast_len():
+    def is_fast(n):
+        for p in (2, 3, 5):
+            while n % p == 0:
+                n //= p
+        return n == 1
+    for n in [1, 2, 5, 7, 11, 13, 64, 65, 97, 127, 1000, 1021]:
+        m = fftconv.next_fast_len(n)
+        assert m >= n and is_fast(m)
+        assert not any(is_fast(i) for i in range(n, m))
@@ -177,7 +177,8 @@ def broadcast_like(value, template, fgraph, dtype=None):
 
 
 theano.configparser.AddConfigVar('tensor.insert_inplace_optimizer_validate_nb',
-        "-1: auto, if graph have less then 500 nodes 1, else 10",
+        "Number of changes after which the graph is validated. "
+        "-1: auto, which validates after each change",
         theano.configparser.IntParam(-1),
         in_c_key=False)
 
@@ -201,32 +202,14 @@ def inplace_elemwise_optimizer_op(OP):
           x + y + z -> x += y += z
           (x + y) * (x * y) -> (x += y) *= (x * y) or (x + y) *= (x *= y)
         """
-        # We should not validate too often as this takes too much time to
-        # execute!
-        # It is the _dfs_toposort() fct in theano/gof/destroyhandler.py
-        # that takes so much time.
-        # Should we try to use another lib that does toposort?
-        #   igraph: http://igraph.sourceforge.net/
-        #   networkx: https://networkx.lanl.gov/
-        # Should we try to use cython?
-        #   Compiling only that fct is not enough, should we try to add the
-        #   deque class too?
-        #   And init the deque and other list to an upper bound number of
-        #   elements?
-        # Maybe Theano should do online toposort as in
-        #   http://code.google.com/p/acyclic
-        #
-        # The next longest optimizer is the canonizer phase.
-        # Then I think it is the [io_?]toposort (need to validate) so check if
-        # the solution is also applicable there.
+        # The DestroyHandler validates incrementally, so validating after
+        # each change costs little, and a change that fails does not revert
+        # the ones made since the previous validation.
 
         # We execute `validate` after this number of change.
         check_each_change = config.tensor.insert_inplace_optimizer_validate_nb
         if check_each_change == -1:
-            if len(fgraph.apply_nodes) > 500:
-                check_each_change = 10
-            else:
-                check_each_change = 1
+            check_each_change = 1
 
         nb_change_no_validate = 0
         chk = fgraph.checkpoint()
@@ -2658,6 +2641,92 @@ def local_incsubtensor_of_zeros(node):
             return False
 
 
+def _inc_subtensor1_of_zeros(var):
+    """Return the owner of `var` if it is AdvancedIncSubtensor1(0s, y, idx).
+
+    This is the graph of the gradient of x[idx] with respect to x.
+    """
+    if (var.owner and isinstance(var.owner.op, AdvancedIncSubtensor1) and
+            not var.owner.op.set_instead_of_inc and
+            T.extract_constant(var.owner.inputs[0]) == 0):
+        return var.owner
+
+
+@register_canonicalize
+@register_specialize
+@gof.local_optimizer([T.mul, T.neg, T.sub, T.add])
+def local_elemwise_of_inc_subtensor1_zeros(node):
+    """
+    mul(s, AdvancedIncSubtensor1(0s, y, idx))
+        -> AdvancedIncSubtensor1(0s, s * y, idx)
+    neg(AdvancedIncSubtensor1(0s, y, idx))
+        -> AdvancedIncSubtensor1(0s, -y, idx)
+    sub(x, AdvancedIncSubtensor1(0s, y, idx))
+        -> AdvancedIncSubtensor1(x, -y, idx)
+    add(x, AdvancedIncSubtensor1(0s, y, idx))
+        -> AdvancedIncSubtensor1(x, y, idx)
+    add(x, sqr(AdvancedIncSubtensor1(0s, y, idx)))
+        -> AdvancedIncSubtensor1(x, sqr(y2), idx2)
+
+    where s is broadcastable in all dimensions and (idx2, y2) is
+    merge_duplicate_rows(idx, y).
+
+    The gradient of x[idx] increments a tensor of zeros as big as x, so
+    an update like x - lr * grad(cost, x) computes the full tensor twice.
+    This moves the scaling into the rows and the subtraction into the
+    increment, which local_inplace_incsubtensor1 then does inplace in x.
+    The square of the gradient, as accumulated by AdaGrad, needs the rows
+    of repeated indices to be summed first.
+    The mul and neg cases build a new tensor of zeros, so they are only
+    applied when the gradient has no other client.
+    """
+    if not isinstance(node.op, Elemwise):
+        return False
+    out = node.outputs[0]
+    if node.op == T.mul:
+        incs = [i for i in node.inputs if _inc_subtensor1_of_zeros(i)]
+        if len(incs) != 1 or incs[0].type != out.type:
+            return False
+        inc = incs[0].owner
+        if len(inc.outputs[0].clients) != 1:
+            return False
+        scalars = [i for i in node.inputs if i is not incs[0]]
+        if not all(all(s.broadcastable) for s in scalars):
+            return False
+        y = inc.inputs[1]
+        # The increment may have less dimensions than x.
+        drop = out.ndim - y.ndim
+        scalars = [s.dimshuffle(range(drop, out.ndim)) for s in scalars]
+        return [inc.op(inc.inputs[0], T.mul(y, *scalars), inc.inputs[2])]
+    elif node.op == T.neg:
+        inc = _inc_subtensor1_of_zeros(node.inputs[0])
+        if inc is None or len(inc.outputs[0].clients) != 1:
+            return False
+        return [inc.op(inc.inputs[0], -inc.inputs[1], inc.inputs[2])]
+    elif node.op == T.sub:
+        x, grad = node.inputs
+        inc = _inc_subtensor1_of_zeros(grad)
+        if (inc is None or x.type != out.type or grad.type != out.type):
+            return False
+        return [inc.op(x, -inc.inputs[1], inc.inputs[2])]
+    elif node.op == T.add and len(node.inputs) == 2:
+        for x, grad in [node.inputs, node.inputs[::-1]]:
+            if x.type != out.type or grad.type != out.type:
+                continue
+            inc = _inc_subtensor1_of_zeros(grad)
+            if inc is not None:
+                return [inc.op(x, inc.inputs[1], inc.inputs[2])]
+            if (grad.owner and grad.owner.op == T.sqr and
+                    len(grad.clients) == 1):
+                inc = _inc_subtensor1_of_zeros(grad.owner.inputs[0])
+                if inc is not None and inc.inputs[1].ndim == out.ndim:
+                    from theano.tensor.extra_ops import merge_duplicate_rows
+                    idx, rows = merge_duplicate_rows(inc.inputs[2],
+                                                     inc.inputs[1])
+                    return [inc.op(x, T.sqr(rows), idx)]
+    return False
+
+
 @register_canonicalize('local_setsubtensor_of_allocs')
 @register_stabilize('local_setsubtensor_of_allocs')
 @gof.local_optimizer([IncSubtensor])
@@ -11,7 +11,7 @@ import __builtin__
 import numpy
 
 import theano
-from theano import gof, Op, tensor, Variable, Apply
+from theano import gof, OpenMPOp, tensor, Variable, Apply
 
 
 def max_pool2D(*args, **kwargs):
@@ -101,11 +101,25 @@ def max_pool_2d(input, ds, ignore_border=False, st=None, padding=(0, 0),
     return tensor.reshape(output, outshp, ndim=input.ndim)
 
 
-class DownsampleFactorMax(Op):
+def _omp_parallel(openmp, size):
+    """Return the pragma to put before the loop over the images of the
+    batch and the channels in the C code of the ops below. Like in
+    Elemwise, the loop stays serial if the C expression `size` is smaller
+    than `theano.config.openmp_elemwise_minsize`."""
+    if openmp:
+        return ('#pragma omp parallel for schedule(static) if(%s >= %d)' %
+                (size, theano.config.openmp_elemwise_minsize))
+    return ''
+
+
+class DownsampleFactorMax(OpenMPOp):
     """For N-dimensional tensors, consider that the last two
     dimensions span images.  This Op downsamples these images by
     taking the max, sum or average over different patch.
 
+    The C code processes the images of the batch and the channels in
+    parallel when OpenMP is enabled.
+
     """
     __props__ = ('ds', 'ignore_border', 'st', 'padding', 'mode')
 
@@ -187,7 +201,7 @@ class DownsampleFactorMax(Op):
         return rval
 
     def __init__(self, ds, ignore_border=False, st=None, padding=(0, 0),
-                 mode='max'):
+                 mode='max', openmp=None):
         """ Take the max, sum or average or different input patches.
 
         :param ds: downsample factor over rows and column.
@@ -214,7 +228,11 @@ class DownsampleFactorMax(Op):
             ('average_inc_pad' excludes the padding from the count,
             'average_exc_pad' include it)
 
+        :param openmp: use OpenMP in the C code. Defaults to
+            `config.openmp`.
+
         """
+        super(DownsampleFactorMax, self).__init__(openmp=openmp)
         self.ds = tuple(ds)
         if not all([isinstance(d, int) for d in ds]):
             raise ValueError(
@@ -312,11 +330,11 @@ class DownsampleFactorMax(Op):
         return [DownsampleFactorMaxGrad(self.ds,
                                         ignore_border=self.ignore_border,
                                         st=self.st, padding=self.padding,
-                                        mode=self.mode)(
+                                        mode=self.mode, openmp=self.openmp)(
                                             x, maxout, gz)]
 
     def c_headers(self):
-        return ['<algorithm>']
+        return ['<algorithm>'] + super(DownsampleFactorMax, self).c_headers()
 
     def c_code(self, node, name, inp, out, sub):
         if self.mode not in ('max', 'sum', 'average_exc_pad', 'average_inc_pad'):
@@ -328,6 +346,8 @@ class DownsampleFactorMax(Op):
         ds0, ds1 = self.ds
         st0, st1 = self.st
         pd0, pd1 = self.padding
+        omp_parallel = _omp_parallel(self.openmp,
+                                     'PyArray_SIZE(%s)' % x)
         ccode = """
         int typenum = PyArray_ObjectType((PyObject*)%(x)s, 0);
         int z_r, z_c; // shape of the output
@@ -392,7 +412,7 @@ class DownsampleFactorMax(Op):
         }
         // memory allocation of z if necessary
         if ((!%(z)s)
-          || *PyArray_DIMS(%(z)s)!=4
+          || PyArray_NDIM(%(z)s)!=4
           ||(PyArray_DIMS(%(z)s)[0] != PyArray_DIMS(%(x)s)[0])
           ||(PyArray_DIMS(%(z)s)[1] != PyArray_DIMS(%(x)s)[1])
           ||(PyArray_DIMS(%(z)s)[2] != z_r)
@@ -409,13 +429,18 @@ class DownsampleFactorMax(Op):
           %(z)s = (PyArrayObject*) PyArray_ZEROS(4, dims, typenum,0);
         }
 
-        // used for indexing a pool region inside the input
-        int r_st, r_end, c_st, c_end;
-        dtype_%(x)s collector; // temp var for the value in a region
+        // the images of the batch and channels are processed in parallel
+        int n_bk;
+        n_bk = PyArray_DIMS(%(x)s)[0] * PyArray_DIMS(%(x)s)[1];
         if (z_r && z_c)
         {
-            for(int b=0; b<PyArray_DIMS(%(x)s)[0]; b++){
-              for(int k=0; k<PyArray_DIMS(%(x)s)[1]; k++){
+            %(omp_parallel)s
+            for(int t=0; t<n_bk; t++){
+                int b = t / PyArray_DIMS(%(x)s)[1];
+                int k = t %% PyArray_DIMS(%(x)s)[1];
+                // used for indexing a pool region inside the input
+                int r_st, r_end, c_st, c_end;
+                dtype_%(x)s collector; // temp var for the value in a region
                 for(int i=0; i< z_r; i++){
                   r_st = i * %(st0)s;
                   r_end = r_st + %(ds0)s;
@@ -492,19 +517,20 @@ class DownsampleFactorMax(Op):
         ccode += """
                   }
                 }
-              }
             }
         }
         """
         return ccode % locals()
 
     def c_code_cache_version(self):
-        return (0, 6, 8, 3)
+        return (0, 6, 8, 5, self.openmp, theano.config.openmp_elemwise_minsize)
 
-class DownsampleFactorMaxGrad(Op):
+class DownsampleFactorMaxGrad(OpenMPOp):
     __props__ = ('ds', 'ignore_border', 'st', 'padding', 'mode')
 
-    def __init__(self, ds, ignore_border, st=None, padding=(0, 0), mode='max'):
+    def __init__(self, ds, ignore_border, st=None, padding=(0, 0), mode='max',
+                 openmp=None):
+        super(DownsampleFactorMaxGrad, self).__init__(openmp=openmp)
         self.ds = tuple(ds)
         self.ignore_border = ignore_border
         if st is None:
@@ -606,7 +632,17 @@ class DownsampleFactorMaxGrad(Op):
                     theano.tensor.zeros_like(maxout),
                     DownsampleFactorMaxGradGrad(
                         self.ds, ignore_border=self.ignore_border,
-                        st=self.st)(x, maxout, ggx)]
+                        st=self.st, openmp=self.openmp)(x, maxout, ggx)]
+        elif self.mode != 'max' and (self.padding == (0, 0) or
+                                     self.mode == 'sum'):
+            # The gradient of sum and average pooling is linear in gz: its
+            # own gradient is the pooling of ggx.
+            return [theano.tensor.zeros_like(x),
+                    theano.tensor.zeros_like(maxout),
+                    DownsampleFactorMax(
+                        self.ds, ignore_border=self.ignore_border,
+                        st=self.st, padding=self.padding, mode=self.mode,
+                        openmp=self.openmp)(ggx)]
         else:
             return [theano.tensor.zeros_like(x),
                     theano.tensor.zeros_like(maxout),
@@ -614,7 +650,8 @@ class DownsampleFactorMaxGrad(Op):
                         self, 2, gz, 'Hessian not implemented with padding')]
 
     def c_code(self, node, name, inp, out, sub):
-        if self.mode != 'max':
+        if self.mode not in ('max', 'sum') and self.padding != (0, 0):
+            # perform() does not support it either
             raise theano.gof.utils.MethodNotDefined()
         x, z, gz = inp
         gx, = out
@@ -623,12 +660,14 @@ class DownsampleFactorMaxGrad(Op):
         ds0, ds1 = self.ds
         st0, st1 = self.st
         pd0, pd1 = self.padding
-        return """
+        omp_parallel = _omp_parallel(self.openmp,
+                                     'PyArray_SIZE(%s)' % x)
+        ccode = """
         // sanity checks
         int x_typenum = PyArray_ObjectType((PyObject*)%(x)s, 0);
         int z_typenum = PyArray_ObjectType((PyObject*)%(z)s, 0);
         int gz_typenum = PyArray_ObjectType((PyObject*)%(gz)s, 0);
-        
+
         if ((x_typenum != z_typenum) || (x_typenum != gz_typenum))
         {
             PyErr_SetString(PyExc_ValueError, "input types must all match");
@@ -649,11 +688,11 @@ class DownsampleFactorMaxGrad(Op):
             PyErr_SetString(PyExc_ValueError, "gz must be a 4d ndarray");
             %(fail)s;
         }
-        
+
         int z_r, z_c;
         z_r = PyArray_DIMS(%(z)s)[2];
         z_c = PyArray_DIMS(%(z)s)[3];
-        
+
         int r, c; // shape of the padded_input
         r = PyArray_DIMS(%(x)s)[2];
         c = PyArray_DIMS(%(x)s)[3];
@@ -676,12 +715,17 @@ class DownsampleFactorMaxGrad(Op):
         else {
           PyArray_FILLWBYTE(%(gx)s, 0);
         }
-        int r_st, r_end, c_st, c_end; // used to index into the input img x
-        dtype_%(z)s maximum; // temp var for maximum value in a region
+        // the images of the batch and channels are processed in parallel,
+        // they never write to the same part of gx
+        int n_bk;
+        n_bk = PyArray_DIMS(%(x)s)[0] * PyArray_DIMS(%(x)s)[1];
         if (z_r && z_c)
         {
-            for(int b=0; b<PyArray_DIMS(%(x)s)[0]; b++){
-              for(int k=0; k<PyArray_DIMS(%(x)s)[1]; k++){
+            %(omp_parallel)s
+            for(int t=0; t<n_bk; t++){
+                int b = t / PyArray_DIMS(%(x)s)[1];
+                int k = t %% PyArray_DIMS(%(x)s)[1];
+                int r_st, r_end, c_st, c_end; // used to index into the input img x
                 for(int i=0; i< z_r; i++){
                   r_st = i * %(st0)s;
                   r_end = r_st + %(ds0)s;
@@ -698,15 +742,18 @@ class DownsampleFactorMaxGrad(Op):
                     // skip the padding
                     c_st = c_st < %(pd1)s ? %(pd1)s : c_st;
                     c_end = c_end > (c - %(pd1)s) ? c - %(pd1)s : c_end;
-                    
+
                     // change coordinates from padding_img space into img space
                     c_st -= %(pd1)s;
                     c_end -= %(pd1)s;
-                    // the maximum value
-                    maximum = ((dtype_%(z)s*)(PyArray_GETPTR4(%(z)s,b,k,i,j)))[0];
-                    // the gradient corresponding to this maximum value in z
+                    // the gradient corresponding to this region in z
                     dtype_%(gz)s * gz = (
                           (dtype_%(gz)s*)(PyArray_GETPTR4(%(gz)s, b, k, i, j)));
+        """
+        if self.mode == 'max':
+            ccode += """
+                    // the maximum value
+                    dtype_%(z)s maximum = ((dtype_%(z)s*)(PyArray_GETPTR4(%(z)s,b,k,i,j)))[0];
                     // go through the pooled region in the unpadded input
                     for(int m=r_st; m<r_end; m++)
                     {
@@ -716,22 +763,44 @@ class DownsampleFactorMaxGrad(Op):
                         dtype_%(gx)s * gx = (
                           (dtype_%(gx)s*)(PyArray_GETPTR4(%(gx)s, b, k, m, n)));
                         if (a == maximum){
-                          gx[0] = gx[0] + gz[0]; 
+                          gx[0] = gx[0] + gz[0];
                         }
                       }
                     }
+            """
+        else:
+            if self.mode == 'sum':
+                ccode += """
+                    dtype_%(gz)s val = gz[0];
+                """
+            else:
+                ccode += """
+                    dtype_%(gz)s val = gz[0] / ((r_end-r_st)*(c_end-c_st));
+                """
+            ccode += """
+                    // spread the gradient over the pooled region
+                    for(int m=r_st; m<r_end; m++)
+                    {
+                      for(int n=c_st; n<c_end; n++)
+                      {
+                        dtype_%(gx)s * gx = (
+                          (dtype_%(gx)s*)(PyArray_GETPTR4(%(gx)s, b, k, m, n)));
+                        gx[0] = gx[0] + val;
+                      }
+                    }
+            """
+        ccode += """
                   }
                 }
-              }
             }
-            
         }
-        """ % locals()
+        """
+        return ccode % locals()
 
     def c_code_cache_version(self):
-        return (0, 7)
+        return (0, 9, self.openmp, theano.config.openmp_elemwise_minsize)
 
-class DownsampleFactorMaxGradGrad(Op):
+class DownsampleFactorMaxGradGrad(OpenMPOp):
     __props__ = ('ds', 'ignore_border', 'st')
 
     @staticmethod
@@ -804,7 +873,8 @@ class DownsampleFactorMaxGradGrad(Op):
         rval = list(imgshape[:-2]) + [nr, nc]
         return rval
 
-    def __init__(self, ds, ignore_border, st=None):
+    def __init__(self, ds, ignore_border, st=None, openmp=None):
+        super(DownsampleFactorMaxGradGrad, self).__init__(openmp=openmp)
         self.ds = tuple(ds)
         self.ignore_border = ignore_border
         if st is None:
@@ -861,3 +931,109 @@ class DownsampleFactorMaxGradGrad(Op):
 
     def infer_shape(self, node, in_shapes):
         return [in_shapes[0]]
+
+    def c_code(self, node, name, inp, out, sub):
+        x, maxout, ggx = inp
+        z, = out  # the grad of grad
+        fail = sub['fail']
+        ds0, ds1 = self.ds
+        st0, st1 = self.st
+        omp_parallel = _omp_parallel(self.openmp,
+                                     'PyArray_SIZE(%s)' % x)
+        return """
+        // sanity checks
+        int x_typenum = PyArray_ObjectType((PyObject*)%(x)s, 0);
+        int maxout_typenum = PyArray_ObjectType((PyObject*)%(maxout)s, 0);
+        int ggx_typenum = PyArray_ObjectType((PyObject*)%(ggx)s, 0);
+
+        if ((x_typenum != maxout_typenum) || (x_typenum != ggx_typenum))
+        {
+            PyErr_SetString(PyExc_ValueError, "input types must all match");
+            %(fail)s;
+        }
+        if(PyArray_NDIM(%(x)s)!=4)
+        {
+            PyErr_SetString(PyExc_ValueError, "x must be a 4d ndarray");
+            %(fail)s;
+        }
+        if(PyArray_NDIM(%(maxout)s)!=4)
+        {
+            PyErr_SetString(PyExc_ValueError, "maxout must be a 4d ndarray");
+            %(fail)s;
+        }
+        if(PyArray_NDIM(%(ggx)s)!=4)
+        {
+            PyErr_SetString(PyExc_ValueError, "ggx must be a 4d ndarray");
+            %(fail)s;
+        }
+
+        int z_r, z_c; // shape of the output
+        z_r = PyArray_DIMS(%(maxout)s)[2];
+        z_c = PyArray_DIMS(%(maxout)s)[3];
+
+        int r, c; // shape of the input
+        r = PyArray_DIMS(%(x)s)[2];
+        c = PyArray_DIMS(%(x)s)[3];
+
+        // allocating memory for the output, every element is written below
+        if ((!%(z)s)
+          || PyArray_NDIM(%(z)s)!=4
+          ||(PyArray_DIMS(%(z)s)[0] != PyArray_DIMS(%(maxout)s)[0])
+          ||(PyArray_DIMS(%(z)s)[1] != PyArray_DIMS(%(maxout)s)[1])
+          ||(PyArray_DIMS(%(z)s)[2] != z_r)
+          ||(PyArray_DIMS(%(z)s)[3] != z_c)
+          )
+        {
+          Py_XDECREF(%(z)s);
+          %(z)s = (PyArrayObject*) PyArray_ZEROS(4, PyArray_DIMS(%(maxout)s),
+                                                  x_typenum, 0);
+          if (!%(z)s)
+          {
+            %(fail)s;
+          }
+        }
+        // the images of the batch and channels are processed in parallel
+        int n_bk;
+        n_bk = PyArray_DIMS(%(x)s)[0] * PyArray_DIMS(%(x)s)[1];
+        if (z_r && z_c)
+        {
+            %(omp_parallel)s
+            for(int t=0; t<n_bk; t++){
+                int b = t / PyArray_DIMS(%(x)s)[1];
+                int k = t %% PyArray_DIMS(%(x)s)[1];
+                for(int i=0; i<z_r; i++){
+                  int r_st = i * %(st0)s;
+                  int r_end = std::min(r_st + %(ds0)s, r);
+                  for(int j=0; j<z_c; j++){
+                    int c_st = j * %(st1)s;
+                    int c_end = std::min(c_st + %(ds1)s, c);
+                    dtype_%(maxout)s maximum = ((dtype_%(maxout)s*)(
+                        PyArray_GETPTR4(%(maxout)s, b, k, i, j)))[0];
+                    dtype_%(z)s * z = ((dtype_%(z)s*)(
+                        PyArray_GETPTR4(%(z)s, b, k, i, j)));
+                    z[0] = 0;
+                    // take the value of ggx at the position of the maximum
+                    for(int m=r_st; m<r_end; m++)
+                    {
+                      for(int n=c_st; n<c_end; n++)
+                      {
+                        dtype_%(x)s a = ((dtype_%(x)s*)(
+                            PyArray_GETPTR4(%(x)s, b, k, m, n)))[0];
+                        if (a == maximum){
+                          z[0] = ((dtype_%(ggx)s*)(
+                              PyArray_GETPTR4(%(ggx)s, b, k, m, n)))[0];
+                        }
+                      }
+                    }
+                  }
+                }
+            }
+        }
+        """ % locals()
+
+    def c_headers(self):
+        return ['<algorithm>'] + super(DownsampleFactorMaxGradGrad,
+                                       self).c_headers()
+
+    def c_code_cache_version(self):
+        return (0, 2, self.openmp, theano.config.openmp_elemwise_minsize)
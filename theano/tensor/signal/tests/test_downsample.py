@@ -483,6 +483,86 @@ class TestDownsampleFactorMax(utt.InferShapeTester):
                     continue
                 utt.verify_grad(mp, [imval, grad_val], rng=rng)
 
+    def test_DownsampleFactorMaxGrad_grad_mode(self):
+        """checks the gradient of the gradient of sum and average
+        pooling"""
+        rng = numpy.random.RandomState(utt.fetch_seed())
+        maxpoolshps = ((1, 1), (3, 2), (2, 3))
+        stridesizes = ((1, 1), (2, 2))
+        imval = rng.rand(2, 3, 5, 4) * 10.0
+
+        for maxpoolshp, ignore_border, mode, stride in product(
+                maxpoolshps, [True, False],
+                ['sum', 'average_inc_pad', 'average_exc_pad'], stridesizes):
+            grad_shape = DownsampleFactorMax.out_shape(
+                imval.shape, maxpoolshp, ignore_border=ignore_border,
+                st=stride)
+            grad_val = rng.rand(*grad_shape) * 10.0
+
+            def mp(input, grad):
+                out = DownsampleFactorMax(
+                    maxpoolshp, ignore_border=ignore_border, st=stride,
+                    mode=mode)(input)
+                grad_op = DownsampleFactorMaxGrad(
+                    maxpoolshp, ignore_border=ignore_border, st=stride,
+                    mode=mode)
+                return grad_op(input, out, grad)
+
+            utt.verify_grad(mp, [imval, grad_val], rng=rng)
+
+    def test_c_code(self):
+        """the C code of the three ops, with and without OpenMP, must
+        agree with perform"""
+        rng = numpy.random.RandomState(utt.fetch_seed())
+        images = tensor.dtensor4()
+        gz = tensor.dtensor4()
+        ggx = tensor.dtensor4()
+        imval = rng.rand(3, 4, 9, 7)
+        py_mode = theano.Mode(linker='py', optimizer='fast_run')
+        orig_minsize = theano.config.openmp_elemwise_minsize
+        try:
+            for maxpoolshp, stride, ignore_border, padding, mode in [
+                    ((2, 2), None, True, (0, 0), 'max'),
+                    ((3, 2), (2, 1), False, (0, 0), 'max'),
+                    ((3, 3), (2, 2), True, (1, 2), 'max'),
+                    ((3, 2), (2, 1), False, (0, 0), 'sum'),
+                    ((3, 3), (2, 2), True, (1, 2), 'sum'),
+                    ((2, 3), None, False, (0, 0), 'average_inc_pad'),
+                    ((2, 3), (1, 2), True, (0, 0), 'average_exc_pad')]:
+                # With a minimum size of 0, the loops run in parallel even
+                # for these small images.
+                for openmp, minsize in [(False, orig_minsize),
+                                        (True, orig_minsize), (True, 0)]:
+                    theano.config.openmp_elemwise_minsize = minsize
+                    op = DownsampleFactorMax(maxpoolshp, ignore_border, stride,
+                                             padding, mode, openmp=openmp)
+                    out = op(images)
+                    grad_op = DownsampleFactorMaxGrad(
+                        maxpoolshp, ignore_border, stride, padding, mode,
+                        openmp=openmp)
+                    grad = grad_op(images, out, gz)
+                    outs = [out, grad]
+                    if padding == (0, 0):
+                        outs.append(tensor.grad(None, gz, known_grads={
+                            grad: ggx}))
+                    gzval = rng.rand(*op.out_shape(imval.shape, maxpoolshp,
+                                                   ignore_border, stride,
+                                                   padding))
+                    ggxval = rng.rand(*imval.shape)
+                    f = function([images, gz, ggx], outs,
+                                 on_unused_input='ignore')
+                    assert all(node.op.openmp == openmp
+                               for node in f.maker.fgraph.toposort()
+                               if isinstance(node.op, theano.OpenMPOp) and
+                               not isinstance(node.op, tensor.Elemwise))
+                    f_py = function([images, gz, ggx], outs, mode=py_mode,
+                                    on_unused_input='ignore')
+                    for a, b in zip(f(imval, gzval, ggxval),
+                                    f_py(imval, gzval, ggxval)):
+                        utt.assert_allclose(a, b)
+        finally:
+            theano.config.openmp_elemwise_minsize = orig_minsize
+
     def test_DownsampleFactorMax_hessian(self):
         # Example provided by Frans Cronje, see
         # https://groups.google.com/d/msg/theano-users/qpqUy_3glhw/JMwIvlN5wX4J
@@ -942,6 +942,12 @@ class Subtensor(Op):
             return [None]
         return self(eval_points[0], *inputs[1:], **dict(return_list=True))
 
+    def batch_apply(self, inputs, batched):
+        if True in batched[1:]:
+            raise NotImplementedError()
+        op = Subtensor([slice(None)] + list(self.idx_list))
+        return op(*inputs, **dict(return_list=True))
+
 
 class SubtensorPrinter:
 
@@ -1521,6 +1527,25 @@ class IncSubtensor(Op):
         return self(eval_points[0], eval_points[1], *inputs[2:],
                     **dict(return_list=True))
 
+    def batch_apply(self, inputs, batched):
+        if True in batched[2:]:
+            raise NotImplementedError()
+        x, y = inputs[:2]
+        if not batched[0]:
+            x = alloc(x, y.shape[0], *[x.shape[i] for i in xrange(x.ndim)])
+        if batched[1]:
+            # y is broadcasted to x[idx], align its dimensions on the last
+            # ones of x[idx].
+            idx_ndim = x.ndim - 1 - len([i for i in self.idx_list
+                                         if not isinstance(i, slice)])
+            y = y.dimshuffle([0] + ['x'] * (idx_ndim - y.ndim + 1) +
+                             range(1, y.ndim))
+        op = IncSubtensor([slice(None)] + list(self.idx_list),
+                          set_instead_of_inc=self.set_instead_of_inc,
+                          destroyhandler_tolerate_aliased=
+                          self.destroyhandler_tolerate_aliased)
+        return op(x, y, *inputs[2:], **dict(return_list=True))
+
     def connection_pattern(self, node):
 
         rval = [[True], [True]]
@@ -2026,18 +2051,177 @@ def adv_index_broadcastable_pattern(a, idx):
     return tuple([dim == 1 for dim in retshape])
 
 
-class AdvancedSubtensor(Op):
+def adv_index_c_supported(node, n_other_inputs):
+    """Return True if the C code of AdvancedSubtensor and
+    AdvancedIncSubtensor supports the indices of node.
+
+    They are the inputs after the first `n_other_inputs` ones. The C code
+    supports integer index arrays on the first dimensions of x, which are
+    broadcasted together, when at least one of them is not a scalar.
+    """
+    x = node.inputs[0]
+    idx = node.inputs[n_other_inputs:]
+    if (not isinstance(x.type, TensorType) or
+            not 0 < len(idx) <= x.ndim):
+        return False
+    for i in idx:
+        if (not isinstance(i.type, TensorType) or
+                i.type.dtype not in ('int8', 'int16', 'int32', 'int64',
+                                     'uint8', 'uint16', 'uint32')):
+            return False
+    return max(i.ndim for i in idx) > 0
+
+
+# C code shared by AdvancedSubtensor and AdvancedIncSubtensor.
+adv_index_support_code = """
+#ifndef THEANO_ADV_INDEX_OFFSETS
+#define THEANO_ADV_INDEX_OFFSETS
+/* Compute the offsets, in number of elements, of the subtensors
+   x[i_0[j], ..., i_{k-1}[j]] in the C contiguous array x, where the k
+   index arrays i_d are broadcasted together.
+
+   Return a new 1d array of NPY_INTP offsets and store the broadcasted
+   shape of the indices in nd and dims. Return NULL with an exception set
+   on error. */
+static PyArrayObject* theano_adv_index_offsets(PyArrayObject* x, int k,
+                                               PyObject** indices,
+                                               int* nd, npy_intp* dims)
+{
+    PyArrayObject* idx[NPY_MAXDIMS];
+    PyArrayObject* offsets = NULL;
+    npy_intp strides[NPY_MAXDIMS];
+    npy_intp n, s;
+    int d, nidx = 0, same_shape = 1;
+
+    if (k > PyArray_NDIM(x)) {
+        PyErr_SetString(PyExc_IndexError, "too many indices");
+        return NULL;
+    }
+    for (d = 0; d < k; d++) {
+        idx[d] = (PyArrayObject*)PyArray_FromAny(
+            indices[d], PyArray_DescrFromType(NPY_INTP), 0, 0,
+            NPY_ARRAY_C_CONTIGUOUS | NPY_ARRAY_ALIGNED | NPY_ARRAY_FORCECAST,
+            NULL);
+        if (idx[d] == NULL)
+            goto fail;
+        nidx++;
+        if (!PyArray_SAMESHAPE(idx[0], idx[d]))
+            same_shape = 0;
+    }
+    if (!same_shape) {
+        // Broadcast the indices like numpy, in new contiguous arrays.
+        PyArrayMultiIterObject* mit = (PyArrayMultiIterObject*)
+            PyArray_MultiIterFromObjects((PyObject**)idx, k, 0);
+        if (mit == NULL)
+            goto fail;
+        *nd = mit->nd;
+        memcpy(dims, mit->dimensions, mit->nd * sizeof(npy_intp));
+        Py_DECREF(mit);
+        for (d = 0; d < k; d++) {
+            PyArrayObject* b = (PyArrayObject*)PyArray_EMPTY(*nd, dims,
+                                                             NPY_INTP, 0);
+            if (b == NULL)
+                goto fail;
+            if (PyArray_CopyInto(b, idx[d]) != 0) {
+                Py_DECREF(b);
+                goto fail;
+            }
+            Py_DECREF(idx[d]);
+            idx[d] = b;
+        }
+    }
+    else {
+        *nd = PyArray_NDIM(idx[0]);
+        memcpy(dims, PyArray_DIMS(idx[0]), *nd * sizeof(npy_intp));
+    }
+
+    s = 1;
+    for (d = PyArray_NDIM(x) - 1; d >= 0; d--) {
+        strides[d] = s;
+        s *= PyArray_DIMS(x)[d];
+    }
+    n = PyArray_SIZE(idx[0]);
+    offsets = (PyArrayObject*)PyArray_EMPTY(1, &n, NPY_INTP, 0);
+    if (offsets == NULL)
+        goto fail;
+    for (npy_intp j = 0; j < n; j++) {
+        npy_intp o = 0;
+        for (d = 0; d < k; d++) {
+            npy_intp v = ((npy_intp*)PyArray_DATA(idx[d]))[j];
+            npy_intp dim = PyArray_DIMS(x)[d];
+            if (v < -dim || v >= dim) {
+                PyErr_Format(PyExc_IndexError,
+                             "index %ld is out of bounds for axis %d"
+                             " with size %ld", (long)v, d, (long)dim);
+                goto fail;
+            }
+            if (v < 0)
+                v += dim;
+            o += v * strides[d];
+        }
+        ((npy_intp*)PyArray_DATA(offsets))[j] = o;
+    }
+    for (d = 0; d < nidx; d++)
+        Py_DECREF(idx[d]);
+    return offsets;
+
+fail:
+    Py_XDECREF(offsets);
+    for (d = 0; d < nidx; d++)
+        Py_DECREF(idx[d]);
+    return NULL;
+}
+#endif
+"""
+
+
+def adv_index_c_code_prepare(x, idx, fail):
+    """Return the C code computing the offsets of the subtensors of the
+    C contiguous array `x` indexed by the arrays `idx`.
+
+    It declares `adv_offsets`, `adv_n` the number of offsets, `adv_inner`
+    the number of elements of each subtensor and `adv_nd`/`adv_dims` the
+    shape of the indexed tensor.
+    """
+    k = len(idx)
+    set_indices = ''.join('adv_indices[%d] = (PyObject*)%s;\n' % (d, i)
+                          for d, i in enumerate(idx))
+    return """
+        PyObject* adv_indices[%(k)s];
+        int adv_nd;
+        npy_intp adv_dims[NPY_MAXDIMS];
+        npy_intp adv_n, adv_inner = 1;
+        PyArrayObject* adv_offsets;
+        %(set_indices)s
+        adv_offsets = theano_adv_index_offsets(%(x)s, %(k)s, adv_indices,
+                                               &adv_nd, adv_dims);
+        if (adv_offsets == NULL) {
+            %(fail)s;
+        }
+        adv_n = PyArray_SIZE(adv_offsets);
+        for (int d = %(k)s; d < PyArray_NDIM(%(x)s); d++) {
+            adv_dims[adv_nd++] = PyArray_DIMS(%(x)s)[d];
+            adv_inner *= PyArray_DIMS(%(x)s)[d];
+        }
+    """ % locals()
+
+
+class AdvancedSubtensor(gof.OpenMPOp):
     """Return a subtensor copy, using advanced indexing.
+
+    The C code supports the integer index arrays on the first dimensions
+    (see adv_index_c_supported), the other indices use `perform`.
     """
     # Should be used by __getitem__ and __getslice__, as follow:
     # AdvancedSubtensor()(self, *args),
     # if args contains and advanced indexing pattern
 
     def __eq__(self, other):
-        return self.__class__ == other.__class__
+        return (self.__class__ == other.__class__ and
+                self.openmp == other.openmp)
 
     def __hash__(self):
-        return hash(self.__class__)
+        return hash((self.__class__, self.openmp))
 
     def __str__(self):
         return self.__class__.__name__
@@ -2088,6 +2272,64 @@ class AdvancedSubtensor(Op):
                 'out[0] (%s), with shape %s, is not correctly filled.'
                 % (out[0], out[0].shape))
 
+    def c_support_code(self):
+        return adv_index_support_code
+
+    def c_code(self, node, name, inputs, outputs, sub):
+        if not adv_index_c_supported(node, 1):
+            raise NotImplementedError()
+        x = inputs[0]
+        out, = outputs
+        fail = sub['fail']
+        # adv_x is released by the failure code of its own declaration.
+        prepare = adv_index_c_code_prepare(
+            'adv_x', inputs[1:], 'Py_DECREF(adv_x); %s' % fail)
+        if self.openmp:
+            omp_for = ('#pragma omp parallel for schedule(static) '
+                       'if(adv_n * adv_inner >= %d)' %
+                       config.openmp_elemwise_minsize)
+        else:
+            omp_for = ''
+        return """
+        {
+        PyArrayObject* adv_x = PyArray_GETCONTIGUOUS(%(x)s);
+        if (adv_x == NULL) {
+            %(fail)s;
+        }
+        {
+        %(prepare)s
+        if (%(out)s == NULL || PyArray_NDIM(%(out)s) != adv_nd ||
+                !PyArray_CompareLists(PyArray_DIMS(%(out)s), adv_dims,
+                                      adv_nd) ||
+                !PyArray_ISCONTIGUOUS(%(out)s) ||
+                PyArray_TYPE(%(out)s) != PyArray_TYPE(adv_x)) {
+            Py_XDECREF(%(out)s);
+            %(out)s = (PyArrayObject*)PyArray_EMPTY(adv_nd, adv_dims,
+                                                    PyArray_TYPE(adv_x), 0);
+            if (%(out)s == NULL) {
+                Py_DECREF(adv_offsets);
+                Py_DECREF(adv_x);
+                %(fail)s;
+            }
+        }
+        const npy_intp* off = (npy_intp*)PyArray_DATA(adv_offsets);
+        const npy_intp nbytes = adv_inner * PyArray_ITEMSIZE(adv_x);
+        const npy_intp itemsize = PyArray_ITEMSIZE(adv_x);
+        const char* src = PyArray_BYTES(adv_x);
+        char* dst = PyArray_BYTES(%(out)s);
+        %(omp_for)s
+        for (npy_intp j = 0; j < adv_n; j++) {
+            memcpy(dst + j * nbytes, src + off[j] * itemsize, nbytes);
+        }
+        Py_DECREF(adv_offsets);
+        Py_DECREF(adv_x);
+        }
+        }
+        """ % locals()
+
+    def c_code_cache_version(self):
+        return (1, self.openmp, config.openmp_elemwise_minsize)
+
     def connection_pattern(self, node):
 
         rval = [[True]]
@@ -2107,16 +2349,25 @@ class AdvancedSubtensor(Op):
 advanced_subtensor = AdvancedSubtensor()
 
 
-class AdvancedIncSubtensor(Op):
+class AdvancedIncSubtensor(gof.OpenMPOp):
     """Increments a subtensor using advanced indexing.
 
     :note: We need the numpy.inplace_increment() function currently
         numpy's PR 326 to be able to make an inplace version of this
         op.
 
+    The C code supports the same indices as AdvancedSubtensor. When the
+    number of incremented elements is at least
+    `config.openmp_elemwise_minsize`, the subtensors have at least 16
+    elements and OpenMP is enabled with several threads, the indices
+    are sorted so that the threads increment different subtensors: each
+    thread sums all the rows of y going to the same subtensor, which
+    handles the duplicated indices without atomic operations.
     """
 
-    def __init__(self, inplace=False, set_instead_of_inc=False):
+    def __init__(self, inplace=False, set_instead_of_inc=False,
+                 openmp=None):
+        super(AdvancedIncSubtensor, self).__init__(openmp=openmp)
         self.inplace = inplace
         self.set_instead_of_inc = set_instead_of_inc
         # The assert is needed as in the pass the first argument was
@@ -2129,12 +2380,14 @@ class AdvancedIncSubtensor(Op):
         self.allow_legacy_perform = False
 
     def __hash__(self):
-        return hash((type(self), self.inplace, self.set_instead_of_inc))
+        return hash((type(self), self.inplace, self.set_instead_of_inc,
+                     self.openmp))
 
     def __eq__(self, other):
         return (type(self) == type(other)
                 and self.inplace == other.inplace
-                and self.set_instead_of_inc == other.set_instead_of_inc)
+                and self.set_instead_of_inc == other.set_instead_of_inc
+                and self.openmp == other.openmp)
 
     def __str__(self):
         return "%s{%s, %s}" % (self.__class__.__name__,
@@ -2225,6 +2478,123 @@ class AdvancedIncSubtensor(Op):
                 'out[0] (%s), with shape %s, is not correctly filled.'
                 % (out[0], out[0].shape))
 
+    def c_support_code(self):
+        return adv_index_support_code
+
+    def c_code(self, node, name, inputs, outputs, sub):
+        if (not adv_index_c_supported(node, 2) or
+                self.allow_legacy_perform or
+                node.outputs[0].dtype in theano.tensor.complex_dtypes):
+            raise NotImplementedError()
+        x, y = inputs[:2]
+        out, = outputs
+        fail = sub['fail']
+        prepare = adv_index_c_code_prepare(out, inputs[2:], fail)
+        if self.set_instead_of_inc:
+            op = '='
+        else:
+            op = '+='
+        if self.openmp:
+            # Sorting the indices costs more than the sequential loop
+            # when the subtensors are small.
+            parallel = ('omp_get_max_threads() > 1 && adv_inner >= 16 && '
+                        'adv_n * adv_inner >= %d' %
+                        config.openmp_elemwise_minsize)
+            omp_for = '#pragma omp parallel for schedule(guided)'
+        else:
+            parallel = '0'
+            omp_for = ''
+        return """
+        Py_XDECREF(%(out)s);
+        %(out)s = (PyArrayObject*)PyArray_NewCopy(%(x)s, NPY_CORDER);
+        if (%(out)s == NULL) {
+            %(fail)s;
+        }
+        {
+        %(prepare)s
+        // y cast to the dtype of x, and broadcasted unless it has only
+        // one element.
+        PyArrayObject* adv_y = (PyArrayObject*)PyArray_FromAny(
+            (PyObject*)%(y)s, PyArray_DescrFromType(PyArray_TYPE(%(out)s)),
+            0, 0, NPY_ARRAY_C_CONTIGUOUS | NPY_ARRAY_ALIGNED |
+            NPY_ARRAY_FORCECAST, NULL);
+        if (adv_y != NULL && PyArray_SIZE(adv_y) != 1 &&
+                !(PyArray_NDIM(adv_y) == adv_nd &&
+                  PyArray_CompareLists(PyArray_DIMS(adv_y), adv_dims,
+                                       adv_nd))) {
+            PyArrayObject* b = (PyArrayObject*)PyArray_EMPTY(
+                adv_nd, adv_dims, PyArray_TYPE(%(out)s), 0);
+            if (b != NULL && PyArray_CopyInto(b, adv_y) != 0) {
+                Py_CLEAR(b);
+            }
+            Py_DECREF(adv_y);
+            adv_y = b;
+        }
+        if (adv_y == NULL) {
+            Py_DECREF(adv_offsets);
+            %(fail)s;
+        }
+        const npy_intp* off = (npy_intp*)PyArray_DATA(adv_offsets);
+        dtype_%(out)s* o = (dtype_%(out)s*)PyArray_DATA(%(out)s);
+        const dtype_%(out)s* yv = (dtype_%(out)s*)PyArray_DATA(adv_y);
+        // Steps in yv between the rows and between their elements.
+        const npy_intp y_row = PyArray_SIZE(adv_y) == 1 ? 0 : adv_inner;
+        const npy_intp y_elem = PyArray_SIZE(adv_y) == 1 ? 0 : 1;
+        if (%(parallel)s) {
+            // Sort the rows by offset, stable to keep the last one for
+            // set, and give each segment of equal offsets to one thread.
+            PyArrayObject* perm = (PyArrayObject*)PyArray_ArgSort(
+                adv_offsets, 0, NPY_MERGESORT);
+            npy_intp* starts = (npy_intp*)malloc(
+                (adv_n + 1) * sizeof(npy_intp));
+            if (perm == NULL || starts == NULL) {
+                Py_XDECREF(perm);
+                free(starts);
+                Py_DECREF(adv_offsets);
+                Py_DECREF(adv_y);
+                if (!PyErr_Occurred()) {
+                    PyErr_NoMemory();
+                }
+                %(fail)s;
+            }
+            const npy_intp* p = (npy_intp*)PyArray_DATA(perm);
+            npy_intp n_seg = 0;
+            for (npy_intp j = 0; j < adv_n; j++) {
+                if (j == 0 || off[p[j]] != off[p[j - 1]]) {
+                    starts[n_seg++] = j;
+                }
+            }
+            starts[n_seg] = adv_n;
+            %(omp_for)s
+            for (npy_intp s = 0; s < n_seg; s++) {
+                dtype_%(out)s* row = o + off[p[starts[s]]];
+                for (npy_intp m = starts[s]; m < starts[s + 1]; m++) {
+                    const dtype_%(out)s* yr = yv + p[m] * y_row;
+                    for (npy_intp t = 0; t < adv_inner; t++) {
+                        row[t] %(op)s yr[t * y_elem];
+                    }
+                }
+            }
+            free(starts);
+            Py_DECREF(perm);
+        }
+        else {
+            for (npy_intp j = 0; j < adv_n; j++) {
+                dtype_%(out)s* row = o + off[j];
+                const dtype_%(out)s* yr = yv + j * y_row;
+                for (npy_intp t = 0; t < adv_inner; t++) {
+                    row[t] %(op)s yr[t * y_elem];
+                }
+            }
+        }
+        Py_DECREF(adv_offsets);
+        Py_DECREF(adv_y);
+        }
+        """ % locals()
+
+    def c_code_cache_version(self):
+        return (1, self.openmp, config.openmp_elemwise_minsize)
+
     def infer_shape(self, node, ishapes):
         return [ishapes[0]]
 
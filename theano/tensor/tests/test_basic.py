@@ -4001,6 +4001,27 @@ class T_Join_and_Split(unittest.TestCase):
         self.assertRaises(ValueError, f)
 
 
+def test_split_view():
+    # The outputs of Split are views of its input, in perform and in the
+    # C code.
+    x = dmatrix()
+    splits = lvector()
+    outs = Split(3)(x, 1, splits)
+    x_val = numpy.arange(12.).reshape(3, 4)
+    for linker in ['py', 'c|py']:
+        mode = compile.Mode(linker=linker, optimizer=None)
+        f = function([compile.In(x, borrow=True), splits],
+                     [compile.Out(o, borrow=True) for o in outs], mode=mode)
+        for o, good in zip(f(x_val, [1, 0, 3]),
+                           [x_val[:, :1], x_val[:, 1:1], x_val[:, 1:]]):
+            assert numpy.all(o == good)
+            assert o.shape == good.shape
+            # numpy.may_share_memory is False for empty arrays.
+            assert o.size == 0 or numpy.may_share_memory(o, x_val)
+        assert_raises(ValueError, f, x_val, [1, 1, 1])
+        assert_raises(ValueError, f, x_val, [5, -1, 0])
+
+
 class test_comparison(unittest.TestCase):
     """Test <, >, <=, >=, == and !=
 
@@ -5069,6 +5090,25 @@ def test_tile():
         assert numpy.all(run_tile(x, x_, (2, 3, 4, 6), use_symbolic_reps) ==
             numpy.tile(x_, (2, 3, 4, 6)))
 
+def test_tile_op():
+    # The Tile op is deprecated but has C code.
+    rng = numpy.random.RandomState(utt.fetch_seed())
+    x = tensor3()
+    reps = ivector()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        out = Tile(3)(x, reps)
+    x_val = rng.randn(2, 4, 3).astype(config.floatX)
+    for linker in ['py', 'c|py']:
+        mode = compile.Mode(linker=linker, optimizer=None)
+        f = function([x, reps], out, mode=mode)
+        for r in [(2, 3, 4), (1, 1, 1), (0, 2, 1)]:
+            assert numpy.all(f(x_val, r) == numpy.tile(x_val, r))
+        # Non contiguous input.
+        assert numpy.all(f(x_val[:, ::2], (1, 2, 3)) ==
+                         numpy.tile(x_val[:, ::2], (1, 2, 3)))
+
+
 def test_tile_grad():
 
     def grad_tile(x, reps, np_x):
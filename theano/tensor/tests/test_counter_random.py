@@ -0,0 +1,232 @@
+import math
+import unittest
+
+import numpy
+
+import theano
+from theano import tensor
+from theano.tensor import counter_random
+from theano.tensor.counter_random import (CounterRandomFunction,
+                                          CounterRandomStreams)
+from theano.tests import unittest_tools as utt
+
+
+def test_philox4x32():
+    # Known answers from the Random123 distribution.
+    for ctr, key, expected in [
+            ((0, 0, 0, 0), (0, 0),
+             (0x6627e8d5, 0xe169c58d, 0xbc57ac4c, 0x9b00dbd8)),
+            ((0xffffffff,) * 4, (0xffffffff,) * 2,
+             (0x408f276d, 0x41c83b0e, 0xa20bc7c6, 0x6d5451fd)),
+            ((0x243f6a88, 0x85a308d3, 0x13198a2e, 0x03707344),
+             (0xa4093822, 0x299f31d0),
+             (0xd16cfe09, 0x94fdcceb, 0x5001e420, 0x24126ea1))]:
+        out = counter_random.philox4x32(ctr, key)
+        assert tuple(int(w[0]) for w in out) == expected
+
+
+class T_CounterRandomFunction(utt.InferShapeTester):
+    def setUp(self):
+        super(T_CounterRandomFunction, self).setUp()
+        self.state = theano.shared(counter_random.seed_state(utt.fetch_seed()))
+
+    def check_c_py(self, sample_fn, exact=True):
+        # The C code and perform must draw the same samples and return the
+        # same state.
+        new_state, out = sample_fn(self.state)
+        outs = []
+        for linker in ['c', 'py']:
+            f = theano.function([], [new_state, out],
+                                mode=theano.Mode(linker=linker))
+            outs.append(f())
+        assert numpy.all(outs[0][0] == outs[1][0])
+        assert outs[0][1].dtype == outs[1][1].dtype == out.dtype
+        if exact:
+            assert numpy.all(outs[0][1] == outs[1][1])
+        else:
+            utt.assert_allclose(outs[0][1], outs[1][1])
+        return outs[0][1]
+
+    def test_c_py(self):
+        cr = counter_random
+        self.check_c_py(lambda s: cr.uniform(s, (3, 5)), exact=False)
+        self.check_c_py(lambda s: cr.uniform(s, (3, 5),
+                                             low=numpy.arange(5.),
+                                             high=10., dtype='float32'),
+                        exact=False)
+        self.check_c_py(lambda s: cr.normal(s, (4, 3), avg=2.,
+                                            std=[1., 2., 3.]), exact=False)
+        self.check_c_py(lambda s: cr.binomial(s, (7, 4), n=[5, 50, 500, 3],
+                                              p=0.3))
+        self.check_c_py(lambda s: cr.binomial(s, (20,), n=40, p=0.8,
+                                              dtype='int32'))
+        self.check_c_py(lambda s: cr.multinomial(s, (6,), n=20,
+                                                 pvals=[0.2, 0.3, 0.5]))
+        self.check_c_py(lambda s: cr.multinomial(
+            s, n=[3, 5], pvals=[[0.1, 0.9], [0.5, 0.5]]))
+        rval = self.check_c_py(lambda s: cr.permutation(s, (3,), n=10))
+        for row in rval:
+            assert numpy.all(numpy.sort(row) == numpy.arange(10))
+        self.check_c_py(lambda s: cr.permutation(s, n=7))
+
+    def test_distributions(self):
+        cr = counter_random
+        n = 100000
+        u = self.check_c_py(lambda s: cr.uniform(s, (n,), low=-1., high=3.),
+                            exact=False)
+        assert u.min() >= -1 and u.max() < 3
+        assert abs(u.mean() - 1) < 0.05
+        z = self.check_c_py(lambda s: cr.normal(s, (n,), avg=1., std=2.),
+                            exact=False)
+        assert abs(z.mean() - 1) < 0.05 and abs(z.std() - 2) < 0.05
+        b = theano.function([], cr.binomial(self.state, (n,), n=100,
+                                            p=0.7)[1])()
+        assert abs(b.mean() - 70) < 0.2 and abs(b.var() - 21) < 1
+        m = theano.function([], cr.multinomial(self.state, (n,), n=10,
+                                               pvals=[.1, .2, .7])[1])()
+        assert numpy.all(m.sum(axis=1) == 10)
+        utt.assert_allclose(m.mean(axis=0), [1, 2, 7], rtol=0.05)
+
+    def test_binomial_large_n(self):
+        # BTPE draws a few uniforms per sample, whatever n is.
+        cr = counter_random
+        self.check_c_py(lambda s: cr.binomial(
+            s, (40, 6), n=[10 ** 9, 10 ** 6, 1000, 100, 75, 31],
+            p=[0.3, 0.7, 0.5, 0.45, 0.9, 0.99]))
+        self.check_c_py(lambda s: cr.multinomial(
+            s, (20,), n=10 ** 7, pvals=[0.2, 0.3, 0.5]))
+        n = 20000
+        b = theano.function([], cr.binomial(self.state, (n,), n=10 ** 6,
+                                            p=0.4)[1])()
+        assert abs(b.mean() - 400000) < 20
+        utt.assert_allclose(b.var(), 240000, rtol=0.05)
+        # The squeeze and the final test of BTPE only see the samples far
+        # from the mode: compare the whole histogram with the pmf.
+        k = numpy.arange(1001)
+        pmf = numpy.exp([math.lgamma(1001) - math.lgamma(i + 1) -
+                         math.lgamma(1001 - i) + i * math.log(0.05) +
+                         (1000 - i) * math.log(0.95) for i in k])
+        b = theano.function([], cr.binomial(self.state, (n * 5,), n=1000,
+                                            p=0.05)[1])()
+        expected = pmf * len(b)
+        keep = expected > 5
+        chi2 = ((numpy.bincount(b, minlength=1001)[keep] - expected[keep]) ** 2
+                / expected[keep]).sum()
+        assert chi2 < 2 * keep.sum(), chi2
+
+    def test_state(self):
+        # The state is only a key and a counter: the samples depend on its
+        # value, not on the history of the generator.
+        state = counter_random.seed_state(234)
+        new_state, out = counter_random.uniform(tensor.as_tensor_variable(
+            state), (5,))
+        f = theano.function([], [new_state, out])
+        s1, u1 = f()
+        assert numpy.all(s1 == [234, 0, 1, 0])
+        assert numpy.all(f()[1] == u1)
+
+        s = tensor.vector(dtype='uint32')
+        g = theano.function([s], counter_random.uniform(s, (5,)))
+        s2, u2 = g(s1)
+        assert numpy.all(s2 == [234, 0, 2, 0])
+        assert not numpy.any(u2 == u1)
+        # The counter is 64 bits.
+        s3, u3 = g(numpy.asarray([234, 0, 2 ** 32 - 1, 0], dtype='uint32'))
+        assert numpy.all(s3 == [234, 0, 0, 1])
+
+    def test_inplace(self):
+        new_state, out = counter_random.normal(self.state, (3, 2))
+        f = theano.function([], out, updates=[(self.state, new_state)])
+        assert any(isinstance(node.op, CounterRandomFunction) and
+                   node.op.inplace for node in f.maker.fgraph.toposort())
+        state = self.state.get_value()
+        v1 = f()
+        v2 = f()
+        assert not numpy.any(v1 == v2)
+        self.state.set_value(state)
+        assert numpy.all(f() == v1)
+
+    def test_bad_params(self):
+        cr = counter_random
+        p = tensor.dscalar()
+        f = theano.function([p], cr.binomial(self.state, (3,), n=4, p=p)[1])
+        f(0.5)
+        self.assertRaises(ValueError, f, 1.5)
+        self.assertRaises(ValueError, f, -0.5)
+        low = tensor.dvector()
+        f = theano.function(
+            [low], CounterRandomFunction(
+                'uniform', tensor.dvector)(self.state, [3], low, 1.)[1])
+        f(numpy.zeros(3))
+        self.assertRaises(ValueError, f, numpy.zeros(4))
+        # The element index must fit in 32 bits, even when the product of
+        # the size overflows.
+        size = tensor.lvector()
+        for linker in ['cvm', 'py']:
+            f = theano.function([size],
+                                cr.uniform(self.state, size, ndim=3)[1],
+                                mode=theano.Mode(linker=linker))
+            for bad_size in [[2 ** 16, 2 ** 16, 1], [2 ** 30] * 3]:
+                self.assertRaises(ValueError, f, bad_size)
+        self.assertRaises(TypeError, CounterRandomFunction, 'normal',
+                          tensor.lvector)
+        self.assertRaises(TypeError, CounterRandomFunction('uniform',
+                                                           tensor.dvector),
+                          self.state, [3])
+
+    def test_infer_shape(self):
+        cr = counter_random
+        p = tensor.dvector()
+        self._compile_and_check(
+            [p], [cr.uniform(self.state, (2, 3), high=p)[1]],
+            [numpy.ones(3)], CounterRandomFunction)
+        self._compile_and_check(
+            [p], [cr.multinomial(self.state, (4,), n=3, pvals=p)[1]],
+            [numpy.ones(5)], CounterRandomFunction)
+        n = tensor.lscalar()
+        self._compile_and_check(
+            [n], [cr.permutation(self.state, (2,), n=n)[1]], [6],
+            CounterRandomFunction)
+
+
+class T_CounterRandomStreams(unittest.TestCase):
+    def test_seed(self):
+        random = CounterRandomStreams(utt.fetch_seed())
+        f = theano.function([], [random.uniform((2, 2)),
+                                 random.normal((2, 2))])
+        v1 = f()
+        v2 = f()
+        assert not numpy.any(v1[0] == v2[0])
+        assert not numpy.any(v1[0] == v1[1])
+        random.seed(utt.fetch_seed())
+        v3 = f()
+        assert numpy.all(v1[0] == v3[0]) and numpy.all(v1[1] == v3[1])
+
+    def test_updates(self):
+        random = CounterRandomStreams(utt.fetch_seed())
+        out = random.uniform((5,))
+        f = theano.function([], out, no_default_updates=True)
+        assert numpy.all(f() == f())
+        f = theano.function([], out, updates=random.updates(),
+                            no_default_updates=True)
+        assert not numpy.any(f() == f())
+
+    def test_shuffle_row_elements(self):
+        random = CounterRandomStreams(utt.fetch_seed())
+        x = tensor.dmatrix()
+        f = theano.function([x], random.shuffle_row_elements(x))
+        val = numpy.arange(20.).reshape(4, 5)
+        out = f(val)
+        assert numpy.all(numpy.sort(out, axis=1) == val)
+
+    def test_scan(self):
+        # Small draws in the inner function of a scan.
+        random = CounterRandomStreams(utt.fetch_seed())
+        x = tensor.dvector()
+        out, updates = theano.scan(lambda x: x + random.uniform((3,)),
+                                   outputs_info=x, n_steps=10)
+        f = theano.function([x], out, updates=updates)
+        val = f(numpy.zeros(3))
+        assert numpy.all(numpy.diff(val, axis=0) > 0)
+        assert numpy.all(val[-1] < 10)
+        assert not numpy.all(f(numpy.zeros(3)) == val)
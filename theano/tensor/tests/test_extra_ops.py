@@ -12,7 +12,7 @@ from theano.tensor.extra_ops import (CumsumOp, cumsum, CumprodOp, cumprod,
                                      Bartlett, bartlett,
                                      FillDiagonal, fill_diagonal,
                                      FillDiagonalOffset, fill_diagonal_offset,
-                                     to_one_hot)
+                                     to_one_hot, merge_duplicate_rows)
 from theano import tensor as T
 from theano import config, tensor, function
 
@@ -661,3 +661,27 @@ def test_to_one_hot():
          [0., 0., 0., 1., 0., 0., 0., 0., 0., 0.],
          [0., 0., 0., 0., 0., 1., 0., 0., 0., 0.],
          [0., 0., 0., 0., 0., 0., 1., 0., 0., 0.]])
+
+
+def test_merge_duplicate_rows():
+    i = tensor.lvector()
+    r = tensor.matrix()
+    f = theano.function([i, r], merge_duplicate_rows(i, r))
+    i_val = numpy.asarray([3, 1, 3, 0, 1, 3])
+    r_val = numpy.random.rand(6, 4).astype(config.floatX)
+    unique_i, summed = f(i_val, r_val)
+    assert numpy.all(unique_i == [0, 1, 3])
+    utt.assert_allclose(summed, [r_val[3], r_val[1] + r_val[4],
+                                 r_val[0] + r_val[2] + r_val[5]])
+
+    # Both representations of the gradient increment x the same way.
+    x = numpy.random.rand(5, 4).astype(config.floatX)
+    dense = x.copy()
+    numpy.add.at(dense, i_val, r_val)
+    sparse = x.copy()
+    sparse[unique_i] += summed
+    utt.assert_allclose(sparse, dense)
+
+    unique_i, summed = f(numpy.zeros(0, dtype='int64'),
+                         numpy.zeros((0, 4), dtype=config.floatX))
+    assert unique_i.shape == (0,) and summed.shape == (0, 4)
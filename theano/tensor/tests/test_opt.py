@@ -2747,6 +2747,67 @@ def test_local_IncSubtensor_serialize():
                         for inp in a.inputs])
 
 
+def test_local_elemwise_of_inc_subtensor1_zeros():
+    # The update of an embedding table must only touch the indexed rows,
+    # inplace in the shared variable.
+    d = numpy.random.normal(0, 0.01, size=(100, 5))
+    d = d.astype(theano.config.floatX)
+    W = theano.shared(d, name='W')
+    i = T.vector('i', dtype='int64')
+    t = T.vector('t')
+    lr = T.scalar('lr')
+    cost = T.sqr(t - W[i].sum(axis=1)).sum()
+    dW = theano.grad(cost, W)
+    mode = theano.compile.mode.get_default_mode()
+    f = theano.function([i, t, lr], updates=[(W, W - lr * dW)], mode=mode)
+    ref = theano.function([i, t, lr], W - lr * dW,
+                          mode=mode.excluding(
+                              'local_elemwise_of_inc_subtensor1_zeros'))
+    topo = f.maker.fgraph.toposort()
+    # The shared variable is the last input of the graph.
+    W_in = f.maker.fgraph.inputs[-1]
+    incs = [n for n in topo if isinstance(n.op, tensor.AdvancedIncSubtensor1)]
+    assert len(incs) == 1
+    assert incs[0].inputs[0] is W_in and incs[0].op.inplace
+    assert not any(isinstance(n.op, T.Elemwise) and W_in in n.inputs
+                   for n in topo)
+
+    i_val = numpy.asarray([3, 1, 3, 7], dtype='int64')
+    t_val = numpy.arange(4).astype(theano.config.floatX)
+    lr_val = numpy.asarray(0.1, dtype=theano.config.floatX)
+    expected = ref(i_val, t_val, lr_val)
+    f(i_val, t_val, lr_val)
+    utt.assert_allclose(W.get_value(), expected)
+
+    # When the gradient is also returned, it is not computed a second time
+    # with the scaling moved into the rows.
+    f = theano.function([i, t, lr], [dW, W - lr * dW], mode=mode)
+    topo = f.maker.fgraph.toposort()
+    incs = [n for n in topo if isinstance(n.op, tensor.AdvancedIncSubtensor1)]
+    assert len(incs) == 1
+    W.set_value(d)
+    dW_val, W_val = f(i_val, t_val, lr_val)
+    utt.assert_allclose(W_val, expected)
+
+    # The AdaGrad accumulator squares the rows after merging the repeated
+    # indices.
+    acc = theano.shared(numpy.ones_like(d), name='acc')
+    f = theano.function([i, t], updates=[(acc, acc + dW ** 2)], mode=mode)
+    ref = theano.function([i, t], acc + dW ** 2,
+                          mode=mode.excluding(
+                              'local_elemwise_of_inc_subtensor1_zeros'))
+    topo = f.maker.fgraph.toposort()
+    acc_in, = [v for v in f.maker.fgraph.inputs if v.name == 'acc']
+    assert any(isinstance(n.op, tensor.AdvancedIncSubtensor1) and
+               n.inputs[0] is acc_in and n.op.inplace for n in topo)
+    assert not any(isinstance(n.op, T.Elemwise) and acc_in in n.inputs
+                   for n in topo)
+    W.set_value(d)
+    expected = ref(i_val, t_val)
+    f(i_val, t_val)
+    utt.assert_allclose(acc.get_value(), expected)
+
+
 def test_local_set_to_inc_subtensor():
     v = theano.tensor.fmatrix()
     s = v[[2, 1]]
@@ -5194,8 +5255,10 @@ def test_local_useless_split():
     graph_nonopt = f_nonopt.maker.fgraph.toposort()
 
     assert isinstance(graph_opt[-1].op, DeepCopyOp)
-    assert len(graph_nonopt)==1
+    # The outputs of Split are views of x, so they get copied.
+    assert len(graph_nonopt) == 4
     assert isinstance(graph_nonopt[0].op, tensor.Split)
+    assert all(isinstance(node.op, DeepCopyOp) for node in graph_nonopt[1:])
 
 
 def test_local_flatten_lift():
@@ -1447,6 +1447,68 @@ class TestAdvancedSubtensor(unittest.TestCase):
                               numpy.random.rand(2).astype(self.dtype)])
 
 
+class TestAdvancedSubtensorCCode(unittest.TestCase):
+    """Test the C code of AdvancedSubtensor and AdvancedIncSubtensor."""
+
+    def setUp(self):
+        if not theano.config.cxx:
+            raise SkipTest("G++ not available")
+        self.rng = numpy.random.RandomState(utt.fetch_seed())
+        self.mode = theano.compile.Mode(linker='cvm', optimizer=None)
+        self.x = tensor.dtensor3()
+        self.i = lvector()
+        self.j = lmatrix()
+        self.xval = self.rng.rand(5, 4, 20)
+        # Negative, duplicated and broadcasted indices.
+        self.ival = numpy.asarray([0, -1, 4, 4, 2])
+        self.jval = numpy.asarray([[0, 3, 3, -4, 1], [1, 1, 1, 2, 2]])
+
+    def test_sub(self):
+        for openmp in [False, True]:
+            op = AdvancedSubtensor(openmp=openmp)
+            f = theano.function([self.x, self.i, self.j],
+                                op(self.x, self.i, self.j), mode=self.mode)
+            # The C code is used, not perform.
+            assert hasattr(f.fn.thunks[0], 'cthunk')
+            out = f(self.xval, self.ival, self.jval)
+            assert numpy.all(out == self.xval[self.ival, self.jval])
+            out = f(self.xval[:, :, ::2], self.ival, self.jval)
+            assert numpy.all(out == self.xval[:, :, ::2][self.ival,
+                                                         self.jval])
+            self.assertRaises(IndexError, f, self.xval, self.ival + 5,
+                              self.jval)
+
+    def test_inc_and_set(self):
+        orig_minsize = config.openmp_elemwise_minsize
+        # Also use the sorted path of OpenMP when there are many threads.
+        config.openmp_elemwise_minsize = 0
+        try:
+            for openmp in [False, True]:
+                for set_instead_of_inc in [False, True]:
+                    for y, yval in [(dscalar(), 2.1),
+                                    (fvector(), self.rng.rand(20)),
+                                    (tensor.dtensor3(),
+                                     self.rng.rand(2, 5, 20))]:
+                        op = AdvancedIncSubtensor(
+                            set_instead_of_inc=set_instead_of_inc,
+                            openmp=openmp)
+                        f = theano.function(
+                            [self.x, y, self.i, self.j],
+                            op(self.x, y, self.i, self.j), mode=self.mode,
+                            allow_input_downcast=True)
+                        assert hasattr(f.fn.thunks[0], 'cthunk')
+                        yval = numpy.asarray(yval, dtype=y.dtype)
+                        good = self.xval.copy()
+                        if set_instead_of_inc:
+                            good[self.ival, self.jval] = yval
+                        else:
+                            numpy.add.at(good, (self.ival, self.jval), yval)
+                        out = f(self.xval, yval, self.ival, self.jval)
+                        assert numpy.allclose(out, good)
+        finally:
+            config.openmp_elemwise_minsize = orig_minsize
+
+
 class TestInferShape(utt.InferShapeTester):
     @attr('slow')
     def test_infer_shape(self):
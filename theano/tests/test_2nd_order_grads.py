@@ -164,3 +164,67 @@ def test_jacobian_disconnected_inputs():
     val = numpy.array(1.0).astype(theano.config.floatX)
     assert numpy.allclose(func_s(val), numpy.zeros(1))
 
+
+
+def has_scan(outputs):
+    return any(isinstance(node.op, theano.scan_module.scan_op.Scan)
+               for node in theano.gof.graph.io_toposort(
+                   theano.gof.graph.inputs(outputs), outputs))
+
+
+def test005_jacobian_vectorize():
+    x = tensor.vector()
+    W = tensor.matrix()
+    rng = numpy.random.RandomState(seed=utt.fetch_seed())
+    vx = rng.uniform(size=(4,)).astype(theano.config.floatX)
+    vW = rng.uniform(size=(3, 4)).astype(theano.config.floatX)
+    for y in [tensor.tanh(tensor.dot(W, x)) * x[:3],
+              tensor.dot(x, W.T) ** 2 + W.sum(axis=1),
+              tensor.inc_subtensor(x[1:], W[0, :3] * 2).reshape((2, 2))[0],
+              tensor.max(W * x, axis=1) + 1]:
+        Js = tensor.jacobian(y, [x, W])
+        vJs = tensor.jacobian(y, [x, W], vectorize=True)
+        assert has_scan(Js)
+        assert not has_scan(vJs)
+        f = theano.function([x, W], Js + vJs)
+        out = f(vx, vW)
+        for J, vJ in zip(out[:2], out[2:]):
+            assert J.dtype == vJ.dtype
+            assert J.shape == vJ.shape
+            assert numpy.allclose(J, vJ)
+
+    # AdvancedSubtensor1 doesn't implement batch_apply: the jacobian with
+    # respect to x uses the scan.
+    y = x[[0, 2, 2]] * W[0, 0]
+    vJx, vJW = tensor.jacobian(y, [x, W], vectorize=True)
+    assert has_scan([vJx]) and not has_scan([vJW])
+    f = theano.function([x, W], [vJx, vJW])
+    Jx, JW = f(vx, vW)
+    assert numpy.allclose(Jx, numpy.eye(4)[[0, 2, 2]] * vW[0, 0])
+    eJW = numpy.zeros((3, 3, 4))
+    eJW[:, 0, 0] = vx[[0, 2, 2]]
+    assert numpy.allclose(JW, eJW)
+
+    # Disconnected inputs
+    v1 = tensor.vector()
+    v2 = tensor.vector()
+    J = theano.gradient.jacobian(1 + v1, v2, disconnected_inputs='ignore',
+                                 vectorize=True)
+    f = theano.function([v1, v2], J)
+    val = numpy.arange(4.0).astype(theano.config.floatX)
+    assert numpy.allclose(f(val, val), numpy.zeros((4, 4)))
+
+
+def test006_hessian_vectorize():
+    x = tensor.vector()
+    W = tensor.matrix()
+    y = tensor.sum(tensor.tanh(tensor.dot(W, x)) ** 2) + tensor.sum(x ** 3)
+    H = tensor.hessian(y, x)
+    vH = tensor.hessian(y, x, vectorize=True)
+    assert not has_scan([vH])
+    f = theano.function([x, W], [H, vH])
+    rng = numpy.random.RandomState(seed=utt.fetch_seed())
+    vx = rng.uniform(size=(4,)).astype(theano.config.floatX)
+    vW = rng.uniform(size=(3, 4)).astype(theano.config.floatX)
+    H, vH = f(vx, vW)
+    assert numpy.allclose(H, vH)
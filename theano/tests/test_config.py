@@ -2,9 +2,11 @@
 Test config options.
 """
 
+import threading
 import unittest
 from theano import config
-from theano.configparser import AddConfigVar, ConfigParam, THEANO_FLAGS_DICT
+from theano.configparser import (AddConfigVar, ConfigParam, THEANO_FLAGS_DICT,
+                                 thread_local_config)
 
 
 class T_config(unittest.TestCase):
@@ -45,3 +47,35 @@ class T_config(unittest.TestCase):
             del THEANO_FLAGS_DICT['T_config.test_invalid_default_b']
 
         # TODO We should remove these dummy options on test exit.
+
+    def test_thread_local_config(self):
+        orig = config.traceback.limit
+        entered = threading.Event()
+        release = threading.Event()
+        seen = []
+
+        def other_thread():
+            with thread_local_config({'traceback.limit': orig + 3}):
+                seen.append(config.traceback.limit)
+                # Setting it in the block only changes this thread.
+                config.traceback.limit = orig + 4
+                seen.append(config.traceback.limit)
+                entered.set()
+                release.wait()
+            seen.append(config.traceback.limit)
+
+        thread = threading.Thread(target=other_thread)
+        thread.start()
+        entered.wait()
+        try:
+            assert config.traceback.limit == orig
+        finally:
+            release.set()
+            thread.join()
+        assert seen == [orig + 3, orig + 4, orig]
+        assert config.traceback.limit == orig
+
+        with thread_local_config({'traceback.limit': '2'}):
+            # The value is filtered.
+            assert config.traceback.limit == 2
+        assert config.traceback.limit == orig
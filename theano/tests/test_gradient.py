@@ -2,6 +2,7 @@ from __future__ import print_function
 #
 # UNIT TEST
 #
+import sys
 import unittest
 
 import numpy as np
@@ -503,6 +504,26 @@ def test_dxdx():
     assert np.allclose(g, 1.)
 
 
+def test_deep_graph():
+    # grad must not recurse on the depth of the graph.
+    depth = 2 * sys.getrecursionlimit()
+    x = theano.tensor.scalar('x')
+    w = theano.tensor.scalar('w')
+    h = x
+    for i in range(depth):
+        h = h * w
+        if i == depth // 2:
+            mid = h
+    gx, gw = theano.tensor.grad(h, [x, w])
+    assert gx.type == x.type and gw.type == w.type
+
+    gx, gw = theano.tensor.grad(h, [x, w], consider_constant=[mid],
+                                disconnected_inputs='ignore',
+                                return_disconnected='Disconnected')
+    assert isinstance(gx.type, gradient.DisconnectedType)
+    assert gw.type == w.type
+
+
 def test_known_grads_integers():
 
     # Tests that known_grads works on integers
@@ -0,0 +1,41 @@
+"""
+Test that `import theano` doesn't import the modules that are slow to
+import and only needed by some features.
+"""
+import os
+import subprocess
+import sys
+
+import theano
+from theano.compat import LazyModule
+
+# Modules imported only when they are used.
+lazy_modules = ['nose', 'theano.tests', 'scipy.stats', 'scipy.signal']
+
+
+def imported_modules(code):
+    """Return the modules imported by `code` in a new process."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(theano.__file__))] +
+        [p for p in [env.get('PYTHONPATH')] if p])
+    code += '; import sys; print(" ".join(sys.modules))'
+    out = subprocess.Popen([sys.executable, '-c', code], env=env,
+                           stdout=subprocess.PIPE).communicate()[0]
+    return out.decode().split()
+
+
+def test_lazy_imports():
+    modules = imported_modules('import theano, theano.tensor')
+    assert 'theano.tensor' in modules
+    for name in lazy_modules:
+        assert name not in modules, name
+
+
+def test_lazy_module():
+    modules = imported_modules(
+        'import theano; theano.tests.unittest_tools.fetch_seed()')
+    assert 'theano.tests.unittest_tools' in modules
+
+    proxy = LazyModule('theano.tests.unittest_tools')
+    assert proxy.fetch_seed is theano.tests.unittest_tools.fetch_seed
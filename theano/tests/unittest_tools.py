@@ -10,7 +10,7 @@ import numpy
 
 import theano
 import theano.tensor as T
-from theano.configparser import config, AddConfigVar, StrParam
+from theano.configparser import config
 try:
     from nose.plugins.skip import SkipTest
 except ImportError:
@@ -21,22 +21,6 @@ except ImportError:
 _logger = logging.getLogger("theano.tests.unittest_tools")
 
 
-def good_seed_param(seed):
-    if seed == "random":
-        return True
-    try:
-        int(seed)
-    except Exception:
-        return False
-    return True
-
-AddConfigVar('unittests.rseed',
-             "Seed to use for randomized unit tests. "
-             "Special value 'random' means using a seed of None.",
-             StrParam(666, is_valid=good_seed_param),
-             in_c_key=False)
-
-
 def fetch_seed(pseed=None):
     """
     Returns the seed to use for running the unit tests.